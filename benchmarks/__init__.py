@@ -0,0 +1,4 @@
+"""
+LLM-top: Benchmarks
+Офлайн бенчмарки оркестрации графа на fake-моделях
+"""
@@ -0,0 +1,278 @@
+"""
+LLM-top: Fake Chat Models
+Детерминированные LLM для бенчмарков графа без обращения к провайдерам
+"""
+
+import asyncio
+import json
+import random
+import re
+import time
+import zlib
+from collections import defaultdict
+from typing import Any, AsyncIterator, Iterator, Optional
+from pydantic import BaseModel, ConfigDict, Field
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from src.agents.usage import estimate_tokens
+
+
+class StageUsage(BaseModel):
+    """Вызовы и токены одного этапа"""
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+class CallLog:
+    """Журнал вызовов fake-моделей по этапам (analysis, critique, ...)"""
+
+    def __init__(self):
+        self.stages: dict[str, StageUsage] = defaultdict(StageUsage)
+
+    def record(self, stage: str, input_tokens: int, output_tokens: int):
+        usage = self.stages[stage]
+        usage.calls += 1
+        usage.input_tokens += input_tokens
+        usage.output_tokens += output_tokens
+
+    def snapshot(self) -> dict[str, dict]:
+        return {stage: usage.model_dump() for stage, usage in sorted(self.stages.items())}
+
+
+class LatencyProfile(BaseModel):
+    """
+    Профиль задержек провайдера
+
+    Время ответа = ttft (± jitter) + output_tokens / tokens_per_second.
+    """
+    ttft_ms: float = 400.0
+    jitter: float = 0.25
+    tokens_per_second: float = 80.0
+    analysis_paragraphs: int = 6
+    critique_score: float = 8.0  # Средняя оценка в критике (влияет на консенсус)
+
+
+# ============================================================
+# Генерация ответов
+# ============================================================
+
+_SENTENCES = [
+    "Рынок растёт на 12–15% в год, но рост концентрируется в сегменте крупных заказчиков.",
+    "Ключевое ограничение — стоимость привлечения клиента, которая выросла вдвое за два года.",
+    "Конкуренты снижают цены, поэтому дифференциация через сервис важнее, чем через функциональность.",
+    "Если удержание клиентов превышает 85%, юнит-экономика сходится уже на втором году.",
+    "Регуляторные изменения могут увеличить издержки на соответствие требованиям на 5–8%.",
+    "Выход в регионы даёт дополнительный объём, но требует локальной команды продаж.",
+    "Партнёрская модель снижает капитальные затраты, но уменьшает контроль над качеством.",
+    "Сценарный анализ показывает, что при пессимистичном сценарии окупаемость сдвигается на 18 месяцев.",
+    "Доля повторных покупок — наиболее чувствительный параметр модели.",
+    "Данные по сопоставимым компаниям указывают на мультипликатор 3–4× выручки.",
+    "Риск зависимости от одного поставщика можно снизить двумя альтернативными контрактами.",
+    "Оценка чувствительности: рост цены на 10% снижает спрос примерно на 6%.",
+]
+
+_CRITERIA = [
+    "Логическая непротиворечивость",
+    "Полнота анализа",
+    "Обоснованность выводов",
+    "Учёт рисков",
+    "Практическая применимость",
+    "Фальсифицируемость выводов",
+    "Количественная оценка",
+    "Учёт альтернатив",
+    "Временной горизонт",
+    "Когнитивные искажения",
+]
+
+_BATCH_TARGET = re.compile(r"^=== Анализ от агента (.+?) ===$", re.MULTILINE)
+
+
+def detect_stage(prompt: str) -> str:
+    """Этап по тексту запроса: analysis, critique, critique_batched, synthesis"""
+    if "Синтезируй результаты" in prompt:
+        return "synthesis"
+    if "# Критика: <имя агента>" in prompt:
+        return "critique_batched"
+    if "Проведи критический анализ" in prompt:
+        return "critique"
+    return "analysis"
+
+
+def _bullets(rng: random.Random, count: int) -> str:
+    return "\n".join(f"- {s}" for s in rng.sample(_SENTENCES, count))
+
+
+def analysis_text(rng: random.Random, agent_name: str, profile: LatencyProfile) -> str:
+    confidence = rng.randint(60, 90)
+    paragraphs = "\n\n".join(
+        " ".join(rng.choices(_SENTENCES, k=4)) for _ in range(profile.analysis_paragraphs)
+    )
+    return (
+        f"## Анализ\n\n"
+        f"Анализ подготовлен агентом {agent_name}.\n\n{paragraphs}\n\n"
+        f"## Ключевые выводы\n{_bullets(rng, 4)}\n\n"
+        f"## Риски\n{_bullets(rng, 3)}\n\n"
+        f"## Допущения\n{_bullets(rng, 2)}\n\n"
+        f"## Уверенность\n"
+        f"Общий уровень уверенности: {confidence}%\n"
+        f"Уверенность: {confidence}%\n"
+    )
+
+
+def critique_text(rng: random.Random, profile: LatencyProfile) -> str:
+    score = max(1.0, min(10.0, round(rng.gauss(profile.critique_score, 0.5), 1)))
+    rows = "\n".join(
+        f"| {criterion} | {rng.randint(5, 9)} | {rng.choice(_SENTENCES)} |"
+        for criterion in _CRITERIA
+    )
+    return (
+        f"## Оценка по критериям\n\n"
+        f"| Критерий | Оценка (1-10) | Комментарий |\n"
+        f"|----------|---------------|-------------|\n{rows}\n\n"
+        f"## Сильные стороны\n{_bullets(rng, 2)}\n\n"
+        f"## Слабости\n{_bullets(rng, 3)}\n\n"
+        f"## Предложения\n{_bullets(rng, 2)}\n\n"
+        f"## Общая оценка: {score}/10\n"
+    )
+
+
+def synthesis_text(rng: random.Random) -> str:
+    data = {
+        "executive_summary": " ".join(rng.sample(_SENTENCES, 5)),
+        "conclusions": [
+            {
+                "conclusion": sentence,
+                "probability": f"{rng.randint(55, 85)}%",
+                "falsification_condition": rng.choice(_SENTENCES),
+            }
+            for sentence in rng.sample(_SENTENCES, 3)
+        ],
+        "formalized_result": "ROI = (Gain - Cost) / Cost × 100%\n\nРасчёт: ROI = (14 - 10) / 10 × 100% = 40%",
+        "recommendations": [
+            {"recommendation": sentence, "pros": rng.choice(_SENTENCES), "cons": rng.choice(_SENTENCES)}
+            for sentence in rng.sample(_SENTENCES, 3)
+        ],
+        "dissenting_opinions": rng.sample(_SENTENCES, 2),
+        "consensus_level": rng.randint(60, 90),
+    }
+    return "```json\n" + json.dumps(data, ensure_ascii=False, indent=2) + "\n```"
+
+
+# ============================================================
+# Модель
+# ============================================================
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat-модель с ответами в формате реальных агентов
+
+    Ответ определяется этапом (по тексту запроса), именем агента и
+    хэшем запроса, поэтому прогоны воспроизводимы. Задержка — через
+    asyncio.sleep: event loop остаётся свободным, как при сетевом вызове.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model: str = "fake"
+    temperature: float = 0.7
+    agent_name: str = "Agent"
+    profile: LatencyProfile = Field(default_factory=LatencyProfile)
+    log: CallLog = Field(default_factory=CallLog)
+    seed: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-cosilium"
+
+    def _respond(self, messages: list[BaseMessage]) -> tuple[str, int, int, random.Random]:
+        prompt = "".join(str(m.content) for m in messages)
+        stage = detect_stage(prompt)
+        rng = random.Random(zlib.crc32(f"{self.seed}|{self.agent_name}|{prompt}".encode()))
+
+        if stage == "analysis":
+            text = analysis_text(rng, self.agent_name, self.profile)
+        elif stage == "critique":
+            text = critique_text(rng, self.profile)
+        elif stage == "critique_batched":
+            text = "\n\n".join(
+                f"# Критика: {name}\n\n{critique_text(rng, self.profile)}"
+                for name in _BATCH_TARGET.findall(prompt)
+            )
+        else:
+            text = synthesis_text(rng)
+
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        self.log.record(stage, input_tokens, output_tokens)
+        return text, input_tokens, output_tokens, rng
+
+    def _ttft(self, rng: random.Random) -> float:
+        jitter = 1 + rng.uniform(-self.profile.jitter, self.profile.jitter)
+        return max(0.0, self.profile.ttft_ms * jitter / 1000)
+
+    def _message(self, text: str, input_tokens: int, output_tokens: int) -> AIMessage:
+        return AIMessage(
+            content=text,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text, input_tokens, output_tokens, rng = self._respond(messages)
+        time.sleep(self._ttft(rng) + output_tokens / self.profile.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=self._message(text, input_tokens, output_tokens))])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text, input_tokens, output_tokens, rng = self._respond(messages)
+        await asyncio.sleep(self._ttft(rng) + output_tokens / self.profile.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=self._message(text, input_tokens, output_tokens))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        result = self._generate(messages, stop, run_manager, **kwargs)
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content=result.generations[0].message.content,
+            usage_metadata=result.generations[0].message.usage_metadata,
+        ))
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        text, input_tokens, output_tokens, rng = self._respond(messages)
+        await asyncio.sleep(self._ttft(rng))
+
+        # Чанки по ~16 токенов: темп как у провайдера без sleep на каждый токен
+        chunk_chars = 64
+        for start in range(0, len(text), chunk_chars):
+            delta = text[start:start + chunk_chars]
+            await asyncio.sleep(estimate_tokens(delta) / self.profile.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=delta))
+
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="",
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        ))
@@ -0,0 +1,325 @@
+"""
+LLM-top: Benchmark Harness
+Прогон create_workflow() на fake-моделях и сбор метрик оркестрации
+"""
+
+import asyncio
+import gc
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Optional
+from uuid import UUID
+from pydantic import BaseModel, Field
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.checkpoint.memory import MemorySaver
+
+import src.graph.workflow as workflow_module
+from src.agents.base import BaseAgent
+from src.agents.synthesizer import Synthesizer
+from src.config import AGENT_CONFIGS, get_settings
+from src.graph.workflow import create_workflow
+from benchmarks.fake_llm import CallLog, FakeChatModel, LatencyProfile
+
+
+class ScenarioConfig(BaseModel):
+    """Параметры сценария"""
+    concurrency: int = 1
+    agents: int = 4
+    runs: Optional[int] = None  # По умолчанию — 3 волны по concurrency
+    max_iterations: int = 1
+    critique_topology: Optional[str] = None
+    pipelined: bool = False  # Конвейер анализ → критика (pipeline_stages_enabled)
+    profile: LatencyProfile = Field(default_factory=LatencyProfile)
+    measure_memory: bool = True
+
+    @property
+    def total_runs(self) -> int:
+        return self.runs or self.concurrency * 3
+
+    @property
+    def name(self) -> str:
+        return f"c={self.concurrency} agents={self.agents}"
+
+
+class Distribution(BaseModel):
+    """Распределение значений, мс"""
+    count: int = 0
+    mean: float = 0.0
+    p50: float = 0.0
+    p95: float = 0.0
+    p99: float = 0.0
+    max: float = 0.0
+
+    @classmethod
+    def of(cls, values_ms: list[float]) -> "Distribution":
+        if not values_ms:
+            return cls()
+        values = sorted(values_ms)
+        return cls(
+            count=len(values),
+            mean=sum(values) / len(values),
+            p50=_percentile(values, 0.50),
+            p95=_percentile(values, 0.95),
+            p99=_percentile(values, 0.99),
+            max=values[-1],
+        )
+
+
+class ScenarioResult(BaseModel):
+    """Результат сценария"""
+    name: str
+    concurrency: int
+    agents: int
+    runs: int
+    errors: int
+    wall_s: float
+    throughput_rps: float
+    latency_ms: Distribution
+    nodes_ms: dict[str, Distribution]
+    loop_lag_ms: Distribution
+    stages: dict[str, dict]
+    memory_peak_kb_per_run: Optional[float] = None
+    memory_retained_kb_per_run: Optional[float] = None
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+# ============================================================
+# Fake агенты
+# ============================================================
+
+class FakeAgent(BaseAgent):
+    """Агент с fake-моделью; парсинг и промпты — как у настоящих"""
+
+    provider = "fake"
+
+    def __init__(self, agent_type: str, config: dict, llm: FakeChatModel):
+        self.agent_type = agent_type
+        self.config = config
+        self.name = config["name"]
+        self._llm = llm
+
+    def _create_llm(self, model: Optional[str] = None) -> FakeChatModel:
+        return self._llm
+
+
+class FakeSynthesizer(Synthesizer):
+    """Синтезатор с fake-моделью"""
+
+    provider = "fake"
+
+    def __init__(self, llm: FakeChatModel):
+        self._llm = llm
+
+    @property
+    def llm(self) -> FakeChatModel:
+        return self._llm
+
+
+def make_agents(count: int, profile: LatencyProfile, log: CallLog) -> dict[str, FakeAgent]:
+    """
+    Набор из count агентов
+
+    Первые четыре — конфигурации реальных агентов, дальше их копии
+    с суффиксом (ChatGPT-2, ...). Ключ совпадает с именем в нижнем
+    регистре, как у настоящих агентов.
+    """
+    base = list(AGENT_CONFIGS.items())
+    agents = {}
+    for i in range(count):
+        agent_type, config = base[i % len(base)]
+        if i >= len(base):
+            config = dict(config, name=f"{config['name']}-{i // len(base) + 1}")
+        key = config["name"].lower()
+        llm = FakeChatModel(model=f"fake-{agent_type}", agent_name=config["name"], profile=profile, log=log, seed=i)
+        agents[key] = FakeAgent(agent_type, config, llm)
+    return agents
+
+
+@contextmanager
+def fake_llms(agents: dict[str, FakeAgent], synthesizer: FakeSynthesizer):
+    """Подменить агентов и синтезатор графа, отключить внешние зависимости"""
+    settings = get_settings()
+    overrides = {
+        "stage_cache_enabled": False,
+        "rate_limit_enabled": False,
+        "enable_rag": False,
+        "llm_telemetry_cost": False,  # Телеметрия считается, но без записи в Redis
+    }
+    saved_settings = {name: getattr(settings, name) for name in overrides}
+    saved = workflow_module._agents, workflow_module._synthesizer
+
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    workflow_module._agents, workflow_module._synthesizer = agents, synthesizer
+    try:
+        yield
+    finally:
+        workflow_module._agents, workflow_module._synthesizer = saved
+        for name, value in saved_settings.items():
+            setattr(settings, name, value)
+
+
+# ============================================================
+# Измерители
+# ============================================================
+
+class NodeTimer(BaseCallbackHandler):
+    """Время выполнения нод графа (по callback'ам LangGraph)"""
+
+    run_inline = True
+
+    def __init__(self):
+        self._started: dict[UUID, tuple[str, float]] = {}
+        self.durations: dict[str, list[float]] = defaultdict(list)
+
+    def on_chain_start(self, serialized: Any, inputs: Any, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs: Any):
+        name = kwargs.get("name")
+        if metadata and name and metadata.get("langgraph_node") == name:
+            self._started[run_id] = (name, time.perf_counter())
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any):
+        started = self._started.pop(run_id, None)
+        if started:
+            name, start = started
+            self.durations[name].append((time.perf_counter() - start) * 1000)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._started.pop(run_id, None)
+
+
+class LoopLagMonitor:
+    """Задержка event loop: насколько позже запланированного просыпается sleep"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags_ms: list[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags_ms.append(max(0.0, (time.perf_counter() - start - self.interval) * 1000))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+# ============================================================
+# Сценарий
+# ============================================================
+
+def _initial_state(index: int, config: ScenarioConfig) -> dict:
+    return {
+        "task": f"Стратегия выхода на рынок облачных сервисов, вариант {index}",
+        "task_type": "strategy",
+        "context": "",
+        "analyses": [],
+        "critiques": [],
+        "synthesis": None,
+        "iteration": 0,
+        "max_iterations": config.max_iterations,
+        "should_continue": True,
+        "error": None,
+        "critique_topology": config.critique_topology,
+    }
+
+
+async def _run_batch(config: ScenarioConfig, runs: int, callbacks: list) -> tuple[list[float], int, float]:
+    """Выполнить runs анализов с ограничением concurrency; (латентности мс, ошибки, wall)"""
+    app = create_workflow(pipelined=config.pipelined).compile(checkpointer=MemorySaver())
+    semaphore = asyncio.Semaphore(config.concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async def one(index: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await app.ainvoke(
+                    _initial_state(index, config),
+                    {"configurable": {"thread_id": str(uuid.uuid4())}, "callbacks": callbacks},
+                )
+                latencies.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(runs)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def run_scenario(config: ScenarioConfig) -> ScenarioResult:
+    """Прогнать сценарий и собрать метрики"""
+    log = CallLog()
+    agents = make_agents(config.agents, config.profile, log)
+    synthesizer = FakeSynthesizer(
+        FakeChatModel(model="fake-synthesizer", agent_name="Synthesizer", profile=config.profile, log=log)
+    )
+
+    with fake_llms(agents, synthesizer):
+        timer = NodeTimer()
+        monitor = LoopLagMonitor()
+        monitor.start()
+        latencies, errors, wall = await _run_batch(config, config.total_runs, [timer])
+        await monitor.stop()
+        stages = log.snapshot()
+
+        peak_kb = retained_kb = None
+        if config.measure_memory:
+            peak_kb, retained_kb = await _measure_memory(config)
+
+    runs = config.total_runs
+    return ScenarioResult(
+        name=config.name,
+        concurrency=config.concurrency,
+        agents=config.agents,
+        runs=runs,
+        errors=errors,
+        wall_s=wall,
+        throughput_rps=(runs - errors) / wall if wall else 0.0,
+        latency_ms=Distribution.of(latencies),
+        nodes_ms={name: Distribution.of(values) for name, values in sorted(timer.durations.items())},
+        loop_lag_ms=Distribution.of(monitor.lags_ms),
+        stages={
+            stage: dict(usage, per_run_calls=usage["calls"] / runs)
+            for stage, usage in stages.items()
+        },
+        memory_peak_kb_per_run=peak_kb,
+        memory_retained_kb_per_run=retained_kb,
+    )
+
+
+async def _measure_memory(config: ScenarioConfig) -> tuple[float, float]:
+    """
+    Память на анализ (отдельный прогон одной волны под tracemalloc)
+
+    peak — пик выделений на одновременный анализ; retained — сколько
+    остаётся после завершения (состояние в checkpointer'е и кэшах).
+    """
+    runs = config.concurrency
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        await _run_batch(config, runs, [])
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (peak - baseline) / 1024 / runs, (current - baseline) / 1024 / runs
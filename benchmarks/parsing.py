@@ -0,0 +1,231 @@
+"""
+LLM-top: Parsing Benchmark
+Микро-бенчмарк разбора ответов: регулярные выражения на каждое поле против разбора секций
+
+Использование:
+    python -m benchmarks.parsing                     # ответы 10, 25 и 50 KB
+    python -m benchmarks.parsing --sizes 50 --repeat 200
+"""
+
+import argparse
+import random
+import re
+import time
+from typing import Callable
+
+from benchmarks.fake_llm import _SENTENCES, LatencyProfile, analysis_text, critique_text
+from benchmarks.harness import FakeAgent, FakeSynthesizer
+from src.agents.sections import parse_sections
+from src.config import AGENT_CONFIGS
+
+
+# ============================================================
+# Ответы заданного размера
+# ============================================================
+
+def _paragraphs(rng: random.Random, count: int) -> str:
+    return "\n\n".join(" ".join(rng.choices(_SENTENCES, k=4)) for _ in range(count))
+
+
+def _fit(build: Callable[[int], str], size_kb: int) -> str:
+    """Текст из build(n) с наименьшим n, при котором он не меньше size_kb"""
+    count = 1
+    while len(build(count).encode()) < size_kb * 1024:
+        count += 1
+    return build(count)
+
+
+def make_analysis(size_kb: int, seed: int = 0) -> str:
+    return _fit(
+        lambda n: analysis_text(random.Random(seed), "ChatGPT", LatencyProfile(analysis_paragraphs=n)),
+        size_kb,
+    )
+
+
+def make_critique(size_kb: int, seed: int = 0) -> str:
+    def build(n: int) -> str:
+        rng = random.Random(seed)
+        return f"## Обоснование\n\n{_paragraphs(rng, n)}\n\n" + critique_text(rng, LatencyProfile())
+    return _fit(build, size_kb)
+
+
+def make_synthesis(size_kb: int, seed: int = 0) -> str:
+    """Синтез в Markdown (ветка без JSON)"""
+    def build(n: int) -> str:
+        rng = random.Random(seed)
+        conclusions = "\n".join(
+            f"| {sentence} | {rng.randint(55, 85)}% | {rng.choice(_SENTENCES)} |"
+            for sentence in rng.sample(_SENTENCES, 3)
+        )
+        recommendations = "\n".join(
+            f"| {sentence} | {rng.choice(_SENTENCES)} | {rng.choice(_SENTENCES)} |"
+            for sentence in rng.sample(_SENTENCES, 3)
+        )
+        dissenting = "\n".join(f"- {s}" for s in rng.sample(_SENTENCES, 2))
+        return (
+            f"## Резюме\n\n{' '.join(rng.sample(_SENTENCES, 5))}\n\n"
+            f"## Анализ позиций\n\n{_paragraphs(rng, n)}\n\n"
+            f"## Таблица выводов\n\n| Вывод | Вероятность | Условие фальсификации |\n"
+            f"|-------|-------------|----------------------|\n{conclusions}\n\n"
+            f"## Рекомендации\n\n| Рекомендация | За | Против |\n|---|---|---|\n{recommendations}\n\n"
+            f"## Формализованный итог\n\nROI = (14 - 10) / 10 × 100% = 40%\n\n"
+            f"## Разногласия\n{dissenting}\n"
+        )
+    return _fit(build, size_kb)
+
+
+# ============================================================
+# Прежний разбор: отдельный re.search по всему тексту на каждое поле
+# ============================================================
+
+def legacy_list_section(text: str, section_name: str) -> list[str]:
+    pattern = rf"##\s*{section_name}\s*\n((?:[-*]\s*.+\n?)+)"
+    match = re.search(pattern, text, re.IGNORECASE)
+    if match:
+        items = re.findall(r"[-*]\s*(.+)", match.group(1))
+        return [item.strip() for item in items if item.strip()]
+    return []
+
+
+def legacy_confidence(text: str) -> float:
+    for pattern in (
+        r"[Уу]веренность[:\s]+(\d+)%",
+        r"[Уу]ровень уверенности[:\s]+(\d+)%",
+        r"(\d+)%\s*уверенност",
+    ):
+        match = re.search(pattern, text)
+        if match:
+            return float(match.group(1)) / 100
+    return 0.7
+
+
+def legacy_score(text: str) -> float:
+    for pattern in (r"[Оо]бщая оценка[:\s]+(\d+(?:\.\d+)?)/10", r"(\d+(?:\.\d+)?)/10"):
+        match = re.search(pattern, text)
+        if match:
+            return float(match.group(1))
+    return 5.0
+
+
+def legacy_parse_analysis(text: str) -> tuple:
+    return (
+        legacy_confidence(text),
+        legacy_list_section(text, "Ключевые выводы"),
+        legacy_list_section(text, "Риски"),
+        legacy_list_section(text, "Допущения"),
+    )
+
+
+def legacy_parse_critique(text: str) -> tuple:
+    return (
+        legacy_score(text),
+        legacy_list_section(text, "Слабости"),
+        legacy_list_section(text, "Сильные стороны"),
+        legacy_list_section(text, "Предложения"),
+    )
+
+
+def _legacy_table(text: str, heading: str) -> list[list[str]]:
+    match = re.search(
+        rf"##\s*{heading}\s*\n+\|[^\n]+\|\s*\n\|[-|\s]+\|\s*\n((?:\|[^\n]+\|\s*\n?)+)",
+        text,
+        re.IGNORECASE,
+    )
+    if not match:
+        return []
+    return [
+        [c.strip() for c in row.split("|") if c.strip()]
+        for row in match.group(1).strip().split("\n")
+        if row.strip() and not row.strip().startswith("|--")
+    ]
+
+
+def legacy_parse_synthesis(text: str) -> tuple:
+    summary = re.search(r"##\s*Резюме\s*\n(.*?)(?=\n##|\Z)", text, re.DOTALL)
+    formalized = re.search(r"##\s*Формализованный итог\s*\n(.*?)(?=\n##|\Z)", text, re.DOTALL | re.IGNORECASE)
+    dissenting = re.search(r"##\s*Разногласия\s*\n(.*?)(?=\n##|\Z)", text, re.DOTALL | re.IGNORECASE)
+    return (
+        summary.group(1).strip() if summary else text[:500],
+        _legacy_table(text, "Таблица выводов"),
+        _legacy_table(text, "Рекомендации"),
+        formalized.group(1).strip() if formalized else "",
+        [i.strip() for i in re.findall(r"[-*]\s*(.+)", dissenting.group(1))] if dissenting else [],
+    )
+
+
+# ============================================================
+# Текущий разбор: методы агента и синтезатора
+# ============================================================
+
+_agent = FakeAgent("chatgpt", AGENT_CONFIGS["chatgpt"], llm=None)
+_synthesizer = FakeSynthesizer(llm=None)
+
+
+def parse_analysis(text: str) -> tuple:
+    return (
+        _agent._extract_confidence(text),
+        _agent._extract_key_points(text),
+        _agent._extract_risks(text),
+        _agent._extract_assumptions(text),
+    )
+
+
+def parse_critique(text: str) -> tuple:
+    return (
+        _agent._extract_score(text),
+        _agent._extract_weaknesses(text),
+        _agent._extract_strengths(text),
+        _agent._extract_suggestions(text),
+    )
+
+
+def parse_synthesis(text: str) -> tuple:
+    return (
+        _synthesizer._extract_summary(text),
+        _synthesizer._extract_conclusions(text),
+        _synthesizer._extract_recommendations(text),
+        _synthesizer._extract_formalized(text),
+        _synthesizer._extract_dissenting(text),
+    )
+
+
+# ============================================================
+# Замер
+# ============================================================
+
+def _per_call_us(parse: Callable[[str], tuple], text: str, repeat: int) -> float:
+    """Среднее время разбора, мкс (кэш секций сбрасывается — каждый ответ новый)"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parse_sections.cache_clear()
+        parse(text)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+CASES = {
+    "analysis": (make_analysis, legacy_parse_analysis, parse_analysis),
+    "critique": (make_critique, legacy_parse_critique, parse_critique),
+    "synthesis": (make_synthesis, legacy_parse_synthesis, parse_synthesis),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора ответов LLM")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 25, 50], help="Размеры ответов, KB")
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'case':<10} {'size':>6} {'legacy us':>10} {'sections us':>12} {'speedup':>8}")
+    for name, (make, legacy, current) in CASES.items():
+        for size_kb in args.sizes:
+            text = make(size_kb)
+            legacy_us = _per_call_us(legacy, text, args.repeat)
+            current_us = _per_call_us(current, text, args.repeat)
+            print(
+                f"{name:<10} {len(text.encode()) // 1024:>4}KB {legacy_us:>10.1f} "
+                f"{current_us:>12.1f} {legacy_us / current_us:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
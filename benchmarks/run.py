@@ -0,0 +1,105 @@
+"""
+LLM-top: Benchmark Runner
+Запуск сценариев бенчмарка графа
+
+Использование:
+    python -m benchmarks.run                          # c=1/10/100 при 4 агентах, 2–8 агентов при c=10
+    python -m benchmarks.run --concurrency 10 --agents 4 --ttft-ms 50
+    python -m benchmarks.run --json bench.json > bench_output.txt
+"""
+
+import argparse
+import asyncio
+import json
+
+from benchmarks.fake_llm import LatencyProfile
+from benchmarks.harness import ScenarioConfig, ScenarioResult, run_scenario
+
+
+def build_scenarios(args: argparse.Namespace) -> list[ScenarioConfig]:
+    """Сценарии: масштаб по concurrency и по числу агентов"""
+    profile = LatencyProfile(
+        ttft_ms=args.ttft_ms,
+        jitter=args.jitter,
+        tokens_per_second=args.tps,
+        critique_score=args.critique_score,
+    )
+    common = dict(
+        runs=args.runs,
+        max_iterations=args.max_iterations,
+        critique_topology=args.topology,
+        pipelined=args.pipelined,
+        profile=profile,
+        measure_memory=not args.no_memory,
+    )
+    scenarios = [
+        ScenarioConfig(concurrency=c, agents=args.base_agents, **common)
+        for c in args.concurrency
+    ]
+    scenarios += [
+        ScenarioConfig(concurrency=args.base_concurrency, agents=n, **common)
+        for n in args.agents
+        if (args.base_concurrency, n) not in {(s.concurrency, s.agents) for s in scenarios}
+    ]
+    return scenarios
+
+
+def format_result(result: ScenarioResult) -> str:
+    """Текстовый отчёт по сценарию"""
+    lines = [
+        f"== {result.name}: {result.runs} runs, {result.errors} errors, "
+        f"{result.wall_s:.2f}s wall, {result.throughput_rps:.2f} runs/s",
+        f"   latency ms   p50={result.latency_ms.p50:.0f} p95={result.latency_ms.p95:.0f} "
+        f"p99={result.latency_ms.p99:.0f} max={result.latency_ms.max:.0f}",
+        f"   loop lag ms  p50={result.loop_lag_ms.p50:.2f} p99={result.loop_lag_ms.p99:.2f} "
+        f"max={result.loop_lag_ms.max:.2f}",
+    ]
+    if result.memory_peak_kb_per_run is not None:
+        lines.append(
+            f"   memory KB/run peak={result.memory_peak_kb_per_run:.0f} "
+            f"retained={result.memory_retained_kb_per_run:.0f}"
+        )
+    for name, dist in result.nodes_ms.items():
+        lines.append(f"   node {name:<22} n={dist.count:<5} p50={dist.p50:.0f} p95={dist.p95:.0f} ms")
+    for stage, usage in result.stages.items():
+        lines.append(
+            f"   stage {stage:<21} calls/run={usage['per_run_calls']:.1f} "
+            f"in={usage['input_tokens']} out={usage['output_tokens']}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк графа LLM-top на fake-моделях")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--agents", type=int, nargs="+", default=[2, 4, 6, 8])
+    parser.add_argument("--base-agents", type=int, default=4, help="Агентов в сценариях по concurrency")
+    parser.add_argument("--base-concurrency", type=int, default=10, help="Concurrency в сценариях по агентам")
+    parser.add_argument("--runs", type=int, default=None, help="Анализов на сценарий (по умолчанию 3×concurrency)")
+    parser.add_argument("--max-iterations", type=int, default=1)
+    parser.add_argument("--topology", default=None, help="full_mesh, ring, single_critic, batched")
+    parser.add_argument("--pipelined", action="store_true", help="Конвейер анализ → критика без барьера")
+    parser.add_argument("--ttft-ms", type=float, default=400.0)
+    parser.add_argument("--jitter", type=float, default=0.25)
+    parser.add_argument("--tps", type=float, default=80.0, help="Токенов в секунду на вызов")
+    parser.add_argument("--critique-score", type=float, default=8.0)
+    parser.add_argument("--no-memory", action="store_true", help="Не измерять память (tracemalloc)")
+    parser.add_argument("--json", default=None, help="Сохранить результаты в JSON")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    for scenario in build_scenarios(args):
+        result = await run_scenario(scenario)
+        results.append(result)
+        print(format_result(result), flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([r.model_dump() for r in results], f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,23 @@
+-- Migration 006: Batched prompt usage counters
+-- PromptLoader accumulates usage in memory and sends one call per prompt
+
+CREATE OR REPLACE FUNCTION increment_prompt_usage(
+  p_agent TEXT,
+  p_type TEXT,
+  p_count INTEGER DEFAULT 1
+)
+RETURNS VOID AS $$
+BEGIN
+  UPDATE rag_prompts
+  SET usage_count = usage_count + p_count
+  WHERE id = (
+    SELECT rp.id
+    FROM rag_prompts rp
+    WHERE rp.agent_name = p_agent
+      AND rp.prompt_type = p_type
+      AND rp.is_active = true
+    ORDER BY rp.version DESC
+    LIMIT 1
+  );
+END;
+$$ LANGUAGE plpgsql;
@@ -5,43 +5,95 @@ LLM-top: Base Agent
 
 import re
 from abc import ABC, abstractmethod
-from langchain_core.messages import HumanMessage, SystemMessage
+from typing import Optional
 from langchain_core.language_models import BaseChatModel
 
 from src.models.state import AgentAnalysis, AgentCritique
-from src.prompts.agent_prompts import get_analysis_prompt, get_critique_prompt
-from src.config import AGENT_CONFIGS
+from src.agents.streaming import invoke_llm, invoke_structured
+from src.agents.prompt_cache import prompt_messages
+from src.agents.structured import (
+    AnalysisOutput,
+    BatchCritiqueOutput,
+    CritiqueOutput,
+    analysis_text,
+    batch_critique_text,
+    critique_text,
+)
+from src.agents.llm_pool import model_id
+from src.agents.budget import fit_critique_target
+from src.agents.sections import CONFIDENCE_PATTERNS, SCORE_PATTERNS, parse_sections, search_first
+from src.prompts.agent_prompts import (
+    get_analysis_prompt,
+    get_critique_prompt,
+    get_batch_critique_prompt,
+    get_prompt_version,
+)
+from src.config import AGENT_CONFIGS, get_settings
+
+
+_BATCH_CRITIQUE_HEADING = re.compile(r"^#\s*Критика:\s*(.+?)\s*$", re.MULTILINE)
 
 
 class BaseAgent(ABC):
     """Базовый класс для всех агентов"""
 
+    provider: str = ""  # Ключ лимитов провайдера (openai, anthropic, google, deepseek)
+
     def __init__(self, agent_type: str):
         self.agent_type = agent_type
         self.config = AGENT_CONFIGS[agent_type]
         self.name = self.config["name"]
-        self.llm = self._create_llm()
+
+    @property
+    def llm(self) -> BaseChatModel:
+        """LLM агента из общего пула клиентов (см. src/agents/llm_pool.py)"""
+        return self._create_llm()
 
     @abstractmethod
-    def _create_llm(self) -> BaseChatModel:
-        """Создать LLM для агента"""
+    def _create_llm(self, model: Optional[str] = None) -> BaseChatModel:
+        """Получить LLM для агента (model — другая модель того же провайдера)"""
         pass
 
-    async def analyze(self, task: str, task_type: str, context: str) -> AgentAnalysis:
-        """Провести анализ задачи"""
-        system_prompt, user_prompt = get_analysis_prompt(
+    def fallback_llm(self, model: str) -> BaseChatModel:
+        """LLM с запасной моделью агента (hedge-запрос, см. src/agents/hedging.py)"""
+        return self._create_llm(model)
+
+    @property
+    def model_id(self) -> str:
+        """Модель и температура (часть ключа кэша этапов)"""
+        return model_id(self.llm)
+
+    def prompt_version(self, stage: str) -> str:
+        """Версия промптов этапа (часть ключа кэша этапов)"""
+        return get_prompt_version(self.config, stage)
+
+    async def analyze(
+        self,
+        task: str,
+        task_type: str,
+        context: str,
+        llm: Optional[BaseChatModel] = None,
+    ) -> AgentAnalysis:
+        """Провести анализ задачи (llm — вместо основной модели агента)"""
+        system_prompt, user_parts = get_analysis_prompt(
             self.config, task, task_type, context
         )
 
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt),
-        ]
-
-        response = await self.llm.ainvoke(messages)
-        content = response.content
-
-        # Парсинг ответа
+        messages = prompt_messages(system_prompt, user_parts)
+
+        if get_settings().structured_output_enabled:
+            output, content = await invoke_structured(
+                llm or self.llm, messages, AnalysisOutput, self.name, "analysis",
+                provider=self.provider, text_of=analysis_text,
+            )
+            if output is not None:
+                return output.to_analysis(self.name)
+        else:
+            content = await invoke_llm(
+                llm or self.llm, messages, self.name, "analysis", provider=self.provider
+            )
+
+        # Парсинг Markdown (и ответа, в котором модель не вызвала инструмент)
         return AgentAnalysis(
             agent_name=self.name,
             analysis=content,
@@ -53,18 +105,76 @@ class BaseAgent(ABC):
 
     async def critique(self, task: str, target_name: str, analysis: str) -> AgentCritique:
         """Критиковать анализ другого агента"""
-        system_prompt, user_prompt = get_critique_prompt(
-            self.config, task, target_name, analysis
+        system_prompt, user_parts = get_critique_prompt(
+            self.config, task, target_name, fit_critique_target(analysis)
         )
 
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt),
-        ]
-
-        response = await self.llm.ainvoke(messages)
-        content = response.content
+        messages = prompt_messages(system_prompt, user_parts)
+
+        if get_settings().structured_output_enabled:
+            output, content = await invoke_structured(
+                self.llm, messages, CritiqueOutput, self.name, "critique",
+                provider=self.provider, text_of=critique_text,
+            )
+            if output is not None:
+                return output.to_critique(self.name, target_name)
+        else:
+            content = await invoke_llm(
+                self.llm, messages, self.name, "critique", provider=self.provider
+            )
+
+        return self._build_critique(target_name, content)
+
+    async def critique_batch(
+        self,
+        task: str,
+        targets: list[AgentAnalysis],
+    ) -> list[AgentCritique]:
+        """
+        Критиковать несколько анализов одним вызовом LLM
+
+        Ответ делится по заголовкам `# Критика: <имя>`; анализы, для которых
+        модель не вернула секцию, остаются без критики.
+        """
+        if len(targets) == 1:
+            target = targets[0]
+            return [await self.critique(task, target.agent_name, target.analysis)]
+
+        system_prompt, user_parts = get_batch_critique_prompt(
+            self.config,
+            task,
+            [(t.agent_name, fit_critique_target(t.analysis, len(targets))) for t in targets],
+        )
 
+        messages = prompt_messages(system_prompt, user_parts)
+
+        if get_settings().structured_output_enabled:
+            output, content = await invoke_structured(
+                self.llm, messages, BatchCritiqueOutput, self.name, "critique",
+                provider=self.provider, text_of=batch_critique_text,
+            )
+            if output is not None:
+                reviews = {item.target.strip(" *<>").lower(): item.review for item in output.critiques}
+                return [
+                    reviews[target.agent_name.lower()].to_critique(self.name, target.agent_name)
+                    for target in targets
+                    if target.agent_name.lower() in reviews
+                ]
+        else:
+            content = await invoke_llm(
+                self.llm, messages, self.name, "critique", provider=self.provider
+            )
+        sections = self._split_batch_critique(content)
+
+        critiques = []
+        for target in targets:
+            section = sections.get(target.agent_name.lower())
+            if section:
+                critiques.append(self._build_critique(target.agent_name, section))
+        return critiques
+
+    def _build_critique(self, target_name: str, content: str) -> AgentCritique:
+        """Собрать AgentCritique из текста ответа"""
         return AgentCritique(
             critic_name=self.name,
             target_name=target_name,
@@ -75,29 +185,28 @@ class BaseAgent(ABC):
             suggestions=self._extract_suggestions(content),
         )
 
+    def _split_batch_critique(self, text: str) -> dict[str, str]:
+        """Разбить пакетную критику на секции по агентам"""
+        parts = _BATCH_CRITIQUE_HEADING.split(text)
+        # parts = [преамбула, имя1, текст1, имя2, текст2, ...]
+        return {
+            parts[i].strip(" *<>").lower(): parts[i + 1].strip()
+            for i in range(1, len(parts) - 1, 2)
+        }
+
     def _extract_confidence(self, text: str) -> float:
-        """Извлечь уровень уверенности из текста"""
-        patterns = [
-            r"[Уу]веренность[:\s]+(\d+)%",
-            r"[Уу]ровень уверенности[:\s]+(\d+)%",
-            r"(\d+)%\s*уверенност",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return float(match.group(1)) / 100
+        """Извлечь уровень уверенности из текста (сначала — из секции «Уверенность»)"""
+        match = search_first(CONFIDENCE_PATTERNS, parse_sections(text).body("Уверенность"), text)
+        if match:
+            return float(match.group(1)) / 100
         return 0.7  # default
 
     def _extract_score(self, text: str) -> float:
-        """Извлечь оценку из критики"""
-        patterns = [
-            r"[Оо]бщая оценка[:\s]+(\d+(?:\.\d+)?)/10",
-            r"(\d+(?:\.\d+)?)/10",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return float(match.group(1))
+        """Извлечь оценку из критики (сначала — из заголовков: "## Общая оценка: 8/10")"""
+        titles = "\n".join(parse_sections(text).titles)
+        match = search_first(SCORE_PATTERNS[:1], titles) or search_first(SCORE_PATTERNS, text)
+        if match:
+            return float(match.group(1))
         return 5.0  # default
 
     def _extract_key_points(self, text: str) -> list[str]:
@@ -125,10 +234,5 @@ class BaseAgent(ABC):
         return self._extract_list_section(text, "Предложения")
 
     def _extract_list_section(self, text: str, section_name: str) -> list[str]:
-        """Извлечь список из секции"""
-        pattern = rf"##\s*{section_name}\s*\n((?:[-*]\s*.+\n?)+)"
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            items = re.findall(r"[-*]\s*(.+)", match.group(1))
-            return [item.strip() for item in items if item.strip()]
-        return []
+        """Извлечь список из секции (ответ разбирается один раз на все секции)"""
+        return parse_sections(text).items(section_name)
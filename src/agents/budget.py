@@ -0,0 +1,331 @@
+"""
+LLM-top: Prompt Budget
+Бюджет токенов промптов критики и синтеза: сжатие, дедупликация, учёт экономии
+"""
+
+import asyncio
+import logging
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Optional
+
+from src.agents.sections import normalize_heading, parse_sections
+from src.models.state import AgentAnalysis, AgentCritique, PromptBudgetStats
+from src.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Секции, которые не сжимаются: ради них анализ и критика читаются дальше
+KEY_SECTIONS = frozenset({
+    "ключевые выводы", "риски", "допущения", "уверенность",
+    "сильные стороны", "слабости", "предложения", "предложения по улучшению",
+    "резюме", "таблица выводов",
+})
+TRUNCATED = "[…]"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+_WORDS = re.compile(r"\w+")
+
+
+# ============================================================
+# Токенизатор
+# ============================================================
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """
+    Кодировка tiktoken (None — недоступна: нет пакета или файла словаря)
+
+    Первая загрузка читает (или скачивает) файл словаря синхронно —
+    её делает warmup_tokenizer() при старте, вне event loop.
+    """
+    name = get_settings().prompt_budget_encoding
+    if not name:
+        return None
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(
+            "tiktoken encoding %r unavailable, counting tokens as UTF-8 bytes / 4: %s", name, e
+        )
+        return None
+
+
+async def warmup_tokenizer():
+    """Загрузить кодировку в потоке, чтобы первый count_tokens не блокировал loop"""
+    await asyncio.to_thread(_encoding)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Число токенов текста
+
+    tiktoken (BPE на Rust) — точнее и быстрее оценки по символам на
+    длинных промптах. Без него — UTF-8 байты / 4: для кириллицы это
+    ближе к реальному числу токенов, чем символы / 4.
+    """
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode_ordinary(text))
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+# ============================================================
+# Учёт экономии
+# ============================================================
+
+_budget_stats: ContextVar[Optional[PromptBudgetStats]] = ContextVar("budget_stats", default=None)
+
+
+@contextmanager
+def track_budget(stage: str, iteration: int = 0):
+    """Считать экономию токенов промптов внутри блока (как track_usage)"""
+    stats = PromptBudgetStats(stage=stage, iteration=iteration)
+    token = _budget_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _budget_stats.reset(token)
+
+
+def record_budget(stage: str, original: int, final: int, deduplicated: int = 0):
+    """Учесть один промпт в активном счётчике и в метриках"""
+    from src.monitoring.exporter import PROMPT_TOKENS_SAVED
+
+    saved = max(0, original - final)
+    if saved:
+        PROMPT_TOKENS_SAVED.labels(stage).inc(saved)
+
+    stats = _budget_stats.get()
+    if stats is None:
+        return
+    stats.prompts += 1
+    stats.original_tokens += original
+    stats.final_tokens += final
+    stats.saved_tokens += saved
+    stats.deduplicated += deduplicated
+
+
+# ============================================================
+# Сжатие
+# ============================================================
+
+def allocate(sizes: list[int], budget: int) -> list[int]:
+    """
+    Разделить бюджет между частями (water-filling)
+
+    Части меньше равной доли получают свой размер целиком, остаток
+    делится поровну между крупными.
+    """
+    shares = [0] * len(sizes)
+    remaining = max(0, budget)
+    pending = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    while pending:
+        share = remaining // len(pending)
+        index = pending[0]
+        if sizes[index] <= share:
+            shares[index] = sizes[index]
+            remaining -= sizes[index]
+            pending.pop(0)
+            continue
+        for index in pending:
+            shares[index] = share
+        break
+    return shares
+
+
+def _first_sentences(text: str, count: int) -> str:
+    """Экстрактивное сжатие: первые count предложений каждого абзаца"""
+    paragraphs = []
+    for paragraph in _PARAGRAPHS.split(text.strip()):
+        if paragraph.lstrip().startswith(("|", "-", "*")) or not paragraph.strip():
+            paragraphs.append(paragraph)  # Таблицы и списки не режем по предложениям
+            continue
+        sentences = _SENTENCE_END.split(paragraph.strip())
+        kept = " ".join(sentences[:count])
+        paragraphs.append(kept + (f" {TRUNCATED}" if len(sentences) > count else ""))
+    return "\n\n".join(paragraphs)
+
+
+def _rewrite_low_value(text: str, rewrite) -> str:
+    """Применить rewrite к преамбуле и второстепенным секциям, ключевые — как есть"""
+    sections = parse_sections(text)
+    parts = []
+    cursor = 0
+    blocks = [("", 0, 0, len(sections.preamble))] + sections.headings
+    for title, start, body_start, end in blocks:
+        parts.append(text[cursor:body_start])  # Строка заголовка
+        body = text[body_start:end]
+        if normalize_heading(title) in KEY_SECTIONS or not body.strip():
+            parts.append(body)
+        else:
+            parts.append(rewrite(body).strip() + "\n\n")
+        cursor = end
+    return "".join(parts).strip()
+
+
+def _truncate(text: str, budget: int) -> str:
+    """Обрезать текст до budget токенов"""
+    if count_tokens(text) <= budget:
+        return text
+    encoding = _encoding()
+    if encoding is not None:
+        tokens = encoding.encode_ordinary(text)
+        return encoding.decode(tokens[:max(0, budget - 2)]).rstrip() + f" {TRUNCATED}"
+    ratio = budget / max(1, count_tokens(text))
+    return text[:int(len(text) * ratio * 0.95)].rstrip() + f" {TRUNCATED}"
+
+
+def fit_text(text: str, budget: Optional[int]) -> str:
+    """
+    Сжать текст агента до budget токенов
+
+    По ступеням, пока не уложится: во второстепенных секциях (сам
+    анализ, таблица критериев) — по два первых предложения абзаца, по
+    одному, затем столько текста, сколько помещается в остаток бюджета
+    после ключевых секций (выводы, риски, слабости, ...). Ключевые
+    секции сохраняются; если не помещаются и они — обрезка по токенам.
+    """
+    if budget is None or count_tokens(text) <= budget:
+        return text
+    for count in (2, 1):
+        compressed = _rewrite_low_value(text, lambda body: _first_sentences(body, count))
+        if count_tokens(compressed) <= budget:
+            return compressed
+
+    bodies = []
+    skeleton = _rewrite_low_value(text, lambda body: bodies.append(_first_sentences(body, 1)) or TRUNCATED)
+    spare = budget - count_tokens(skeleton)
+    if spare <= 0:
+        return _truncate(skeleton, budget)
+    shares = iter(allocate([count_tokens(body) for body in bodies], spare))
+    compressed = _rewrite_low_value(text, lambda body: _truncate(_first_sentences(body, 1), next(shares)))
+    return compressed if count_tokens(compressed) <= budget else skeleton
+
+
+def budget_enabled() -> bool:
+    return get_settings().prompt_budget_enabled
+
+
+def fit_critique_target(analysis: str, targets: int = 1) -> str:
+    """Анализ для промпта критики (бюджет делится между целями пакета)"""
+    if not budget_enabled():
+        return analysis
+    budget = get_settings().critique_prompt_budget // max(1, targets)
+    original = count_tokens(analysis)
+    fitted = fit_text(analysis, budget) if original > budget else analysis
+    record_budget("critique", original, count_tokens(fitted) if fitted is not analysis else original)
+    return fitted
+
+
+# ============================================================
+# Дедупликация слабостей
+# ============================================================
+
+def _words(text: str) -> frozenset[str]:
+    return frozenset(word for word in _WORDS.findall(text.lower()) if len(word) > 2)
+
+
+def _same(a: frozenset[str], b: frozenset[str], threshold: float = 0.8) -> bool:
+    if not a or not b:
+        return a == b
+    return len(a & b) / len(a | b) >= threshold
+
+
+def dedupe_weaknesses(critiques: list[AgentCritique]) -> tuple[list[str], int]:
+    """
+    Тексты критик без повторяющихся слабостей
+
+    Слабость цели, уже названная другим критиком (совпадение слов по
+    Жаккару ≥ 0.8), остаётся только в первой критике — с пометкой,
+    кто ещё её отметил. Возвращает (тексты, сколько пунктов убрано).
+    """
+    seen: dict[str, list[tuple[frozenset[str], int, list[str]]]] = {}
+    keep: list[list[tuple[str, list[str]]]] = []
+    removed = 0
+    for index, critique in enumerate(critiques):
+        known = seen.setdefault(critique.target_name, [])
+        items = []
+        for weakness in parse_sections(critique.critique).items("Слабости"):
+            words = _words(weakness)
+            match = next((entry for entry in known if _same(entry[0], words)), None)
+            if match is None:
+                also: list[str] = []
+                known.append((words, index, also))
+                items.append((weakness, also))
+            else:
+                match[2].append(critique.critic_name)
+                removed += 1
+        keep.append(items)
+
+    if not removed:
+        return [c.critique for c in critiques], 0
+
+    texts = []
+    for critique, items in zip(critiques, keep):
+        span = parse_sections(critique.critique).span("Слабости")
+        if span is None:
+            texts.append(critique.critique)
+            continue
+        lines = [
+            f"- {weakness}" + (f" (также: {', '.join(also)})" if also else "")
+            for weakness, also in items
+        ]
+        body = "\n".join(lines) if lines else "- (совпадают с уже перечисленными)"
+        start, end = span
+        texts.append(critique.critique[:start] + body + "\n\n" + critique.critique[end:].lstrip("\n"))
+    return texts, removed
+
+
+# ============================================================
+# Промпт синтеза
+# ============================================================
+
+def _entries(headers: list[str], texts: list[str], budget: Optional[int]) -> list[str]:
+    sizes = [count_tokens(header) + count_tokens(text) for header, text in zip(headers, texts)]
+    shares = allocate(sizes, budget) if budget is not None else sizes
+    return [
+        text if share >= size else fit_text(text, max(0, share - count_tokens(header)))
+        for header, text, size, share in zip(headers, texts, sizes, shares)
+    ]
+
+
+def fit_synthesis(
+    analyses: list[AgentAnalysis],
+    critiques: list[AgentCritique],
+    analysis_headers: list[str],
+    critique_headers: list[str],
+) -> tuple[list[str], list[str]]:
+    """
+    Тексты анализов и критик для промпта синтеза в пределах бюджета
+
+    Сначала из критик убираются повторяющиеся слабости. Если вместе
+    с анализами они не укладываются в synthesis_prompt_budget, каждой
+    части достаётся не меньше половины бюджета (неиспользованное
+    переходит другой), внутри — water-filling по анализам/критикам.
+    """
+    analysis_texts = [a.analysis for a in analyses]
+    critique_texts = [c.critique for c in critiques]
+    if not budget_enabled():
+        return analysis_texts, critique_texts
+
+    original = sum(count_tokens(t) for t in analysis_texts + critique_texts)
+    critique_texts, removed = dedupe_weaknesses(critiques)
+
+    budget = get_settings().synthesis_prompt_budget
+    analysis_tokens = sum(count_tokens(t) for t in analysis_texts)
+    critique_tokens = sum(count_tokens(t) for t in critique_texts)
+    if analysis_tokens + critique_tokens > budget:
+        critique_budget = min(critique_tokens, max(budget // 2, budget - analysis_tokens))
+        analysis_texts = _entries(analysis_headers, analysis_texts, budget - critique_budget)
+        critique_texts = _entries(critique_headers, critique_texts, critique_budget)
+
+    final = sum(count_tokens(t) for t in analysis_texts + critique_texts)
+    record_budget("synthesis", original, final, deduplicated=removed)
+    return analysis_texts, critique_texts
@@ -8,6 +8,7 @@ from pydantic import BaseModel
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
 
+from src.agents.llm_pool import get_llm
 from src.config import get_settings
 
 
@@ -122,25 +123,29 @@ DATA_COLLECTION_USER_PROMPT = """## Задача для анализа:
 class DataCollectionAgent:
     """Агент для планирования сбора данных"""
 
-    def __init__(self):
+    @property
+    def llm(self):
         settings = get_settings()
 
         # Используем прокси если включен
         if settings.llm_proxy_enabled:
-            self.llm = ChatOpenAI(
+            return get_llm(
+                ChatOpenAI,
+                provider="proxy",
                 model="gpt-4o",
                 temperature=0.3,
-                max_tokens=4096,
-                api_key=settings.llm_proxy_api_key,
                 base_url=settings.llm_proxy_base_url,
-            )
-        else:
-            self.llm = ChatOpenAI(
-                model="gpt-4o",
-                temperature=0.3,
                 max_tokens=4096,
-                api_key=settings.openai_api_key,
+                api_key=settings.llm_proxy_api_key,
             )
+        return get_llm(
+            ChatOpenAI,
+            provider="openai",
+            model="gpt-4o",
+            temperature=0.3,
+            max_tokens=4096,
+            api_key=settings.openai_api_key,
+        )
 
     async def create_collection_plan(
         self,
@@ -0,0 +1,197 @@
+"""
+LLM-top: Hedged Requests
+Дедлайны агентов, hedge-запросы к запасной модели и кворум K из N
+"""
+
+import asyncio
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, TypeVar
+from pydantic import BaseModel
+
+from src.agents.llm_pool import model_name
+from src.agents.streaming import mute_tokens
+from src.models.state import AgentAnalysis
+from src.monitoring.exporter import HEDGE_EVENTS
+from src.config import get_settings
+
+T = TypeVar("T")
+
+AGENTS_CONFIG_PATH = Path(__file__).resolve().parents[2] / "configs" / "agents.json"
+
+
+class AgentDeadline(BaseModel):
+    """Дедлайны вызова агента, секунд"""
+    soft: float  # После него — hedge-запрос к fallback_model
+    hard: float  # После него агент считается не ответившим
+    fallback_model: Optional[str] = None
+
+
+@lru_cache
+def load_agent_deadlines(path: Path = AGENTS_CONFIG_PATH) -> dict[str, AgentDeadline]:
+    """
+    Дедлайны из configs/agents.json (api.timeout_ms, api.fallback_model)
+
+    Мягкий дедлайн — api.soft_timeout_ms или доля timeout_ms
+    (`analysis_soft_deadline_ratio`).
+    """
+    try:
+        agents = json.loads(path.read_text(encoding="utf-8"))["agents"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+    ratio = get_settings().analysis_soft_deadline_ratio
+    deadlines = {}
+    for agent_type, config in agents.items():
+        api = config.get("api", {})
+        if not api.get("timeout_ms"):
+            continue
+        hard = api["timeout_ms"] / 1000
+        soft = api.get("soft_timeout_ms", api["timeout_ms"] * ratio) / 1000
+        deadlines[agent_type] = AgentDeadline(
+            soft=min(soft, hard),
+            hard=hard,
+            fallback_model=api.get("fallback_model"),
+        )
+    return deadlines
+
+
+def get_agent_deadline(agent) -> Optional[AgentDeadline]:
+    """Дедлайны агента (None — дедлайны отключены или не заданы)"""
+    if not get_settings().analysis_deadlines_enabled:
+        return None
+    return load_agent_deadlines().get(getattr(agent, "agent_type", None))
+
+
+async def hedged(
+    primary: Callable[[], Awaitable[T]],
+    hedge: Optional[Callable[[], Awaitable[T]]],
+    soft: float,
+    hard: float,
+    label: str = "",
+) -> T:
+    """
+    Вызов с мягким и жёстким дедлайном
+
+    Если основной вызов не завершился за `soft` секунд (или упал
+    раньше), параллельно запускается `hedge`; побеждает первый успешный
+    ответ, проигравший отменяется. После `hard` секунд от начала —
+    asyncio.TimeoutError.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    primary_task = asyncio.ensure_future(primary())
+    pending = {primary_task}
+    error: Optional[BaseException] = None
+
+    try:
+        while True:
+            elapsed = loop.time() - start
+            if hedge is not None and (not pending or elapsed >= soft):
+                pending.add(asyncio.ensure_future(_muted(hedge)))
+                HEDGE_EVENTS.labels(label, "hedge_launched").inc()
+                hedge = None
+            if not pending:
+                raise error
+
+            remaining = hard - elapsed
+            if remaining <= 0:
+                HEDGE_EVENTS.labels(label, "hard_deadline").inc()
+                raise asyncio.TimeoutError(f"{label} exceeded hard deadline {hard:.1f}s")
+            timeout = remaining if hedge is None else min(remaining, soft - elapsed)
+
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary_task:
+                        HEDGE_EVENTS.labels(label, "hedge_won").inc()
+                    return task.result()
+                error = task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _muted(factory: Callable[[], Awaitable[T]]) -> T:
+    # Токены hedge-запроса не смешиваются с потоком основного
+    with mute_tokens():
+        return await factory()
+
+
+async def analyze_with_deadline(agent, task: str, task_type: str, context: str) -> AgentAnalysis:
+    """
+    Анализ агента с дедлайнами и hedge-запросом из configs/agents.json
+
+    hedge-запроса нет, если запасная модель совпадает с основной: это
+    был бы такой же второй вызов. Ответ hedge-запроса помечен запасной
+    моделью (answered_by_hedge) — в кэш этапов под ключом основной
+    модели он не попадает.
+    """
+    deadline = get_agent_deadline(agent)
+    if deadline is None:
+        return await agent.analyze(task, task_type, context)
+
+    hedge = None
+    fallback = deadline.fallback_model
+    if fallback and fallback != model_name(agent.llm) and get_settings().analysis_hedging_enabled:
+        async def hedge():
+            result = await agent.analyze(task, task_type, context, llm=agent.fallback_llm(fallback))
+            if isinstance(result, AgentAnalysis):
+                result._hedge_model = fallback
+            return result
+
+    return await hedged(
+        lambda: agent.analyze(task, task_type, context),
+        hedge,
+        soft=deadline.soft,
+        hard=deadline.hard,
+        label=agent.name,
+    )
+
+
+def answered_by_hedge(analysis: AgentAnalysis) -> bool:
+    """Анализ дала запасная модель hedge-запроса"""
+    return analysis._hedge_model is not None
+
+
+async def gather_quorum(
+    aws: list[Awaitable[T]],
+    quorum: Optional[int],
+    grace: float = 0.0,
+    is_success: Callable[[object], bool] = lambda result: True,
+) -> list:
+    """
+    Как gather(return_exceptions=True), но до кворума
+
+    Возвращается, когда `quorum` вызовов завершились успешно (плюс
+    `grace` секунд на остальных) или все завершились. Незавершённые
+    отменяются, на их месте — asyncio.CancelledError. quorum=None —
+    ждать всех.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    if quorum is None or quorum >= len(tasks):
+        return list(await asyncio.gather(*tasks, return_exceptions=True))
+
+    pending = set(tasks)
+    succeeded = 0
+    try:
+        while pending and succeeded < quorum:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded += sum(
+                1 for task in done
+                if not task.cancelled() and task.exception() is None and is_success(task.result())
+            )
+        if pending and grace > 0:
+            _, pending = await asyncio.wait(pending, timeout=grace)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    return [_outcome(task) for task in tasks]
+
+
+def _outcome(task: asyncio.Future):
+    if not task.done() or task.cancelled():
+        return asyncio.CancelledError()
+    return task.exception() or task.result()
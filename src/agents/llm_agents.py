@@ -3,39 +3,48 @@ LLM-top: LLM Agents
 Конкретные реализации агентов для каждой LLM
 """
 
+from typing import Optional
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.language_models import BaseChatModel
 
 from src.agents.base import BaseAgent
+from src.agents.llm_pool import get_llm
 from src.config import get_settings
 
 
 def _create_proxy_llm(model: str) -> BaseChatModel:
-    """Создать LLM через vsellm.ru прокси"""
+    """Получить LLM через vsellm.ru прокси"""
     settings = get_settings()
-    return ChatOpenAI(
+    return get_llm(
+        ChatOpenAI,
+        provider="proxy",
         model=model,
         temperature=settings.temperature,
+        base_url=settings.llm_proxy_base_url,
         max_tokens=settings.max_tokens,
         api_key=settings.llm_proxy_api_key,
-        base_url=settings.llm_proxy_base_url,
     )
 
 
 class ChatGPTAgent(BaseAgent):
     """Агент на базе ChatGPT - Логический аналитик"""
 
+    provider = "openai"
+
     def __init__(self):
         super().__init__("chatgpt")
 
-    def _create_llm(self) -> BaseChatModel:
+    def _create_llm(self, model: Optional[str] = None) -> BaseChatModel:
         settings = get_settings()
+        model = model or settings.chatgpt_model
         if settings.llm_proxy_enabled:
-            return _create_proxy_llm(settings.chatgpt_model)
-        return ChatOpenAI(
-            model=settings.chatgpt_model,
+            return _create_proxy_llm(model)
+        return get_llm(
+            ChatOpenAI,
+            provider="openai",
+            model=model,
             temperature=settings.temperature,
             max_tokens=settings.max_tokens,
             api_key=settings.openai_api_key,
@@ -45,15 +54,20 @@ class ChatGPTAgent(BaseAgent):
 class ClaudeAgent(BaseAgent):
     """Агент на базе Claude - Системный архитектор"""
 
+    provider = "anthropic"
+
     def __init__(self):
         super().__init__("claude")
 
-    def _create_llm(self) -> BaseChatModel:
+    def _create_llm(self, model: Optional[str] = None) -> BaseChatModel:
         settings = get_settings()
+        model = model or settings.claude_model
         if settings.llm_proxy_enabled:
-            return _create_proxy_llm(settings.claude_model)
-        return ChatAnthropic(
-            model=settings.claude_model,
+            return _create_proxy_llm(model)
+        return get_llm(
+            ChatAnthropic,
+            provider="anthropic",
+            model=model,
             temperature=settings.temperature,
             max_tokens=settings.max_tokens,
             api_key=settings.anthropic_api_key,
@@ -63,24 +77,31 @@ class ClaudeAgent(BaseAgent):
 class GeminiAgent(BaseAgent):
     """Агент на базе Gemini - Генератор альтернатив"""
 
+    provider = "google"
+
     def __init__(self):
         super().__init__("gemini")
 
-    def _create_llm(self) -> BaseChatModel:
+    def _create_llm(self, model: Optional[str] = None) -> BaseChatModel:
         settings = get_settings()
+        model = model or settings.gemini_model
         # Gemini через отдельный прокси (vsellm.ru)
         if settings.gemini_proxy_enabled:
-            return ChatOpenAI(
-                model=settings.gemini_model,
+            return get_llm(
+                ChatOpenAI,
+                provider="gemini_proxy",
+                model=model,
                 temperature=settings.temperature,
+                base_url=settings.gemini_proxy_base_url,
                 max_tokens=settings.max_tokens,
                 api_key=settings.gemini_proxy_api_key,
-                base_url=settings.gemini_proxy_base_url,
             )
         if settings.llm_proxy_enabled:
-            return _create_proxy_llm(settings.gemini_model)
-        return ChatGoogleGenerativeAI(
-            model=settings.gemini_model,
+            return _create_proxy_llm(model)
+        return get_llm(
+            ChatGoogleGenerativeAI,
+            provider="google",
+            model=model,
             temperature=settings.temperature,
             max_output_tokens=settings.max_tokens,
             google_api_key=settings.google_api_key,
@@ -90,20 +111,25 @@ class GeminiAgent(BaseAgent):
 class DeepSeekAgent(BaseAgent):
     """Агент на базе DeepSeek - Формальный аналитик"""
 
+    provider = "deepseek"
+
     def __init__(self):
         super().__init__("deepseek")
 
-    def _create_llm(self) -> BaseChatModel:
+    def _create_llm(self, model: Optional[str] = None) -> BaseChatModel:
         settings = get_settings()
+        model = model or settings.deepseek_model
         if settings.llm_proxy_enabled:
-            return _create_proxy_llm(settings.deepseek_model)
+            return _create_proxy_llm(model)
         # DeepSeek использует OpenAI-совместимый API
-        return ChatOpenAI(
-            model=settings.deepseek_model,
+        return get_llm(
+            ChatOpenAI,
+            provider="deepseek",
+            model=model,
             temperature=settings.temperature,
+            base_url="https://api.deepseek.com/v1",
             max_tokens=settings.max_tokens,
             api_key=settings.deepseek_api_key,
-            base_url="https://api.deepseek.com/v1",
         )
 
 
@@ -115,3 +141,19 @@ def create_all_agents() -> dict[str, BaseAgent]:
         "gemini": GeminiAgent(),
         "deepseek": DeepSeekAgent(),
     }
+
+
+_shared_agents: Optional[dict[str, BaseAgent]] = None
+
+
+def get_shared_agents() -> dict[str, BaseAgent]:
+    """
+    Агенты процесса
+
+    Агенты не хранят состояние запроса, а LLM клиенты берут из общего
+    пула, поэтому один набор обслуживает граф, fallback и пул агентов.
+    """
+    global _shared_agents
+    if _shared_agents is None:
+        _shared_agents = create_all_agents()
+    return _shared_agents
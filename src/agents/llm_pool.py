@@ -0,0 +1,215 @@
+"""
+LLM-top: LLM Client Pool
+Общий реестр LLM клиентов и HTTP соединений на процесс
+"""
+
+import asyncio
+import importlib
+import logging
+import weakref
+from typing import Any, Callable, Optional
+import httpx
+from langchain_core.language_models import BaseChatModel
+
+from src.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+class LLMPool:
+    """
+    Реестр LLM клиентов
+
+    Клиент создаётся один раз на ключ (factory, provider, model, base_url,
+    temperature, ...) и переиспользуется агентами, синтезатором и
+    вспомогательными компонентами. HTTP соединения с keep-alive общие
+    для всех моделей одного провайдера.
+
+    Соединения httpx привязаны к event loop, поэтому реестр ведётся
+    отдельно для каждого loop: Celery worker с новым loop на задачу
+    не получит клиента с сокетами закрытого loop. Записи исчезают вместе
+    с loop (weakref), `aclose_loop()` закрывает соединения явно.
+    """
+
+    def __init__(self):
+        self._models: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = (
+            weakref.WeakKeyDictionary()
+        )
+        # Клиенты, созданные вне event loop (без общего async HTTP пула)
+        self._unbound: dict[tuple, BaseChatModel] = {}
+
+    def get(
+        self,
+        factory: Callable[..., BaseChatModel],
+        provider: str,
+        model: str,
+        temperature: float,
+        base_url: Optional[str] = None,
+        **kwargs: Any,
+    ) -> BaseChatModel:
+        """
+        Получить (или создать) LLM клиент
+
+        Args:
+            factory: Класс модели (ChatOpenAI, ChatAnthropic, ...)
+            provider: openai, anthropic, google, deepseek, proxy
+            model: Имя модели
+            temperature: Температура
+            base_url: Базовый URL (для прокси и OpenAI-совместимых API)
+            **kwargs: Остальные параметры конструктора (api_key, max_tokens)
+        """
+        key = (factory, provider, model, base_url, temperature, tuple(sorted(kwargs.items())))
+        loop = _running_loop()
+
+        models = self._unbound if loop is None else self._models.setdefault(loop, {})
+        llm = models.get(key)
+        if llm is None:
+            llm = self._create(factory, provider, model, temperature, base_url, loop, kwargs)
+            models[key] = llm
+        return llm
+
+    def _create(
+        self,
+        factory: Callable[..., BaseChatModel],
+        provider: str,
+        model: str,
+        temperature: float,
+        base_url: Optional[str],
+        loop: Optional[asyncio.AbstractEventLoop],
+        kwargs: dict,
+    ) -> BaseChatModel:
+        params = dict(kwargs, model=model, temperature=temperature)
+        if base_url:
+            params["base_url"] = base_url
+
+        fields = getattr(factory, "model_fields", None)
+        fields = fields if isinstance(fields, dict) else {}
+
+        if loop is None:
+            return factory(**params)
+
+        # OpenAI-совместимые клиенты (OpenAI, DeepSeek, прокси) принимают пул явно
+        if "http_async_client" in fields:
+            params["http_async_client"] = self._http_client(loop, provider, httpx.AsyncClient)
+            return factory(**params)
+
+        llm = factory(**params)
+        if "anthropic_api_url" in fields:
+            _bind_anthropic_http_client(llm, lambda cls: self._http_client(loop, provider, cls))
+        return llm
+
+    def _http_client(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        provider: str,
+        client_cls: type,
+    ):
+        """Общий HTTP клиент провайдера в рамках event loop"""
+        clients = self._http_clients.setdefault(loop, {})
+        client = clients.get(provider)
+        if client is None:
+            settings = get_settings()
+            # SDK провайдеров могут собираться на разных версиях httpx —
+            # Limits/Timeout берём из того же пакета, что и класс клиента
+            http = _http_module(client_cls)
+            client = client_cls(
+                limits=http.Limits(
+                    max_connections=settings.llm_pool_max_connections,
+                    max_keepalive_connections=settings.llm_pool_max_keepalive,
+                    keepalive_expiry=settings.llm_pool_keepalive_expiry,
+                ),
+                timeout=http.Timeout(settings.llm_request_timeout, connect=10.0),
+            )
+            clients[provider] = client
+        return client
+
+    async def aclose_loop(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Закрыть соединения и забыть клиентов текущего (или указанного) loop"""
+        loop = loop or _running_loop()
+        if loop is None:
+            return
+        self._models.pop(loop, None)
+        clients = self._http_clients.pop(loop, {})
+        for client in clients.values():
+            await client.aclose()
+
+    def stats(self) -> dict:
+        """Статистика пула"""
+        return {
+            "event_loops": len(self._models),
+            "models": sum(len(m) for m in self._models.values()) + len(self._unbound),
+            "http_clients": sum(len(c) for c in self._http_clients.values()),
+        }
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _http_module(client_cls: type):
+    """Пакет httpx, к которому относится класс клиента"""
+    for base in client_cls.__mro__:
+        root = base.__module__.split(".")[0]
+        if root.startswith("httpx"):
+            return importlib.import_module(root)
+    return httpx
+
+
+def _bind_anthropic_http_client(llm: BaseChatModel, get_http_client: Callable[[type], Any]):
+    """
+    Подключить общий HTTP пул к ChatAnthropic
+
+    langchain-anthropic не принимает http клиент в конструкторе и создаёт
+    anthropic.AsyncClient лениво (cached_property `_async_client`).
+    Заполняем этот кэш заранее — версия пакета ограничена в
+    requirements.txt, а TestLLMPool.test_anthropic_uses_shared_pool
+    падает, если привязка перестала работать. При сбое остаётся клиент
+    по умолчанию (с предупреждением в лог). Версии с полем
+    http_async_client получают пул через конструктор, см. LLMPool._create.
+    """
+    try:
+        import anthropic
+
+        params = dict(llm._client_params)
+        params["http_client"] = get_http_client(anthropic.DefaultAsyncHttpxClient)
+        llm.__dict__["_async_client"] = anthropic.AsyncClient(**params)
+    except Exception as e:
+        logger.warning(
+            "Общий HTTP пул не подключён к %s, используется клиент по умолчанию: %s",
+            type(llm).__name__, e, exc_info=True,
+        )
+
+
+_pool = LLMPool()
+
+
+def get_llm_pool() -> LLMPool:
+    """Получить реестр LLM клиентов процесса"""
+    return _pool
+
+
+def get_llm(
+    factory: Callable[..., BaseChatModel],
+    provider: str,
+    model: str,
+    temperature: float,
+    base_url: Optional[str] = None,
+    **kwargs: Any,
+) -> BaseChatModel:
+    """Получить общий LLM клиент (см. LLMPool.get)"""
+    return _pool.get(factory, provider, model, temperature, base_url, **kwargs)
+
+
+def model_name(llm: BaseChatModel) -> str:
+    """Имя модели клиента"""
+    return getattr(llm, "model_name", None) or getattr(llm, "model", "")
+
+
+def model_id(llm: BaseChatModel) -> str:
+    """Идентификатор модели клиента: имя и температура"""
+    return f"{model_name(llm)}@{getattr(llm, 'temperature', '')}"
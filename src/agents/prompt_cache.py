@@ -0,0 +1,80 @@
+"""
+LLM-top: Prompt Cache
+Кэширование префикса промпта у провайдера: стабильные части впереди, маркеры Anthropic
+"""
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from src.config import get_settings
+
+
+# Anthropic принимает не больше 4 точек кэширования на запрос
+MAX_CACHE_BREAKPOINTS = 4
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def prompt_messages(system: str, parts: list[str]) -> list[BaseMessage]:
+    """
+    Сообщения вызова: системный промпт и запрос блоками
+
+    parts — части запроса от стабильных к переменным (задача, контекст,
+    анализ цели, инструкция). Блоки сводятся в строку или размечаются
+    для кэша в cache_prompt() — по модели, которая выполнит вызов.
+    """
+    return [
+        SystemMessage(content=system),
+        HumanMessage(content=[{"type": "text", "text": part} for part in parts if part]),
+    ]
+
+
+def _is_anthropic(llm: BaseChatModel) -> bool:
+    """Нативный клиент Anthropic (через OpenAI-совместимый прокси маркеры не передаются)"""
+    return getattr(llm, "_llm_type", None) == "anthropic-chat"
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+def cache_prompt(llm: BaseChatModel, messages: list[BaseMessage]) -> list[BaseMessage]:
+    """
+    Подготовить сообщения к вызову llm
+
+    OpenAI и DeepSeek кэшируют общий префикс запросов автоматически
+    (от 1024 токенов) — им нужен только стабильный порядок частей,
+    блоки сводятся в строку, и запрос не отличается от обычного.
+    Anthropic кэширует только размеченный префикс: cache_control ставится
+    на системный промпт и на блоки запроса перед последним (переменным),
+    не больше MAX_CACHE_BREAKPOINTS. Повторные вызовы с тем же
+    префиксом — критика целей одним критиком, повтор после ошибки,
+    следующая итерация — читают его из кэша по сниженной цене.
+    """
+    if not (get_settings().prompt_caching_enabled and _is_anthropic(llm)):
+        return [
+            message if isinstance(message.content, str)
+            else message.model_copy(update={"content": _text(message.content)})
+            for message in messages
+        ]
+
+    budget = MAX_CACHE_BREAKPOINTS
+    prepared = []
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            blocks = [{"type": "text", "text": _text(message.content), "cache_control": CACHE_CONTROL}]
+            budget -= 1
+        elif isinstance(message, HumanMessage) and isinstance(message.content, list):
+            blocks = [dict(block) for block in message.content]
+            # Точки на последних стабильных блоках: префикс до них тоже читается из кэша
+            for block in reversed(blocks[:-1]):
+                if budget <= 0:
+                    break
+                block["cache_control"] = CACHE_CONTROL
+                budget -= 1
+        else:
+            prepared.append(message)
+            continue
+        prepared.append(message.model_copy(update={"content": blocks}))
+    return prepared
@@ -251,10 +251,14 @@ class FactChecker:
     Использует поисковые API и LLM для верификации утверждений
     """
 
-    def __init__(self):
+    @property
+    def llm(self):
         settings = get_settings()
         from langchain_openai import ChatOpenAI
-        self.llm = ChatOpenAI(
+        from src.agents.llm_pool import get_llm
+        return get_llm(
+            ChatOpenAI,
+            provider="openai",
             model="gpt-4-turbo-preview",
             temperature=0,
             api_key=settings.openai_api_key,
@@ -0,0 +1,151 @@
+"""
+LLM-top: Section Parser
+Однопроходный разбор Markdown ответа LLM на секции «заголовок → текст»
+"""
+
+import re
+from functools import lru_cache
+from typing import Optional
+
+
+# Строка заголовка любого уровня: "## Риски", "### Общая оценка: 8/10 ##"
+_HEADING = re.compile(r"#{1,6}[ \t]*(.*?)[ \t#]*")
+# Пункт списка: "- текст", "* текст" (не "**жирный**" и не "---")
+_BULLET = re.compile(r"^[ \t]*[-*](?![-*])[ \t]*(\S[^\n]*)$", re.MULTILINE)
+_TABLE_SEPARATOR = re.compile(r"^[-:|\s]+$")
+_SPACES = re.compile(r"\s+")
+
+CONFIDENCE_PATTERNS = (
+    re.compile(r"[Уу]веренность[:\s]+(\d+)%"),
+    re.compile(r"[Уу]ровень уверенности[:\s]+(\d+)%"),
+    re.compile(r"(\d+)%\s*уверенност"),
+)
+SCORE_PATTERNS = (
+    re.compile(r"[Оо]бщая оценка[:\s]+(\d+(?:\.\d+)?)/10"),
+    re.compile(r"(\d+(?:\.\d+)?)/10"),
+)
+
+
+def normalize_heading(title: str) -> str:
+    """Ключ заголовка: без разметки, пробелы схлопнуты, нижний регистр"""
+    return _SPACES.sub(" ", title.strip(" \t*_:")).lower()
+
+
+class Sections:
+    """
+    Секции ответа
+
+    Заголовки находятся одним проходом по тексту; текст секции — срез
+    до следующего заголовка любого уровня. Пункты
+    списков и строки таблиц разбираются при первом обращении к секции
+    и запоминаются. При повторяющихся заголовках берётся первый.
+    """
+
+    __slots__ = ("text", "titles", "headings", "preamble", "_spans", "_items")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.titles: list[str] = []
+        # (заголовок, начало строки заголовка, начало текста, конец секции)
+        self.headings: list[tuple[str, int, int, int]] = []
+        self._spans: dict[str, tuple[int, int]] = {}
+        self._items: dict[str, list[str]] = {}
+
+        # Поиск строк с "#" через str.find быстрее регулярного выражения
+        # с re.MULTILINE: тот проверяет "^" в каждой позиции текста
+        found = []
+        pos = 0 if text.startswith("#") else text.find("\n#")
+        while pos != -1:
+            start = pos if text[pos] == "#" else pos + 1
+            end = text.find("\n", start)
+            if end == -1:
+                end = len(text)
+            match = _HEADING.fullmatch(text, start, end)
+            if match:
+                found.append((start, end, match.group(1)))
+            pos = text.find("\n#", end)
+
+        # Текст до первого заголовка (пусто, если заголовков нет)
+        self.preamble = text[:found[0][0]] if found else ""
+        for i, (start, end, title) in enumerate(found):
+            section_end = found[i + 1][0] if i + 1 < len(found) else len(text)
+            self.titles.append(title)
+            self.headings.append((title, start, min(end + 1, section_end), section_end))
+            self._spans.setdefault(normalize_heading(title), (end + 1, section_end))
+
+    def __contains__(self, name: str) -> bool:
+        return normalize_heading(name) in self._spans
+
+    def _key(self, names: tuple[str, ...]) -> Optional[str]:
+        for name in names:
+            key = normalize_heading(name)
+            if key in self._spans:
+                return key
+        return None
+
+    def span(self, *names: str) -> Optional[tuple[int, int]]:
+        """Границы текста первой найденной секции (без строки заголовка)"""
+        key = self._key(names)
+        return None if key is None else self._spans[key]
+
+    def body(self, *names: str) -> Optional[str]:
+        """Текст первой найденной секции из names (None — нет ни одной)"""
+        key = self._key(names)
+        if key is None:
+            return None
+        start, end = self._spans[key]
+        return self.text[start:end].strip()
+
+    def items(self, *names: str) -> list[str]:
+        """Пункты маркированного списка секции"""
+        key = self._key(names)
+        if key is None:
+            return []
+        if key not in self._items:
+            start, end = self._spans[key]
+            self._items[key] = [
+                item.strip() for item in _BULLET.findall(self.text, start, end) if item.strip()
+            ]
+        return list(self._items[key])
+
+    def table(self, *names: str) -> list[list[str]]:
+        """Строки первой таблицы секции без заголовка и разделителя"""
+        body = self.body(*names)
+        if not body:
+            return []
+        rows = []
+        for line in body.splitlines():
+            line = line.strip()
+            if line.startswith("|") and line.endswith("|"):
+                rows.append(line[1:-1])
+            elif rows:
+                break  # Таблица закончилась
+        cells = [
+            [cell.strip() for cell in row.split("|") if cell.strip()]
+            for row in rows[1:]
+            if not _TABLE_SEPARATOR.match(row)
+        ]
+        return [row for row in cells if row]
+
+
+@lru_cache(maxsize=64)
+def parse_sections(text: str) -> Sections:
+    """
+    Секции текста (кэшируются)
+
+    Несколько извлекателей одного ответа — уверенность, выводы, риски,
+    допущения — разбирают его один раз.
+    """
+    return Sections(text)
+
+
+def search_first(patterns: tuple[re.Pattern, ...], *texts: Optional[str]) -> Optional[re.Match]:
+    """Первое совпадение по приоритету шаблонов в первом тексте, где оно есть"""
+    for text in texts:
+        if not text:
+            continue
+        for pattern in patterns:
+            match = pattern.search(text)
+            if match:
+                return match
+    return None
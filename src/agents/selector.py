@@ -261,6 +261,22 @@ class AgentSelector:
         return self.health_status.copy()
 
 
+_agent_selector: Optional[AgentSelector] = None
+
+
+def get_agent_selector() -> AgentSelector:
+    """
+    Селектор процесса
+
+    Общий для пула агентов и телеметрии LLM вызовов, которая обновляет
+    здоровье агентов по каждому вызову.
+    """
+    global _agent_selector
+    if _agent_selector is None:
+        _agent_selector = AgentSelector()
+    return _agent_selector
+
+
 class FallbackExecutor:
     """
     Исполнитель с fallback
@@ -285,9 +301,9 @@ class FallbackExecutor:
             (result, actual_agent_name)
         """
         import time
-        from src.agents.llm_agents import create_all_agents
+        from src.agents.llm_agents import get_shared_agents
 
-        agents = create_all_agents()
+        agents = get_shared_agents()
         current_agent_name = primary_agent.agent_type
         attempts = 0
 
@@ -332,7 +348,7 @@ class AdaptiveAgentPool:
     """
 
     def __init__(self):
-        self.selector = AgentSelector()
+        self.selector = get_agent_selector()
         self.executor = FallbackExecutor(self.selector)
 
     async def run_parallel_analysis(
@@ -348,9 +364,9 @@ class AdaptiveAgentPool:
         Returns:
             Список (analysis, agent_name) туплов
         """
-        from src.agents.llm_agents import create_all_agents
+        from src.agents.llm_agents import get_shared_agents
 
-        agents = create_all_agents()
+        agents = get_shared_agents()
 
         if use_personas:
             agent_personas = self.selector.select_with_personas(task_type, task)
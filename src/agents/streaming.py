@@ -0,0 +1,337 @@
+"""
+LLM-top: Token Streaming
+Потоковая передача токенов от агентов в SSE
+"""
+
+import asyncio
+import json
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Callable, Optional
+from pydantic import BaseModel
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import ensure_config, merge_configs
+from langchain_core.utils.json import parse_partial_json
+
+from src.agents.prompt_cache import cache_prompt
+from src.agents.usage import estimate_tokens, record_usage
+from src.config import get_settings
+
+
+class TokenEvent(BaseModel):
+    """Дельта токенов от одного LLM вызова"""
+    agent: str
+    stage: str  # analysis, critique, synthesis
+    iteration: int
+    delta: str
+
+
+class TokenStream:
+    """
+    Ограниченная очередь событий для одного streaming-запроса
+
+    Ограниченный размер очереди даёт backpressure: если клиент читает
+    медленно, `emit` ждёт, и чтение из сокета провайдера приостанавливается,
+    вместо того чтобы копить токены в памяти.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.closed = False
+
+    async def emit(self, agent: str, stage: str, delta: str):
+        """Отправить дельту токенов"""
+        if self.closed or not delta:
+            return
+        event = TokenEvent(
+            agent=agent,
+            stage=stage,
+            iteration=_stream_iteration.get(),
+            delta=delta,
+        )
+        await self.queue.put(("token", event))
+
+    async def put(self, kind: str, payload):
+        """Отправить произвольное событие (node, done, error)"""
+        if self.closed:
+            return
+        await self.queue.put((kind, payload))
+
+    def close(self):
+        """Закрыть поток: последующие события отбрасываются"""
+        self.closed = True
+        # Освобождаем producers, заблокированные на полной очереди
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+_token_stream: ContextVar[Optional[TokenStream]] = ContextVar("token_stream", default=None)
+_stream_iteration: ContextVar[int] = ContextVar("stream_iteration", default=0)
+
+
+@contextmanager
+def stream_tokens(stream: TokenStream):
+    """
+    Включить потоковую передачу токенов в текущем контексте
+
+    Контекст наследуется задачами asyncio, поэтому все агенты,
+    запущенные внутри графа, пишут в один поток.
+    """
+    token = _token_stream.set(stream)
+    try:
+        yield stream
+    finally:
+        _token_stream.reset(token)
+
+
+@contextmanager
+def mute_tokens():
+    """Не передавать токены вызовов текущего контекста (например, hedge-запроса)"""
+    token = _token_stream.set(None)
+    try:
+        yield
+    finally:
+        _token_stream.reset(token)
+
+
+def set_stream_iteration(iteration: int):
+    """Пометить текущую итерацию для событий токенов"""
+    _stream_iteration.set(iteration)
+
+
+def get_token_stream() -> Optional[TokenStream]:
+    """Получить активный поток токенов (если есть)"""
+    return _token_stream.get()
+
+
+async def invoke_llm(
+    llm: BaseChatModel,
+    messages: list[BaseMessage],
+    agent_name: str,
+    stage: str,
+    provider: Optional[str] = None,
+) -> str:
+    """
+    Вызвать LLM и вернуть текст ответа
+
+    Без активного потока используется обычный `ainvoke`. Если поток
+    включён — `astream`, и каждая дельта сразу уходит клиенту.
+    При включённом rate limiting вызов сначала ждёт допуска по лимитам
+    провайдера, в задаче пакета — ещё и слота в общем бюджете
+    провайдера (src/infrastructure/batch.py). Все вызовы проходят
+    контроль допуска по классу приоритета (src/infrastructure/admission.py).
+    Латентность и токены вызова собирает LLMCallHandler
+    (см. src/monitoring/llm_calls.py).
+    """
+    messages = cache_prompt(llm, messages)
+    prompt_text = _messages_text(messages)
+    config = _call_config(agent_name, stage, provider)
+    async with _batch_slot(provider), _admission(provider), _rate_limit(provider, prompt_text):
+        stream = _token_stream.get()
+        if stream is None:
+            response = await llm.ainvoke(messages, config=config)
+            record_usage(
+                getattr(response, "usage_metadata", None),
+                prompt_text,
+                _chunk_text(response.content),
+            )
+            return response.content
+
+        parts = []
+        usage: dict = {}
+        async for chunk in llm.astream(messages, config=config):
+            delta = _chunk_text(chunk.content)
+            if delta:
+                parts.append(delta)
+                await stream.emit(agent_name, stage, delta)
+            # Провайдеры присылают usage частями (Anthropic) или в последнем чанке (OpenAI)
+            if isinstance(getattr(chunk, "usage_metadata", None), dict):
+                for key in ("input_tokens", "output_tokens"):
+                    usage[key] = usage.get(key, 0) + chunk.usage_metadata.get(key, 0)
+
+        content = "".join(parts)
+        record_usage(usage, prompt_text, content)
+        return content
+
+
+async def invoke_structured(
+    llm: BaseChatModel,
+    messages: list[BaseMessage],
+    schema: type[BaseModel],
+    agent_name: str,
+    stage: str,
+    provider: Optional[str] = None,
+    text_of: Callable[[dict], str] = lambda args: "",
+) -> tuple[Optional[BaseModel], str]:
+    """
+    Вызвать LLM с обязательным вызовом инструмента `schema`
+
+    Возвращает (аргументы, проверенные схемой, или None; текст ответа
+    вне инструмента). В потоковом режиме аргументы приходят частями:
+    частичный JSON разбирается по мере роста, и в поток токенов уходит
+    прирост `text_of(аргументы)` — клиент видит тот же текст анализа,
+    что и в Markdown режиме.
+    """
+    from src.agents.structured import STRUCTURED_INSTRUCTION, validate_output
+
+    tool = schema.__name__
+    if messages and isinstance(messages[0], SystemMessage):
+        instruction = STRUCTURED_INSTRUCTION.format(tool=tool)
+        messages = [SystemMessage(content=_chunk_text(messages[0].content) + instruction), *messages[1:]]
+    messages = cache_prompt(llm, messages)
+    bound = llm.bind_tools([schema], tool_choice=tool)
+
+    prompt_text = _messages_text(messages)
+    config = _call_config(agent_name, stage, provider)
+    async with _batch_slot(provider), _admission(provider), _rate_limit(provider, prompt_text):
+        stream = _token_stream.get()
+        if stream is None:
+            response = await bound.ainvoke(messages, config=config)
+            args = next((call["args"] for call in response.tool_calls if call["name"] == tool), None)
+            content = _chunk_text(response.content)
+            record_usage(
+                getattr(response, "usage_metadata", None),
+                prompt_text,
+                content + (json.dumps(args, ensure_ascii=False) if args else ""),
+            )
+            return validate_output(schema, args), content
+
+        parts = []
+        args_parts = []
+        usage: dict = {}
+        partial = _PartialArgs(text_of)
+        async for chunk in bound.astream(messages, config=config):
+            delta = _chunk_text(chunk.content)
+            if delta:
+                parts.append(delta)
+            for call in getattr(chunk, "tool_call_chunks", None) or []:
+                if call.get("args"):
+                    args_parts.append(call["args"])
+                    delta = partial.feed(call["args"])
+                    if delta:
+                        await stream.emit(agent_name, stage, delta)
+            if isinstance(getattr(chunk, "usage_metadata", None), dict):
+                for key in ("input_tokens", "output_tokens"):
+                    usage[key] = usage.get(key, 0) + chunk.usage_metadata.get(key, 0)
+
+        raw_args = "".join(args_parts)
+        args = partial.finish()
+        delta = partial.pending()
+        if delta:
+            await stream.emit(agent_name, stage, delta)
+        content = "".join(parts)
+        record_usage(usage, prompt_text, content + raw_args)
+        return validate_output(schema, args), content
+
+
+class _PartialArgs:
+    """
+    Аргументы инструмента, собираемые из потока частичного JSON
+
+    Разбор частичного JSON линейный по длине, поэтому он повторяется не
+    на каждом чанке, а когда буфер вырос на 1/16 (но не меньше 64
+    символов) — суммарно O(n) вместо O(n²) на длинных ответах.
+    """
+
+    def __init__(self, text_of: Callable[[dict], str]):
+        self.text_of = text_of
+        self.buffer = ""
+        self.parsed_at = 0
+        self.sent = ""
+        self.args: Optional[dict] = None
+
+    def feed(self, piece: str) -> str:
+        """Добавить часть аргументов; вернуть новый текст для потока"""
+        self.buffer += piece
+        if len(self.buffer) - self.parsed_at < max(64, len(self.buffer) // 16):
+            return ""
+        self._parse()
+        return self.pending()
+
+    def finish(self) -> Optional[dict]:
+        """Полные аргументы (None — не JSON объект)"""
+        try:
+            args = json.loads(self.buffer) if self.buffer else None
+        except ValueError:
+            args = None
+        self.args = args if isinstance(args, dict) else None
+        return self.args
+
+    def pending(self) -> str:
+        """Прирост текста с прошлой отправки"""
+        text = self.text_of(self.args) if self.args else ""
+        if not text.startswith(self.sent):
+            return ""
+        delta, self.sent = text[len(self.sent):], text
+        return delta
+
+    def _parse(self):
+        self.parsed_at = len(self.buffer)
+        args = parse_partial_json(self.buffer)
+        if isinstance(args, dict):
+            self.args = args
+
+
+def _call_config(agent_name: str, stage: str, provider: Optional[str]) -> Optional[RunnableConfig]:
+    """
+    Config вызова: callback телеметрии и метаданные агента
+
+    Сливается с config графа, чтобы не потерять его callbacks и thread_id.
+    """
+    from src.monitoring.llm_calls import get_llm_call_handler
+
+    handler = get_llm_call_handler()
+    if handler is None:
+        return None
+    return merge_configs(ensure_config(), {
+        "callbacks": [handler],
+        "metadata": {
+            "cosilium_agent": agent_name,
+            "cosilium_stage": stage,
+            "cosilium_provider": provider or "",
+            "cosilium_iteration": _stream_iteration.get(),
+        },
+    })
+
+
+def _batch_slot(provider: Optional[str]):
+    """Слот провайдера в общем бюджете пакета /analyze/batch (или пустой контекст)"""
+    from src.infrastructure.batch import batch_slot
+    return batch_slot(provider)
+
+
+def _admission(provider: Optional[str]):
+    """Слот провайдера по классу приоритета вызова (или пустой контекст)"""
+    if not provider or not get_settings().admission_enabled:
+        return nullcontext()
+
+    from src.infrastructure.admission import get_admission_controller
+    return get_admission_controller().admit(provider)
+
+
+def _rate_limit(provider: Optional[str], prompt_text: str):
+    """Допуск по rate limit провайдера (или пустой контекст)"""
+    if not provider or not get_settings().rate_limit_enabled:
+        return nullcontext()
+
+    from src.infrastructure.rate_limiter import get_rate_limiter
+    return get_rate_limiter().acquire(provider, tokens=estimate_tokens(prompt_text))
+
+
+def _messages_text(messages: list[BaseMessage]) -> str:
+    """Текст промпта для оценки токенов"""
+    return "".join(_chunk_text(m.content) for m in messages)
+
+
+def _chunk_text(content) -> str:
+    """Текст из чанка (Anthropic отдаёт список content-блоков)"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content
+        )
+    return ""
@@ -0,0 +1,177 @@
+"""
+LLM-top: Structured Output
+Ответы агентов вызовом инструмента по JSON схеме вместо разбора Markdown
+"""
+
+from typing import Optional
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from src.models.state import AgentAnalysis, AgentCritique
+
+
+def _as_list(value) -> list[str]:
+    """Модели иногда возвращают список строкой — по пункту на строку"""
+    if isinstance(value, str):
+        return [line.strip(" \t-*•") for line in value.splitlines() if line.strip(" \t-*•")]
+    return value
+
+
+def _number(value, parse) -> float:
+    """
+    Число из аргумента: строку разбирает parse ("85%", "7/10")
+
+    null, списки и объекты — ValueError, а не TypeError: pydantic
+    превращает её в ValidationError, и ответ разбирается как Markdown.
+    """
+    if isinstance(value, str):
+        return float(parse(value))
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"ожидалось число, получено {type(value).__name__}")
+    return float(value)
+
+
+def _bullets(title: str, items: list[str]) -> str:
+    if not items:
+        return ""
+    return f"\n\n## {title}\n" + "\n".join(f"- {item}" for item in items)
+
+
+class AnalysisOutput(BaseModel):
+    """Результат независимого анализа задачи"""
+    analysis: str = Field(description="Структурированный анализ в Markdown, без разделов ниже")
+    key_points: list[str] = Field(default_factory=list, description="Ключевые выводы с условием фальсификации")
+    risks: list[str] = Field(default_factory=list, description="Риски")
+    assumptions: list[str] = Field(default_factory=list, description="Допущения")
+    confidence: float = Field(description="Общий уровень уверенности от 0 до 1")
+
+    @field_validator("key_points", "risks", "assumptions", mode="before")
+    @classmethod
+    def split_lists(cls, value):
+        return _as_list(value)
+
+    @field_validator("confidence", mode="before")
+    @classmethod
+    def confidence_fraction(cls, value):
+        value = _number(value, lambda text: text.rstrip("% "))
+        if value > 1:  # Проценты вместо доли
+            value /= 100
+        return min(1.0, max(0.0, value))
+
+    def to_analysis(self, agent_name: str) -> AgentAnalysis:
+        """
+        AgentAnalysis с текстом в прежнем Markdown формате
+
+        Разделы дописываются в текст, чтобы критика и синтез видели
+        анализ целиком, как в Markdown режиме.
+        """
+        text = (
+            self.analysis.strip()
+            + _bullets("Ключевые выводы", self.key_points)
+            + _bullets("Риски", self.risks)
+            + _bullets("Допущения", self.assumptions)
+            + f"\n\n## Уверенность\nОбщий уровень уверенности: {round(self.confidence * 100)}%"
+        )
+        return AgentAnalysis(
+            agent_name=agent_name,
+            analysis=text,
+            confidence=self.confidence,
+            key_points=self.key_points,
+            risks=self.risks,
+            assumptions=self.assumptions,
+        )
+
+
+class CritiqueOutput(BaseModel):
+    """Критическая оценка анализа другого агента"""
+    critique: str = Field(description="Оценка по 10 критериям в Markdown (таблица с комментариями)")
+    strengths: list[str] = Field(default_factory=list, description="Сильные стороны")
+    weaknesses: list[str] = Field(default_factory=list, description="Слабости")
+    suggestions: list[str] = Field(default_factory=list, description="Предложения по улучшению")
+    score: float = Field(description="Общая оценка от 0 до 10")
+
+    @field_validator("strengths", "weaknesses", "suggestions", mode="before")
+    @classmethod
+    def split_lists(cls, value):
+        return _as_list(value)
+
+    @field_validator("score", mode="before")
+    @classmethod
+    def score_range(cls, value):
+        value = _number(value, lambda text: text.split("/")[0])
+        return min(10.0, max(0.0, value))
+
+    def to_critique(self, critic_name: str, target_name: str) -> AgentCritique:
+        """AgentCritique с текстом в прежнем Markdown формате"""
+        text = (
+            self.critique.strip()
+            + _bullets("Сильные стороны", self.strengths)
+            + _bullets("Слабости", self.weaknesses)
+            + _bullets("Предложения", self.suggestions)
+            + f"\n\n## Общая оценка: {self.score:g}/10"
+        )
+        return AgentCritique(
+            critic_name=critic_name,
+            target_name=target_name,
+            critique=text,
+            score=self.score,
+            weaknesses=self.weaknesses,
+            strengths=self.strengths,
+            suggestions=self.suggestions,
+        )
+
+
+class TargetCritique(BaseModel):
+    """Критика одного анализа в пакете"""
+    target: str = Field(description="Имя агента, чей анализ оценивается")
+    review: CritiqueOutput
+
+
+class BatchCritiqueOutput(BaseModel):
+    """Критика нескольких анализов, по элементу на каждого агента"""
+    critiques: list[TargetCritique]
+
+
+STRUCTURED_INSTRUCTION = (
+    "\n\nВерни ответ одним вызовом инструмента {tool}. Формат ответа выше "
+    "задаёт содержание: разделы со списками передай отдельными полями, "
+    "а не в тексте."
+)
+
+
+# ============================================================
+# Потоковый текст из частичного JSON
+# ============================================================
+
+def analysis_text(args: dict) -> str:
+    """Текст для потока токенов из частичных аргументов AnalysisOutput"""
+    return args.get("analysis") or ""
+
+
+def critique_text(args: dict) -> str:
+    """Текст для потока токенов из частичных аргументов CritiqueOutput"""
+    return args.get("critique") or ""
+
+
+def batch_critique_text(args: dict) -> str:
+    """
+    Текст для потока токенов из частичных аргументов BatchCritiqueOutput
+
+    Заголовок элемента появляется, когда имя агента дописано (начался
+    review), поэтому текст только растёт.
+    """
+    parts = []
+    for item in args.get("critiques") or []:
+        if not isinstance(item, dict) or "review" not in item:
+            break
+        parts.append(f"# Критика: {item['target']}\n\n{critique_text(item['review'] or {})}")
+    return "\n\n".join(parts)
+
+
+def validate_output(schema: type[BaseModel], args: Optional[dict]) -> Optional[BaseModel]:
+    """Аргументы вызова инструмента → модель (None — не прошли валидацию)"""
+    if not args:
+        return None
+    try:
+        return schema.model_validate(args)
+    except ValidationError:
+        return None
@@ -5,27 +5,71 @@ LLM-top: Synthesizer
 
 import re
 import json
+from typing import Optional
 from langchain_anthropic import ChatAnthropic
-from langchain_core.messages import HumanMessage, SystemMessage
 
 from src.models.state import AgentAnalysis, AgentCritique, SynthesisResult
-from src.prompts.agent_prompts import get_synthesis_prompt
+from src.prompts.agent_prompts import get_synthesis_prompt, get_prompt_version
+from src.agents.streaming import invoke_llm
+from src.agents.prompt_cache import prompt_messages
+from src.agents.llm_pool import get_llm, model_id
+from src.agents.budget import fit_synthesis
+from src.agents.sections import parse_sections
 from src.config import get_settings
 
 
+_JSON_BLOCK = re.compile(r"```(?:json)?\s*\n?(\{.*?\})\s*\n?```", re.DOTALL)
+_EXECUTIVE_SUMMARY = re.compile(
+    r"(?:Executive\s+Summary|Исполнительное\s+резюме)\s*\n(.*?)(?=\n##|\Z)",
+    re.DOTALL | re.IGNORECASE,
+)
+_CONCLUSION_SECTIONS = ("Таблица выводов", "Выводы", "Вывод", "Conclusions", "Conclusion")
+_CONCLUSION_ITEM = re.compile(
+    r"(?:^|\n)\s*(?:\d+[\.\)]\s*|\*\s*|-\s*)(.+?)(?:\s*[\(\[]?\s*(\d+%?)\s*[\)\]]?)?"
+    r"(?:\s*[-–—]\s*[Фф]альсификация:\s*(.+?))?(?=\n|$)"
+)
+_CONCLUSION_PHRASE = re.compile(
+    r"(?:ключевой вывод|главный вывод|основной вывод|вывод):\s*(.+?)(?:\.|$)",
+    re.IGNORECASE,
+)
+_RECOMMENDATION_ITEM = re.compile(r"(?:^|\n)\s*(?:\d+[\.\)]\s*|\*\s*|-\s*)([^\n]+)")
+_RECOMMENDATION_PARTS = re.compile(r"\s*[-–—:]\s*")
+_RECOMMENDATION_PHRASE = re.compile(
+    r"(?:рекомендуется|следует|необходимо|важно)\s+(.+?)(?:\.|$)",
+    re.IGNORECASE,
+)
+_MATH_BLOCK = re.compile(r"```(?:math|latex)?\s*\n(.*?)\n```", re.DOTALL)
+_FORMULA = re.compile(r"(?:формула|расчёт|модель):\s*\n?(.*?)(?:\n\n|\Z)", re.DOTALL | re.IGNORECASE)
+_MATH_LINE = re.compile(r"^.*[=×÷±∑∏√∫≈≠≤≥].*$", re.MULTILINE)
+
+
 class Synthesizer:
     """Синтезатор результатов анализа"""
 
-    def __init__(self):
+    provider = "anthropic"
+
+    @property
+    def llm(self):
         settings = get_settings()
         # Используем Claude как главного интегратора
-        self.llm = ChatAnthropic(
+        return get_llm(
+            ChatAnthropic,
+            provider="anthropic",
             model=settings.claude_model,
             temperature=0.5,  # Меньше креативности для синтеза
             max_tokens=settings.max_tokens,
             api_key=settings.anthropic_api_key,
         )
 
+    @property
+    def model_id(self) -> str:
+        """Модель и температура (часть ключа кэша этапов)"""
+        return model_id(self.llm)
+
+    def prompt_version(self, stage: str = "synthesis") -> str:
+        """Версия промптов синтеза (часть ключа кэша этапов)"""
+        return get_prompt_version(None, stage)
+
     async def synthesize(
         self,
         task: str,
@@ -34,21 +78,25 @@ class Synthesizer:
     ) -> SynthesisResult:
         """Синтезировать результаты в единый отчёт"""
 
-        # Форматируем анализы
-        analyses_text = self._format_analyses(analyses)
-        critiques_text = self._format_critiques(critiques)
+        # Бюджет токенов: без повторов слабостей, длинные тексты сжаты
+        analysis_texts, critique_texts = fit_synthesis(
+            analyses,
+            critiques,
+            [self._analysis_header(a) for a in analyses],
+            [self._critique_header(c) for c in critiques],
+        )
+        analyses_text = self._format_analyses(analyses, analysis_texts)
+        critiques_text = self._format_critiques(critiques, critique_texts)
 
-        system_prompt, user_prompt = get_synthesis_prompt(
+        system_prompt, user_parts = get_synthesis_prompt(
             task, analyses_text, critiques_text
         )
 
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt),
-        ]
+        messages = prompt_messages(system_prompt, user_parts)
 
-        response = await self.llm.ainvoke(messages)
-        content = response.content
+        content = await invoke_llm(
+            self.llm, messages, "Synthesizer", "synthesis", provider=self.provider
+        )
 
         # Пробуем распарсить как JSON
         json_data = self._try_parse_json(content)
@@ -77,7 +125,7 @@ class Synthesizer:
     def _try_parse_json(self, text: str) -> dict | None:
         """Попробовать распарсить JSON из ответа"""
         # Ищем JSON в code block
-        json_match = re.search(r"```(?:json)?\s*\n?(\{.*?\})\s*\n?```", text, re.DOTALL)
+        json_match = _JSON_BLOCK.search(text)
         if json_match:
             try:
                 return json.loads(json_match.group(1))
@@ -195,100 +243,82 @@ class Synthesizer:
 
         return self._extract_dissenting(fallback_text)
 
-    def _format_analyses(self, analyses: list[AgentAnalysis]) -> str:
-        """Форматировать анализы для промпта"""
+    @staticmethod
+    def _analysis_header(a: AgentAnalysis) -> str:
+        return f"### {a.agent_name} (уверенность: {a.confidence:.0%})\n"
+
+    @staticmethod
+    def _critique_header(c: AgentCritique) -> str:
+        return f"### {c.critic_name} -> {c.target_name} (оценка: {c.score}/10)\n"
+
+    def _format_analyses(self, analyses: list[AgentAnalysis], texts: Optional[list[str]] = None) -> str:
+        """Форматировать анализы для промпта (texts — тексты после бюджета)"""
         result = []
-        for a in analyses:
-            result.append(f"### {a.agent_name} (уверенность: {a.confidence:.0%})\n")
-            result.append(a.analysis)
+        for i, a in enumerate(analyses):
+            result.append(self._analysis_header(a))
+            result.append(texts[i] if texts is not None else a.analysis)
             result.append("\n---\n")
         return "\n".join(result)
 
-    def _format_critiques(self, critiques: list[AgentCritique]) -> str:
-        """Форматировать критики для промпта"""
+    def _format_critiques(self, critiques: list[AgentCritique], texts: Optional[list[str]] = None) -> str:
+        """Форматировать критики для промпта (texts — тексты после бюджета)"""
         result = []
-        for c in critiques:
-            result.append(f"### {c.critic_name} -> {c.target_name} (оценка: {c.score}/10)\n")
-            result.append(c.critique)
+        for i, c in enumerate(critiques):
+            result.append(self._critique_header(c))
+            result.append(texts[i] if texts is not None else c.critique)
             result.append("\n---\n")
         return "\n".join(result)
 
     def _extract_summary(self, text: str) -> str:
         """Извлечь резюме"""
-        # Способ 1: Секция "Резюме"
-        match = re.search(r"##\s*Резюме\s*\n(.*?)(?=\n##|\Z)", text, re.DOTALL)
-        if match:
-            return match.group(1).strip()
+        sections = parse_sections(text)
 
-        # Способ 2: "Executive Summary" или "Исполнительное резюме"
-        match = re.search(
-            r"(?:##\s*)?(?:Executive\s+Summary|Исполнительное\s+резюме)\s*\n(.*?)(?=\n##|\Z)",
-            text,
-            re.DOTALL | re.IGNORECASE
-        )
+        # Способ 1: Секция "Резюме", "Executive Summary" или "Исполнительное резюме"
+        body = sections.body("Резюме", "Executive Summary", "Исполнительное резюме")
+        if body is not None:
+            return body
+
+        # Способ 2: "Executive Summary" без разметки заголовка
+        match = _EXECUTIVE_SUMMARY.search(text)
         if match:
             return match.group(1).strip()
 
         # Способ 3: Первые абзацы до первого заголовка
-        first_section = re.match(r"^(.*?)(?=\n##)", text, re.DOTALL)
-        if first_section and first_section.group(1).strip():
-            return first_section.group(1).strip()
+        if sections.preamble.strip():
+            return sections.preamble.strip()
 
         # Fallback: первые 500 символов
         return text[:500]
 
     def _extract_conclusions(self, text: str) -> list[dict]:
         """Извлечь выводы из таблицы"""
+        sections = parse_sections(text)
         conclusions = []
 
-        # Способ 1: Ищем Markdown таблицу после "Таблица выводов"
-        table_match = re.search(
-            r"##\s*Таблица выводов\s*\n+\|[^\n]+\|\s*\n\|[-|\s]+\|\s*\n((?:\|[^\n]+\|\s*\n?)+)",
-            text,
-            re.IGNORECASE
-        )
-        if table_match:
-            rows = table_match.group(1).strip().split("\n")
-            for row in rows:
-                if not row.strip() or row.strip().startswith("|--"):
-                    continue
-                cells = [c.strip() for c in row.split("|")]
-                cells = [c for c in cells if c]  # Убираем пустые
-                if len(cells) >= 2:
-                    conclusions.append({
-                        "conclusion": cells[0],
-                        "probability": cells[1] if len(cells) > 1 else "N/A",
-                        "falsification_condition": cells[2] if len(cells) > 2 else "",
-                    })
-
-        # Способ 2: Ищем нумерованный список выводов
+        # Способ 1: Markdown таблица в секции "Таблица выводов"
+        for cells in sections.table("Таблица выводов"):
+            if len(cells) >= 2:
+                conclusions.append({
+                    "conclusion": cells[0],
+                    "probability": cells[1],
+                    "falsification_condition": cells[2] if len(cells) > 2 else "",
+                })
+
+        # Способ 2: Нумерованный список выводов
         if not conclusions:
-            section_match = re.search(
-                r"(?:##\s*(?:Таблица\s+)?[Вв]ыводы?|##\s*Conclusions?)\s*\n(.*?)(?=\n##|\Z)",
-                text,
-                re.DOTALL | re.IGNORECASE
-            )
-            if section_match:
-                items = re.findall(
-                    r"(?:^|\n)\s*(?:\d+[\.\)]\s*|\*\s*|-\s*)(.+?)(?:\s*[\(\[]?\s*(\d+%?)\s*[\)\]]?)?(?:\s*[-–—]\s*[Фф]альсификация:\s*(.+?))?(?=\n|$)",
-                    section_match.group(1)
-                )
-                for item in items:
+            body = sections.body(*_CONCLUSION_SECTIONS)
+            if body:
+                for item in _CONCLUSION_ITEM.findall("\n" + body):
                     if item[0].strip():
                         conclusions.append({
                             "conclusion": item[0].strip(),
                             "probability": item[1] if item[1] else "N/A",
-                            "falsification_condition": item[2] if len(item) > 2 else "",
+                            "falsification_condition": item[2],
                         })
 
         # Способ 3: Извлекаем ключевые фразы как выводы
         if not conclusions:
-            key_phrases = re.findall(
-                r"(?:ключевой вывод|главный вывод|основной вывод|вывод):\s*(.+?)(?:\.|$)",
-                text,
-                re.IGNORECASE
-            )
-            for phrase in key_phrases[:5]:
+            for phrase in _CONCLUSION_PHRASE.findall(text)[:5]:
                 conclusions.append({
                     "conclusion": phrase.strip(),
                     "probability": "N/A",
@@ -299,44 +329,25 @@ class Synthesizer:
 
     def _extract_recommendations(self, text: str) -> list[dict]:
         """Извлечь рекомендации из таблицы"""
+        sections = parse_sections(text)
         recommendations = []
 
-        # Способ 1: Markdown таблица после "Рекомендации"
-        table_match = re.search(
-            r"##\s*Рекомендации\s*\n+\|[^\n]+\|\s*\n\|[-|\s]+\|\s*\n((?:\|[^\n]+\|\s*\n?)+)",
-            text,
-            re.IGNORECASE
-        )
-        if table_match:
-            rows = table_match.group(1).strip().split("\n")
-            for row in rows:
-                if not row.strip() or row.strip().startswith("|--"):
-                    continue
-                cells = [c.strip() for c in row.split("|")]
-                cells = [c for c in cells if c]  # Убираем пустые
-                if len(cells) >= 1:
-                    recommendations.append({
-                        "recommendation": cells[0],
-                        "pros": cells[1] if len(cells) > 1 else "",
-                        "cons": cells[2] if len(cells) > 2 else "",
-                    })
-
-        # Способ 2: Ищем секцию "Рекомендации" и нумерованный/маркированный список
+        # Способ 1: Markdown таблица в секции "Рекомендации"
+        for cells in sections.table("Рекомендации"):
+            recommendations.append({
+                "recommendation": cells[0],
+                "pros": cells[1] if len(cells) > 1 else "",
+                "cons": cells[2] if len(cells) > 2 else "",
+            })
+
+        # Способ 2: Нумерованный/маркированный список в секции "Рекомендации"
         if not recommendations:
-            section_match = re.search(
-                r"##\s*Рекомендации\s*\n(.*?)(?=\n##|\Z)",
-                text,
-                re.DOTALL | re.IGNORECASE
-            )
-            if section_match:
-                items = re.findall(
-                    r"(?:^|\n)\s*(?:\d+[\.\)]\s*|\*\s*|-\s*)([^\n]+)",
-                    section_match.group(1)
-                )
-                for item in items:
+            body = sections.body("Рекомендации")
+            if body:
+                for item in _RECOMMENDATION_ITEM.findall("\n" + body):
                     if item.strip() and not item.strip().startswith("|"):
                         # Пытаемся разделить на рекомендацию и описание
-                        parts = re.split(r"\s*[-–—:]\s*", item, maxsplit=2)
+                        parts = _RECOMMENDATION_PARTS.split(item, maxsplit=2)
                         recommendations.append({
                             "recommendation": parts[0].strip(),
                             "pros": parts[1] if len(parts) > 1 else "",
@@ -345,12 +356,7 @@ class Synthesizer:
 
         # Способ 3: Ищем фразы "рекомендуется", "следует"
         if not recommendations:
-            rec_phrases = re.findall(
-                r"(?:рекомендуется|следует|необходимо|важно)\s+(.+?)(?:\.|$)",
-                text,
-                re.IGNORECASE
-            )
-            for phrase in rec_phrases[:5]:
+            for phrase in _RECOMMENDATION_PHRASE.findall(text)[:5]:
                 recommendations.append({
                     "recommendation": phrase.strip(),
                     "pros": "",
@@ -362,38 +368,22 @@ class Synthesizer:
     def _extract_formalized(self, text: str) -> str:
         """Извлечь формализованный итог"""
         # Способ 1: Секция "Формализованный итог"
-        match = re.search(
-            r"##\s*Формализованный итог\s*\n(.*?)(?=\n##|\Z)",
-            text,
-            re.DOTALL | re.IGNORECASE
-        )
-        if match:
-            return match.group(1).strip()
+        body = parse_sections(text).body("Формализованный итог")
+        if body is not None:
+            return body
 
         # Способ 2: Ищем блок кода с формулой
-        code_match = re.search(
-            r"```(?:math|latex)?\s*\n(.*?)\n```",
-            text,
-            re.DOTALL
-        )
-        if code_match:
-            return code_match.group(1).strip()
+        match = _MATH_BLOCK.search(text)
+        if match:
+            return match.group(1).strip()
 
         # Способ 3: Ищем математические выражения
-        formula_match = re.search(
-            r"(?:формула|расчёт|модель):\s*\n?(.*?)(?:\n\n|\Z)",
-            text,
-            re.DOTALL | re.IGNORECASE
-        )
-        if formula_match:
-            return formula_match.group(1).strip()
+        match = _FORMULA.search(text)
+        if match:
+            return match.group(1).strip()
 
         # Способ 4: Ищем строки с математическими символами
-        math_lines = re.findall(
-            r"^.*[=×÷±∑∏√∫≈≠≤≥].*$",
-            text,
-            re.MULTILINE
-        )
+        math_lines = _MATH_LINE.findall(text)
         if math_lines:
             return "\n".join(math_lines[:5])
 
@@ -401,15 +391,7 @@ class Synthesizer:
 
     def _extract_dissenting(self, text: str) -> list[str]:
         """Извлечь разногласия"""
-        match = re.search(
-            r"##\s*Разногласия\s*\n(.*?)(?=\n##|\Z)",
-            text,
-            re.DOTALL | re.IGNORECASE
-        )
-        if match:
-            items = re.findall(r"[-*]\s*(.+)", match.group(1))
-            return [item.strip() for item in items]
-        return []
+        return parse_sections(text).items("Разногласия")
 
     def _calculate_consensus(self, critiques: list[AgentCritique]) -> float:
         """Рассчитать уровень консенсуса на основе оценок"""
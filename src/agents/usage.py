@@ -0,0 +1,61 @@
+"""
+LLM-top: Usage Accounting
+Подсчёт вызовов и токенов LLM в рамках одного этапа графа
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from pydantic import BaseModel
+
+
+class UsageCounter(BaseModel):
+    """Счётчик вызовов и токенов"""
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+
+_usage_counter: ContextVar[Optional[UsageCounter]] = ContextVar("usage_counter", default=None)
+
+
+@contextmanager
+def track_usage():
+    """
+    Считать вызовы LLM внутри блока
+
+    Usage:
+        with track_usage() as usage:
+            await asyncio.gather(*calls)
+        print(usage.calls, usage.total_tokens)
+    """
+    counter = UsageCounter()
+    token = _usage_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _usage_counter.reset(token)
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка токенов, когда провайдер не вернул usage"""
+    return max(1, len(text) // 4) if text else 0
+
+
+def record_usage(usage_metadata: Optional[dict], prompt_text: str, completion_text: str):
+    """Учесть один вызов LLM в активном счётчике"""
+    counter = _usage_counter.get()
+    if counter is None:
+        return
+
+    counter.calls += 1
+    if isinstance(usage_metadata, dict) and usage_metadata.get("input_tokens"):
+        counter.input_tokens += int(usage_metadata.get("input_tokens", 0))
+        counter.output_tokens += int(usage_metadata.get("output_tokens", 0))
+    else:
+        counter.input_tokens += estimate_tokens(prompt_text)
+        counter.output_tokens += estimate_tokens(completion_text)
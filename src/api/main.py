@@ -3,24 +3,53 @@ LLM-top: FastAPI Application
 REST API для системы
 """
 
+import time
 import uuid
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from collections import defaultdict
+from typing import Optional
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import asyncio
 import json
+from contextlib import asynccontextmanager, nullcontext
+from pydantic import ValidationError
 
-from src.models.state import TaskInput, CosiliumOutput, CosiliumState
+from src.models.state import BatchInput, TaskInput, CosiliumOutput, CosiliumState
 from src.graph.workflow import app as langgraph_app
+from src.agents.streaming import TokenStream, stream_tokens
+from src.infrastructure.single_flight import SingleFlight
+from src.infrastructure.batch import BatchScheduler, request_key
+from src.infrastructure.admission import priority_scope
+from src.infrastructure.task_store import FINAL_EVENTS, TaskProgressHandler, get_task_store
+from src.prompts.agent_prompts import prepare_prompts, close_prompts
+from src.agents.budget import warmup_tokenizer
+from src.monitoring.exporter import QUEUE_WAIT, REGISTRY, LoopLagMonitor
 from src.config import get_settings
 
 settings = get_settings()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Прогрев промптов и токенизатора при старте, отправка счётчиков при остановке"""
+    loop_lag = LoopLagMonitor(settings.metrics_loop_lag_interval)
+    if settings.metrics_enabled:
+        loop_lag.start()
+    await prepare_prompts()
+    await warmup_tokenizer()
+    yield
+    await close_prompts()
+    await get_task_store().close()
+    await loop_lag.stop()
+
+
 # FastAPI app
 api = FastAPI(
     title="LLM-top API",
     description="Мульти-агентная аналитическая система",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS
@@ -32,8 +61,11 @@ api.add_middleware(
     allow_headers=["*"],
 )
 
-# Хранилище задач в памяти (в production использовать Redis)
-tasks_store: dict[str, dict] = {}
+# Одновременные одинаковые анализы
+analysis_flights = SingleFlight()
+
+# Задачи /analyze/async, ожидающие одно выполнение графа: request key -> task_ids
+flight_tasks: dict[str, set[str]] = defaultdict(set)
 
 
 @api.get("/")
@@ -46,16 +78,9 @@ async def root():
     }
 
 
-@api.post("/analyze")
-async def analyze(input_data: TaskInput) -> CosiliumOutput:
-    """
-    Синхронный анализ задачи
-
-    Выполняет полный цикл анализа и возвращает результат.
-    Может занять несколько минут.
-    """
-    # Начальное состояние
-    initial_state: CosiliumState = {
+def _initial_state(input_data: TaskInput) -> CosiliumState:
+    """Начальное состояние графа"""
+    return {
         "task": input_data.task,
         "task_type": input_data.task_type,
         "context": input_data.context,
@@ -66,14 +91,38 @@ async def analyze(input_data: TaskInput) -> CosiliumOutput:
         "max_iterations": input_data.max_iterations,
         "should_continue": True,
         "error": None,
+        "critique_topology": input_data.critique_topology,
     }
 
-    # Конфигурация для checkpointing
-    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
 
-    try:
-        # Запускаем граф
-        final_state = await langgraph_app.ainvoke(initial_state, config)
+def _request_key(input_data: TaskInput) -> str:
+    """Ключ одинаковых запросов (все параметры, влияющие на результат)"""
+    return request_key(input_data)
+
+
+async def _run_analysis(input_data: TaskInput, thread_id: str) -> CosiliumOutput:
+    """
+    Выполнить граф для задачи
+
+    Одновременные одинаковые запросы (/analyze и /analyze/async)
+    разделяют одно выполнение графа.
+    """
+    key = _request_key(input_data)
+
+    async def run() -> CosiliumOutput:
+        # Прогресс по нодам — во все задачи, ждущие это выполнение, включая
+        # присоединившиеся позже (множество живое)
+        subscribers = flight_tasks[key]
+        config = {
+            "configurable": {"thread_id": thread_id},
+            "callbacks": [TaskProgressHandler(get_task_store(), subscribers)],
+        }
+        try:
+            final_state = await langgraph_app.ainvoke(_initial_state(input_data), config)
+        finally:
+            # Выполнение без задач /analyze/async не оставляет пустое множество
+            if not subscribers and flight_tasks.get(key) is subscribers:
+                del flight_tasks[key]
 
         return CosiliumOutput(
             task=final_state["task"],
@@ -81,83 +130,145 @@ async def analyze(input_data: TaskInput) -> CosiliumOutput:
             critiques=final_state["critiques"],
             synthesis=final_state["synthesis"],
             iterations_used=final_state["iteration"],
+            critique_stats=final_state.get("critique_stats", []),
+            budget_stats=final_state.get("budget_stats", []),
+            consensus_stats=final_state.get("consensus_stats", []),
+            iteration_metrics=final_state.get("iteration_metrics", []),
         )
 
+    return await analysis_flights.do(key, run)
+
+
+@api.post("/analyze")
+async def analyze(
+    input_data: TaskInput,
+    x_priority: str = Header("interactive"),
+    x_tenant_id: str = Header(""),
+) -> CosiliumOutput:
+    """
+    Синхронный анализ задачи
+
+    Выполняет полный цикл анализа и возвращает результат.
+    Может занять несколько минут. X-Priority — класс приоритета LLM
+    вызовов (interactive, standard, batch), X-Tenant-ID — тенант для
+    справедливой очереди (src/infrastructure/admission.py).
+    """
+    try:
+        with priority_scope(x_priority, x_tenant_id):
+            return await _run_analysis(input_data, str(uuid.uuid4()))
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @api.post("/analyze/async")
-async def analyze_async(input_data: TaskInput, background_tasks: BackgroundTasks) -> dict:
+async def analyze_async(
+    input_data: TaskInput,
+    background_tasks: BackgroundTasks,
+    x_priority: str = Header("standard"),
+    x_tenant_id: str = Header(""),
+) -> dict:
     """
     Асинхронный анализ задачи
 
     Запускает анализ в фоне и возвращает task_id.
-    Используйте GET /tasks/{task_id} для получения результата.
+    Прогресс — GET /tasks/{task_id}/events (SSE), результат — GET /tasks/{task_id}.
     """
     task_id = str(uuid.uuid4())
 
     # Сохраняем начальный статус
-    tasks_store[task_id] = {
-        "status": "pending",
-        "input": input_data.model_dump(),
-        "result": None,
-        "error": None,
-    }
+    await get_task_store().create(task_id, input_data.model_dump())
 
     # Запускаем в фоне
-    background_tasks.add_task(run_analysis_background, task_id, input_data)
+    background_tasks.add_task(
+        run_analysis_background, task_id, input_data, time.monotonic(), x_priority, x_tenant_id
+    )
 
     return {
         "task_id": task_id,
         "status": "pending",
-        "message": "Analysis started. Use GET /tasks/{task_id} to check status.",
+        "message": "Analysis started. Use GET /tasks/{task_id}/events to follow progress.",
     }
 
 
-async def run_analysis_background(task_id: str, input_data: TaskInput):
+async def run_analysis_background(
+    task_id: str,
+    input_data: TaskInput,
+    enqueued_at: Optional[float] = None,
+    priority: str = "standard",
+    tenant: str = "",
+):
     """Фоновое выполнение анализа"""
-    tasks_store[task_id]["status"] = "running"
-
-    initial_state: CosiliumState = {
-        "task": input_data.task,
-        "task_type": input_data.task_type,
-        "context": input_data.context,
-        "analyses": [],
-        "critiques": [],
-        "synthesis": None,
-        "iteration": 0,
-        "max_iterations": input_data.max_iterations,
-        "should_continue": True,
-        "error": None,
-    }
-
-    config = {"configurable": {"thread_id": task_id}}
+    if enqueued_at is not None:
+        QUEUE_WAIT.labels("background").observe(time.monotonic() - enqueued_at)
+    store = get_task_store()
+    key = _request_key(input_data)
+    flight_tasks[key].add(task_id)
+    await store.update(task_id, status="running")
 
     try:
-        final_state = await langgraph_app.ainvoke(initial_state, config)
-
-        tasks_store[task_id]["status"] = "completed"
-        tasks_store[task_id]["result"] = CosiliumOutput(
-            task=final_state["task"],
-            analyses=final_state["analyses"],
-            critiques=final_state["critiques"],
-            synthesis=final_state["synthesis"],
-            iterations_used=final_state["iteration"],
-        ).model_dump()
+        with priority_scope(priority, tenant):
+            result = await _run_analysis(input_data, task_id)
+        await store.set_result(task_id, result.model_dump(mode="json"))
 
     except Exception as e:
-        tasks_store[task_id]["status"] = "failed"
-        tasks_store[task_id]["error"] = str(e)
+        await store.update(task_id, status="failed", error=str(e))
+
+    finally:
+        subscribers = flight_tasks.get(key)
+        if subscribers is not None:
+            subscribers.discard(task_id)
+            # Пока выполнение идёт, множество принадлежит его обработчику прогресса
+            if not subscribers and not analysis_flights.in_flight(key):
+                del flight_tasks[key]
 
 
 @api.get("/tasks/{task_id}")
-async def get_task(task_id: str) -> dict:
-    """Получить статус и результат задачи"""
-    if task_id not in tasks_store:
+async def get_task(task_id: str, fields: Optional[str] = None, include_result: bool = True) -> dict:
+    """
+    Получить статус и результат задачи
+
+    fields — поля результата через запятую (например, synthesis,iterations_used):
+    читаются только они, без анализов и критик целиком.
+    """
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    task = await get_task_store().get(task_id, fields=selected, include_result=include_result)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    return task
+
+
+@api.get("/tasks/{task_id}/events")
+async def task_events(task_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    События задачи (SSE): status, node (завершение ноды графа), completed, failed
+
+    Поток начинается с первого события (или после Last-Event-ID при
+    переподключении) и закрывается после completed/failed. Результат
+    после completed — GET /tasks/{task_id}?fields=...
+    """
+    store = get_task_store()
+    if await store.get(task_id, include_result=False) is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    return tasks_store[task_id]
+    async def event_generator():
+        cursor = last_event_id or "0"
+        while True:
+            events = await store.read_events(task_id, cursor, timeout=settings.task_events_keepalive)
+            if not events:
+                if await store.get(task_id, include_result=False) is None:
+                    return  # Вытеснена по TTL
+                yield ": keepalive\n\n"
+                continue
+            for event_id, kind, data in events:
+                cursor = event_id
+                payload = json.dumps(data, default=str, ensure_ascii=False)
+                yield f"id: {event_id}\nevent: {kind}\ndata: {payload}\n\n"
+                if kind in FINAL_EVENTS:
+                    return
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
 @api.get("/analyze/stream")
@@ -165,11 +276,15 @@ async def analyze_stream(
     task: str,
     task_type: str = "research",
     context: str = "",
+    tokens: bool = True,
 ):
     """
     Streaming анализ задачи
 
     Возвращает результаты по мере выполнения каждого этапа.
+    При tokens=true дополнительно отправляет дельты токенов каждого агента
+    (`event: token` с полями agent, stage, iteration, delta), не дожидаясь
+    завершения ноды графа.
     """
     async def event_generator():
         initial_state: CosiliumState = {
@@ -186,17 +301,38 @@ async def analyze_stream(
         }
 
         config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+        stream = TokenStream(maxsize=settings.stream_queue_size)
 
-        try:
-            async for event in langgraph_app.astream(initial_state, config):
-                # Отправляем каждое событие как SSE
-                yield f"data: {json.dumps(event, default=str, ensure_ascii=False)}\n\n"
-                await asyncio.sleep(0.1)
+        async def run_graph():
+            try:
+                async for event in langgraph_app.astream(initial_state, config):
+                    await stream.put("node", event)
+                await stream.put("done", None)
+            except Exception as e:
+                await stream.put("error", str(e))
 
-            yield "data: {\"status\": \"completed\"}\n\n"
+        # Задача наследует контекст, поэтому агенты внутри графа видят поток
+        with stream_tokens(stream) if tokens else nullcontext(), priority_scope("interactive"):
+            runner = asyncio.create_task(run_graph())
 
-        except Exception as e:
-            yield f"data: {{\"error\": \"{str(e)}\"}}\n\n"
+        try:
+            while True:
+                kind, payload = await stream.queue.get()
+                if kind == "token":
+                    yield f"event: token\ndata: {payload.model_dump_json()}\n\n"
+                elif kind == "node":
+                    # Отправляем каждое событие графа как SSE
+                    yield f"data: {json.dumps(payload, default=str, ensure_ascii=False)}\n\n"
+                elif kind == "done":
+                    yield "data: {\"status\": \"completed\"}\n\n"
+                    break
+                else:
+                    yield f"data: {json.dumps({'error': payload}, ensure_ascii=False)}\n\n"
+                    break
+        finally:
+            # Клиент отключился или граф завершён — останавливаем producers
+            stream.close()
+            runner.cancel()
 
     return StreamingResponse(
         event_generator(),
@@ -204,6 +340,62 @@ async def analyze_stream(
     )
 
 
+def _batch_items(body: bytes, content_type: str) -> list[TaskInput]:
+    """Задачи пакета: JSON {"items": [...]} или JSONL (задача на строку)"""
+    try:
+        if "ndjson" in content_type or "jsonl" in content_type:
+            lines = [line for line in body.decode().splitlines() if line.strip()]
+            if not lines:
+                raise HTTPException(status_code=422, detail="Empty batch")
+            items = []
+            for number, line in enumerate(lines, 1):
+                try:
+                    items.append(TaskInput.model_validate_json(line))
+                except ValidationError as e:
+                    raise HTTPException(
+                        status_code=422,
+                        detail={"line": number, "errors": json.loads(e.json(include_url=False))},
+                    )
+            return items
+        return BatchInput.model_validate_json(body).items
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=json.loads(e.json(include_url=False)))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=422, detail="Batch must be UTF-8")
+
+
+@api.post("/analyze/batch")
+async def analyze_batch(request: Request, x_tenant_id: str = Header("")):
+    """
+    Пакетный анализ
+
+    Тело — {"items": [TaskInput, ...]} или JSONL (Content-Type:
+    application/x-ndjson), задача на строку. Одинаковые задачи
+    выполняются один раз, LLM вызовы всех задач делят бюджеты
+    провайдеров (src/infrastructure/batch.py).
+
+    Ответ — SSE: `event: item` (BatchItemResult) по мере готовности
+    задач, в конце `event: done` (BatchStats: makespan, задач в минуту,
+    загрузка провайдеров).
+    """
+    items = _batch_items(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > settings.batch_max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(items)} items (max {settings.batch_max_items})",
+        )
+
+    # Общий single-flight с /analyze: задача, которая уже выполняется, не запускается заново
+    scheduler = BatchScheduler(runner=_run_analysis, tenant=x_tenant_id)
+
+    async def event_generator():
+        async for item in scheduler.run(items):
+            yield f"event: item\ndata: {item.model_dump_json()}\n\n"
+        yield f"event: done\ndata: {scheduler.stats.model_dump_json()}\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+
 @api.get("/agents")
 async def list_agents():
     """Список доступных агентов"""
@@ -217,10 +409,21 @@ async def health():
     return {
         "status": "healthy",
         "agents": list(AGENT_CONFIGS.keys()),
-        "active_tasks": len([t for t in tasks_store.values() if t["status"] == "running"]),
+        "active_tasks": await get_task_store().count_active(),
     }
 
 
+@api.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Метрики в формате Prometheus"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    return PlainTextResponse(
+        REGISTRY.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
 @api.post("/collect-data")
 async def collect_data(input_data: TaskInput):
     """
@@ -280,13 +483,8 @@ async def analyze_smart(input_data: TaskInput, background_tasks: BackgroundTasks
 
     # Контекст достаточен — запускаем анализ
     task_id = str(uuid.uuid4())
-    tasks_store[task_id] = {
-        "status": "pending",
-        "input": input_data.model_dump(),
-        "result": None,
-        "error": None,
-    }
-    background_tasks.add_task(run_analysis_background, task_id, input_data)
+    await get_task_store().create(task_id, input_data.model_dump())
+    background_tasks.add_task(run_analysis_background, task_id, input_data, time.monotonic())
 
     return {
         "status": "analysis_started",
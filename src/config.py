@@ -38,6 +38,114 @@ class Settings(BaseSettings):
     # LLM parameters
     temperature: float = 0.7
     max_tokens: int = 4096
+    # Ответы агентов вызовом инструмента по JSON схеме (src/agents/structured.py)
+    structured_output_enabled: bool = False
+    # Маркеры cache_control Anthropic на стабильном префиксе промпта (src/agents/prompt_cache.py)
+    prompt_caching_enabled: bool = True
+
+    # Общий пул LLM клиентов (на процесс и event loop)
+    llm_pool_max_connections: int = 100
+    llm_pool_max_keepalive: int = 20
+    llm_pool_keepalive_expiry: float = 30.0
+    llm_request_timeout: float = 600.0
+
+    # Дедлайны анализа: timeout_ms и fallback_model из configs/agents.json
+    analysis_deadlines_enabled: bool = True
+    analysis_soft_deadline_ratio: float = 0.5  # Мягкий дедлайн = доля timeout_ms
+    analysis_hedging_enabled: bool = True  # Hedge-запрос к fallback_model после мягкого дедлайна
+    analysis_quorum: int = 0  # K из N анализов для перехода к критике (0 — ждать всех)
+    analysis_quorum_grace: float = 0.0  # Ожидание остальных после кворума, секунд
+
+    # Бюджет токенов промптов критики и синтеза (src/agents/budget.py)
+    prompt_budget_enabled: bool = True
+    prompt_budget_encoding: str = "cl100k_base"  # Кодировка tiktoken для подсчёта
+    critique_prompt_budget: int = 6000  # Токенов на анализ(ы) в промпте критики
+    synthesis_prompt_budget: int = 24000  # Токенов на анализы и критики в промпте синтеза
+
+    # Adversarial critique topology: full_mesh, ring, single_critic, batched
+    critique_topology: str = "full_mesh"
+    critique_topology_by_task_type: dict[str, str] = {}  # {"research": "batched"}
+    critique_single_critic: str = "claude"
+
+    # Проверка согласия анализов перед критикой (src/graph/consensus.py)
+    consensus_precheck_enabled: bool = True
+    consensus_skip_enabled: bool = False  # Пропуск критики целиком (иначе при полном согласии — reduced)
+    consensus_skip_threshold: float = 0.85  # Минимальное попарное согласие для пропуска критики
+    consensus_reduce_threshold: float = 0.6  # Среднее согласие для сокращённой критики
+    consensus_reduced_topology: str = "ring"  # Топология сокращённой критики
+
+    # Вариант графа: default — фиксированный порог консенсуса, adaptive —
+    # AdaptiveIterationController и FocusedRefiner (src/graph/iterative.py)
+    workflow_variant: str = "default"
+    adaptive_min_consensus: float = 0.75
+    adaptive_improvement_threshold: float = 0.05  # Прирост консенсуса за раунд, ниже — остановка
+    refine_max_targets: int = 3  # Слабых областей на раунд уточнения
+    # Критика анализа сразу по его готовности, без барьера между этапами
+    pipeline_stages_enabled: bool = False
+
+    # Rate limiting LLM API (GCRA, общий для API, Celery и Telegram)
+    rate_limit_enabled: bool = False
+    rate_limit_backend: str = "redis"  # redis, memory
+    rate_limit_wait_timeout: float = 60.0  # Максимальное ожидание допуска, секунд
+    rate_limit_lease_requests: int = 4  # Запросов на локальный lease (1 — без lease)
+    rate_limit_lease_tokens: int = 8000
+    rate_limit_lease_ttl: float = 1.0
+
+    # Допуск LLM вызовов по классам приоритета (src/infrastructure/admission.py)
+    admission_enabled: bool = True
+    admission_concurrency: dict[str, int] = {}  # {"anthropic": 5}; по умолчанию concurrent_requests лимитов
+    admission_weights: dict[str, float] = {"interactive": 8.0, "standard": 3.0, "batch": 1.0}
+    admission_batch_headroom: int = 1  # Слотов провайдера, недоступных batch вызовам
+    admission_preempt_max_wait: float = 30.0  # Дольше batch вызов не пропускает другие вперёд, секунд
+
+    # Кэш результатов: L1 в памяти процесса перед Redis
+    analysis_cache_l1_max_entries: int = 256
+    analysis_cache_l1_max_bytes: int = 64 * 1024 * 1024
+    analysis_cache_l1_ttl: float = 300.0  # Ограничивает устаревание после invalidate в другом процессе
+    analysis_cache_hit_flush_interval: float = 1.0
+
+    # Кэш этапов графа (анализ, критика, синтез)
+    stage_cache_enabled: bool = True
+    stage_cache_ttl: int = 86400
+    stage_cache_l1_max_entries: int = 1024
+
+    # Семантический кэш (VectorIndex)
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_nprobe: int = 8  # Списков IVF на запрос
+    semantic_cache_sync_interval: float = 5.0  # Догрузка записей других воркеров, секунд
+
+    # Реестр задач /analyze/async (src/infrastructure/task_store.py)
+    task_store_backend: str = "memory"  # memory (один процесс), redis (несколько workers)
+    task_ttl: int = 86400  # Задача и результат хранятся после последнего изменения, секунд
+    task_events_keepalive: float = 15.0  # Интервал keepalive в /tasks/{id}/events, секунд
+
+    # Celery воркер (src/infrastructure/celery_app.py)
+    celery_persistent_loop: bool = True  # Общий event loop процесса вместо loop на задачу
+    celery_worker_pool: str = "threads"  # threads — много анализов на процесс, prefork — один
+    celery_worker_concurrency: int = 32  # Одновременных анализов на процесс
+
+    # Пакетный анализ /analyze/batch (src/infrastructure/batch.py)
+    batch_max_items: int = 500
+    batch_max_in_flight: int = 32  # Одновременных графов пакета
+    batch_time_limit: int = 3600  # Лимит Celery задачи пакета, секунд
+    batch_provider_concurrency: dict[str, int] = {}  # {"anthropic": 5}; по умолчанию concurrent_requests лимитов
+
+    # Checkpointing графа
+    checkpointer_backend: str = "memory"  # memory, redis
+    checkpoint_ttl: int = 86400  # Скользящий TTL thread'а в Redis, секунд
+
+    # Телеметрия LLM вызовов (src/monitoring/llm_calls.py)
+    llm_telemetry_enabled: bool = True
+    llm_telemetry_cost: bool = True  # Запись стоимости в CostTracker (Redis)
+    llm_telemetry_flush_interval: float = 1.0
+    llm_telemetry_batch_size: int = 200
+
+    # Prometheus метрики (/metrics)
+    metrics_enabled: bool = True
+    metrics_loop_lag_interval: float = 0.5  # Период замера задержки event loop, сек
+
+    # Streaming (SSE)
+    stream_queue_size: int = 256  # Буфер событий на один /analyze/stream
 
     # Database
     database_url: str = "postgresql://localhost:5432/cosilium"
@@ -69,6 +177,8 @@ class Settings(BaseSettings):
 
     # Feature flags
     enable_rag: bool = True
+    prompt_cache_ttl: float = 300.0  # Обновление снимка rag_prompts, секунд
+    prompt_usage_flush_interval: float = 30.0
     enable_thinking_patterns: bool = True
     enable_prompt_evolution: bool = True
     enable_caching: bool = True
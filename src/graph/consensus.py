@@ -0,0 +1,212 @@
+"""
+LLM-top: Consensus Pre-check
+Локальная проверка согласия анализов перед критикой: матрица сходства выводов без LLM
+"""
+
+import re
+import zlib
+from typing import Literal, Optional
+
+import numpy as np
+
+from src.agents.budget import budget_enabled, count_tokens
+from src.agents.sections import parse_sections
+from src.graph.topology import CritiqueAssignment
+from src.models.state import AgentAnalysis
+from src.config import get_settings
+
+
+# Размерность hashing-векторов: коллизии на выводах из десятков слов редки
+EMBEDDING_DIM = 2048
+# Основа слова для биграмм: без окончаний русские словоформы совпадают
+STEM_LENGTH = 5
+# Отрицания: короткие, но меняют смысл вывода на противоположный
+NEGATIONS = frozenset({"не", "нет", "ни", "нельзя", "not", "no", "never", "cannot"})
+NEGATION_MARK = "¬"
+CONCLUSION_SECTIONS = ("Выводы", "Вывод", "Заключение", "Резюме", "Conclusions", "Conclusion")
+
+_WORDS = re.compile(r"\w+")
+
+Decision = Literal["full", "reduced", "skip"]
+
+
+# ============================================================
+# Векторы выводов
+# ============================================================
+
+def conclusions(analysis: AgentAnalysis) -> list[str]:
+    """Ключевые выводы и пункты секции выводов (без них — весь анализ одним пунктом)"""
+    points = list(analysis.key_points)
+    points += parse_sections(analysis.analysis).items(*CONCLUSION_SECTIONS)
+    points = [p for p in dict.fromkeys(points) if p.strip()]
+    return points or [analysis.analysis]
+
+
+def _words(text: str) -> list[str]:
+    """
+    Слова текста; слово после отрицания («не», «нет», «not», ...) — с меткой ¬
+
+    Само отрицание остаётся отдельным словом-меткой: короткое, но
+    меняет смысл вывода на противоположный.
+    """
+    words = []
+    negated = False
+    for word in _WORDS.findall(text.lower().replace("ё", "е")):
+        if word in NEGATIONS:
+            words.append(NEGATION_MARK)
+            negated = True
+        elif len(word) > 2 or word.isdigit():
+            words.append(NEGATION_MARK + word if negated else word)
+            negated = False
+    return words
+
+
+def _features(text: str) -> list[int]:
+    """Хэши символьных триграмм слов и пар соседних основ (отрицаемые — отдельно)"""
+    words = _words(text)
+    grams = []
+    for word in words:
+        prefix = NEGATION_MARK if word.startswith(NEGATION_MARK) and word != NEGATION_MARK else ""
+        padded = f" {word[len(prefix):]} "
+        grams += [prefix + padded[i:i + 3] for i in range(len(padded) - 2)]
+    stems = [_stem(w) for w in words]
+    grams += [f"{a} {b}" for a, b in zip(stems, stems[1:])]
+    return [zlib.crc32(g.encode()) % EMBEDDING_DIM for g in grams]
+
+
+def _stem(word: str) -> str:
+    if word.startswith(NEGATION_MARK):
+        return word[:STEM_LENGTH + 1]
+    return word[:STEM_LENGTH]
+
+
+def _polarity(texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Хэши основ, утверждаемых и отрицаемых в каждом тексте (бинарные матрицы)"""
+    positive = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    negative = np.zeros_like(positive)
+    for row, text in enumerate(texts):
+        for word in _words(text):
+            if word == NEGATION_MARK:
+                continue
+            if word.startswith(NEGATION_MARK):
+                negative[row, zlib.crc32(word[1:STEM_LENGTH + 1].encode()) % EMBEDDING_DIM] = 1
+            else:
+                positive[row, zlib.crc32(word[:STEM_LENGTH].encode()) % EMBEDDING_DIM] = 1
+    return positive, negative
+
+
+def contradictions(texts: list[str]) -> np.ndarray:
+    """Пары текстов, где одна и та же основа утверждается в одном и отрицается в другом"""
+    positive, negative = _polarity(texts)
+    return (positive @ negative.T + negative @ positive.T) > 0
+
+
+def embed(texts: list[str]) -> np.ndarray:
+    """
+    Векторы текстов: hashing trick по триграммам и биграммам основ
+
+    Триграммы сглаживают словоформы («рынок»/«рынка»), биграммы основ
+    учитывают порядок слов. Без модели эмбеддингов и сетевых вызовов —
+    на четырёх анализах это доли миллисекунды. Частоты сглажены log(1 + tf), строки
+    нормированы: скалярное произведение — косинусное сходство.
+    """
+    matrix = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    rows, cols = [], []
+    for row, text in enumerate(texts):
+        features = _features(text)
+        rows += [row] * len(features)
+        cols += features
+    np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)), 1.0)
+    np.log1p(matrix, out=matrix)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def agreement_matrix(analyses: list[AgentAnalysis]) -> np.ndarray:
+    """
+    Попарное согласие анализов, 0..1
+
+    Выводы всех анализов сравниваются одним умножением матриц. Согласие
+    пары — среднее по выводам каждого из двух лучшего совпадения среди
+    выводов другого (симметричное мягкое сопоставление): вывод, которого
+    нет у соседа, снижает согласие, порядок и формулировки — нет.
+    Выводы, где одно утверждается, а другое отрицается («вырастет» /
+    «не вырастет»), не совпадают вовсе.
+    """
+    points = [conclusions(a) for a in analyses]
+    owner = np.repeat(np.arange(len(points)), [len(p) for p in points])
+    vectors = embed([p for group in points for p in group])
+    similarity = np.clip(vectors @ vectors.T, 0.0, 1.0)
+    # Противоположные по знаку выводы о том же не считаются совпадением
+    similarity[contradictions([p for group in points for p in group])] = 0.0
+
+    n = len(analyses)
+    matrix = np.eye(n)
+    for i in range(n):
+        rows = similarity[owner == i]
+        for j in range(i + 1, n):
+            block = rows[:, owner == j]
+            score = (block.max(axis=1).mean() + block.max(axis=0).mean()) / 2
+            matrix[i, j] = matrix[j, i] = score
+    return matrix
+
+
+# ============================================================
+# Решение
+# ============================================================
+
+def decide(matrix: np.ndarray) -> tuple[Decision, float, float]:
+    """
+    (решение, среднее согласие, минимальное согласие) по матрице
+
+    skip — каждая пара согласна не меньше consensus_skip_threshold:
+    критику пропускаем (только с consensus_skip_enabled, иначе —
+    reduced). reduced — среднее согласие не меньше
+    consensus_reduce_threshold: сокращённая критика. Иначе — full.
+    """
+    settings = get_settings()
+    upper = matrix[np.triu_indices(len(matrix), k=1)]
+    if upper.size == 0:
+        return "full", 0.0, 0.0
+    mean, minimum = float(upper.mean()), float(upper.min())
+    if minimum >= settings.consensus_skip_threshold:
+        return ("skip" if settings.consensus_skip_enabled else "reduced"), mean, minimum
+    if mean >= settings.consensus_reduce_threshold:
+        return "reduced", mean, minimum
+    return "full", mean, minimum
+
+
+def plan_tokens(task: str, plan: list[CritiqueAssignment]) -> int:
+    """Оценка токенов промптов плана критики: задача и анализы целей (с бюджетом)"""
+    budget = get_settings().critique_prompt_budget if budget_enabled() else None
+    task_tokens = count_tokens(task)
+    total = 0
+    for assignment in plan:
+        total += task_tokens
+        for target in assignment.targets:
+            tokens = count_tokens(target.analysis)
+            if budget is not None:
+                tokens = min(tokens, budget // len(assignment.targets))
+            total += tokens
+    return total
+
+
+# ============================================================
+# Длительность раундов критики
+# ============================================================
+
+# Скользящее среднее длительности раунда критики по топологии, секунд:
+# оценка сэкономленного времени (на процесс)
+_round_seconds: dict[str, float] = {}
+EWMA_ALPHA = 0.2
+
+
+def record_round(topology: str, seconds: float):
+    """Учесть длительность раунда критики с LLM вызовами"""
+    previous = _round_seconds.get(topology)
+    _round_seconds[topology] = seconds if previous is None else previous + EWMA_ALPHA * (seconds - previous)
+
+
+def round_seconds(topology: str) -> Optional[float]:
+    """Средняя длительность раунда топологии (None — ещё не было)"""
+    return _round_seconds.get(topology)
@@ -5,24 +5,16 @@ Adaptive iterations, focused refinement, disagreement resolution
 
 import re
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel
 from langchain_anthropic import ChatAnthropic
 from langchain_core.messages import HumanMessage, SystemMessage
 
-from src.models.state import AgentAnalysis, AgentCritique, SynthesisResult
+from src.models.state import AgentAnalysis, AgentCritique, IterationMetrics, SynthesisResult
+from src.agents.llm_pool import get_llm
+from src.agents.streaming import invoke_llm
 from src.config import get_settings
 
 
-class IterationMetrics(BaseModel):
-    """Метрики итерации"""
-    iteration_number: int
-    consensus_level: float
-    avg_critique_score: float
-    disagreement_count: int
-    improvement_delta: float = 0.0  # Изменение качества от прошлой итерации
-    weak_areas: list[str] = []
-
-
 class DisagreementPoint(BaseModel):
     """Точка разногласия между агентами"""
     topic: str
@@ -39,6 +31,7 @@ class RefinementTarget(BaseModel):
     description: str
     agent_suggestions: list[str]
     priority: float  # 0-1
+    agents: list[str] = []  # Агенты, в чьих анализах найдена слабость
 
 
 class AdaptiveIterationController:
@@ -49,13 +42,22 @@ class AdaptiveIterationController:
     - Нужна ли следующая итерация
     - Какие области требуют уточнения
     - Когда достаточно консенсуса
+
+    История итераций передаётся при создании: в графе она хранится
+    в состоянии (iteration_metrics), а контроллер создаётся на каждую
+    проверку.
     """
 
-    def __init__(self):
-        self.iteration_history: list[IterationMetrics] = []
-        self.min_consensus = 0.75
-        self.max_iterations = 5
-        self.improvement_threshold = 0.05  # Минимальное улучшение для продолжения
+    def __init__(
+        self,
+        history: Optional[list[IterationMetrics]] = None,
+        max_iterations: int = 5,
+    ):
+        settings = get_settings()
+        self.iteration_history: list[IterationMetrics] = list(history or [])
+        self.min_consensus = settings.adaptive_min_consensus
+        self.max_iterations = max_iterations
+        self.improvement_threshold = settings.adaptive_improvement_threshold  # Минимальное улучшение для продолжения
 
     def should_continue(
         self,
@@ -76,9 +78,11 @@ class AdaptiveIterationController:
         if current_metrics.consensus_level >= self.min_consensus:
             return False, "consensus_reached"
 
-        # Проверяем улучшение
-        if len(self.iteration_history) > 0:
-            prev = self.iteration_history[-1]
+        # Проверяем улучшение относительно прошлой итерации
+        # (calculate_metrics уже добавил текущую в историю)
+        previous = [m for m in self.iteration_history if m is not current_metrics]
+        if previous:
+            prev = previous[-1]
             improvement = current_metrics.consensus_level - prev.consensus_level
 
             if improvement < self.improvement_threshold and current_metrics.iteration_number >= 2:
@@ -156,9 +160,12 @@ class FocusedRefiner:
     Вместо полного повторного анализа, уточняет только слабые области
     """
 
-    def __init__(self):
+    @property
+    def llm(self):
         settings = get_settings()
-        self.llm = ChatAnthropic(
+        return get_llm(
+            ChatAnthropic,
+            provider="anthropic",
             model=settings.claude_model,
             temperature=0.5,
             api_key=settings.anthropic_api_key,
@@ -206,6 +213,7 @@ class FocusedRefiner:
                 description=f"Критикуется {len(related)} агентами",
                 agent_suggestions=list(set(suggestions))[:3],
                 priority=priority,
+                agents=list(dict.fromkeys(r["target"] for r in related)),
             ))
 
             for r in related:
@@ -213,7 +221,7 @@ class FocusedRefiner:
 
         # Сортируем по приоритету
         targets.sort(key=lambda t: t.priority, reverse=True)
-        return targets[:3]  # Топ-3 для уточнения
+        return targets[:get_settings().refine_max_targets]  # Топ для уточнения
 
     def _is_similar(self, text1: str, text2: str) -> bool:
         """Простая проверка похожести текстов"""
@@ -273,13 +281,16 @@ class FocusedRefiner:
 
 Напиши ДОПОЛНЕНИЕ к анализу, усиливающее слабые области:"""
 
-        response = await self.llm.ainvoke([
-            SystemMessage(content=system),
-            HumanMessage(content=user),
-        ])
+        content = await invoke_llm(
+            self.llm,
+            [SystemMessage(content=system), HumanMessage(content=user)],
+            agent_name=original_analysis.agent_name,
+            stage="refine",
+            provider="anthropic",
+        )
 
         # Объединяем оригинал и дополнение
-        refined_analysis = f"{original_analysis.analysis}\n\n## Дополнение (после критики)\n\n{response.content}"
+        refined_analysis = f"{original_analysis.analysis}\n\n## Дополнение (после критики)\n\n{content}"
 
         return AgentAnalysis(
             agent_name=original_analysis.agent_name,
@@ -298,9 +309,12 @@ class DisagreementResolver:
     Структурированный процесс для разрешения противоречий
     """
 
-    def __init__(self):
+    @property
+    def llm(self):
         settings = get_settings()
-        self.llm = ChatAnthropic(
+        return get_llm(
+            ChatAnthropic,
+            provider="anthropic",
             model=settings.claude_model,
             temperature=0.3,
             api_key=settings.anthropic_api_key,
@@ -426,9 +440,12 @@ class MetaAnalyzer:
     Анализирует паттерны в качестве анализов для улучшения процесса
     """
 
-    def __init__(self):
+    @property
+    def llm(self):
         settings = get_settings()
-        self.llm = ChatAnthropic(
+        return get_llm(
+            ChatAnthropic,
+            provider="anthropic",
             model="claude-3-haiku-20240307",
             temperature=0.2,
             api_key=settings.anthropic_api_key,
@@ -0,0 +1,105 @@
+"""
+LLM-top: Critique Topology
+Схемы распределения критики между агентами
+"""
+
+from enum import Enum
+from typing import Optional
+from pydantic import BaseModel
+
+from src.models.state import AgentAnalysis
+from src.config import get_settings
+
+
+class CritiqueTopology(str, Enum):
+    """
+    Топология критики
+
+    Число LLM вызовов на итерацию для N агентов:
+    - FULL_MESH: N·(N-1) — каждый критикует каждого
+    - RING: N — каждый критикует следующего
+    - SINGLE_CRITIC: N-1 — один назначенный критик
+    - BATCHED: N — один вызов на критика со всеми анализами сразу
+    """
+    FULL_MESH = "full_mesh"
+    RING = "ring"
+    SINGLE_CRITIC = "single_critic"
+    BATCHED = "batched"
+
+
+class CritiqueAssignment(BaseModel):
+    """Один вызов критики: критик и анализы, которые он оценивает"""
+    critic: str
+    targets: list[AgentAnalysis]
+    batched: bool = False
+
+
+def resolve_topology(task_type: str, override: Optional[str] = None) -> CritiqueTopology:
+    """Выбрать топологию: явный выбор > настройка для task_type > по умолчанию"""
+    settings = get_settings()
+    name = (
+        override
+        or settings.critique_topology_by_task_type.get(task_type)
+        or settings.critique_topology
+    )
+    return CritiqueTopology(name)
+
+
+def plan_critiques(
+    topology: CritiqueTopology,
+    critics: list[str],
+    analyses: list[AgentAnalysis],
+    single_critic: Optional[str] = None,
+) -> list[CritiqueAssignment]:
+    """
+    Построить план вызовов критики
+
+    Args:
+        topology: Топология критики
+        critics: Ключи доступных агентов (chatgpt, claude, ...)
+        analyses: Анализы для критики
+        single_critic: Критик для SINGLE_CRITIC (по умолчанию первый)
+
+    Returns:
+        Список назначений, по одному на LLM вызов
+    """
+    if not critics or not analyses:
+        return []
+
+    def peers(critic: str) -> list[AgentAnalysis]:
+        # Не критикуем самого себя
+        return [a for a in analyses if a.agent_name.lower() != critic]
+
+    if topology == CritiqueTopology.FULL_MESH:
+        return [
+            CritiqueAssignment(critic=critic, targets=[analysis])
+            for critic in critics
+            for analysis in peers(critic)
+        ]
+
+    if topology == CritiqueTopology.BATCHED:
+        return [
+            CritiqueAssignment(critic=critic, targets=targets, batched=True)
+            for critic in critics
+            if (targets := peers(critic))
+        ]
+
+    if topology == CritiqueTopology.SINGLE_CRITIC:
+        critic = single_critic if single_critic in critics else critics[0]
+        return [
+            CritiqueAssignment(critic=critic, targets=[analysis])
+            for analysis in peers(critic)
+        ]
+
+    # RING: анализ агента k критикует агент k-1
+    plan = []
+    n = len(critics)
+    for i, analysis in enumerate(analyses):
+        owner = analysis.agent_name.lower()
+        start = critics.index(owner) - 1 if owner in critics else i
+        for step in range(n):
+            critic = critics[(start - step) % n]
+            if critic != owner:
+                plan.append(CritiqueAssignment(critic=critic, targets=[analysis]))
+                break
+    return plan
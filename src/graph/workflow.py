@@ -4,24 +4,50 @@ LLM-top: LangGraph Workflow
 """
 
 import asyncio
-from typing import Literal
+import contextvars
+import time
+from typing import Literal, Optional
 from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
 
-from src.models.state import CosiliumState, AgentAnalysis, AgentCritique
+from src.models.state import (
+    CosiliumState,
+    AgentAnalysis,
+    AgentCritique,
+    CritiqueStats,
+    ConsensusStats,
+    SynthesisResult,
+)
+from src.agents.streaming import set_stream_iteration
+from src.agents.usage import track_usage
+from src.agents.budget import track_budget
+from src.agents.hedging import analyze_with_deadline, answered_by_hedge, gather_quorum
+from src.graph import consensus
+from src.graph.topology import CritiqueTopology, resolve_topology, plan_critiques
+from src.prompts.agent_prompts import prepare_prompts
+from src.infrastructure.stage_cache import StageCache, get_stage_cache, task_hash, content_hash
+from src.monitoring.exporter import (
+    CONSENSUS_AGREEMENT,
+    CRITIQUE_CALLS_SAVED,
+    HEDGE_EVENTS,
+    ITERATION_DECISIONS,
+    timed_node,
+)
+from src.config import get_settings
 
 
 # Lazy initialization
 _agents = None
 _synthesizer = None
+_refiner = None
 
 
 def get_agents():
     """Lazy load agents"""
     global _agents
     if _agents is None:
-        from src.agents.llm_agents import create_all_agents
-        _agents = create_all_agents()
+        from src.agents.llm_agents import get_shared_agents
+        _agents = get_shared_agents()
     return _agents
 
 
@@ -34,6 +60,40 @@ def get_synthesizer():
     return _synthesizer
 
 
+def get_refiner():
+    """Lazy load focused refiner"""
+    global _refiner
+    if _refiner is None:
+        from src.graph.iterative import FocusedRefiner
+        _refiner = FocusedRefiner()
+    return _refiner
+
+
+# ============================================================
+# Кэш этапов (см. src/infrastructure/stage_cache.py)
+# ============================================================
+def _stage_key(stage: str, agent, *inputs: str) -> Optional[str]:
+    """Ключ этапа: агент, модель, версия промптов и входы (None без кэша)"""
+    if get_stage_cache() is None:
+        return None
+    name = getattr(agent, "name", "Synthesizer")
+    return StageCache.key(stage, name, agent.model_id, agent.prompt_version(stage), *inputs)
+
+
+async def _stage_lookup(keys: list[str], model_cls) -> list:
+    """Результаты этапов из кэша (None — нет в кэше или кэш отключён)"""
+    cache = get_stage_cache()
+    if cache is None or not keys:
+        return [None] * len(keys)
+    return list(await asyncio.gather(*(cache.get(key, model_cls) for key in keys)))
+
+
+async def _stage_store(key: Optional[str], value):
+    cache = get_stage_cache()
+    if cache is not None and key:
+        await cache.set(key, value)
+
+
 # ============================================================
 # NODE: Параллельный анализ всеми агентами
 # ============================================================
@@ -44,20 +104,47 @@ async def parallel_analysis(state: CosiliumState) -> dict:
     task = state["task"]
     task_type = state["task_type"]
     context = state["context"]
+    set_stream_iteration(state["iteration"] + 1)
 
-    # Запускаем всех агентов параллельно
+    # Промпты из БД нужны до ключей кэша (в них входит версия промптов)
+    await prepare_prompts()
+
+    # Готовые анализы (из прошлых запусков или до сбоя соседа) берём из кэша
+    agents = list(get_agents().values())
+    input_hash = task_hash(task, task_type, context)
+    keys = [_stage_key("analysis", agent, input_hash) for agent in agents]
+    cached = await _stage_lookup(keys, AgentAnalysis)
+
+    # Запускаем остальных агентов параллельно: у каждого свои дедлайны
+    # и hedge-запрос, а при кворуме K из N ждём только первых K
+    missing = [i for i, hit in enumerate(cached) if hit is None]
     analysis_tasks = [
-        agent.analyze(task, task_type, context)
-        for agent in get_agents().values()
+        analyze_with_deadline(agents[i], task, task_type, context)
+        for i in missing
     ]
 
-    analyses = await asyncio.gather(*analysis_tasks, return_exceptions=True)
+    settings = get_settings()
+    quorum = None
+    if settings.analysis_quorum:
+        # Анализы из кэша входят в кворум
+        quorum = max(settings.analysis_quorum - (len(agents) - len(missing)), 0)
+    analyses = await gather_quorum(
+        analysis_tasks,
+        quorum=quorum,
+        grace=settings.analysis_quorum_grace,
+        is_success=lambda result: isinstance(result, AgentAnalysis),
+    )
 
     # Фильтруем ошибки
-    valid_analyses = [
-        a for a in analyses
-        if isinstance(a, AgentAnalysis)
-    ]
+    valid_analyses = [a for a in cached if a is not None]
+    for i, analysis in zip(missing, analyses):
+        if isinstance(analysis, AgentAnalysis):
+            valid_analyses.append(analysis)
+            # Ключ — по основной модели: ответ запасной в кэш не кладём
+            if not answered_by_hedge(analysis):
+                await _stage_store(keys[i], analysis)
+        elif isinstance(analysis, asyncio.CancelledError):
+            HEDGE_EVENTS.labels(agents[i].name, "quorum_skipped").inc()
 
     return {
         "analyses": valid_analyses,
@@ -65,38 +152,327 @@ async def parallel_analysis(state: CosiliumState) -> dict:
     }
 
 
+# ============================================================
+# NODE: Проверка согласия перед критикой
+# ============================================================
+def _critique_plan(state: CosiliumState, critics: list[str], mode: Optional[str] = None):
+    """Топология и план критики; при mode="reduced" — более дешёвая из двух"""
+    settings = get_settings()
+    topology = resolve_topology(state["task_type"], state.get("critique_topology"))
+    plan = plan_critiques(
+        topology, critics, state["analyses"], single_critic=settings.critique_single_critic
+    )
+    if mode == "reduced":
+        reduced = CritiqueTopology(settings.consensus_reduced_topology)
+        reduced_plan = plan_critiques(
+            reduced, critics, state["analyses"], single_critic=settings.critique_single_critic
+        )
+        if len(reduced_plan) < len(plan):
+            return reduced, reduced_plan
+    return topology, plan
+
+
+async def consensus_precheck(state: CosiliumState) -> dict:
+    """
+    Перед критикой: насколько анализы уже согласны друг с другом
+
+    Ключевые выводы анализов сравниваются локально (src/graph/consensus.py).
+    Все согласны — критика пропускается и граф идёт сразу к синтезу,
+    в основном согласны — критика по сокращённой топологии. Оценка
+    сэкономленных вызовов, токенов и секунд — в consensus_stats.
+    """
+    analyses = state["analyses"]
+    if not get_settings().consensus_precheck_enabled or len(analyses) < 2:
+        return {"critique_mode": "full"}
+
+    started = time.perf_counter()
+    matrix = consensus.agreement_matrix(analyses)
+    decision, agreement, minimum = consensus.decide(matrix)
+    elapsed = time.perf_counter() - started
+
+    critics = list(get_agents().keys())
+    topology, plan = _critique_plan(state, critics)
+    chosen, chosen_plan = (None, []) if decision == "skip" else _critique_plan(state, critics, decision)
+
+    saved_seconds = 0.0
+    full_seconds = consensus.round_seconds(topology.value)
+    if chosen is None:
+        saved_seconds = full_seconds or 0.0
+    elif chosen != topology and full_seconds is not None:
+        saved_seconds = max(0.0, full_seconds - (consensus.round_seconds(chosen.value) or full_seconds))
+
+    stats = ConsensusStats(
+        iteration=state["iteration"] + 1,
+        decision=decision,
+        agreement=round(agreement, 3),
+        min_agreement=round(minimum, 3),
+        matrix=[[round(float(v), 3) for v in row] for row in matrix],
+        topology=chosen.value if chosen else "",
+        planned_calls=len(plan),
+        saved_calls=len(plan) - len(chosen_plan),
+        saved_tokens=consensus.plan_tokens(state["task"], plan)
+        - consensus.plan_tokens(state["task"], chosen_plan),
+        saved_seconds=round(saved_seconds, 3),
+        elapsed=round(elapsed, 4),
+    )
+    CONSENSUS_AGREEMENT.labels(decision).observe(agreement)
+    if stats.saved_calls:
+        CRITIQUE_CALLS_SAVED.labels(decision).inc(stats.saved_calls)
+
+    return {"critique_mode": decision, "consensus_stats": [stats]}
+
+
+def route_after_precheck(state: CosiliumState) -> Literal["critique", "synthesize"]:
+    """Критика или сразу синтез"""
+    if state.get("critique_mode") == "skip":
+        return "synthesize"
+    return "critique"
+
+
 # ============================================================
 # NODE: Adversarial mode - взаимная критика
 # ============================================================
 async def adversarial_critique(state: CosiliumState) -> dict:
     """
-    Итерация 2: Каждый агент критикует анализы других агентов
+    Итерация 2: Агенты критикуют анализы друг друга
+
+    Кто кого критикует, определяет топология (full_mesh, ring,
+    single_critic, batched) — см. src/graph/topology.py. После
+    consensus_precheck с решением reduced — сокращённая топология.
     """
     task = state["task"]
     analyses = state["analyses"]
+    set_stream_iteration(state["iteration"] + 1)
+
+    agents = get_agents()
+    topology, plan = _critique_plan(state, list(agents.keys()), state.get("critique_mode"))
+
+    # Критика неизменённых анализов с прошлой итерации остаётся актуальной:
+    # пары (критик, цель) с тем же хэшем анализа повторно не вызываем
+    hashes = {a.agent_name: a.content_hash() for a in analyses}
+    fresh = {
+        (c.critic_name, c.target_name)
+        for c in state.get("critiques", [])
+        if c.target_hash and c.target_hash == hashes.get(c.target_name)
+    }
+
+    # Пары, уже посчитанные с теми же входами, берём из кэша этапов
+    input_hash = task_hash(task)
+    pending = []
+    for assignment in plan:
+        critic_agent = agents[assignment.critic]
+        stage = "critique_batched" if assignment.batched else "critique"
+        for target in assignment.targets:
+            if (critic_agent.name, target.agent_name) in fresh:
+                continue
+            key = _stage_key(stage, critic_agent, input_hash, target.content_hash())
+            pending.append((assignment, critic_agent, target, key))
+
+    cached = await _stage_lookup([key for *_, key in pending], AgentCritique)
+    cached_critiques = [c for c in cached if c is not None]
+    reused = sum(len(a.targets) for a in plan) - len(pending) + len(cached_critiques)
 
     critique_tasks = []
+    keys_by_pair = {}
+    for assignment in plan:
+        critic_agent = agents[assignment.critic]
+        targets = []
+        for (owner, _, target, key), hit in zip(pending, cached):
+            if owner is assignment and hit is None:
+                targets.append(target)
+                keys_by_pair[(critic_agent.name, target.agent_name)] = key
+        if not targets:
+            continue
+
+        if assignment.batched:
+            critique_tasks.append(critic_agent.critique_batch(task, targets))
+        else:
+            target = targets[0]
+            critique_tasks.append(
+                critic_agent.critique(task, target.agent_name, target.analysis)
+            )
+
+    started = time.perf_counter()
+    with track_usage() as usage, track_budget("critique", state["iteration"] + 1) as budget:
+        results = await asyncio.gather(*critique_tasks, return_exceptions=True)
+    if critique_tasks:
+        consensus.record_round(topology.value, time.perf_counter() - started)
+
+    # Фильтруем ошибки; пакетная критика возвращает список
+    valid_critiques = []
+    for result in results:
+        if isinstance(result, AgentCritique):
+            valid_critiques.append(result)
+        elif isinstance(result, list):
+            valid_critiques.extend(c for c in result if isinstance(c, AgentCritique))
+
+    for critique in valid_critiques:
+        critique.target_hash = hashes.get(critique.target_name)
+        key = keys_by_pair.get((critique.critic_name, critique.target_name))
+        if key:
+            await _stage_store(key, critique)
+
+    valid_critiques = cached_critiques + valid_critiques
+
+    stats = CritiqueStats(
+        iteration=state["iteration"] + 1,
+        topology=topology.value,
+        calls=len(critique_tasks),
+        input_tokens=usage.input_tokens,
+        output_tokens=usage.output_tokens,
+        critiques=len(valid_critiques),
+        reused=reused,
+    )
 
-    # Каждый агент критикует каждого другого
-    for critic_name, critic_agent in get_agents().items():
-        for analysis in analyses:
-            # Не критикуем самого себя
-            if analysis.agent_name.lower() != critic_name:
-                critique_tasks.append(
-                    critic_agent.critique(task, analysis.agent_name, analysis.analysis)
-                )
+    return {
+        "critiques": valid_critiques,
+        "critique_stats": [stats],
+        "budget_stats": [budget] if budget.prompts else [],
+        "iteration": state["iteration"] + 1,
+    }
 
-    critiques = await asyncio.gather(*critique_tasks, return_exceptions=True)
 
-    # Фильтруем ошибки
-    valid_critiques = [
-        c for c in critiques
-        if isinstance(c, AgentCritique)
-    ]
+# ============================================================
+# NODE: Конвейер анализ → критика (pipeline_stages_enabled)
+# ============================================================
+async def pipelined_analysis_critique(state: CosiliumState) -> dict:
+    """
+    Итерации 1–2 конвейером: критика анализа начинается, как только он готов
+
+    Вместо барьера после parallel_analysis каждый завершившийся анализ
+    сразу получает вызовы своих критиков по топологии (full_mesh,
+    ring, single_critic — у цели они не зависят от остальных анализов),
+    их допуск к провайдерам решает очередь провайдера. Ответ самого
+    быстрого агента не простаивает, пока отвечает самый медленный:
+    латентность стремится к критическому пути анализ → критика вместо
+    суммы максимумов этапов. Пакетной критике (batched) нужны все
+    анализы — она стартует после них, как в обычном графе.
+    Проверки согласия (consensus_precheck) в конвейере нет: критика
+    начинается раньше, чем готовы все анализы.
+    """
+    task = state["task"]
+    task_type = state["task_type"]
+    context = state["context"]
+    set_stream_iteration(state["iteration"] + 1)
+    await prepare_prompts()
+
+    agents_by_key = get_agents()
+    agents = list(agents_by_key.values())
+    critics = list(agents_by_key.keys())
+    input_hash = task_hash(task, task_type, context)
+    keys = [_stage_key("analysis", agent, input_hash) for agent in agents]
+    cached = await _stage_lookup(keys, AgentAnalysis)
+
+    settings = get_settings()
+    topology = resolve_topology(task_type, state.get("critique_topology"))
+    critique_iteration = state["iteration"] + 2
+    critique_hash = task_hash(task)
+
+    # Контекст задач критики: свой учёт токенов и бюджета и номер
+    # итерации в потоке токенов (анализы в него не попадают)
+    with track_usage() as usage, track_budget("critique", critique_iteration) as budget:
+        critique_context = contextvars.copy_context()
+    critique_context.run(set_stream_iteration, critique_iteration)
+
+    critique_tasks: list[asyncio.Task] = []
+    counts = {"calls": 0, "reused": 0}
+
+    async def critique(assignment) -> list[AgentCritique]:
+        critic = agents_by_key[assignment.critic]
+        stage = "critique_batched" if assignment.batched else "critique"
+        keys_by_name = {
+            t.agent_name: _stage_key(stage, critic, critique_hash, t.content_hash())
+            for t in assignment.targets
+        }
+        hits = await _stage_lookup(list(keys_by_name.values()), AgentCritique)
+        done = [hit for hit in hits if hit is not None]
+        counts["reused"] += len(done)
+        targets = [t for t, hit in zip(assignment.targets, hits) if hit is None]
+        if not targets:
+            return done
+
+        counts["calls"] += 1
+        if assignment.batched:
+            results = await critic.critique_batch(task, targets)
+        else:
+            results = [await critic.critique(task, targets[0].agent_name, targets[0].analysis)]
+        hashes = {t.agent_name: t.content_hash() for t in targets}
+        for result in results:
+            if isinstance(result, AgentCritique):
+                result.target_hash = hashes.get(result.target_name)
+                await _stage_store(keys_by_name.get(result.target_name), result)
+                done.append(result)
+        return done
+
+    def start_critiques(analyses: list[AgentAnalysis], topology: CritiqueTopology):
+        plan = plan_critiques(
+            topology, critics, analyses, single_critic=settings.critique_single_critic
+        )
+        for assignment in plan:
+            critique_tasks.append(
+                asyncio.create_task(critique(assignment), context=critique_context.copy())
+            )
+
+    streaming = topology != CritiqueTopology.BATCHED
+
+    async def analyze(i: int):
+        result = await analyze_with_deadline(agents[i], task, task_type, context)
+        if streaming and isinstance(result, AgentAnalysis):
+            start_critiques([result], topology)
+        return result
+
+    try:
+        valid_analyses = [a for a in cached if a is not None]
+        if streaming:
+            start_critiques(valid_analyses, topology)
+
+        missing = [i for i, hit in enumerate(cached) if hit is None]
+        quorum = None
+        if settings.analysis_quorum:
+            quorum = max(settings.analysis_quorum - (len(agents) - len(missing)), 0)
+        analyses = await gather_quorum(
+            [analyze(i) for i in missing],
+            quorum=quorum,
+            grace=settings.analysis_quorum_grace,
+            is_success=lambda result: isinstance(result, AgentAnalysis),
+        )
+        for i, analysis in zip(missing, analyses):
+            if isinstance(analysis, AgentAnalysis):
+                valid_analyses.append(analysis)
+                if not answered_by_hedge(analysis):
+                    await _stage_store(keys[i], analysis)
+            elif isinstance(analysis, asyncio.CancelledError):
+                HEDGE_EVENTS.labels(agents[i].name, "quorum_skipped").inc()
+
+        if not streaming:
+            start_critiques(valid_analyses, topology)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*critique_tasks, return_exceptions=True)
+        if counts["calls"]:
+            consensus.record_round(topology.value, time.perf_counter() - started)
+    finally:
+        for pending in critique_tasks:
+            pending.cancel()
+
+    valid_critiques = [c for result in results if isinstance(result, list) for c in result]
+    stats = CritiqueStats(
+        iteration=critique_iteration,
+        topology=topology.value,
+        calls=counts["calls"],
+        input_tokens=usage.input_tokens,
+        output_tokens=usage.output_tokens,
+        critiques=len(valid_critiques),
+        reused=counts["reused"],
+    )
 
     return {
+        "analyses": valid_analyses,
         "critiques": valid_critiques,
-        "iteration": state["iteration"] + 1,
+        "critique_stats": [stats],
+        "budget_stats": [budget] if budget.prompts else [],
+        "critique_mode": "full",
+        "iteration": critique_iteration,
     }
 
 
@@ -107,14 +483,39 @@ async def synthesize_results(state: CosiliumState) -> dict:
     """
     Итерация 3: Синтез всех анализов и критик в единый результат
     """
-    synthesis = await get_synthesizer().synthesize(
-        task=state["task"],
-        analyses=state["analyses"],
-        critiques=state["critiques"],
+    set_stream_iteration(state["iteration"] + 1)
+    synthesizer = get_synthesizer()
+    key = _stage_key(
+        "synthesis",
+        synthesizer,
+        task_hash(state["task"]),
+        content_hash(state["analyses"]),
+        content_hash(state["critiques"], exclude={"target_hash"}),
     )
 
+    synthesis = (await _stage_lookup([key], SynthesisResult))[0]
+    budget_stats = []
+    if synthesis is None:
+        with track_budget("synthesis", state["iteration"] + 1) as budget:
+            synthesis = await synthesizer.synthesize(
+                task=state["task"],
+                analyses=state["analyses"],
+                critiques=state["critiques"],
+            )
+        await _stage_store(key, synthesis)
+        if budget.prompts:
+            budget_stats.append(budget)
+
+    # Критика пропущена проверкой согласия: consensus_level по оценкам
+    # критиков не из чего считать — берём согласие анализов
+    if state.get("critique_mode") == "skip" and state.get("consensus_stats"):
+        synthesis = synthesis.model_copy(
+            update={"consensus_level": state["consensus_stats"][-1].min_agreement}
+        )
+
     return {
         "synthesis": synthesis,
+        "budget_stats": budget_stats,
         "iteration": state["iteration"] + 1,
     }
 
@@ -155,31 +556,116 @@ async def refine_analysis(state: CosiliumState) -> dict:
     """
     Дополнительная итерация: уточнение на основе критики
     """
-    # В этой версии просто перезапускаем adversarial
-    # В продвинутой версии можно передавать критику обратно агентам
-    return {"iteration": state["iteration"]}
+    # В этой версии просто перезапускаем adversarial: критика неизменённых
+    # анализов переиспользуется, повторно оплачиваются только изменения.
+    # Консенсус синтеза не достигнут — критика снова полная
+    return {"iteration": state["iteration"], "critique_mode": "full"}
+
+
+# ============================================================
+# Вариант adaptive: AdaptiveIterationController и FocusedRefiner
+# ============================================================
+def adaptive_check(state: CosiliumState) -> dict:
+    """
+    Продолжать ли итерации (вариант adaptive)
+
+    Вместо фиксированного порога — AdaptiveIterationController по
+    истории раундов из состояния: остановка при достаточном консенсусе,
+    после max_iterations раундов и как только прирост консенсуса за
+    раунд меньше adaptive_improvement_threshold. Без слабостей в
+    критике уточнять нечего — тоже остановка.
+    """
+    from src.graph.iterative import AdaptiveIterationController
+
+    history = state.get("iteration_metrics", [])
+    controller = AdaptiveIterationController(history, max_iterations=state["max_iterations"])
+    metrics = controller.calculate_metrics(
+        len(history) + 1, state["analyses"], state["critiques"], state.get("synthesis")
+    )
+    proceed, reason = controller.should_continue(metrics, state.get("synthesis"))
+    if proceed and not metrics.weak_areas:
+        proceed, reason = False, "nothing_to_refine"
+    metrics.reason = reason
+    ITERATION_DECISIONS.labels(reason).inc()
+
+    return {"should_continue": proceed, "iteration_metrics": [metrics]}
+
+
+async def focused_refine(state: CosiliumState) -> dict:
+    """
+    Уточнение только слабых областей (вариант adaptive)
+
+    FocusedRefiner выбирает refine_max_targets главных слабостей из
+    критики; анализы агентов, к которым они относятся, дополняются
+    параллельно. Следующий раунд критики перекритикует только их —
+    критика неизменённых анализов переиспользуется.
+    """
+    refiner = get_refiner()
+    set_stream_iteration(state["iteration"] + 1)
+    targets = await refiner.identify_refinement_targets(state["analyses"], state["critiques"])
+
+    jobs = []
+    for analysis in state["analyses"]:
+        own = [t for t in targets if analysis.agent_name in t.agents]
+        if own:
+            jobs.append(refiner.refine_analysis(analysis, own, state["critiques"]))
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+
+    return {
+        "analyses": [r for r in results if isinstance(r, AgentAnalysis)],
+        "critique_mode": "full",
+        "iteration": state["iteration"],
+    }
 
 
 # ============================================================
 # BUILD GRAPH
 # ============================================================
-def create_workflow() -> StateGraph:
-    """Создать граф workflow"""
+def create_workflow(variant: Optional[str] = None, pipelined: Optional[bool] = None) -> StateGraph:
+    """
+    Создать граф workflow
+
+    variant (по умолчанию workflow_variant из настроек): default —
+    check_consensus с порогом 0.8 и повторная критика, adaptive —
+    adaptive_check и focused_refine под теми же именами нод.
+    pipelined (по умолчанию pipeline_stages_enabled): первый раунд
+    анализа и критики — одной нодой-конвейером, без барьера между
+    этапами; последующие раунды критики — adversarial_critique.
+    """
+    settings = get_settings()
+    adaptive = (variant or settings.workflow_variant) == "adaptive"
+    if pipelined is None:
+        pipelined = settings.pipeline_stages_enabled
 
     # Создаём граф
     workflow = StateGraph(CosiliumState)
 
     # Добавляем ноды
-    workflow.add_node("parallel_analysis", parallel_analysis)
-    workflow.add_node("adversarial_critique", adversarial_critique)
-    workflow.add_node("synthesize", synthesize_results)
-    workflow.add_node("check_consensus", check_consensus)
-    workflow.add_node("refine", refine_analysis)
+    workflow.add_node("adversarial_critique", timed_node("adversarial_critique", adversarial_critique))
+    workflow.add_node("synthesize", timed_node("synthesize", synthesize_results))
+    workflow.add_node("check_consensus", timed_node(
+        "check_consensus", adaptive_check if adaptive else check_consensus
+    ))
+    workflow.add_node("refine", timed_node("refine", focused_refine if adaptive else refine_analysis))
 
     # Определяем flow
-    workflow.set_entry_point("parallel_analysis")
-
-    workflow.add_edge("parallel_analysis", "adversarial_critique")
+    if pipelined:
+        workflow.add_node("analysis_critique", timed_node("analysis_critique", pipelined_analysis_critique))
+        workflow.set_entry_point("analysis_critique")
+        workflow.add_edge("analysis_critique", "synthesize")
+    else:
+        workflow.add_node("parallel_analysis", timed_node("parallel_analysis", parallel_analysis))
+        workflow.add_node("consensus_precheck", timed_node("consensus_precheck", consensus_precheck))
+        workflow.set_entry_point("parallel_analysis")
+        workflow.add_edge("parallel_analysis", "consensus_precheck")
+        workflow.add_conditional_edges(
+            "consensus_precheck",
+            route_after_precheck,
+            {
+                "critique": "adversarial_critique",
+                "synthesize": "synthesize",
+            }
+        )
     workflow.add_edge("adversarial_critique", "synthesize")
     workflow.add_edge("synthesize", "check_consensus")
 
@@ -201,8 +687,15 @@ def create_workflow() -> StateGraph:
 def create_app():
     """Создать приложение с checkpointing"""
     workflow = create_workflow()
-    memory = MemorySaver()
-    return workflow.compile(checkpointer=memory)
+    return workflow.compile(checkpointer=_create_checkpointer())
+
+
+def _create_checkpointer():
+    """Checkpointer по настройке: MemorySaver или RedisCheckpointer"""
+    if get_settings().checkpointer_backend == "redis":
+        from src.infrastructure.redis_state import RedisCheckpointer
+        return RedisCheckpointer()
+    return MemorySaver()
 
 
 # Создаём приложение
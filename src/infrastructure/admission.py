@@ -0,0 +1,254 @@
+"""
+LLM-top: Admission Control
+Допуск LLM вызовов по классам приоритета: взвешенная справедливая очередь по классам и тенантам
+"""
+
+import asyncio
+import itertools
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple, Optional
+
+from src.config import get_settings
+from src.monitoring.exporter import ADMISSION_PREEMPTED, ADMISSION_WAIT, REGISTRY
+
+
+class PriorityClass(NamedTuple):
+    """Класс приоритета вызовов"""
+    rank: int  # Меньше — важнее (при равных виртуальных временах)
+    preemptible: bool  # Ожидающие вызовы пропускают вперёд непрерываемые классы
+    batch: bool  # Не занимает слоты запаса (admission_batch_headroom)
+
+
+# interactive — Telegram и синхронный /analyze, standard — /analyze/async,
+# batch — /analyze/batch и Celery
+PRIORITY_CLASSES = {
+    "interactive": PriorityClass(rank=0, preemptible=False, batch=False),
+    "standard": PriorityClass(rank=1, preemptible=False, batch=False),
+    "batch": PriorityClass(rank=2, preemptible=True, batch=True),
+}
+DEFAULT_PRIORITY = "standard"
+
+_priority: ContextVar[tuple[str, str]] = ContextVar("admission_priority", default=(DEFAULT_PRIORITY, ""))
+
+
+@contextmanager
+def priority_scope(priority: str, tenant: str = ""):
+    """
+    Класс приоритета и тенант LLM вызовов внутри блока
+
+    Наследуется задачами, созданными в блоке (ноды графа, вызовы агентов).
+    Неизвестный класс — standard.
+    """
+    if priority not in PRIORITY_CLASSES:
+        priority = DEFAULT_PRIORITY
+    token = _priority.set((priority, tenant))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> tuple[str, str]:
+    """(класс приоритета, тенант) текущего контекста"""
+    return _priority.get()
+
+
+class _Waiter(NamedTuple):
+    seq: int
+    priority: str
+    tenant: str
+    enqueued_at: float
+    future: asyncio.Future
+
+
+class _ProviderQueue:
+    """
+    Очередь вызовов одного провайдера
+
+    Выбор следующего вызова — start-time fair queuing в два уровня:
+    класс с наименьшим виртуальным временем, внутри него — тенант, внутри
+    тенанта — FIFO. Время класса растёт на 1/вес за каждый допуск и не
+    отстаёт от общего (простаивавший класс не копит кредит), поэтому
+    под нагрузкой классы делят слоты пропорционально весам, а тенанты
+    класса — поровну.
+    """
+
+    def __init__(self, provider: str, capacity: int):
+        self.provider = provider
+        self.capacity = capacity
+        self.in_flight = 0
+        self.waiters: list[_Waiter] = []
+        self.clock = 0.0
+        self.class_time: dict[str, float] = {}
+        self.tenant_clock: dict[str, float] = {}
+        self.tenant_time: dict[tuple[str, str], float] = {}
+
+    def depth(self) -> dict[str, int]:
+        depths = dict.fromkeys(PRIORITY_CLASSES, 0)
+        for waiter in self.waiters:
+            if not waiter.future.done():
+                depths[waiter.priority] += 1
+        return depths
+
+
+class AdmissionController:
+    """
+    Допуск LLM вызовов процесса
+
+    Каждый вызов BaseAgent/Synthesizer (invoke_llm, invoke_structured)
+    занимает один из admission_concurrency слотов провайдера; свободный
+    слот получает вызов, выбранный взвешенной справедливой очередью.
+
+    Вызовы класса batch вытесняемые: пока ждёт вызов interactive или
+    standard, ожидающий batch вызов пропускает его вперёд (дольше
+    admission_preempt_max_wait — уже нет, без голодания). Кроме того,
+    batch не занимает последние admission_batch_headroom слотов:
+    интерактивный вызов не ждёт завершения чужих пакетных — уже идущие
+    вызовы не прерываются, поэтому без запаса p95 рос бы с пакетом.
+    """
+
+    def __init__(self):
+        settings = get_settings()
+        self.weights = {name: 1.0 for name in PRIORITY_CLASSES}
+        self.weights.update({k: max(float(v), 1e-3) for k, v in settings.admission_weights.items()})
+        self.concurrency = dict(settings.admission_concurrency)
+        self.batch_headroom = settings.admission_batch_headroom
+        self.preempt_max_wait = settings.admission_preempt_max_wait
+        self._seq = itertools.count()
+        # Future привязаны к event loop (Celery без общего loop создаёт свой на задачу)
+        self._queues: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, _ProviderQueue]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def capacity(self, provider: str) -> int:
+        if provider in self.concurrency:
+            return max(1, self.concurrency[provider])
+        from src.infrastructure.rate_limiter import DEFAULT_LIMITS, RateLimitConfig
+        return DEFAULT_LIMITS.get(provider, RateLimitConfig()).concurrent_requests
+
+    def _queue(self, provider: str) -> _ProviderQueue:
+        queues = self._queues.setdefault(asyncio.get_running_loop(), {})
+        if provider not in queues:
+            queues[provider] = _ProviderQueue(provider, self.capacity(provider))
+        return queues[provider]
+
+    def _limit(self, queue: _ProviderQueue, priority: str) -> int:
+        """Слотов, доступных классу"""
+        if PRIORITY_CLASSES[priority].batch:
+            return max(1, queue.capacity - self.batch_headroom)
+        return queue.capacity
+
+    @asynccontextmanager
+    async def admit(self, provider: str):
+        """Слот провайдера на время вызова (класс и тенант — из priority_scope)"""
+        priority, tenant = current_priority()
+        queue = self._queue(provider)
+        started = time.monotonic()
+
+        if not queue.waiters and queue.in_flight < self._limit(queue, priority):
+            queue.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            waiter = _Waiter(next(self._seq), priority, tenant, started, future)
+            queue.waiters.append(waiter)
+            self._dispatch(queue)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release(queue)  # Слот уже выдан — возвращаем
+                else:
+                    future.cancel()
+                    queue.waiters.remove(waiter)
+                raise
+        ADMISSION_WAIT.labels(priority).observe(time.monotonic() - started)
+
+        try:
+            yield
+        finally:
+            self._release(queue)
+
+    def _release(self, queue: _ProviderQueue):
+        queue.in_flight -= 1
+        self._dispatch(queue)
+
+    def _dispatch(self, queue: _ProviderQueue):
+        """Выдать свободные слоты ожидающим"""
+        while queue.waiters and queue.in_flight < queue.capacity:
+            waiter = self._pick(queue)
+            if waiter is None:
+                return  # Остались только классы без свободных слотов
+            queue.waiters.remove(waiter)
+            queue.in_flight += 1
+            waiter.future.set_result(None)
+
+    def _pick(self, queue: _ProviderQueue) -> Optional[_Waiter]:
+        now = time.monotonic()
+        eligible = [
+            w for w in queue.waiters
+            if not w.future.done() and queue.in_flight < self._limit(queue, w.priority)
+        ]
+        # Вытеснение: ожидающие batch вызовы пропускают вперёд остальные
+        protected = [
+            w for w in eligible
+            if not PRIORITY_CLASSES[w.priority].preemptible
+            or now - w.enqueued_at >= self.preempt_max_wait
+        ]
+        candidates = protected or eligible
+        if not candidates:
+            return None
+
+        def class_start(name: str) -> tuple[float, int]:
+            return max(queue.class_time.get(name, 0.0), queue.clock), PRIORITY_CLASSES[name].rank
+
+        priority = min({w.priority for w in candidates}, key=class_start)
+        start = class_start(priority)[0]
+        queue.clock = start
+        queue.class_time[priority] = start + 1 / self.weights[priority]
+
+        # Тенант внутри класса — так же, с весом 1
+        clock = queue.tenant_clock.get(priority, 0.0)
+        in_class = [w for w in candidates if w.priority == priority]
+        tenant = min(
+            dict.fromkeys(w.tenant for w in in_class),
+            key=lambda t: max(queue.tenant_time.get((priority, t), 0.0), clock),
+        )
+        tenant_start = max(queue.tenant_time.get((priority, tenant), 0.0), clock)
+        queue.tenant_clock[priority] = tenant_start
+        queue.tenant_time[(priority, tenant)] = tenant_start + 1
+        chosen = next(w for w in in_class if w.tenant == tenant)
+        if len(candidates) < len(eligible) and any(
+            w.seq < chosen.seq for w in eligible if w not in candidates
+        ):
+            ADMISSION_PREEMPTED.labels(queue.provider).inc()  # Обогнал ожидающий batch вызов
+        return chosen
+
+    def queue_depths(self) -> dict[tuple, float]:
+        """Ожидающие вызовы по (провайдер, класс) для метрики"""
+        depths: dict[tuple, float] = {}
+        for queues in list(self._queues.values()):
+            for provider, queue in queues.items():
+                for priority, depth in queue.depth().items():
+                    key = (provider, priority)
+                    depths[key] = depths.get(key, 0) + depth
+        return depths
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """Контроллер допуска процесса"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+        REGISTRY.gauge(
+            "cosilium_admission_queue_depth",
+            "LLM calls waiting for admission",
+            _controller.queue_depths,
+            ("provider", "priority"),
+        )
+    return _controller
@@ -0,0 +1,249 @@
+"""
+LLM-top: Batch Scheduler
+Пакетный анализ: общий планировщик LLM вызовов задач по бюджетам провайдеров
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from src.models.state import (
+    BatchItemResult,
+    BatchStats,
+    CosiliumOutput,
+    CosiliumState,
+    ProviderThroughput,
+    TaskInput,
+)
+from src.infrastructure.admission import priority_scope
+from src.config import get_settings
+
+
+Runner = Callable[[TaskInput, str], Awaitable[CosiliumOutput]]
+
+
+def request_key(input_data: TaskInput) -> str:
+    """Ключ одинаковых задач (все параметры, влияющие на результат)"""
+    return hashlib.sha256(input_data.model_dump_json().encode()).hexdigest()
+
+
+class ProviderSlots:
+    """
+    Бюджеты одновременных LLM вызовов по провайдерам, общие для пакета
+
+    Освободившийся слот получает ожидающий вызов задачи с меньшим
+    номером (приоритетом): ранние задачи проходят этапы без очереди за
+    поздними и завершаются по одной, а поздние занимают провайдеров,
+    которые ранним сейчас не нужны (OpenAI, пока синтез ждёт Anthropic).
+    """
+
+    def __init__(self, budgets: dict[str, int], default: int = 10):
+        self.budgets = budgets
+        self.default = default
+        self._free: dict[str, int] = {}
+        self._waiters: dict[str, list] = defaultdict(list)  # heap (приоритет, seq, future)
+        self._seq = itertools.count()
+        self.calls: dict[str, int] = defaultdict(int)
+        self.busy: dict[str, float] = defaultdict(float)
+
+    def budget(self, provider: str) -> int:
+        return max(1, self.budgets.get(provider, self.default))
+
+    async def acquire(self, provider: str, priority: int):
+        free = self._free.setdefault(provider, self.budget(provider))
+        waiters = self._waiters[provider]
+        if free > 0 and not waiters:
+            self._free[provider] -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(waiters, (priority, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(provider)  # Слот уже передан — возвращаем
+            else:
+                future.cancel()  # release() пропустит отменённого
+            raise
+
+    def release(self, provider: str):
+        waiters = self._waiters[provider]
+        while waiters:
+            _, _, future = heapq.heappop(waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free[provider] += 1
+
+    @asynccontextmanager
+    async def slot(self, provider: str, priority: int):
+        """Слот провайдера на время вызова (с учётом занятости)"""
+        await self.acquire(provider, priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.calls[provider] += 1
+            self.busy[provider] += time.monotonic() - started
+            self.release(provider)
+
+    def throughput(self, makespan: float) -> list[ProviderThroughput]:
+        return [
+            ProviderThroughput(
+                provider=provider,
+                concurrency=self.budget(provider),
+                calls=self.calls[provider],
+                busy=round(self.busy[provider], 3),
+                utilization=round(self.busy[provider] / (self.budget(provider) * makespan), 3)
+                if makespan > 0 else 0,
+            )
+            for provider in sorted(self.calls)
+        ]
+
+
+# Слоты пакета и приоритет задачи: наследуются нодами графа и вызовами агентов
+_batch_slot: ContextVar[Optional[tuple[ProviderSlots, int]]] = ContextVar("batch_slot", default=None)
+
+
+def batch_slot(provider: Optional[str]):
+    """Слот провайдера, если вызов идёт из задачи пакета (иначе пустой контекст)"""
+    active = _batch_slot.get()
+    if active is None or not provider:
+        return nullcontext()
+    slots, priority = active
+    return slots.slot(provider, priority)
+
+
+def _default_budgets() -> dict[str, int]:
+    """Бюджеты провайдеров: concurrent_requests лимитов и переопределения из настроек"""
+    from src.infrastructure.rate_limiter import DEFAULT_LIMITS
+
+    budgets = {provider: config.concurrent_requests for provider, config in DEFAULT_LIMITS.items()}
+    budgets.update(get_settings().batch_provider_concurrency)
+    return budgets
+
+
+async def run_graph(input_data: TaskInput, thread_id: str) -> CosiliumOutput:
+    """Выполнить граф для задачи пакета (Celery; API передаёт свой runner)"""
+    from src.graph.workflow import app as langgraph_app
+
+    initial_state: CosiliumState = {
+        "task": input_data.task,
+        "task_type": input_data.task_type,
+        "context": input_data.context,
+        "analyses": [],
+        "critiques": [],
+        "synthesis": None,
+        "iteration": 0,
+        "max_iterations": input_data.max_iterations,
+        "should_continue": True,
+        "error": None,
+        "critique_topology": input_data.critique_topology,
+    }
+    final_state = await langgraph_app.ainvoke(
+        initial_state, {"configurable": {"thread_id": thread_id}}
+    )
+    return CosiliumOutput(
+        task=final_state["task"],
+        analyses=final_state["analyses"],
+        critiques=final_state["critiques"],
+        synthesis=final_state["synthesis"],
+        iterations_used=final_state["iteration"],
+        critique_stats=final_state.get("critique_stats", []),
+        budget_stats=final_state.get("budget_stats", []),
+        consensus_stats=final_state.get("consensus_stats", []),
+        iteration_metrics=final_state.get("iteration_metrics", []),
+    )
+
+
+class BatchScheduler:
+    """
+    Выполнение пакета задач
+
+    Одинаковые задачи выполняются один раз. До max_in_flight графов
+    идут одновременно, их LLM вызовы делят бюджеты провайдеров
+    (ProviderSlots) — пакет упирается в лимиты провайдеров, а не
+    в N × время одного анализа. Результаты отдаются по мере готовности.
+
+    Usage:
+        scheduler = BatchScheduler()
+        async for item in scheduler.run(items):
+            ...
+        print(scheduler.stats.items_per_minute)
+    """
+
+    def __init__(
+        self,
+        runner: Runner = run_graph,
+        max_in_flight: Optional[int] = None,
+        budgets: Optional[dict[str, int]] = None,
+        tenant: str = "",
+    ):
+        settings = get_settings()
+        self.runner = runner
+        self.tenant = tenant
+        self.max_in_flight = max(1, max_in_flight or settings.batch_max_in_flight)
+        self.slots = ProviderSlots(_default_budgets() if budgets is None else budgets)
+        self.batch_id = str(uuid.uuid4())
+        self.stats: Optional[BatchStats] = None
+
+    async def run(self, items: list[TaskInput]) -> AsyncIterator[BatchItemResult]:
+        """Выполнить пакет; результаты — в порядке завершения"""
+        groups: dict[str, list[int]] = {}
+        for index, item in enumerate(items):
+            groups.setdefault(request_key(item), []).append(index)
+        self.stats = BatchStats(items=len(items), unique=len(groups))
+
+        started = time.monotonic()
+        window = asyncio.Semaphore(self.max_in_flight)
+
+        async def run_one(priority: int, indices: list[int]):
+            async with window:
+                token = _batch_slot.set((self.slots, priority))
+                try:
+                    # Класс batch в контроле допуска: интерактивные вызовы идут вперёд
+                    with priority_scope("batch", self.tenant):
+                        output = await self.runner(items[indices[0]], f"{self.batch_id}:{indices[0]}")
+                    return indices, output, None
+                except Exception as e:
+                    return indices, None, f"{type(e).__name__}: {e}"
+                finally:
+                    _batch_slot.reset(token)
+
+        tasks = [
+            asyncio.create_task(run_one(priority, indices))
+            for priority, indices in enumerate(groups.values())
+        ]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                indices, output, error = await finished
+                elapsed = round(time.monotonic() - started, 3)
+                for index in indices:
+                    if error is None:
+                        self.stats.completed += 1
+                    else:
+                        self.stats.failed += 1
+                    yield BatchItemResult(
+                        index=index,
+                        status="completed" if error is None else "failed",
+                        result=output,
+                        error=error,
+                        duplicate_of=indices[0] if index != indices[0] else None,
+                        elapsed=elapsed,
+                    )
+        finally:
+            # Клиент отключился — оставшиеся задачи не нужны
+            for task in tasks:
+                task.cancel()
+            makespan = time.monotonic() - started
+            self.stats.makespan = round(makespan, 3)
+            done = self.stats.completed + self.stats.failed
+            self.stats.items_per_minute = round(done / makespan * 60, 2) if makespan > 0 else 0
+            self.stats.providers = self.slots.throughput(makespan)
@@ -5,12 +5,18 @@ LLM-top: Analysis Cache
 
 import hashlib
 import json
+import math
+import time
+from collections import Counter, OrderedDict
 from typing import Optional, Any
 from datetime import timedelta
+import numpy as np
 import redis.asyncio as redis
 from pydantic import BaseModel
 
 from src.config import get_settings
+from src.infrastructure.vector_index import VectorIndex
+from src.monitoring.exporter import observe_cache
 from src.models.state import AgentAnalysis, CosiliumOutput
 
 
@@ -23,6 +29,60 @@ class CacheEntry(BaseModel):
     expires_at: str
 
 
+class LRUCache:
+    """
+    In-process LRU с TTL и ограничением по числу записей и байтам
+
+    Хранит готовые объекты (без повторной валидации pydantic).
+    Размер записи задаёт вызывающий — обычно длина сериализованного JSON.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[Any, float, int]] = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self.delete(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int = 0, ttl: Optional[float] = None):
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        self.delete(key)
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._data[key] = (value, time.monotonic() + ttl, size)
+        self._bytes += size
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def delete(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def delete_prefix(self, prefix: str):
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            self.delete(key)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+
 class AnalysisCache:
     """
     Кэш результатов анализа
@@ -31,6 +91,10 @@ class AnalysisCache:
     - Полные результаты анализа (по хэшу задачи)
     - Промежуточные результаты агентов
     - Embedding'и для семантического кэширования
+
+    Два уровня: L1 — LRU в памяти процесса (готовые объекты, короткий TTL),
+    L2 — Redis. Попадания копятся локально и сбрасываются в Redis одним
+    pipeline не чаще раза в `analysis_cache_hit_flush_interval` секунд.
     """
 
     def __init__(self):
@@ -38,6 +102,14 @@ class AnalysisCache:
         self.redis = redis.from_url(settings.redis_url)
         self.prefix = "cosilium:cache:"
         self.default_ttl = timedelta(hours=24)
+        self.local = LRUCache(
+            max_entries=settings.analysis_cache_l1_max_entries,
+            max_bytes=settings.analysis_cache_l1_max_bytes,
+            ttl=settings.analysis_cache_l1_ttl,
+        )
+        self.hit_flush_interval = settings.analysis_cache_hit_flush_interval
+        self._pending_hits: Counter[str] = Counter()
+        self._hits_flushed_at = time.monotonic()
 
     def _hash_task(self, task: str, task_type: str, context: str) -> str:
         """Создать хэш задачи для ключа кэша"""
@@ -61,16 +133,54 @@ class AnalysisCache:
             CosiliumOutput если найден, None если нет
         """
         task_hash = self._hash_task(task, task_type, context)
-        key = self._key(task_hash, "full")
 
-        data = await self.redis.get(key)
-        if data:
-            # Увеличиваем счётчик попаданий
-            await self.redis.incr(self._key(task_hash, "hits"))
+        result = await self._load_full(task_hash)
+        observe_cache("analysis", result is not None)
+        if result is None:
+            return None
 
-            return CosiliumOutput.model_validate_json(data)
+        await self._count_hit(task_hash)
+        return result
 
-        return None
+    async def _load_full(self, task_hash: str) -> Optional[CosiliumOutput]:
+        """L1, затем Redis (значение и PTTL одним round-trip)"""
+        result = self.local.get(task_hash)
+        if result is not None:
+            return result
+
+        key = self._key(task_hash, "full")
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        data, pttl = await pipe.execute()
+        if not data:
+            return None
+
+        result = CosiliumOutput.model_validate_json(data)
+        # В L1 запись не живёт дольше, чем в Redis
+        ttl = pttl / 1000 if pttl and pttl > 0 else None
+        self.local.set(task_hash, result, size=len(data), ttl=ttl)
+        return result
+
+    async def _count_hit(self, task_hash: str):
+        """Учесть попадание; счётчики уходят в Redis пачкой"""
+        self._pending_hits[task_hash] += 1
+        if time.monotonic() - self._hits_flushed_at >= self.hit_flush_interval:
+            await self.flush_hits()
+
+    async def flush_hits(self):
+        """Сбросить накопленные попадания одним pipeline"""
+        self._hits_flushed_at = time.monotonic()
+        if not self._pending_hits:
+            return
+        pending, self._pending_hits = self._pending_hits, Counter()
+
+        pipe = self.redis.pipeline(transaction=False)
+        for task_hash, hits in pending.items():
+            key = self._key(task_hash, "hits")
+            pipe.incrby(key, hits)
+            pipe.expire(key, self.default_ttl)
+        await pipe.execute()
 
     async def set_analysis(
         self,
@@ -88,16 +198,12 @@ class AnalysisCache:
         """
         ttl = ttl or self.default_ttl
         task_hash = self._hash_task(task, task_type, context)
-        key = self._key(task_hash, "full")
+        data = result.model_dump_json()
 
-        await self.redis.setex(
-            key,
-            ttl,
-            result.model_dump_json()
-        )
-
-        # Сохраняем метаданные
-        await self.redis.setex(
+        # Результат и метаданные — один round-trip
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.setex(self._key(task_hash, "full"), ttl, data)
+        pipe.setex(
             self._key(task_hash, "meta"),
             ttl,
             json.dumps({
@@ -106,7 +212,9 @@ class AnalysisCache:
                 "iterations": result.iterations_used,
             })
         )
+        await pipe.execute()
 
+        self.local.set(task_hash, result, size=len(data), ttl=ttl.total_seconds())
         return task_hash
 
     async def get_agent_analysis(
@@ -141,6 +249,9 @@ class AnalysisCache:
 
     async def invalidate(self, task_hash: str) -> bool:
         """Инвалидировать кэш для задачи"""
+        self.local.delete_prefix(task_hash)
+        self._pending_hits.pop(task_hash, None)
+
         # Находим все ключи
         pattern = self._key(task_hash, "*")
         keys = []
@@ -155,6 +266,8 @@ class AnalysisCache:
 
     async def get_stats(self) -> dict:
         """Получить статистику кэша"""
+        await self.flush_hits()
+
         # Общее количество записей
         pattern = f"{self.prefix}*:full"
         count = 0
@@ -172,6 +285,8 @@ class AnalysisCache:
             "total_entries": count,
             "total_hits": total_hits,
             "avg_hits_per_entry": total_hits / count if count > 0 else 0,
+            "local_entries": len(self.local),
+            "local_bytes": self.local.size_bytes,
         }
 
     async def cleanup_expired(self) -> int:
@@ -182,6 +297,7 @@ class AnalysisCache:
 
     async def close(self):
         """Закрыть соединение"""
+        await self.flush_hits()
         await self.redis.close()
 
 
@@ -189,12 +305,35 @@ class SemanticCache(AnalysisCache):
     """
     Семантический кэш
 
-    Находит похожие задачи по embedding'ам, а не точному совпадению
+    Находит похожие задачи по embedding'ам, а не точному совпадению.
+
+    Embedding'и хранятся в Redis (float32 bytes, тот же TTL, что у `:full`)
+    и в локальном VectorIndex процесса. Индекс загружается из Redis при
+    первом обращении и догружает записи других воркеров из stream
+    `semantic:log` не чаще раза в `semantic_cache_sync_interval` секунд.
     """
 
     def __init__(self):
         super().__init__()
-        self.similarity_threshold = 0.95
+        settings = get_settings()
+        self.similarity_threshold = settings.semantic_cache_threshold
+        self.sync_interval = settings.semantic_cache_sync_interval
+        self.index = VectorIndex(nprobe=settings.semantic_cache_nprobe)
+        self._log_key = f"{self.prefix}semantic:log"
+        self._log_id: Optional[str] = None
+        self._synced_at = 0.0
+        self._embeddings = None
+
+    async def _embed(self, text: str) -> np.ndarray:
+        if self._embeddings is None:
+            from langchain_openai import OpenAIEmbeddings
+            settings = get_settings()
+
+            self._embeddings = OpenAIEmbeddings(
+                api_key=settings.openai_api_key,
+                model="text-embedding-3-small"
+            )
+        return np.asarray(await self._embeddings.aembed_query(text), dtype=np.float32)
 
     async def get_similar_analysis(
         self,
@@ -208,47 +347,24 @@ class SemanticCache(AnalysisCache):
         Returns:
             (result, similarity_score) или None
         """
-        from langchain_openai import OpenAIEmbeddings
-        settings = get_settings()
-
-        embeddings = OpenAIEmbeddings(
-            api_key=settings.openai_api_key,
-            model="text-embedding-3-small"
-        )
+        query_embedding = await self._embed(f"{task} {task_type} {context}")
+        await self._sync_index()
 
-        # Получаем embedding запроса
-        query_embedding = await embeddings.aembed_query(f"{task} {task_type} {context}")
-
-        # Ищем похожие в кэше
-        pattern = f"{self.prefix}*:embedding"
-        best_match = None
-        best_similarity = 0
-
-        async for key in self.redis.scan_iter(match=pattern):
-            cached_embedding = await self.redis.get(key)
-            if cached_embedding:
-                cached_vec = json.loads(cached_embedding)
-                similarity = self._cosine_similarity(query_embedding, cached_vec)
-
-                if similarity > best_similarity:
-                    best_similarity = similarity
-                    task_hash = key.decode().replace(self.prefix, "").replace(":embedding", "")
-                    best_match = task_hash
-
-        if best_match and best_similarity >= self.similarity_threshold:
-            result = await self.get_analysis_by_hash(best_match)
+        matches = self.index.search(query_embedding, k=3, threshold=self.similarity_threshold)
+        for task_hash, similarity in matches:
+            result = await self.get_analysis_by_hash(task_hash)
             if result:
-                return result, best_similarity
+                observe_cache("semantic", True)
+                return result, similarity
+            # `:full` вытеснен раньше embedding'а — убираем из индекса
+            self.index.remove(task_hash)
 
+        observe_cache("semantic", False)
         return None
 
     async def get_analysis_by_hash(self, task_hash: str) -> Optional[CosiliumOutput]:
         """Получить анализ по хэшу"""
-        key = self._key(task_hash, "full")
-        data = await self.redis.get(key)
-        if data:
-            return CosiliumOutput.model_validate_json(data)
-        return None
+        return await self._load_full(task_hash)
 
     async def set_with_embedding(
         self,
@@ -259,34 +375,72 @@ class SemanticCache(AnalysisCache):
         ttl: Optional[timedelta] = None
     ) -> str:
         """Сохранить с embedding для семантического поиска"""
-        from langchain_openai import OpenAIEmbeddings
-        settings = get_settings()
+        ttl = ttl or self.default_ttl
 
         # Сохраняем основной результат
         task_hash = await self.set_analysis(task, task_type, context, result, ttl)
 
-        # Сохраняем embedding
-        embeddings = OpenAIEmbeddings(
-            api_key=settings.openai_api_key,
-            model="text-embedding-3-small"
-        )
-        embedding = await embeddings.aembed_query(f"{task} {task_type} {context}")
+        # Сохраняем embedding с тем же TTL
+        embedding = await self._embed(f"{task} {task_type} {context}")
 
-        await self.redis.setex(
-            self._key(task_hash, "embedding"),
-            ttl or self.default_ttl,
-            json.dumps(embedding)
-        )
+        pipe = self.redis.pipeline()
+        pipe.setex(self._key(task_hash, "embedding"), ttl, embedding.tobytes())
+        pipe.xadd(self._log_key, {"hash": task_hash}, maxlen=100000, approximate=True)
+        await pipe.execute()
 
+        self.index.add(task_hash, embedding, expires_at=time.time() + ttl.total_seconds())
         return task_hash
 
-    def _cosine_similarity(self, vec1: list[float], vec2: list[float]) -> float:
-        """Косинусное сходство между векторами"""
-        dot_product = sum(a * b for a, b in zip(vec1, vec2))
-        norm1 = sum(a * a for a in vec1) ** 0.5
-        norm2 = sum(b * b for b in vec2) ** 0.5
-
-        if norm1 == 0 or norm2 == 0:
-            return 0
-
-        return dot_product / (norm1 * norm2)
+    async def invalidate(self, task_hash: str) -> bool:
+        """Инвалидировать кэш для задачи"""
+        self.index.remove(task_hash)
+        return await super().invalidate(task_hash)
+
+    async def _sync_index(self):
+        """Загрузить индекс из Redis / догрузить новые записи других процессов"""
+        now = time.time()
+        if now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+
+        if self._log_id is None:
+            # Первая загрузка: позиция в логе до сканирования, чтобы не потерять записи
+            last = await self.redis.xrevrange(self._log_key, count=1)
+            self._log_id = last[0][0].decode() if last else "0"
+
+            hashes = []
+            async for key in self.redis.scan_iter(match=f"{self.prefix}*:embedding", count=1000):
+                hashes.append(key.decode().replace(self.prefix, "").replace(":embedding", ""))
+        else:
+            entries = await self.redis.xrange(self._log_key, min=f"({self._log_id}")
+            if entries:
+                self._log_id = entries[-1][0].decode()
+            hashes = [fields[b"hash"].decode() for _, fields in entries]
+
+        for start in range(0, len(hashes), 500):
+            await self._load_embeddings(hashes[start:start + 500])
+
+        self.index.evict_expired(now)
+
+    async def _load_embeddings(self, hashes: list[str]):
+        """Добавить embedding'и в индекс одним pipeline (значение + PTTL)"""
+        pipe = self.redis.pipeline()
+        for task_hash in hashes:
+            key = self._key(task_hash, "embedding")
+            pipe.get(key)
+            pipe.pttl(key)
+        values = await pipe.execute()
+
+        now = time.time()
+        for task_hash, data, pttl in zip(hashes, values[::2], values[1::2]):
+            if not data:
+                continue
+            expires_at = now + pttl / 1000 if pttl and pttl > 0 else math.inf
+            self.index.add(task_hash, _decode_embedding(data), expires_at=expires_at)
+
+
+def _decode_embedding(data: bytes) -> np.ndarray:
+    """float32 bytes (или JSON список из старых записей)"""
+    if data[:1] == b"[":
+        return np.asarray(json.loads(data), dtype=np.float32)
+    return np.frombuffer(data, dtype=np.float32)
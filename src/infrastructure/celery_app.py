@@ -1,12 +1,19 @@
 """
 LLM-top: Celery Application
 Распределённые задачи для длинных анализов
+
+Воркер: celery -A src.infrastructure.celery_app worker
+(pool и число одновременных анализов — CELERY_WORKER_POOL и
+CELERY_WORKER_CONCURRENCY)
 """
 
-from celery import Celery
+from celery import Celery, signals
 from celery.result import AsyncResult
 import asyncio
+from typing import Optional
 
+from src.infrastructure.admission import priority_scope
+from src.infrastructure.worker_loop import WorkerLoop
 from src.config import get_settings
 
 settings = get_settings()
@@ -28,19 +35,38 @@ celery_app.conf.update(
     task_track_started=True,
     task_time_limit=600,  # 10 минут максимум
     task_soft_time_limit=540,  # Soft limit 9 минут
-    worker_prefetch_multiplier=1,  # Один task за раз для LLM
+    worker_prefetch_multiplier=1,  # Не больше задач, чем свободных потоков
     task_acks_late=True,
     task_reject_on_worker_lost=True,
+    # Анализ — ожидание сетевого I/O: в threads pool один процесс ведёт
+    # много графов в общем event loop (prefork — по одному на процесс)
+    worker_pool=settings.celery_worker_pool,
+    worker_concurrency=(
+        settings.celery_worker_concurrency if settings.celery_worker_pool == "threads" else None
+    ),
+)
+
+# Threads pool не поддерживает task_time_limit — ограничение в loop
+worker_loop = WorkerLoop(
+    max_concurrency=settings.celery_worker_concurrency,
+    timeout=celery_app.conf.task_soft_time_limit,
 )
 
 
-def run_async(coro):
-    """Запуск async функции в sync контексте Celery"""
+def run_async(coro, timeout: Optional[float] = None):
+    """Запуск async функции в sync контексте Celery (timeout — вместо soft limit задачи)"""
+    if settings.celery_persistent_loop:
+        return worker_loop.run(coro, timeout)
+
+    from src.agents.llm_pool import get_llm_pool
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
         return loop.run_until_complete(coro)
     finally:
+        # HTTP соединения пула привязаны к этому loop — закрываем вместе с ним
+        loop.run_until_complete(get_llm_pool().aclose_loop(loop))
         loop.close()
 
 
@@ -77,7 +103,9 @@ def analyze_task(self, task: str, task_type: str, context: str, max_iterations:
     config = {"configurable": {"thread_id": self.request.id}}
 
     async def run():
-        return await langgraph_app.ainvoke(initial_state, config)
+        # Фоновые задачи уступают интерактивным вызовам процесса
+        with priority_scope("batch"):
+            return await langgraph_app.ainvoke(initial_state, config)
 
     try:
         final_state = run_async(run())
@@ -88,6 +116,10 @@ def analyze_task(self, task: str, task_type: str, context: str, max_iterations:
             critiques=final_state["critiques"],
             synthesis=final_state["synthesis"],
             iterations_used=final_state["iteration"],
+            critique_stats=final_state.get("critique_stats", []),
+            budget_stats=final_state.get("budget_stats", []),
+            consensus_stats=final_state.get("consensus_stats", []),
+            iteration_metrics=final_state.get("iteration_metrics", []),
         )
 
         return output.model_dump()
@@ -97,6 +129,60 @@ def analyze_task(self, task: str, task_type: str, context: str, max_iterations:
         raise
 
 
+@celery_app.task(
+    bind=True,
+    name="cosilium.analyze_batch",
+    soft_time_limit=settings.batch_time_limit,
+    time_limit=settings.batch_time_limit + 60,
+)
+def analyze_batch_task(self, items: list[dict]):
+    """
+    Celery task для пакета задач (см. BatchScheduler)
+
+    Args:
+        items: Задачи пакета (поля TaskInput)
+
+    Прогресс — состояние PROGRESS с meta total, completed, failed и
+    индексом последней готовой задачи. Результат — items в порядке
+    входа и stats (makespan, задач в минуту, загрузка провайдеров).
+    """
+    from src.infrastructure.batch import BatchScheduler
+    from src.models.state import TaskInput
+
+    inputs = [TaskInput.model_validate(item) for item in items]
+    # Корутина выполняется в потоке loop: контекст запроса Celery там недоступен
+    task_id = self.request.id
+    scheduler = BatchScheduler()
+
+    async def run():
+        results = []
+        async for item in scheduler.run(inputs):
+            results.append(item)
+            await asyncio.to_thread(
+                self.update_state,
+                task_id=task_id,
+                state="PROGRESS",
+                meta={
+                    "total": len(inputs),
+                    "completed": scheduler.stats.completed,
+                    "failed": scheduler.stats.failed,
+                    "last": item.index,
+                },
+            )
+        return results
+
+    try:
+        results = run_async(run(), timeout=settings.batch_time_limit)
+        return {
+            "items": [r.model_dump(mode="json") for r in sorted(results, key=lambda r: r.index)],
+            "stats": scheduler.stats.model_dump(mode="json"),
+        }
+
+    except Exception as e:
+        self.update_state(state="FAILED", meta={"error": str(e)})
+        raise
+
+
 @celery_app.task(bind=True, name="cosilium.analyze_with_rag")
 def analyze_with_rag_task(
     self,
@@ -118,6 +204,8 @@ def analyze_with_rag_task(
     from src.models.state import CosiliumState, CosiliumOutput
 
     self.update_state(state="PREPARING", meta={"stage": "rag_setup"})
+    # Корутина выполняется в потоке loop: контекст запроса Celery там недоступен
+    task_id = self.request.id
 
     async def run():
         enhanced_task = task
@@ -136,7 +224,10 @@ def analyze_with_rag_task(
             # Промпт эволюция будет применена внутри агентов
             pass
 
-        self.update_state(state="ANALYZING", meta={"stage": "main_analysis"})
+        # Синхронная запись в backend — вне общего loop
+        await asyncio.to_thread(
+            self.update_state, task_id=task_id, state="ANALYZING", meta={"stage": "main_analysis"}
+        )
 
         initial_state: CosiliumState = {
             "task": enhanced_task,
@@ -151,8 +242,9 @@ def analyze_with_rag_task(
             "error": None,
         }
 
-        config = {"configurable": {"thread_id": self.request.id}}
-        return await langgraph_app.ainvoke(initial_state, config)
+        config = {"configurable": {"thread_id": task_id}}
+        with priority_scope("batch"):
+            return await langgraph_app.ainvoke(initial_state, config)
 
     try:
         final_state = run_async(run())
@@ -163,6 +255,10 @@ def analyze_with_rag_task(
             critiques=final_state["critiques"],
             synthesis=final_state["synthesis"],
             iterations_used=final_state["iteration"],
+            critique_stats=final_state.get("critique_stats", []),
+            budget_stats=final_state.get("budget_stats", []),
+            consensus_stats=final_state.get("consensus_stats", []),
+            iteration_metrics=final_state.get("iteration_metrics", []),
         )
 
         return output.model_dump()
@@ -175,21 +271,63 @@ def analyze_with_rag_task(
 @celery_app.task(name="cosilium.warmup")
 def warmup_task():
     """Прогрев кэшей и соединений"""
+    return run_async(_warmup())
+
+
+async def _warmup() -> dict:
+    """Redis, снимок промптов, агенты и LLM клиенты в loop воркера"""
     from src.infrastructure import RedisStateStore, AnalysisCache
+    from src.agents.llm_pool import get_llm_pool
+    from src.graph.workflow import get_agents, get_synthesizer
+    from src.prompts.agent_prompts import prepare_prompts
+    from src.agents.budget import warmup_tokenizer
+
+    # Проверяем Redis
+    store = RedisStateStore()
+    await store.redis.ping()
+    await store.close()
+
+    cache = AnalysisCache()
+    await cache.redis.ping()
+    await cache.close()
+
+    # Клиенты пула привязаны к loop — создаём их в том, где пойдут анализы
+    await prepare_prompts()
+    await warmup_tokenizer()
+    agents = get_agents()
+    for agent in agents.values():
+        agent.llm
+    get_synthesizer().llm
+
+    return {"status": "ok", "agents": list(agents), "llm_pool": get_llm_pool().stats()}
+
+
+def _warm_worker():
+    if not settings.celery_persistent_loop:
+        return
+    try:
+        worker_loop.run(_warmup())
+    except Exception as e:
+        print(f"Worker warmup failed: {e}")
+
+
+@signals.worker_process_init.connect
+def _on_process_init(**kwargs):
+    # Дочерний процесс prefork pool: свой loop после fork
+    _warm_worker()
 
-    async def run():
-        # Проверяем Redis
-        store = RedisStateStore()
-        await store.redis.ping()
-        await store.close()
 
-        cache = AnalysisCache()
-        await cache.redis.ping()
-        await cache.close()
+@signals.worker_ready.connect
+def _on_worker_ready(**kwargs):
+    # threads/solo pool: задачи выполняются в главном процессе
+    if settings.celery_worker_pool != "prefork":
+        _warm_worker()
 
-        return {"status": "ok"}
 
-    return run_async(run())
+@signals.worker_process_shutdown.connect
+@signals.worker_shutdown.connect
+def _on_shutdown(**kwargs):
+    worker_loop.stop()
 
 
 def get_task_status(task_id: str) -> dict:
@@ -29,24 +29,34 @@ MODEL_PRICING: dict[str, TokenPricing] = {
     "gpt-4o": TokenPricing(
         input_per_1k=Decimal("0.005"),
         output_per_1k=Decimal("0.015"),
+        cached_input_per_1k=Decimal("0.0025"),
     ),
     "gpt-4o-mini": TokenPricing(
         input_per_1k=Decimal("0.00015"),
         output_per_1k=Decimal("0.0006"),
+        cached_input_per_1k=Decimal("0.000075"),
     ),
 
     # Anthropic
     "claude-3-opus-20240229": TokenPricing(
         input_per_1k=Decimal("0.015"),
         output_per_1k=Decimal("0.075"),
+        cached_input_per_1k=Decimal("0.0015"),
     ),
     "claude-3-sonnet-20240229": TokenPricing(
         input_per_1k=Decimal("0.003"),
         output_per_1k=Decimal("0.015"),
+        cached_input_per_1k=Decimal("0.0003"),
+    ),
+    "claude-sonnet-4-20250514": TokenPricing(
+        input_per_1k=Decimal("0.003"),
+        output_per_1k=Decimal("0.015"),
+        cached_input_per_1k=Decimal("0.0003"),
     ),
     "claude-3-haiku-20240307": TokenPricing(
         input_per_1k=Decimal("0.00025"),
         output_per_1k=Decimal("0.00125"),
+        cached_input_per_1k=Decimal("0.00003"),
     ),
 
     # Google
@@ -68,6 +78,7 @@ MODEL_PRICING: dict[str, TokenPricing] = {
     "deepseek-reasoner": TokenPricing(
         input_per_1k=Decimal("0.00055"),
         output_per_1k=Decimal("0.00219"),
+        cached_input_per_1k=Decimal("0.00014"),
     ),
 }
 
@@ -83,6 +94,8 @@ class UsageRecord(BaseModel):
     cached_tokens: int = 0
     cost_usd: Decimal
     latency_ms: int
+    agent: str = ""
+    stage: str = ""  # analysis, critique, synthesis
 
 
 class DailyCost(BaseModel):
@@ -109,7 +122,8 @@ class CostTracker:
 
     def __init__(self):
         settings = get_settings()
-        self.redis = redis.from_url(settings.redis_url)
+        # Строки вместо bytes: агрегаты читаются как Decimal/int
+        self.redis = redis.from_url(settings.redis_url, decode_responses=True)
         self.prefix = "cosilium:cost:"
         self.pricing = MODEL_PRICING
 
@@ -161,57 +175,83 @@ class CostTracker:
             cost_usd=cost,
             latency_ms=latency_ms,
         )
-
-        # Сохраняем запись
-        today = date.today().isoformat()
-        key = f"{self.prefix}daily:{today}"
-
-        await self.redis.rpush(key, record.model_dump_json())
-        await self.redis.expire(key, 86400 * 90)  # 90 дней
-
-        # Обновляем агрегаты
-        await self._update_aggregates(today, record)
-
+        await self.record_batch([record])
         return record
 
-    async def _update_aggregates(self, day: str, record: UsageRecord):
-        """Обновить агрегированные метрики"""
-        pipe = self.redis.pipeline()
+    async def record_calls(self, calls: list) -> list[UsageRecord]:
+        """
+        Записать пачку LLM вызовов (LLMCallRecord из телеметрии)
 
-        # Общая стоимость за день
-        pipe.incrbyfloat(f"{self.prefix}total:{day}", float(record.cost_usd))
+        input_tokens вызова включают кэшированные: они тарифицируются
+        по цене cached_input (если она известна), остальные — по обычной.
+        """
+        records = []
+        for call in calls:
+            pricing = self.pricing.get(call.model)
+            cached = call.cached_tokens if pricing and pricing.cached_input_per_1k else 0
+            records.append(UsageRecord(
+                timestamp=call.timestamp,
+                task_id=call.task_id,
+                model=call.model,
+                provider=call.provider,
+                input_tokens=call.input_tokens,
+                output_tokens=call.output_tokens,
+                cached_tokens=call.cached_tokens,
+                cost_usd=self.calculate_cost(
+                    call.model, call.input_tokens - cached, call.output_tokens, cached
+                ),
+                latency_ms=int(call.latency_ms),
+                agent=call.agent,
+                stage=call.stage,
+            ))
+        await self.record_batch(records)
+        return records
+
+    async def record_batch(self, records: list[UsageRecord]):
+        """Сохранить записи и обновить агрегаты одним pipeline"""
+        if not records:
+            return
+
+        day = date.today().isoformat()
+        key = f"{self.prefix}daily:{day}"
 
-        # По провайдеру
-        pipe.incrbyfloat(
-            f"{self.prefix}provider:{day}:{record.provider}",
-            float(record.cost_usd)
-        )
+        pipe = self.redis.pipeline()
+        pipe.rpush(key, *(record.model_dump_json() for record in records))
+        touched = {key}
+        for record in records:
+            touched.update(self._update_aggregates(pipe, day, record))
 
-        # По модели
-        pipe.incrbyfloat(
-            f"{self.prefix}model:{day}:{record.model}",
-            float(record.cost_usd)
-        )
+        for key in touched:
+            pipe.expire(key, 86400 * 90)  # 90 дней
+        await pipe.execute()
 
-        # Счётчики токенов
-        pipe.incrby(f"{self.prefix}tokens:{day}:input", record.input_tokens)
-        pipe.incrby(f"{self.prefix}tokens:{day}:output", record.output_tokens)
-
-        # Счётчик запросов
-        pipe.incr(f"{self.prefix}requests:{day}")
-
-        # TTL для всех ключей
-        for key in [
-            f"{self.prefix}total:{day}",
-            f"{self.prefix}provider:{day}:{record.provider}",
-            f"{self.prefix}model:{day}:{record.model}",
-            f"{self.prefix}tokens:{day}:input",
-            f"{self.prefix}tokens:{day}:output",
-            f"{self.prefix}requests:{day}",
+    def _update_aggregates(self, pipe, day: str, record: UsageRecord) -> list[str]:
+        """Добавить в pipeline обновление агрегатов; вернуть ключи"""
+        cost = float(record.cost_usd)
+        keys = []
+
+        def incr_float(key: str):
+            pipe.incrbyfloat(key, cost)
+            keys.append(key)
+
+        # Общая стоимость за день, по провайдеру, по модели, по этапу
+        incr_float(f"{self.prefix}total:{day}")
+        incr_float(f"{self.prefix}provider:{day}:{record.provider}")
+        incr_float(f"{self.prefix}model:{day}:{record.model}")
+        if record.stage:
+            incr_float(f"{self.prefix}stage:{day}:{record.stage}")
+
+        # Счётчики токенов и запросов
+        for key, amount in [
+            (f"{self.prefix}tokens:{day}:input", record.input_tokens),
+            (f"{self.prefix}tokens:{day}:output", record.output_tokens),
+            (f"{self.prefix}tokens:{day}:cached", record.cached_tokens),
+            (f"{self.prefix}requests:{day}", 1),
         ]:
-            pipe.expire(key, 86400 * 90)
+            pipe.incrby(key, amount)
+            keys.append(key)
 
-        await pipe.execute()
+        return keys
 
     async def get_daily_cost(self, day: Optional[date] = None) -> DailyCost:
         """Получить стоимость за день"""
@@ -4,13 +4,16 @@ LLM-top: Rate Limiter
 """
 
 import asyncio
-from typing import Optional
-from datetime import datetime, timedelta
+import math
+import time
+import weakref
+from typing import NamedTuple, Optional
 from collections import defaultdict
 import redis.asyncio as redis
 from pydantic import BaseModel
 
 from src.config import get_settings
+from src.monitoring.exporter import RATE_LIMIT_WAIT
 
 
 class RateLimitConfig(BaseModel):
@@ -60,34 +63,350 @@ class RateLimitExceeded(Exception):
         super().__init__(f"Rate limit exceeded for {provider}: {limit_type}. Retry after {retry_after}s")
 
 
+# GCRA с резервированием для нескольких bucket'ов за один вызов.
+#
+# KEYS: ключи bucket'ов (TAT в микросекундах)
+# ARGV[1]: максимальное ожидание (мкс); ARGV[2]: 1 — пробовать lease
+# ARGV[3 + 5*(i-1) ...]: interval, period, cost, lease_cost, refund для bucket i
+#
+# Сначала возвращаются неиспользованные lease (refund), затем пробуется
+# lease без ожидания, затем одиночный запрос. Если ожидание укладывается
+# в max_wait, слот резервируется и вызывающий спит до своей очереди —
+# порядок резервирования в Redis и есть глобальный FIFO.
+_GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000000 + tonumber(t[2])
+local max_wait = tonumber(ARGV[1])
+local try_lease = tonumber(ARGV[2]) == 1
+local n = #KEYS
+
+local tats = {}
+for i = 1, n do
+  local base = 3 + (i - 1) * 5
+  local tat = tonumber(redis.call('GET', KEYS[i]) or now)
+  tat = tat - tonumber(ARGV[base + 4]) * tonumber(ARGV[base])
+  if tat < now then tat = now end
+  tats[i] = tat
+end
+
+local function plan(offset)
+  local wait = 0
+  local limit_index = 0
+  local new_tats = {}
+  for i = 1, n do
+    local base = 3 + (i - 1) * 5
+    local new_tat = tats[i] + tonumber(ARGV[base]) * tonumber(ARGV[base + offset])
+    local w = new_tat - tonumber(ARGV[base + 1]) - now
+    if w > wait then
+      wait = w
+      limit_index = i
+    end
+    new_tats[i] = new_tat
+  end
+  return wait, limit_index, new_tats
+end
+
+local function commit(new_tats)
+  for i = 1, n do
+    local ttl = math.ceil((new_tats[i] - now) / 1000) + 1
+    redis.call('SET', KEYS[i], string.format('%d', new_tats[i]), 'PX', ttl)
+  end
+end
+
+if try_lease then
+  local wait, _, new_tats = plan(3)
+  if wait <= 0 then
+    commit(new_tats)
+    return {1, 0, 1, 0}
+  end
+end
+
+local wait, limit_index, new_tats = plan(2)
+if wait > max_wait then
+  return {0, math.floor(wait), 0, limit_index}
+end
+commit(new_tats)
+return {1, math.floor(wait), 0, limit_index}
+"""
+
+
+class _Bucket(NamedTuple):
+    """Параметры одного bucket'а GCRA для вызова reserve"""
+    key: str
+    limit_type: str
+    interval: float  # секунд на единицу (period / limit)
+    period: float  # допустимый burst, секунд
+    cost: int
+    lease_cost: int
+    refund: int
+
+
+class _Reservation(NamedTuple):
+    granted: bool
+    wait: float  # секунд до своего слота
+    leased: bool
+    limit_type: Optional[str]
+
+
+class _MemoryBuckets:
+    """GCRA в памяти процесса (backend memory и fallback без Redis)"""
+
+    def __init__(self):
+        self._tats: dict[str, float] = {}
+
+    async def reserve(
+        self, buckets: list[_Bucket], max_wait: float, try_lease: bool
+    ) -> _Reservation:
+        now = time.monotonic()
+        tats = [
+            max(self._tats.get(b.key, now) - b.refund * b.interval, now)
+            for b in buckets
+        ]
+
+        def plan(costs: list[int]):
+            new_tats = [tat + b.interval * c for tat, b, c in zip(tats, buckets, costs)]
+            waits = [new - b.period - now for new, b in zip(new_tats, buckets)]
+            wait = max([0.0, *waits])
+            limit_type = buckets[waits.index(wait)].limit_type if wait > 0 else None
+            return wait, limit_type, new_tats
+
+        if try_lease:
+            wait, _, new_tats = plan([b.lease_cost for b in buckets])
+            if wait <= 0:
+                self._commit(buckets, new_tats)
+                return _Reservation(True, 0.0, True, None)
+
+        wait, limit_type, new_tats = plan([b.cost for b in buckets])
+        if wait > max_wait:
+            return _Reservation(False, wait, False, limit_type)
+        self._commit(buckets, new_tats)
+        return _Reservation(True, wait, False, limit_type)
+
+    def _commit(self, buckets: list[_Bucket], new_tats: list[float]):
+        for b, tat in zip(buckets, new_tats):
+            self._tats[b.key] = tat
+
+    async def backlog(self, keys: list[str]) -> list[float]:
+        now = time.monotonic()
+        return [max(self._tats.get(k, now) - now, 0.0) for k in keys]
+
+    async def delete(self, keys: list[str]):
+        for key in keys:
+            self._tats.pop(key, None)
+
+    async def close(self):
+        pass
+
+
+class _RedisBuckets:
+    """GCRA в Redis: один атомарный Lua вызов на резервирование"""
+
+    def __init__(self, client: redis.Redis):
+        self.redis = client
+        self._script = client.register_script(_GCRA_SCRIPT)
+
+    async def reserve(
+        self, buckets: list[_Bucket], max_wait: float, try_lease: bool
+    ) -> _Reservation:
+        args = [_us(max_wait), 1 if try_lease else 0]
+        for b in buckets:
+            args += [_us(b.interval), _us(b.period), b.cost, b.lease_cost, b.refund]
+
+        granted, wait, leased, index = await self._script(
+            keys=[b.key for b in buckets], args=args
+        )
+        return _Reservation(
+            bool(granted),
+            int(wait) / 1_000_000,
+            bool(leased),
+            buckets[int(index) - 1].limit_type if int(index) else None,
+        )
+
+    async def backlog(self, keys: list[str]) -> list[float]:
+        seconds, micros = await self.redis.time()
+        now = int(seconds) * 1_000_000 + int(micros)
+        values = await self.redis.mget(keys)
+        return [
+            max(int(v) - now, 0) / 1_000_000 if v else 0.0
+            for v in values
+        ]
+
+    async def delete(self, keys: list[str]):
+        await self.redis.delete(*keys)
+
+    async def close(self):
+        await self.redis.close()
+
+
+def _us(seconds: float) -> int:
+    return int(seconds * 1_000_000)
+
+
+class _Lease:
+    """Локальный запас разрешений, взятый из общего лимита одним вызовом"""
+
+    def __init__(self):
+        self.requests = 0
+        self.tokens = 0
+        self.expires_at = 0.0
+
+    def take(self, tokens: int) -> bool:
+        """Fast path: списать разрешение без обращения к Redis"""
+        if self.requests < 1 or self.tokens < tokens or time.monotonic() >= self.expires_at:
+            return False
+        self.requests -= 1
+        self.tokens -= tokens
+        return True
+
+    def release(self) -> tuple[int, int]:
+        """Забрать неиспользованный остаток для возврата в общий лимит"""
+        unused = (self.requests, self.tokens)
+        self.requests = self.tokens = 0
+        return unused
+
+
 class RateLimiter:
     """
     Rate limiter для LLM API
 
     Поддерживает:
-    - Per-minute и per-hour лимиты
-    - Token-based лимиты
+    - Per-minute и per-hour лимиты на запросы и токены (GCRA)
     - Concurrent request лимиты
-    - Distributed rate limiting через Redis
+    - Distributed rate limiting через Redis (атомарный Lua скрипт)
+    - Ожидание допуска с дедлайном вместо немедленного отказа
+
+    Запрос не отклоняется, а резервирует ближайший свободный слот и ждёт
+    его; порядок резервирования общий для API, Celery и Telegram, поэтому
+    очередь честная (FIFO). Отказ (RateLimitExceeded) — только если слот
+    не наступит до дедлайна.
+
+    Fast path: при свободном лимите процесс берёт lease на несколько
+    запросов/токенов за один вызов Redis и расходует его локально.
+    Неиспользованный lease возвращается при следующем обращении к Redis.
     """
 
-    def __init__(self):
+    def __init__(self, backend: Optional[str] = None):
         settings = get_settings()
-        self.redis = redis.from_url(settings.redis_url)
         self.prefix = "cosilium:ratelimit:"
         self.limits = DEFAULT_LIMITS.copy()
-        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self.lease_requests = settings.rate_limit_lease_requests
+        self.lease_tokens = settings.rate_limit_lease_tokens
+        self.lease_ttl = settings.rate_limit_lease_ttl
+        self.default_timeout = settings.rate_limit_wait_timeout
+
+        backend = backend or settings.rate_limit_backend
+        self._memory = _MemoryBuckets()
+        self._store = (
+            _RedisBuckets(redis.from_url(settings.redis_url))
+            if backend == "redis"
+            else self._memory
+        )
+
+        # asyncio примитивы привязаны к event loop (Celery создаёт loop на задачу)
+        self._loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._leases: dict[str, _Lease] = {}
 
     def _key(self, provider: str, limit_type: str) -> str:
         return f"{self.prefix}{provider}:{limit_type}"
 
+    def _buckets(self, provider: str, tokens: int, lease: _Lease) -> list[_Bucket]:
+        config = self.limits.get(provider, RateLimitConfig())
+        lease_requests = max(self.lease_requests, 1)
+        lease_tokens = max(self.lease_tokens, tokens)
+        refund_requests, refund_tokens = lease.release()
+
+        specs = [
+            ("rpm", 60, config.requests_per_minute, 1, lease_requests, refund_requests),
+            ("rph", 3600, config.requests_per_hour, 1, lease_requests, refund_requests),
+        ]
+        if tokens > 0 or refund_tokens > 0 or self.lease_tokens > 0:
+            specs += [
+                ("tpm", 60, config.tokens_per_minute, tokens, lease_tokens, refund_tokens),
+                ("tph", 3600, config.tokens_per_hour, tokens, lease_tokens, refund_tokens),
+            ]
+        return [
+            _Bucket(
+                key=self._key(provider, name),
+                limit_type=_LIMIT_NAMES[name],
+                interval=period / limit,
+                period=period,
+                cost=cost,
+                lease_cost=lease_cost,
+                refund=refund,
+            )
+            for name, period, limit, cost, lease_cost, refund in specs
+        ]
+
+    async def wait_for_admission(
+        self,
+        provider: str,
+        tokens: int = 0,
+        timeout: Optional[float] = None,
+    ) -> float:
+        """
+        Дождаться допуска запроса по лимитам частоты
+
+        Args:
+            provider: Провайдер (openai, anthropic, etc)
+            tokens: Оценка токенов запроса
+            timeout: Максимальное ожидание, секунд (None — из настроек)
+
+        Returns:
+            Время ожидания в секундах
+
+        Raises:
+            RateLimitExceeded: если слот не наступит до дедлайна
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        # Lock провайдера держится только на время резервирования (не сна),
+        # asyncio.Lock отдаёт очередь в порядке прихода
+        async with self._lock(provider):
+            lease = self._leases.setdefault(provider, _Lease())
+            if lease.take(tokens):
+                return 0.0
+
+            buckets = self._buckets(provider, tokens, lease)
+            max_wait = max(deadline - time.monotonic(), 0.0)
+            reservation = await self._reserve(buckets, max_wait, self.lease_requests > 1)
+
+            if reservation.leased:
+                lease.requests = max(self.lease_requests, 1)
+                lease.tokens = max(self.lease_tokens, tokens)
+                lease.expires_at = time.monotonic() + self.lease_ttl
+                lease.take(tokens)
+
+        if not reservation.granted:
+            raise RateLimitExceeded(
+                provider,
+                reservation.limit_type or "requests_per_minute",
+                max(math.ceil(reservation.wait), 1),
+            )
+
+        if reservation.wait > 0:
+            await asyncio.sleep(reservation.wait)
+        return time.monotonic() - started
+
+    async def _reserve(
+        self, buckets: list[_Bucket], max_wait: float, try_lease: bool
+    ) -> _Reservation:
+        try:
+            return await self._store.reserve(buckets, max_wait, try_lease)
+        except (redis.ConnectionError, redis.TimeoutError, OSError):
+            # Redis недоступен — ограничиваем хотя бы в пределах процесса
+            return await self._memory.reserve(buckets, max_wait, try_lease)
+
     async def check_and_increment(
         self,
         provider: str,
         tokens: int = 0
     ) -> bool:
         """
-        Проверить лимиты и инкрементировать счётчики
+        Проверить лимиты и инкрементировать счётчики без ожидания
 
         Args:
             provider: Провайдер (openai, anthropic, etc)
@@ -99,127 +418,122 @@ class RateLimiter:
         Raises:
             RateLimitExceeded: если лимит превышен
         """
-        config = self.limits.get(provider, RateLimitConfig())
-
-        # Проверяем concurrent requests
-        semaphore = self._get_semaphore(provider, config.concurrent_requests)
-        if semaphore.locked():
-            raise RateLimitExceeded(provider, "concurrent", 1)
-
-        # Проверяем RPM
-        rpm_key = self._key(provider, "rpm")
-        rpm_count = await self.redis.get(rpm_key)
-        if rpm_count and int(rpm_count) >= config.requests_per_minute:
-            ttl = await self.redis.ttl(rpm_key)
-            raise RateLimitExceeded(provider, "requests_per_minute", max(ttl, 1))
-
-        # Проверяем RPH
-        rph_key = self._key(provider, "rph")
-        rph_count = await self.redis.get(rph_key)
-        if rph_count and int(rph_count) >= config.requests_per_hour:
-            ttl = await self.redis.ttl(rph_key)
-            raise RateLimitExceeded(provider, "requests_per_hour", max(ttl, 1))
-
-        # Проверяем TPM
-        if tokens > 0:
-            tpm_key = self._key(provider, "tpm")
-            tpm_count = await self.redis.get(tpm_key)
-            if tpm_count and int(tpm_count) + tokens > config.tokens_per_minute:
-                ttl = await self.redis.ttl(tpm_key)
-                raise RateLimitExceeded(provider, "tokens_per_minute", max(ttl, 1))
-
-        # Инкрементируем счётчики
-        pipe = self.redis.pipeline()
-
-        # RPM с TTL 60 секунд
-        pipe.incr(rpm_key)
-        pipe.expire(rpm_key, 60)
-
-        # RPH с TTL 3600 секунд
-        pipe.incr(rph_key)
-        pipe.expire(rph_key, 3600)
-
-        # TPM
-        if tokens > 0:
-            tpm_key = self._key(provider, "tpm")
-            pipe.incrby(tpm_key, tokens)
-            pipe.expire(tpm_key, 60)
-
-        await pipe.execute()
+        await self.wait_for_admission(provider, tokens, timeout=0)
         return True
 
+    def _state(self, kind: str) -> dict:
+        loop = asyncio.get_running_loop()
+        return self._loop_state.setdefault(loop, {"semaphores": {}, "locks": {}})[kind]
+
     def _get_semaphore(self, provider: str, limit: int) -> asyncio.Semaphore:
         """Получить или создать семафор для провайдера"""
-        if provider not in self._semaphores:
-            self._semaphores[provider] = asyncio.Semaphore(limit)
-        return self._semaphores[provider]
-
-    async def acquire(self, provider: str, tokens: int = 0):
+        semaphores = self._state("semaphores")
+        if provider not in semaphores:
+            semaphores[provider] = asyncio.Semaphore(limit)
+        return semaphores[provider]
+
+    def _lock(self, provider: str) -> asyncio.Lock:
+        locks = self._state("locks")
+        if provider not in locks:
+            locks[provider] = asyncio.Lock()
+        return locks[provider]
+
+    def acquire(self, provider: str, tokens: int = 0, timeout: Optional[float] = None):
         """
         Получить разрешение на запрос (context manager)
 
+        Ждёт допуска по частоте и свободного слота concurrency;
+        общий дедлайн — timeout.
+
         Usage:
-            async with rate_limiter.acquire("openai", tokens=1000):
-                response = await llm.invoke(...)
+            async with rate_limiter.acquire("openai", tokens=1000, timeout=30):
+                response = await llm.ainvoke(...)
         """
-        await self.check_and_increment(provider, tokens)
-        semaphore = self._get_semaphore(
-            provider,
-            self.limits.get(provider, RateLimitConfig()).concurrent_requests
-        )
-        return _RateLimitContext(semaphore)
+        return _RateLimitContext(self, provider, tokens, timeout)
 
     async def get_usage(self, provider: str) -> dict:
-        """Получить текущее использование"""
+        """Получить текущее использование (занятая часть окна)"""
         config = self.limits.get(provider, RateLimitConfig())
-
-        rpm = await self.redis.get(self._key(provider, "rpm")) or 0
-        rph = await self.redis.get(self._key(provider, "rph")) or 0
-        tpm = await self.redis.get(self._key(provider, "tpm")) or 0
-
-        return {
-            "requests_per_minute": {
-                "current": int(rpm),
-                "limit": config.requests_per_minute,
-                "percent": int(rpm) / config.requests_per_minute * 100,
-            },
-            "requests_per_hour": {
-                "current": int(rph),
-                "limit": config.requests_per_hour,
-                "percent": int(rph) / config.requests_per_hour * 100,
-            },
-            "tokens_per_minute": {
-                "current": int(tpm),
-                "limit": config.tokens_per_minute,
-                "percent": int(tpm) / config.tokens_per_minute * 100,
-            },
-        }
+        keys = [self._key(provider, name) for name in ("rpm", "rph", "tpm")]
+        rpm, rph, tpm = await self._store.backlog(keys)
+
+        usage = {}
+        for limit_type, backlog, period, limit in (
+            ("requests_per_minute", rpm, 60, config.requests_per_minute),
+            ("requests_per_hour", rph, 3600, config.requests_per_hour),
+            ("tokens_per_minute", tpm, 60, config.tokens_per_minute),
+        ):
+            # TAT впереди текущего времени на backlog секунд = backlog/interval единиц
+            current = min(round(backlog * limit / period), limit)
+            usage[limit_type] = {
+                "current": current,
+                "limit": limit,
+                "percent": current / limit * 100,
+            }
+        return usage
 
     async def reset(self, provider: str):
         """Сбросить счётчики для провайдера"""
-        await self.redis.delete(
-            self._key(provider, "rpm"),
-            self._key(provider, "rph"),
-            self._key(provider, "tpm"),
+        self._leases.pop(provider, None)
+        await self._store.delete(
+            [self._key(provider, name) for name in _LIMIT_NAMES]
         )
 
     def set_limits(self, provider: str, config: RateLimitConfig):
         """Установить кастомные лимиты"""
         self.limits[provider] = config
+        for state in self._loop_state.values():
+            state["semaphores"].pop(provider, None)
 
     async def close(self):
         """Закрыть соединение"""
-        await self.redis.close()
+        await self._store.close()
+
+
+_LIMIT_NAMES = {
+    "rpm": "requests_per_minute",
+    "rph": "requests_per_hour",
+    "tpm": "tokens_per_minute",
+    "tph": "tokens_per_hour",
+}
 
 
 class _RateLimitContext:
     """Context manager для rate limiting"""
 
-    def __init__(self, semaphore: asyncio.Semaphore):
-        self.semaphore = semaphore
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        provider: str,
+        tokens: int,
+        timeout: Optional[float],
+    ):
+        self.limiter = limiter
+        self.provider = provider
+        self.tokens = tokens
+        self.timeout = limiter.default_timeout if timeout is None else timeout
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.waited = 0.0
 
     async def __aenter__(self):
-        await self.semaphore.acquire()
+        started = time.monotonic()
+        await self.limiter.wait_for_admission(self.provider, self.tokens, self.timeout)
+
+        self.semaphore = self.limiter._get_semaphore(
+            self.provider,
+            self.limiter.limits.get(self.provider, RateLimitConfig()).concurrent_requests,
+        )
+        if self.semaphore.locked():
+            remaining = self.timeout - (time.monotonic() - started)
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), timeout=max(remaining, 0))
+            except asyncio.TimeoutError:
+                raise RateLimitExceeded(self.provider, "concurrent", 1) from None
+        else:
+            await self.semaphore.acquire()
+
+        self.waited = time.monotonic() - started
+        RATE_LIMIT_WAIT.labels(self.provider).observe(self.waited)
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -234,8 +548,8 @@ class AdaptiveRateLimiter(RateLimiter):
     на основе ответов с 429 ошибками
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, backend: Optional[str] = None):
+        super().__init__(backend)
         self.backoff_multiplier: dict[str, float] = defaultdict(lambda: 1.0)
 
     async def handle_rate_limit_error(
@@ -262,3 +576,14 @@ class AdaptiveRateLimiter(RateLimiter):
     def get_effective_limit(self, provider: str, base_limit: int) -> int:
         """Получить эффективный лимит с учётом backoff"""
         return int(base_limit / self.backoff_multiplier[provider])
+
+
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Получить rate limiter процесса"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter()
+    return _rate_limiter
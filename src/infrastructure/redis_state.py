@@ -4,10 +4,24 @@ LLM-top: Redis State Store
 """
 
 import json
-from typing import Optional, Any
+from typing import Optional, Any, AsyncIterator, Sequence
 from datetime import datetime, timedelta
+import ormsgpack
 import redis.asyncio as redis
 from pydantic import BaseModel
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
 
 from src.config import get_settings
 
@@ -211,28 +225,306 @@ class RedisStateStore:
         await self.redis.close()
 
 
-class RedisCheckpointer:
+class RedisCheckpointer(BaseCheckpointSaver):
     """
-    LangGraph-совместимый checkpointer на базе Redis
-
-    Для использования с langgraph.checkpoint
+    LangGraph checkpointer на базе Redis
+
+    Реализует async API BaseCheckpointSaver (ainvoke/astream), поэтому
+    граф можно продолжить после падения процесса с последней завершённой
+    ноды. Синхронные методы остаются базовыми (NotImplementedError).
+
+    Хранение (на thread_id + checkpoint_ns):
+    - `checkpoints` (HASH) — checkpoint без значений каналов + metadata + parent
+    - `order` (ZSET, lex) — id checkpoint'ов по порядку
+    - `blobs` (HASH) — значения каналов по (channel, version); пишутся только
+      каналы из `new_versions`, то есть дельта, а не полный снимок
+    - `writes:{checkpoint_id}` (HASH) — pending writes задач
+
+    Значения сериализуются serde LangGraph (msgpack); AgentAnalysis,
+    AgentCritique и прочие модели состояния разрешены явно.
+    TTL скользящий: каждый put продлевает ключи thread'а.
     """
 
-    def __init__(self):
-        self.store = RedisStateStore()
+    def __init__(
+        self,
+        redis_client: Optional[redis.Redis] = None,
+        ttl: Optional[timedelta] = None,
+    ):
+        settings = get_settings()
+        super().__init__(serde=JsonPlusSerializer(allowed_msgpack_modules=_STATE_MODELS))
+        self.redis = redis_client or redis.from_url(settings.redis_url)
+        self.prefix = "cosilium:checkpoint:"
+        self.ttl = ttl or timedelta(seconds=settings.checkpoint_ttl)
 
-    async def put(self, config: dict, checkpoint: dict) -> None:
-        """Сохранить checkpoint"""
-        thread_id = config.get("configurable", {}).get("thread_id", "default")
-        await self.store.save_state(thread_id, checkpoint)
+    # ------------------------------------------------------------
+    # Ключи
+    # ------------------------------------------------------------
 
-    async def get(self, config: dict) -> Optional[dict]:
-        """Загрузить checkpoint"""
-        thread_id = config.get("configurable", {}).get("thread_id", "default")
-        return await self.store.load_state(thread_id)
-
-    async def list(self, config: dict) -> list[dict]:
-        """Список checkpoint'ов"""
-        thread_id = config.get("configurable", {}).get("thread_id", "default")
-        checkpoints = await self.store.list_checkpoints(thread_id)
-        return [{"name": cp} for cp in checkpoints]
+    def _key(self, thread_id: str, checkpoint_ns: str, suffix: str) -> str:
+        return f"{self.prefix}{thread_id}:{checkpoint_ns}:{suffix}"
+
+    def _namespaces_key(self, thread_id: str) -> str:
+        return f"{self.prefix}{thread_id}:namespaces"
+
+    # ------------------------------------------------------------
+    # Запись
+    # ------------------------------------------------------------
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """Сохранить checkpoint и изменившиеся каналы"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = checkpoint["id"]
+        parent_id = config["configurable"].get("checkpoint_id")
+
+        c = checkpoint.copy()
+        values = c.pop("channel_values")
+
+        blobs_key = self._key(thread_id, checkpoint_ns, "blobs")
+        checkpoints_key = self._key(thread_id, checkpoint_ns, "checkpoints")
+        order_key = self._key(thread_id, checkpoint_ns, "order")
+        namespaces_key = self._namespaces_key(thread_id)
+
+        pipe = self.redis.pipeline(transaction=True)
+        blobs = {
+            _blob_field(channel, version): _pack(
+                self.serde.dumps_typed(values[channel]) if channel in values else ("empty", b"")
+            )
+            for channel, version in new_versions.items()
+        }
+        if blobs:
+            pipe.hset(blobs_key, mapping=blobs)
+        pipe.hset(checkpoints_key, checkpoint_id, ormsgpack.packb([
+            *self.serde.dumps_typed(c),
+            *self.serde.dumps_typed(get_checkpoint_metadata(config, metadata)),
+            parent_id,
+        ]))
+        pipe.zadd(order_key, {checkpoint_id: 0})
+        pipe.sadd(namespaces_key, checkpoint_ns)
+        for key in (blobs_key, checkpoints_key, order_key, namespaces_key):
+            pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+            }
+        }
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Сохранить промежуточные записи задачи"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        key = self._key(thread_id, checkpoint_ns, f"writes:{checkpoint_id}")
+
+        fields = {}
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            fields[f"{task_id}:{write_idx}"] = (write_idx, ormsgpack.packb([
+                task_id, channel, *self.serde.dumps_typed(value), task_path, write_idx,
+            ]))
+        if not fields:
+            return
+
+        pipe = self.redis.pipeline(transaction=True)
+        for field, (write_idx, data) in fields.items():
+            # Специальные каналы (ошибки, interrupt) не перезаписываются
+            if write_idx >= 0:
+                pipe.hsetnx(key, field, data)
+            else:
+                pipe.hset(key, field, data)
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    # ------------------------------------------------------------
+    # Чтение
+    # ------------------------------------------------------------
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """Получить checkpoint (указанный или последний)"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+
+        if not checkpoint_id:
+            latest = await self.redis.zrevrangebylex(
+                self._key(thread_id, checkpoint_ns, "order"), "+", "-", start=0, num=1
+            )
+            if not latest:
+                return None
+            checkpoint_id = latest[0].decode()
+
+        return await self._load_tuple(thread_id, checkpoint_ns, checkpoint_id)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        """Список checkpoint'ов thread'а, от новых к старым"""
+        if config is None:
+            raise ValueError("RedisCheckpointer.alist requires config with thread_id")
+
+        thread_id = config["configurable"]["thread_id"]
+        namespace = config["configurable"].get("checkpoint_ns")
+        config_checkpoint_id = get_checkpoint_id(config)
+        before_id = get_checkpoint_id(before) if before else None
+
+        if namespace is None:
+            namespaces = sorted(
+                ns.decode() for ns in await self.redis.smembers(self._namespaces_key(thread_id))
+            )
+        else:
+            namespaces = [namespace]
+
+        for checkpoint_ns in namespaces:
+            ids = await self.redis.zrevrangebylex(
+                self._key(thread_id, checkpoint_ns, "order"),
+                f"({before_id}" if before_id else "+",
+                "-",
+            )
+            for raw_id in ids:
+                checkpoint_id = raw_id.decode()
+                if config_checkpoint_id and checkpoint_id != config_checkpoint_id:
+                    continue
+                if limit is not None and limit <= 0:
+                    return
+
+                item = await self._load_tuple(thread_id, checkpoint_ns, checkpoint_id)
+                if item is None:
+                    continue
+                if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                if limit is not None:
+                    limit -= 1
+                yield item
+
+    async def _load_tuple(
+        self,
+        thread_id: str,
+        checkpoint_ns: str,
+        checkpoint_id: str,
+    ) -> Optional[CheckpointTuple]:
+        """Собрать CheckpointTuple: checkpoint, нужные версии каналов, writes"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hget(self._key(thread_id, checkpoint_ns, "checkpoints"), checkpoint_id)
+        pipe.hgetall(self._key(thread_id, checkpoint_ns, f"writes:{checkpoint_id}"))
+        saved, raw_writes = await pipe.execute()
+        if not saved:
+            return None
+
+        type_, data, metadata_type, metadata_data, parent_id = ormsgpack.unpackb(saved)
+        checkpoint: Checkpoint = self.serde.loads_typed((type_, data))
+
+        # Значения каналов — по версиям из checkpoint (дельты разных шагов)
+        versions = checkpoint["channel_versions"]
+        channel_values = {}
+        if versions:
+            fields = [_blob_field(ch, ver) for ch, ver in versions.items()]
+            blobs = await self.redis.hmget(self._key(thread_id, checkpoint_ns, "blobs"), fields)
+            for channel, blob in zip(versions, blobs):
+                if blob is None:
+                    continue
+                typed = _unpack(blob)
+                if typed[0] != "empty":
+                    channel_values[channel] = self.serde.loads_typed(typed)
+
+        writes = sorted(
+            (ormsgpack.unpackb(value) for value in raw_writes.values()),
+            key=lambda w: writes_sort_key(w[4], w[0], w[5]),
+        )
+
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=self.serde.loads_typed((metadata_type, metadata_data)),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_id,
+                    }
+                }
+                if parent_id
+                else None
+            ),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((value_type, value)))
+                for task_id, channel, value_type, value, _, _ in writes
+            ],
+        )
+
+    # ------------------------------------------------------------
+    # Удаление
+    # ------------------------------------------------------------
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        """Удалить все checkpoint'ы и записи thread'а"""
+        namespaces_key = self._namespaces_key(thread_id)
+        namespaces = [ns.decode() for ns in await self.redis.smembers(namespaces_key)]
+
+        keys = [namespaces_key]
+        for checkpoint_ns in namespaces:
+            order_key = self._key(thread_id, checkpoint_ns, "order")
+            ids = await self.redis.zrange(order_key, 0, -1)
+            keys += [
+                order_key,
+                self._key(thread_id, checkpoint_ns, "checkpoints"),
+                self._key(thread_id, checkpoint_ns, "blobs"),
+                *(self._key(thread_id, checkpoint_ns, f"writes:{i.decode()}") for i in ids),
+            ]
+        await self.redis.delete(*keys)
+
+    async def close(self):
+        """Закрыть соединение"""
+        await self.redis.close()
+
+
+# Модели состояния, которые serde может восстанавливать из msgpack
+_STATE_MODELS = [
+    ("src.models.state", "AgentAnalysis"),
+    ("src.models.state", "AgentCritique"),
+    ("src.models.state", "SynthesisResult"),
+    ("src.models.state", "CritiqueStats"),
+    ("src.models.state", "PromptBudgetStats"),
+    ("src.models.state", "ConsensusStats"),
+    ("src.models.state", "IterationMetrics"),
+]
+
+
+def _blob_field(channel: str, version) -> str:
+    return f"{channel}:{version}"
+
+
+def _pack(typed: tuple[str, bytes]) -> bytes:
+    return ormsgpack.packb(list(typed))
+
+
+def _unpack(data: bytes) -> tuple[str, bytes]:
+    type_, value = ormsgpack.unpackb(data)
+    return type_, value
@@ -0,0 +1,37 @@
+"""
+LLM-top: Single Flight
+Объединение одновременных одинаковых запросов в одно выполнение
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    """
+    Single-flight по ключу
+
+    Первый вызов с ключом запускает выполнение отдельной задачей,
+    остальные вызовы с тем же ключом, пришедшие до завершения, ждут
+    тот же результат (или ту же ошибку). Отмена одного из ожидающих
+    (например, клиент отключился) не прерывает общее выполнение.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнить fn() или присоединиться к уже идущему выполнению"""
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        return await asyncio.shield(task)
+
+    def in_flight(self, key: str) -> bool:
+        """Есть ли выполнение по ключу"""
+        return key in self._flights
+
+    def __len__(self) -> int:
+        return len(self._flights)
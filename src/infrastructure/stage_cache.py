@@ -0,0 +1,116 @@
+"""
+LLM-top: Stage Cache
+Кэш результатов отдельных этапов графа (анализ, критика, синтез)
+"""
+
+import hashlib
+import json
+import time
+from datetime import timedelta
+from typing import Optional, TypeVar
+import redis.asyncio as redis
+from pydantic import BaseModel
+
+from src.config import get_settings
+from src.infrastructure.cache import LRUCache
+from src.monitoring.exporter import observe_cache
+
+T = TypeVar("T", bound=BaseModel)
+
+# RuntimeError — клиент, созданный в другом (уже закрытом) event loop
+_REDIS_ERRORS = (redis.ConnectionError, redis.TimeoutError, OSError, RuntimeError)
+
+
+class StageCache:
+    """
+    Content-addressed кэш этапов
+
+    Ключ — хэш (этап, агент, модель, версия промптов, хэши входов),
+    поэтому запись переиспользуется везде, где этап получает те же
+    входы: повтор после сбоя провайдера, перезапуск с большим
+    max_iterations, A/B варианты с общим этапом.
+
+    Два уровня: LRU в памяти процесса и Redis. Кэш не должен ломать
+    анализ: при недоступном Redis работает только L1, и Redis не
+    опрашивается `redis_retry_after` секунд.
+    """
+
+    redis_retry_after = 30.0
+
+    def __init__(self):
+        settings = get_settings()
+        self.redis = redis.from_url(settings.redis_url)
+        self.prefix = "cosilium:stage:"
+        self.ttl = timedelta(seconds=settings.stage_cache_ttl)
+        self.local = LRUCache(
+            max_entries=settings.stage_cache_l1_max_entries,
+            ttl=settings.stage_cache_ttl,
+        )
+        self._redis_down_until = 0.0
+
+    @staticmethod
+    def key(stage: str, agent: str, model: str, prompt_version: str, *inputs: str) -> str:
+        """Ключ этапа по его входам"""
+        content = json.dumps([stage, agent, model, prompt_version, *inputs], ensure_ascii=False)
+        return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+    async def get(self, key: str, model_cls: type[T]) -> Optional[T]:
+        """Получить результат этапа"""
+        value = self.local.get(key)
+        if value is None and self._redis_available():
+            try:
+                data = await self.redis.get(self.prefix + key)
+            except _REDIS_ERRORS:
+                self._mark_redis_down()
+                return None
+            if data:
+                value = model_cls.model_validate_json(data)
+                self.local.set(key, value, size=len(data))
+        observe_cache("stage", value is not None)
+        # Копия: вызывающий может менять объект (например, target_hash)
+        return value.model_copy(deep=True) if value is not None else None
+
+    async def set(self, key: str, value: BaseModel):
+        """Сохранить результат этапа"""
+        data = value.model_dump_json()
+        self.local.set(key, value.model_copy(deep=True), size=len(data))
+        if not self._redis_available():
+            return
+        try:
+            await self.redis.setex(self.prefix + key, self.ttl, data)
+        except _REDIS_ERRORS:
+            self._mark_redis_down()
+
+    def _redis_available(self) -> bool:
+        return time.monotonic() >= self._redis_down_until
+
+    def _mark_redis_down(self):
+        self._redis_down_until = time.monotonic() + self.redis_retry_after
+
+    async def close(self):
+        """Закрыть соединение"""
+        await self.redis.close()
+
+
+def task_hash(task: str, task_type: str = "", context: str = "") -> str:
+    """Хэш входа задачи"""
+    return hashlib.sha256(f"{task}|{task_type}|{context}".encode()).hexdigest()[:16]
+
+
+def content_hash(items: list[BaseModel], exclude: Optional[set[str]] = None) -> str:
+    """Хэш набора объектов независимо от порядка"""
+    dumps = sorted(item.model_dump_json(exclude=exclude) for item in items)
+    return hashlib.sha256("\x00".join(dumps).encode()).hexdigest()[:16]
+
+
+_stage_cache: Optional[StageCache] = None
+
+
+def get_stage_cache() -> Optional[StageCache]:
+    """Кэш этапов процесса (None, если отключён)"""
+    global _stage_cache
+    if not get_settings().stage_cache_enabled:
+        return None
+    if _stage_cache is None:
+        _stage_cache = StageCache()
+    return _stage_cache
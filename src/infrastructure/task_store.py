@@ -0,0 +1,399 @@
+"""
+LLM-top: Task Store
+Реестр задач /analyze/async с TTL, событиями прогресса и выборкой полей результата
+"""
+
+import asyncio
+import json
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Optional
+from uuid import UUID
+import redis.asyncio as redis
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from src.config import get_settings
+
+
+# События, после которых задача больше не меняется
+FINAL_EVENTS = ("completed", "failed")
+
+Event = tuple[str, str, dict]  # (id, kind, data)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class TaskStore(ABC):
+    """
+    Реестр задач
+
+    Задача — метаданные (статус, вход, ошибка, текущий этап) и результат,
+    хранимый по полям CosiliumOutput: `get(task_id, fields=[...])` читает
+    только нужные поля, не весь результат. Изменения задачи публикуются
+    как события (`status`, `node`, `completed`, `failed`), которые
+    `read_events` отдаёт начиная с курсора, ожидая новых до timeout.
+    """
+
+    @abstractmethod
+    async def create(self, task_id: str, input_data: dict):
+        pass
+
+    @abstractmethod
+    async def update(self, task_id: str, **fields: Any):
+        """Обновить метаданные; смена статуса публикует событие status/failed"""
+        pass
+
+    @abstractmethod
+    async def set_result(self, task_id: str, result: dict):
+        """Сохранить результат и завершить задачу"""
+        pass
+
+    @abstractmethod
+    async def get(
+        self,
+        task_id: str,
+        fields: Optional[list[str]] = None,
+        include_result: bool = True,
+    ) -> Optional[dict]:
+        """Задача с результатом (только fields, если заданы) или None"""
+        pass
+
+    @abstractmethod
+    async def publish(self, task_id: str, kind: str, data: dict):
+        pass
+
+    @abstractmethod
+    async def read_events(self, task_id: str, after: str = "0", timeout: float = 0) -> list[Event]:
+        """События после курсора after (ожидание не дольше timeout секунд)"""
+        pass
+
+    @abstractmethod
+    async def count_active(self) -> int:
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryTaskStore(TaskStore):
+    """Реестр в памяти процесса (один uvicorn worker, тесты)"""
+
+    def __init__(self, ttl: int = 86400, max_events: int = 1000):
+        self.ttl = ttl
+        self.max_events = max_events
+        self._tasks: dict[str, dict] = {}
+        self._results: dict[str, dict] = {}
+        self._events: dict[str, list[Event]] = {}
+        self._expires: dict[str, float] = {}
+        # Ожидающие read_events: событие срабатывает при publish и заменяется новым
+        self._signals: dict[str, asyncio.Event] = {}
+        self._seq = 0
+
+    def _touch(self, task_id: str):
+        self._expires[task_id] = time.monotonic() + self.ttl
+
+    def _evict(self):
+        now = time.monotonic()
+        for task_id in [t for t, expires in self._expires.items() if expires <= now]:
+            for storage in (self._tasks, self._results, self._events, self._expires):
+                storage.pop(task_id, None)
+            self._wake(task_id)
+
+    def _wake(self, task_id: str):
+        signal = self._signals.pop(task_id, None)
+        if signal is not None:
+            signal.set()
+
+    async def create(self, task_id: str, input_data: dict):
+        self._evict()
+        now = _now()
+        self._tasks[task_id] = {
+            "task_id": task_id,
+            "status": "pending",
+            "input": input_data,
+            "error": None,
+            "stage": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._events[task_id] = []
+        self._touch(task_id)
+        await self.publish(task_id, "status", {"status": "pending"})
+
+    async def update(self, task_id: str, **fields: Any):
+        task = self._tasks.get(task_id)
+        if task is None:
+            return
+        task.update(fields, updated_at=_now())
+        self._touch(task_id)
+        if "status" in fields:
+            kind = "failed" if fields["status"] == "failed" else "status"
+            await self.publish(task_id, kind, {"status": fields["status"], "error": fields.get("error")})
+
+    async def set_result(self, task_id: str, result: dict):
+        if task_id not in self._tasks:
+            return
+        self._results[task_id] = result
+        self._tasks[task_id].update(status="completed", updated_at=_now())
+        self._touch(task_id)
+        await self.publish(task_id, "completed", {"status": "completed", "fields": list(result)})
+
+    async def get(
+        self,
+        task_id: str,
+        fields: Optional[list[str]] = None,
+        include_result: bool = True,
+    ) -> Optional[dict]:
+        self._evict()
+        task = self._tasks.get(task_id)
+        if task is None:
+            return None
+        data = dict(task)
+        if include_result:
+            result = self._results.get(task_id) if task["status"] == "completed" else None
+            if result is not None and fields:
+                result = {name: result[name] for name in fields if name in result}
+            data["result"] = result
+        return data
+
+    async def publish(self, task_id: str, kind: str, data: dict):
+        events = self._events.get(task_id)
+        if events is None:
+            return
+        if kind == "node":
+            self._tasks[task_id]["stage"] = data["node"]
+        self._seq += 1
+        events.append((str(self._seq), kind, data))
+        del events[:-self.max_events]
+        self._wake(task_id)
+
+    async def read_events(self, task_id: str, after: str = "0", timeout: float = 0) -> list[Event]:
+        deadline = time.monotonic() + timeout
+        while True:
+            if task_id not in self._events:
+                return []
+            events = [e for e in self._events[task_id] if int(e[0]) > int(after)]
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            # Ждём publish, а не опрашиваем список
+            signal = self._signals.setdefault(task_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(signal.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def count_active(self) -> int:
+        self._evict()
+        return sum(1 for task in self._tasks.values() if task["status"] == "running")
+
+    def clear(self):
+        for storage in (self._tasks, self._results, self._events, self._expires):
+            storage.clear()
+        for task_id in list(self._signals):
+            self._wake(task_id)
+
+
+class RedisTaskStore(TaskStore):
+    """
+    Реестр в Redis, общий для всех uvicorn workers
+
+    Ключи задачи (TTL обновляется при каждой записи):
+    - `task:{id}`        HASH метаданных (значения — JSON)
+    - `task:{id}:result` HASH полей результата (HMGET для выборки полей)
+    - `task:{id}:events` STREAM событий (XREAD BLOCK для ожидания)
+    - `tasks:running`    ZSET выполняющихся задач (для /health)
+    """
+
+    def __init__(self, client: Optional[redis.Redis] = None, ttl: int = 86400, max_events: int = 1000):
+        self.redis = client or redis.from_url(get_settings().redis_url, decode_responses=True)
+        self.prefix = "cosilium:"
+        self.ttl = ttl
+        self.max_events = max_events
+
+    def _key(self, task_id: str, suffix: str = "") -> str:
+        return f"{self.prefix}task:{task_id}{':' + suffix if suffix else ''}"
+
+    def _expire(self, pipe, task_id: str):
+        for suffix in ("", "result", "events"):
+            pipe.expire(self._key(task_id, suffix), self.ttl)
+
+    def _xadd(self, pipe, task_id: str, kind: str, data: dict):
+        pipe.xadd(
+            self._key(task_id, "events"),
+            {"kind": kind, "data": json.dumps(data, ensure_ascii=False, default=str)},
+            maxlen=self.max_events,
+            approximate=True,
+        )
+
+    async def create(self, task_id: str, input_data: dict):
+        now = _now()
+        meta = {
+            "task_id": task_id,
+            "status": "pending",
+            "input": input_data,
+            "error": None,
+            "stage": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(task_id), mapping=_dump_fields(meta))
+            self._xadd(pipe, task_id, "status", {"status": "pending"})
+            self._expire(pipe, task_id)
+            await pipe.execute()
+
+    async def update(self, task_id: str, **fields: Any):
+        key = self._key(task_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            # Не воскрешаем задачу, вытесненную по TTL
+            pipe.exists(key)
+            pipe.hset(key, mapping=_dump_fields({**fields, "updated_at": _now()}))
+            if "status" in fields:
+                status = fields["status"]
+                kind = "failed" if status == "failed" else "status"
+                self._xadd(pipe, task_id, kind, {"status": status, "error": fields.get("error")})
+                running = f"{self.prefix}tasks:running"
+                if status == "running":
+                    pipe.zadd(running, {task_id: time.time()})
+                else:
+                    pipe.zrem(running, task_id)
+            self._expire(pipe, task_id)
+            exists, *_ = await pipe.execute()
+        if not exists:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(key, self._key(task_id, "events"))
+                pipe.zrem(f"{self.prefix}tasks:running", task_id)
+                await pipe.execute()
+
+    async def set_result(self, task_id: str, result: dict):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(task_id, "result"), mapping=_dump_fields(result))
+            pipe.hset(self._key(task_id), mapping=_dump_fields({"status": "completed", "updated_at": _now()}))
+            pipe.zrem(f"{self.prefix}tasks:running", task_id)
+            self._xadd(pipe, task_id, "completed", {"status": "completed", "fields": list(result)})
+            self._expire(pipe, task_id)
+            await pipe.execute()
+
+    async def get(
+        self,
+        task_id: str,
+        fields: Optional[list[str]] = None,
+        include_result: bool = True,
+    ) -> Optional[dict]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._key(task_id))
+            if include_result:
+                result_key = self._key(task_id, "result")
+                pipe.hmget(result_key, fields) if fields else pipe.hgetall(result_key)
+            replies = await pipe.execute()
+
+        if not replies[0]:
+            return None
+        data = _load_fields(replies[0])
+        if include_result:
+            raw = replies[1]
+            if fields:
+                raw = {name: value for name, value in zip(fields, raw) if value is not None}
+            data["result"] = _load_fields(raw) if data["status"] == "completed" else None
+        return data
+
+    async def publish(self, task_id: str, kind: str, data: dict):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if kind == "node":
+                pipe.hset(self._key(task_id), "stage", json.dumps(data["node"]))
+            self._xadd(pipe, task_id, kind, data)
+            await pipe.execute()
+
+    async def read_events(self, task_id: str, after: str = "0", timeout: float = 0) -> list[Event]:
+        block = int(timeout * 1000) if timeout > 0 else None
+        reply = await self.redis.xread({self._key(task_id, "events"): after}, block=block)
+        events = []
+        for _, entries in reply or []:
+            for event_id, values in entries:
+                events.append((event_id, values["kind"], json.loads(values["data"])))
+        return events
+
+    async def count_active(self) -> int:
+        # Записи упавших процессов не висят дольше TTL
+        running = f"{self.prefix}tasks:running"
+        await self.redis.zremrangebyscore(running, "-inf", time.time() - self.ttl)
+        return await self.redis.zcard(running)
+
+    async def close(self):
+        await self.redis.close()
+
+
+def _dump_fields(values: dict) -> dict[str, str]:
+    return {name: json.dumps(value, ensure_ascii=False, default=str) for name, value in values.items()}
+
+
+def _load_fields(values: dict[str, str]) -> dict:
+    return {name: json.loads(value) for name, value in values.items()}
+
+
+class TaskProgressHandler(AsyncCallbackHandler):
+    """
+    Публикация завершения нод графа как событий `node` задач
+
+    task_ids — живое множество: к одному выполнению графа (single-flight)
+    могут присоединиться несколько задач /analyze/async.
+    """
+
+    run_inline = True
+
+    def __init__(self, store: TaskStore, task_ids: set[str]):
+        self.store = store
+        self.task_ids = task_ids
+        self._nodes: dict[UUID, str] = {}
+
+    async def on_chain_start(self, serialized: Any, inputs: Any, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs: Any):
+        name = kwargs.get("name")
+        if metadata and name and metadata.get("langgraph_node") == name:
+            self._nodes[run_id] = name
+
+    async def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any):
+        node = self._nodes.pop(run_id, None)
+        if node is None:
+            return
+        data = {"node": node, **_summarize(outputs)}
+        await asyncio.gather(
+            *(self.store.publish(task_id, "node", data) for task_id in list(self.task_ids)),
+            return_exceptions=True,
+        )
+
+    async def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._nodes.pop(run_id, None)
+
+
+def _summarize(outputs: Any) -> dict:
+    """Краткое содержимое обновления ноды: числа, флаги и размеры списков"""
+    if not isinstance(outputs, dict):
+        return {}
+    summary = {}
+    for name, value in outputs.items():
+        if isinstance(value, (bool, int, float)) or value is None:
+            summary[name] = value
+        elif isinstance(value, list):
+            summary[name] = len(value)
+        elif hasattr(value, "consensus_level"):
+            summary["consensus_level"] = value.consensus_level
+    return summary
+
+
+_task_store: Optional[TaskStore] = None
+
+
+def get_task_store() -> TaskStore:
+    """Реестр задач процесса (backend — task_store_backend)"""
+    global _task_store
+    if _task_store is None:
+        settings = get_settings()
+        if settings.task_store_backend == "redis":
+            _task_store = RedisTaskStore(ttl=settings.task_ttl)
+        else:
+            _task_store = MemoryTaskStore(ttl=settings.task_ttl)
+    return _task_store
@@ -0,0 +1,238 @@
+"""
+LLM-top: Vector Index
+IVF индекс embedding'ов для семантического кэша
+"""
+
+import math
+import time
+from typing import Optional
+import numpy as np
+
+
+class _InvertedList:
+    """Список IVF: непрерывная float32 матрица векторов одного кластера"""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.expires = np.empty(capacity, dtype=np.float64)
+        self.keys: list[str] = []
+
+    @property
+    def size(self) -> int:
+        return len(self.keys)
+
+    def append(self, key: str, vector: np.ndarray, expires_at: float) -> int:
+        pos = self.size
+        if pos == len(self.vectors):
+            # Удвоение ёмкости: амортизированно O(1) на вставку
+            self.vectors = np.resize(self.vectors, (pos * 2, self.vectors.shape[1]))
+            self.expires = np.resize(self.expires, pos * 2)
+        self.vectors[pos] = vector
+        self.expires[pos] = expires_at
+        self.keys.append(key)
+        return pos
+
+    def remove(self, pos: int) -> Optional[str]:
+        """Удалить строку (на её место встаёт последняя); вернуть ключ перемещённой"""
+        last = self.size - 1
+        moved = None
+        if pos != last:
+            self.vectors[pos] = self.vectors[last]
+            self.expires[pos] = self.expires[last]
+            self.keys[pos] = self.keys[last]
+            moved = self.keys[pos]
+        self.keys.pop()
+        return moved
+
+    def scores(self, queries: np.ndarray, now: float) -> np.ndarray:
+        """Косинусное сходство (m, size); истёкшие строки = -inf"""
+        scores = queries @ self.vectors[:self.size].T
+        scores[:, self.expires[:self.size] <= now] = -np.inf
+        return scores
+
+
+class VectorIndex:
+    """
+    Индекс ближайших соседей по косинусному сходству
+
+    Векторы нормализуются и хранятся в непрерывных float32 матрицах.
+    До `train_threshold` записей поиск точный (одна матрица, один matmul).
+    Дальше индекс обучает IVF: k-means разбивает векторы на ~sqrt(N)
+    кластеров, запрос сравнивается с центроидами и сканирует только
+    `nprobe` ближайших списков. Переобучение — при росте в 4 раза.
+
+    Каждая запись имеет срок жизни (expires_at, unix time): истёкшие
+    записи не возвращаются поиском и удаляются `evict_expired()`.
+    """
+
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        nprobe: int = 8,
+        train_threshold: int = 4096,
+    ):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: list[_InvertedList] = []
+        self._where: dict[str, tuple[int, int]] = {}
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._where
+
+    def add(self, key: str, vector, expires_at: float = math.inf):
+        """Добавить (или заменить) вектор"""
+        vector = self._normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        if key in self._where:
+            self.remove(key)
+
+        list_id = int(self._assign(vector[None, :])[0])
+        pos = self._lists[list_id].append(key, vector, expires_at)
+        self._where[key] = (list_id, pos)
+
+        if len(self) >= self.train_threshold and len(self) >= 4 * self._trained_size:
+            self.train()
+
+    def remove(self, key: str) -> bool:
+        """Удалить вектор по ключу"""
+        where = self._where.pop(key, None)
+        if where is None:
+            return False
+        list_id, pos = where
+        moved = self._lists[list_id].remove(pos)
+        if moved is not None:
+            self._where[moved] = (list_id, pos)
+        return True
+
+    def search(
+        self,
+        query,
+        k: int = 1,
+        threshold: float = -1.0,
+        now: Optional[float] = None,
+    ) -> list[tuple[str, float]]:
+        """Найти k ближайших к запросу: [(key, similarity)] по убыванию"""
+        return self.search_batch(np.asarray(query).reshape(1, -1), k, threshold, now)[0]
+
+    def search_batch(
+        self,
+        queries,
+        k: int = 1,
+        threshold: float = -1.0,
+        now: Optional[float] = None,
+    ) -> list[list[tuple[str, float]]]:
+        """
+        Поиск для пачки запросов (m, d)
+
+        Для каждого списка IVF считается один matmul по всем запросам,
+        которые его зондируют.
+        """
+        queries = self._normalize(np.asarray(queries, dtype=np.float32))
+        m = len(queries)
+        if not self._lists or len(self) == 0:
+            return [[] for _ in range(m)]
+
+        now = time.time() if now is None else now
+        probes = self._probe(queries)
+
+        best: list[list[tuple[float, str]]] = [[] for _ in range(m)]
+        for list_id in np.unique(probes):
+            inv = self._lists[list_id]
+            if inv.size == 0:
+                continue
+            rows = np.flatnonzero((probes == list_id).any(axis=1))
+            scores = inv.scores(queries[rows], now)
+            top = min(k, inv.size)
+            idx = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+            for row, q in enumerate(rows):
+                for i in idx[row]:
+                    score = float(scores[row, i])
+                    if score >= threshold:
+                        best[q].append((score, inv.keys[i]))
+
+        return [
+            [(key, score) for score, key in sorted(found, reverse=True)[:k]]
+            for found in best
+        ]
+
+    def evict_expired(self, now: Optional[float] = None) -> list[str]:
+        """Удалить истёкшие записи; вернуть их ключи"""
+        now = time.time() if now is None else now
+        evicted = []
+        for inv in self._lists:
+            expired = np.flatnonzero(inv.expires[:inv.size] <= now)
+            # С конца: перемещаемая на место удалённой строка уже не истёкшая
+            for pos in expired[::-1]:
+                key = inv.keys[pos]
+                self.remove(key)
+                evicted.append(key)
+        return evicted
+
+    def train(self, iterations: int = 8, seed: int = 0):
+        """Обучить (или переобучить) IVF кластеры по текущим векторам"""
+        keys, vectors, expires = self._snapshot()
+        n = len(keys)
+        nlist = max(1, int(math.sqrt(n)))
+        rng = np.random.default_rng(seed)
+
+        # Сферический k-means на выборке (~64 вектора на кластер)
+        sample = vectors[rng.choice(n, size=min(n, nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = self._normalize(sums)
+
+        self._centroids = centroids
+        self._lists = [_InvertedList(self.dim) for _ in range(nlist)]
+        self._where = {}
+        labels = self._assign(vectors)
+        for key, vector, expires_at, list_id in zip(keys, vectors, expires, labels):
+            pos = self._lists[list_id].append(key, vector, expires_at)
+            self._where[key] = (int(list_id), pos)
+        self._trained_size = n
+
+    def _snapshot(self) -> tuple[list[str], np.ndarray, np.ndarray]:
+        keys = [key for inv in self._lists for key in inv.keys]
+        vectors = np.concatenate([inv.vectors[:inv.size] for inv in self._lists])
+        expires = np.concatenate([inv.expires[:inv.size] for inv in self._lists])
+        return keys, vectors, expires
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Номер списка для каждого вектора"""
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if not self._lists:
+            self._lists = [_InvertedList(self.dim)]
+        if self._centroids is None:
+            return np.zeros(len(vectors), dtype=np.int64)
+
+        labels = np.empty(len(vectors), dtype=np.int64)
+        # Порциями, чтобы не держать (N, nlist) матрицу целиком
+        for start in range(0, len(vectors), 16384):
+            chunk = vectors[start:start + 16384]
+            labels[start:start + len(chunk)] = np.argmax(chunk @ self._centroids.T, axis=1)
+        return labels
+
+    def _probe(self, queries: np.ndarray) -> np.ndarray:
+        """Списки для сканирования: (m, nprobe)"""
+        if self._centroids is None:
+            return np.zeros((len(queries), 1), dtype=np.int64)
+        nprobe = min(self.nprobe, len(self._centroids))
+        scores = queries @ self._centroids.T
+        return np.argpartition(-scores, nprobe - 1, axis=1)[:, :nprobe]
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        if self.dim is not None and vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected dimension {self.dim}, got {vectors.shape[1]}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32, copy=False)
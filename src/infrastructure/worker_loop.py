@@ -0,0 +1,100 @@
+"""
+LLM-top: Worker Event Loop
+Долгоживущий event loop процесса воркера для sync-контекстов (Celery)
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Optional
+
+
+class WorkerLoop:
+    """
+    Event loop в отдельном потоке, общий для всех задач процесса
+
+    Задачи Celery синхронные: `run()` отправляет корутину в loop и ждёт
+    результата в потоке задачи. Loop, LLM клиенты пула, Redis клиенты и
+    снимок промптов живут всё время работы процесса, а не одну задачу.
+    Одновременно выполняется не больше `max_concurrency` корутин,
+    остальные ждут на семафоре внутри loop.
+
+    Поток создаётся при первом вызове, поэтому объект безопасно
+    создавать до fork (prefork pool).
+    """
+
+    def __init__(self, max_concurrency: int = 32, timeout: Optional[float] = None):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self.active = 0
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None and self._loop.is_running()
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Запустить loop (если ещё не запущен)"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._serve, args=(loop, started), name="cosilium-worker-loop", daemon=True
+                )
+                self._thread.start()
+                started.wait()
+                self._loop = loop
+        return self._loop
+
+    def _serve(self, loop: asyncio.AbstractEventLoop, started: threading.Event):
+        asyncio.set_event_loop(loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        loop.call_soon(started.set)
+        loop.run_forever()
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """Выполнить корутину в loop воркера и дождаться результата"""
+        loop = self.start()
+        future = asyncio.run_coroutine_threadsafe(self._limited(coro, timeout or self.timeout), loop)
+        try:
+            return future.result()
+        except BaseException:
+            # Time limit или отзыв задачи прерывают поток — отменяем и корутину
+            future.cancel()
+            raise
+
+    async def _limited(self, coro: Awaitable, timeout: Optional[float]) -> Any:
+        async with self._semaphore:
+            self.active += 1
+            try:
+                return await asyncio.wait_for(coro, timeout)
+            finally:
+                self.active -= 1
+
+    def stop(self, timeout: float = 10.0):
+        """Закрыть соединения процесса и остановить loop"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None or loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(_close_process_resources(), loop).result(timeout)
+        except Exception:
+            pass  # Не мешаем остановке воркера
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout)
+        loop.close()
+
+
+async def _close_process_resources():
+    """Отправить счётчики и телеметрию, закрыть HTTP клиенты loop"""
+    from src.agents.llm_pool import get_llm_pool
+    from src.monitoring.llm_calls import get_telemetry_sink
+    from src.prompts.agent_prompts import close_prompts
+
+    await close_prompts()
+    await get_telemetry_sink().flush()
+    await get_llm_pool().aclose_loop()
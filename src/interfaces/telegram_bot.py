@@ -269,7 +269,9 @@ class CosiliumBot:
                         "task": session.current_task,
                         "task_type": session.task_type,
                         "max_iterations": 2
-                    }
+                    },
+                    # Пользователь ждёт ответа: вызовы идут впереди пакетных
+                    headers={"X-Priority": "interactive", "X-Tenant-ID": f"telegram:{chat_id}"},
                 )
 
                 if response.status_code != 200:
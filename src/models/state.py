@@ -3,8 +3,9 @@ LLM-top: State Models
 Модели состояния для LangGraph
 """
 
-from typing import TypedDict, Annotated, Literal, Optional
-from pydantic import BaseModel, Field
+import hashlib
+from typing import TypedDict, Annotated, Literal, Optional, NotRequired
+from pydantic import BaseModel, Field, PrivateAttr
 from operator import add
 
 
@@ -16,6 +17,13 @@ class AgentAnalysis(BaseModel):
     key_points: list[str] = []
     risks: list[str] = []
     assumptions: list[str] = []
+    # Запасная модель, если ответил hedge-запрос (не сериализуется, см. src/agents/hedging.py)
+    _hedge_model: Optional[str] = PrivateAttr(default=None)
+
+    def content_hash(self) -> str:
+        """Хэш содержимого анализа (для переиспользования критики)"""
+        content = f"{self.agent_name}|{self.analysis}"
+        return hashlib.sha256(content.encode()).hexdigest()[:16]
 
 
 class AgentCritique(BaseModel):
@@ -27,6 +35,55 @@ class AgentCritique(BaseModel):
     weaknesses: list[str] = []
     strengths: list[str] = []
     suggestions: list[str] = []
+    target_hash: Optional[str] = None  # content_hash() анализа на момент критики
+
+
+class CritiqueStats(BaseModel):
+    """Стоимость одного раунда критики"""
+    iteration: int
+    topology: str
+    calls: int
+    input_tokens: int = 0
+    output_tokens: int = 0
+    critiques: int = 0
+    reused: int = 0  # Критики из прошлой итерации или кэша этапов (без вызова LLM)
+
+
+class ConsensusStats(BaseModel):
+    """Проверка согласия анализов перед критикой и её экономия (src/graph/consensus.py)"""
+    iteration: int
+    decision: Literal["full", "reduced", "skip"]
+    agreement: float  # Среднее попарное согласие
+    min_agreement: float
+    matrix: list[list[float]] = []  # Попарное согласие в порядке analyses
+    topology: str  # Топология, с которой пойдёт критика ("" — пропущена)
+    planned_calls: int = 0  # Вызовов критики без проверки
+    saved_calls: int = 0
+    saved_tokens: int = 0  # Оценка токенов промптов несделанных вызовов
+    saved_seconds: float = 0  # Оценка по средней длительности раундов критики
+    elapsed: float = 0  # Длительность проверки, секунд
+
+
+class IterationMetrics(BaseModel):
+    """Метрики раунда адаптивных итераций (src/graph/iterative.py)"""
+    iteration_number: int
+    consensus_level: float
+    avg_critique_score: float
+    disagreement_count: int
+    improvement_delta: float = 0.0  # Изменение качества от прошлой итерации
+    weak_areas: list[str] = []
+    reason: str = ""  # Почему продолжили или остановились
+
+
+class PromptBudgetStats(BaseModel):
+    """Токены промптов этапа до и после бюджета (src/agents/budget.py)"""
+    iteration: int = 0
+    stage: str
+    prompts: int = 0
+    original_tokens: int = 0
+    final_tokens: int = 0
+    saved_tokens: int = 0
+    deduplicated: int = 0  # Повторяющихся слабостей убрано
 
 
 class SynthesisResult(BaseModel):
@@ -39,12 +96,33 @@ class SynthesisResult(BaseModel):
     dissenting_opinions: list[str] = []
 
 
+def merge_analyses(
+    existing: list[AgentAnalysis],
+    new: list[AgentAnalysis],
+) -> list[AgentAnalysis]:
+    """Reducer: новый анализ агента заменяет предыдущий"""
+    merged = {a.agent_name: a for a in existing}
+    merged.update({a.agent_name: a for a in new})
+    return list(merged.values())
+
+
+def merge_critiques(
+    existing: list[AgentCritique],
+    new: list[AgentCritique],
+) -> list[AgentCritique]:
+    """Reducer: новая критика пары (критик, цель) заменяет устаревшую"""
+    merged = {(c.critic_name, c.target_name): c for c in existing}
+    merged.update({(c.critic_name, c.target_name): c for c in new})
+    return list(merged.values())
+
+
 class CosiliumState(TypedDict):
     """
     Состояние графа Cosilium
 
     Аннотация `add` означает, что новые элементы добавляются к списку,
-    а не заменяют его
+    а не заменяют его. `merge_analyses`/`merge_critiques` заменяют
+    устаревшие записи того же агента или пары агентов.
     """
     # Входные данные
     task: str
@@ -52,10 +130,16 @@ class CosiliumState(TypedDict):
     context: str
 
     # Итерация 1: Независимый анализ
-    analyses: Annotated[list[AgentAnalysis], add]
+    analyses: Annotated[list[AgentAnalysis], merge_analyses]
 
     # Итерация 2: Adversarial mode
-    critiques: Annotated[list[AgentCritique], add]
+    critiques: Annotated[list[AgentCritique], merge_critiques]
+    critique_topology: NotRequired[Optional[str]]
+    critique_stats: NotRequired[Annotated[list[CritiqueStats], add]]
+    budget_stats: NotRequired[Annotated[list[PromptBudgetStats], add]]
+    critique_mode: NotRequired[Optional[Literal["full", "reduced", "skip"]]]
+    consensus_stats: NotRequired[Annotated[list[ConsensusStats], add]]
+    iteration_metrics: NotRequired[Annotated[list[IterationMetrics], add]]
 
     # Итерация 3: Синтез
     synthesis: Optional[SynthesisResult]
@@ -73,6 +157,7 @@ class TaskInput(BaseModel):
     task_type: Literal["strategy", "research", "investment", "development", "audit"] = "research"
     context: str = Field(default="", description="Дополнительный контекст")
     max_iterations: int = Field(default=3, ge=1, le=5)
+    critique_topology: Optional[Literal["full_mesh", "ring", "single_critic", "batched"]] = None
 
 
 class CosiliumOutput(BaseModel):
@@ -82,3 +167,42 @@ class CosiliumOutput(BaseModel):
     critiques: list[AgentCritique]
     synthesis: SynthesisResult
     iterations_used: int
+    critique_stats: list[CritiqueStats] = []
+    budget_stats: list[PromptBudgetStats] = []
+    consensus_stats: list[ConsensusStats] = []
+    iteration_metrics: list[IterationMetrics] = []
+
+
+class BatchInput(BaseModel):
+    """Пакет задач для /analyze/batch"""
+    items: list[TaskInput] = Field(..., min_length=1)
+
+
+class BatchItemResult(BaseModel):
+    """Результат одной задачи пакета"""
+    index: int  # Позиция во входном пакете
+    status: Literal["completed", "failed"]
+    result: Optional[CosiliumOutput] = None
+    error: Optional[str] = None
+    duplicate_of: Optional[int] = None  # Задача с тем же входом, чей результат переиспользован
+    elapsed: float = 0  # Секунд от начала пакета до завершения
+
+
+class ProviderThroughput(BaseModel):
+    """Загрузка провайдера за пакет"""
+    provider: str
+    concurrency: int  # Бюджет одновременных вызовов
+    calls: int = 0
+    busy: float = 0  # Сумма длительностей вызовов, секунд
+    utilization: float = 0  # busy / (concurrency × makespan)
+
+
+class BatchStats(BaseModel):
+    """Итог пакета"""
+    items: int
+    unique: int  # Задач после дедупликации
+    completed: int = 0
+    failed: int = 0
+    makespan: float = 0  # Секунд от начала до последней задачи
+    items_per_minute: float = 0
+    providers: list[ProviderThroughput] = []
@@ -0,0 +1,397 @@
+"""
+LLM-top: Metrics Exporter
+In-process счётчики и гистограммы в формате Prometheus
+"""
+
+import asyncio
+import functools
+import inspect
+import math
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Optional, Union
+
+
+# Секунды: от быстрых нод/кэша до долгих LLM вызовов
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+# ============================================================
+# Метрики
+# ============================================================
+#
+# Наблюдения не берут блокировок: все они происходят в потоке event
+# loop (ноды графа, callbacks LLM, кэши), а += над атрибутом объекта
+# дешевле любой синхронизации. Наблюдение из пула потоков в худшем
+# случае теряет единичный инкремент, что для мониторинга допустимо.
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Последний — +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+
+    @abstractmethod
+    def render(self) -> list[str]:
+        pass
+
+    def _header(self, name: Optional[str] = None) -> list[str]:
+        name = name or self.name
+        return [
+            f"# HELP {name} {self.documentation}",
+            f"# TYPE {name} {self.kind}",
+        ]
+
+    def _labels_text(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _SeriesMetric(_Metric):
+    """Метрика с сериями по меткам, накапливаемыми в процессе"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._children: dict[tuple, object] = {}
+
+    @abstractmethod
+    def _new_child(self):
+        pass
+
+    def labels(self, *values: str):
+        """Серия с заданными значениями меток (создаётся при первом обращении)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+
+class Counter(_SeriesMetric):
+    """Монотонный счётчик"""
+
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.labels(*labels).inc(amount)
+
+    def render(self) -> list[str]:
+        # Формат 0.0.4: метаданные под именем сэмплов (как у prometheus_client)
+        name = f"{self.name}_total"
+        lines = self._header(name)
+        for values, child in list(self._children.items()):
+            lines.append(f"{name}{self._labels_text(values)} {_number(child.value)}")
+        return lines
+
+
+class Histogram(_SeriesMetric):
+    """Гистограмма с фиксированными границами корзин"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float, *labels: str):
+        self.labels(*labels).observe(value)
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            counts = list(child.counts)
+            cumulative = 0
+            for bound, count in zip((*self.bounds, math.inf), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == math.inf else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{self._labels_text(values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels_text(values)} {_number(child.sum)}")
+            lines.append(f"{self.name}_count{self._labels_text(values)} {cumulative}")
+        return lines
+
+
+GaugeValue = Union[float, dict[tuple, float]]
+
+
+class Gauge(_Metric):
+    """Текущее значение, вычисляемое при сборе (`fn()` → число или {метки: число})"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        fn: Callable[[], GaugeValue],
+        labels: tuple[str, ...] = (),
+    ):
+        super().__init__(name, documentation, labels)
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        series = value if isinstance(value, dict) else {(): value}
+        lines = self._header()
+        for values, number in series.items():
+            lines.append(f"{self.name}{self._labels_text(values)} {_number(number)}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        fn: Callable[[], GaugeValue],
+        labels: tuple[str, ...] = (),
+    ) -> Gauge:
+        """Зарегистрировать (или заменить) gauge"""
+        self._metrics[name] = Gauge(name, documentation, fn, labels)
+        return self._metrics[name]
+
+    def render(self) -> str:
+        """Текст в формате Prometheus exposition 0.0.4"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+# ============================================================
+# Метрики LLM-top
+# ============================================================
+
+REGISTRY = Registry()
+
+NODE_DURATION = REGISTRY.histogram(
+    "cosilium_node_duration_seconds",
+    "Duration of LangGraph node execution",
+    ("node",),
+)
+LLM_LATENCY = REGISTRY.histogram(
+    "cosilium_llm_latency_seconds",
+    "Total latency of LLM calls",
+    ("provider", "model", "stage"),
+)
+LLM_TTFT = REGISTRY.histogram(
+    "cosilium_llm_ttft_seconds",
+    "Time to first token of streaming LLM calls",
+    ("provider", "model"),
+)
+LLM_CALLS = REGISTRY.counter(
+    "cosilium_llm_calls",
+    "LLM calls by outcome",
+    ("provider", "status"),
+)
+LLM_TOKENS = REGISTRY.counter(
+    "cosilium_llm_tokens",
+    "LLM tokens by kind (input includes cached)",
+    ("provider", "model", "kind"),
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "cosilium_queue_wait_seconds",
+    "Time a task waited before execution started",
+    ("queue",),
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "cosilium_cache_requests",
+    "Cache lookups by result (hit ratio = hit / (hit + miss))",
+    ("cache", "result"),
+)
+RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "cosilium_rate_limit_wait_seconds",
+    "Time spent waiting for rate limiter admission",
+    ("provider",),
+)
+HEDGE_EVENTS = REGISTRY.counter(
+    "cosilium_hedge_events",
+    "Per-agent deadline events: hedge launched/won, hard deadline, skipped by quorum",
+    ("agent", "event"),
+)
+PROMPT_TOKENS_SAVED = REGISTRY.counter(
+    "cosilium_prompt_tokens_saved",
+    "Prompt tokens removed by the critique/synthesis prompt budget",
+    ("stage",),
+)
+CONSENSUS_AGREEMENT = REGISTRY.histogram(
+    "cosilium_consensus_agreement",
+    "Mean pairwise agreement of analyses before critique",
+    ("decision",),
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0),
+)
+CRITIQUE_CALLS_SAVED = REGISTRY.counter(
+    "cosilium_critique_calls_saved",
+    "Critique LLM calls skipped by the consensus pre-check",
+    ("decision",),
+)
+ITERATION_DECISIONS = REGISTRY.counter(
+    "cosilium_iteration_decisions",
+    "Adaptive iteration continue/stop decisions by reason",
+    ("reason",),
+)
+ADMISSION_WAIT = REGISTRY.histogram(
+    "cosilium_admission_wait_seconds",
+    "Time LLM calls waited for an admission slot",
+    ("priority",),
+)
+ADMISSION_PREEMPTED = REGISTRY.counter(
+    "cosilium_admission_preempted",
+    "Queued batch LLM calls overtaken by interactive or standard calls",
+    ("provider",),
+)
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "cosilium_event_loop_lag_seconds",
+    "Event loop scheduling lag",
+    buckets=LAG_BUCKETS,
+)
+
+
+def timed_node(name: str, fn: Callable) -> Callable:
+    """Нода графа с замером длительности в NODE_DURATION"""
+    child = NODE_DURATION.labels(name)
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_node(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return async_node
+
+    @functools.wraps(fn)
+    def node(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - start)
+    return node
+
+
+def observe_cache(cache: str, hit: bool):
+    """Учесть обращение к кэшу"""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def observe_llm_call(record):
+    """Учесть LLM вызов (LLMCallRecord телеметрии)"""
+    provider = record.provider or "unknown"
+    LLM_CALLS.labels(provider, "error" if record.error else "ok").inc()
+    if record.error:
+        return
+    LLM_LATENCY.labels(provider, record.model, record.stage).observe(record.latency_ms / 1000)
+    if record.ttft_ms is not None:
+        LLM_TTFT.labels(provider, record.model).observe(record.ttft_ms / 1000)
+    LLM_TOKENS.labels(provider, record.model, "input").inc(record.input_tokens)
+    LLM_TOKENS.labels(provider, record.model, "output").inc(record.output_tokens)
+    if record.cached_tokens:
+        LLM_TOKENS.labels(provider, record.model, "cached").inc(record.cached_tokens)
+
+
+class LoopLagMonitor:
+    """Фоновая задача: задержка пробуждения event loop в EVENT_LOOP_LAG"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - start - self.interval))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
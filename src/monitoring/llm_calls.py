@@ -0,0 +1,275 @@
+"""
+LLM-top: LLM Call Telemetry
+Латентность, токены и стоимость каждого LLM вызова
+"""
+
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional
+from uuid import UUID
+from pydantic import BaseModel, Field
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from src.config import get_settings
+from src.monitoring.exporter import observe_llm_call
+
+
+class LLMCallRecord(BaseModel):
+    """Один LLM вызов"""
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    task_id: str = ""
+    agent: str = ""
+    stage: str = ""  # analysis, critique, synthesis
+    iteration: int = 0
+    provider: str = ""
+    model: str = ""
+    input_tokens: int = 0  # Включая cached_tokens
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    ttft_ms: Optional[float] = None  # Только для streaming вызовов
+    latency_ms: float = 0
+    error: Optional[str] = None
+
+
+Consumer = Callable[[list[LLMCallRecord]], Awaitable[None]]
+
+
+class TelemetrySink:
+    """
+    Буфер записей с пакетной отправкой потребителям
+
+    `submit()` только добавляет запись в очередь: на пути LLM вызова нет
+    ни await, ни сетевых операций. Фоновая задача раз в `flush_interval`
+    (или при накоплении `batch_size` записей) отдаёт пачку каждому
+    потребителю. Ошибка потребителя не влияет на остальных.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 1.0,
+        batch_size: int = 200,
+        max_buffer: int = 10000,
+    ):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # При недоступных потребителях старые записи вытесняются
+        self._buffer: deque[LLMCallRecord] = deque(maxlen=max_buffer)
+        self._consumers: list[Consumer] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def add_consumer(self, consumer: Consumer):
+        self._consumers.append(consumer)
+
+    def submit(self, record: LLMCallRecord):
+        """Поставить запись в очередь (без ожидания)"""
+        self._buffer.append(record)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Вне event loop — отправится при следующем flush
+
+        if self._flusher is None or self._flusher.done() or self._flusher.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._flusher = loop.create_task(self._run())
+        elif len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        # Задача завершается, когда буфер пуст: без нагрузки нет фоновой работы
+        while self._buffer:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Отправить накопленные записи"""
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            await asyncio.gather(
+                *(consumer(batch) for consumer in self._consumers),
+                return_exceptions=True,
+            )
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+
+class LLMCallHandler(BaseCallbackHandler):
+    """
+    LangChain callback: замер каждого вызова chat-модели
+
+    Агент, этап, провайдер и итерация берутся из metadata вызова
+    (см. `invoke_llm`), модель — из `ls_model_name`, task_id — из
+    thread_id графа. Токены — из usage_metadata ответа. Латентность и
+    токены сразу попадают в метрики /metrics, остальное — через sink.
+    """
+
+    run_inline = True
+
+    def __init__(self, sink: TelemetrySink):
+        self.sink = sink
+        self._calls: dict[UUID, dict] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized: dict,
+        messages: list,
+        *,
+        run_id: UUID,
+        metadata: Optional[dict] = None,
+        **kwargs: Any,
+    ):
+        metadata = metadata or {}
+        self._calls[run_id] = {
+            "start": time.perf_counter(),
+            "first_token": None,
+            "task_id": str(metadata.get("thread_id", "")),
+            "agent": metadata.get("cosilium_agent", ""),
+            "stage": metadata.get("cosilium_stage", ""),
+            "iteration": metadata.get("cosilium_iteration", 0),
+            "provider": metadata.get("cosilium_provider") or metadata.get("ls_provider", ""),
+            "model": metadata.get("ls_model_name", ""),
+        }
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        call = self._calls.get(run_id)
+        if call is not None and call["first_token"] is None and token:
+            call["first_token"] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+        record = self._record(call, **_usage(response))
+        observe_llm_call(record)
+        self.sink.submit(record)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+        record = self._record(call, error=f"{type(error).__name__}: {error}"[:500])
+        observe_llm_call(record)
+        self.sink.submit(record)
+
+    def _record(self, call: dict, **fields: Any) -> LLMCallRecord:
+        now = time.perf_counter()
+        first_token = call["first_token"]
+        return LLMCallRecord(
+            task_id=call["task_id"],
+            agent=call["agent"],
+            stage=call["stage"],
+            iteration=call["iteration"],
+            provider=call["provider"],
+            model=call["model"],
+            ttft_ms=(first_token - call["start"]) * 1000 if first_token else None,
+            latency_ms=(now - call["start"]) * 1000,
+            **fields,
+        )
+
+
+def _usage(response: LLMResult) -> dict:
+    """Токены из ответа (usage_metadata сообщения или llm_output провайдера)"""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                details = metadata.get("input_token_details") or {}
+                return {
+                    "input_tokens": int(metadata.get("input_tokens", 0)),
+                    "output_tokens": int(metadata.get("output_tokens", 0)),
+                    "cached_tokens": int(details.get("cache_read", 0) or 0) or _cached_tokens(usage),
+                }
+
+    return {
+        "input_tokens": int(usage.get("prompt_tokens", 0)),
+        "output_tokens": int(usage.get("completion_tokens", 0)),
+        "cached_tokens": _cached_tokens(usage),
+    }
+
+
+def _cached_tokens(token_usage: dict) -> int:
+    """Токены префикса из кэша провайдера в token_usage (OpenAI или DeepSeek)"""
+    details = token_usage.get("prompt_tokens_details") or {}
+    return int(details.get("cached_tokens") or token_usage.get("prompt_cache_hit_tokens") or 0)
+
+
+# ============================================================
+# Потребители
+# ============================================================
+
+def _cost_consumer() -> Consumer:
+    """Стоимость и токены в CostTracker (одним pipeline на пачку)"""
+    tracker = None
+
+    async def consume(records: list[LLMCallRecord]):
+        nonlocal tracker
+        if not get_settings().llm_telemetry_cost:
+            return
+        if tracker is None:
+            from src.infrastructure.cost_tracker import CostTracker
+            tracker = CostTracker()
+        await tracker.record_calls([r for r in records if r.error is None])
+
+    return consume
+
+
+async def _selector_consumer(records: list[LLMCallRecord]):
+    """Здоровье агентов (латентность и ошибки) в AgentSelector"""
+    from src.agents.selector import get_agent_selector
+
+    selector = get_agent_selector()
+    for record in records:
+        agent = record.agent.lower()
+        if record.error is None:
+            selector.record_success(agent, record.latency_ms)
+        else:
+            selector.record_failure(agent, record.error)
+
+
+async def _tracer_consumer(records: list[LLMCallRecord]):
+    """Spans вызовов в LangSmith трейсе задачи"""
+    from src.monitoring.tracing import get_tracer
+
+    tracer = get_tracer()
+    if not tracer.enabled:
+        return
+    # Отправка RunTree синхронная — в отдельном потоке
+    await asyncio.to_thread(lambda: [tracer.record_llm_call(r) for r in records])
+
+
+_sink: Optional[TelemetrySink] = None
+_handler: Optional[LLMCallHandler] = None
+
+
+def get_telemetry_sink() -> TelemetrySink:
+    """Буфер телеметрии процесса с потребителями по умолчанию"""
+    global _sink
+    if _sink is None:
+        settings = get_settings()
+        _sink = TelemetrySink(
+            flush_interval=settings.llm_telemetry_flush_interval,
+            batch_size=settings.llm_telemetry_batch_size,
+        )
+        _sink.add_consumer(_cost_consumer())
+        _sink.add_consumer(_selector_consumer)
+        _sink.add_consumer(_tracer_consumer)
+    return _sink
+
+
+def get_llm_call_handler() -> Optional[LLMCallHandler]:
+    """Callback для LLM вызовов (None, если телеметрия отключена)"""
+    global _handler
+    if not get_settings().llm_telemetry_enabled:
+        return None
+    if _handler is None:
+        _handler = LLMCallHandler(get_telemetry_sink())
+    return _handler
@@ -5,7 +5,7 @@ LangSmith интеграция для мониторинга
 
 import os
 from typing import Optional, Any
-from datetime import datetime
+from datetime import datetime, timedelta
 from contextlib import contextmanager
 from functools import wraps
 import uuid
@@ -134,6 +134,34 @@ class CosiliumTracer:
         finally:
             child_run.post()
 
+    def record_llm_call(self, record):
+        """
+        Записать LLM вызов (LLMCallRecord телеметрии) в трейс задачи
+
+        Вызов становится дочерним span'ом активного trace_task с тем же
+        task_id; без активного трейса запись пропускается.
+        """
+        if not self.enabled or record.task_id not in self._active_runs:
+            return
+
+        child_run = self._active_runs[record.task_id].create_child(
+            name=f"{record.agent} - {record.stage}",
+            run_type="llm",
+            inputs={"iteration": record.iteration},
+            start_time=record.timestamp - timedelta(milliseconds=record.latency_ms),
+            extra={"metadata": {
+                "provider": record.provider,
+                "model": record.model,
+                "latency_ms": record.latency_ms,
+                "ttft_ms": record.ttft_ms,
+                "cached_tokens": record.cached_tokens,
+            }},
+        )
+        span = _AgentSpan(child_run)
+        span.set_tokens(record.input_tokens, record.output_tokens)
+        child_run.end(error=record.error, end_time=record.timestamp)
+        child_run.post()
+
     def log_feedback(
         self,
         run_id: str,
@@ -191,6 +219,17 @@ class CosiliumTracer:
             return {}
 
 
+_tracer: Optional[CosiliumTracer] = None
+
+
+def get_tracer() -> CosiliumTracer:
+    """Трейсер процесса"""
+    global _tracer
+    if _tracer is None:
+        _tracer = CosiliumTracer()
+    return _tracer
+
+
 class _TaskTrace:
     """Хелпер для трейсинга задачи"""
 
@@ -3,6 +3,7 @@ LLM-top: Agent Prompts
 Промпты для каждого агента с поддержкой загрузки из БД
 """
 
+import hashlib
 from typing import Optional
 from src.config import get_settings
 
@@ -58,15 +59,26 @@ ANALYSIS_SYSTEM_PROMPT = """Ты {role} в мульти-агентной ана
 [Общий уровень уверенности: X%]
 """
 
-ANALYSIS_USER_PROMPT = """Задача для анализа: {task}
+# Запросы состоят из частей от стабильных к переменным: общий префикс
+# повторных вызовов (системный промпт, задача, контекст) кэшируется
+# провайдером (см. src/agents/prompt_cache.py)
+TASK_PROMPT = """Исходная задача: {task}
+
+"""
+
+ANALYSIS_CONTEXT_PROMPT = """Задача для анализа: {task}
 
 Тип задачи: {task_type}
 
 Контекст: {context}
 
-Проведи независимый анализ этой задачи, используя свою специализацию.
 """
 
+ANALYSIS_INSTRUCTION = """Проведи независимый анализ этой задачи, используя свою специализацию.
+"""
+
+ANALYSIS_USER_PROMPT = ANALYSIS_CONTEXT_PROMPT + ANALYSIS_INSTRUCTION
+
 
 CRITIQUE_SYSTEM_PROMPT = """Ты {role} в режиме критического анализа (Adversarial Mode).
 
@@ -108,15 +120,38 @@ CRITIQUE_SYSTEM_PROMPT = """Ты {role} в режиме критического
 ## Общая оценка: X/10
 """
 
-CRITIQUE_USER_PROMPT = """Исходная задача: {task}
-
-Анализ от агента {target_name}:
+CRITIQUE_TARGET_PROMPT = """Анализ от агента {target_name}:
 
 {analysis}
 
 ---
 
-Проведи критический анализ этого ответа.
+"""
+
+CRITIQUE_INSTRUCTION = """Проведи критический анализ этого ответа.
+"""
+
+CRITIQUE_USER_PROMPT = TASK_PROMPT + CRITIQUE_TARGET_PROMPT + CRITIQUE_INSTRUCTION
+
+BATCH_CRITIQUE_TARGETS_PROMPT = """Ниже анализы нескольких агентов. Оцени КАЖДЫЙ анализ отдельно.
+
+{analyses}
+
+---
+
+"""
+
+BATCH_CRITIQUE_INSTRUCTION = """Для каждого агента дай отдельную критику в формате из инструкции.
+Каждую критику начинай с заголовка первого уровня:
+
+# Критика: <имя агента>
+"""
+
+BATCH_CRITIQUE_USER_PROMPT = TASK_PROMPT + BATCH_CRITIQUE_TARGETS_PROMPT + BATCH_CRITIQUE_INSTRUCTION
+
+BATCH_CRITIQUE_ITEM = """=== Анализ от агента {target_name} ===
+
+{analysis}
 """
 
 
@@ -188,28 +223,34 @@ SYNTHESIS_SYSTEM_PROMPT = """Ты главный интегратор систе
 - Ответ ТОЛЬКО в формате JSON (без дополнительного текста)
 """
 
-SYNTHESIS_USER_PROMPT = """Исходная задача: {task}
-
-## Анализы агентов:
+SYNTHESIS_ANALYSES_PROMPT = """## Анализы агентов:
 
 {analyses}
 
-## Критики:
+"""
+
+SYNTHESIS_CRITIQUES_PROMPT = """## Критики:
 
 {critiques}
 
 ---
 
-Синтезируй результаты в единый отчёт.
 """
 
+SYNTHESIS_INSTRUCTION = """Синтезируй результаты в единый отчёт.
+"""
+
+SYNTHESIS_USER_PROMPT = (
+    TASK_PROMPT + SYNTHESIS_ANALYSES_PROMPT + SYNTHESIS_CRITIQUES_PROMPT + SYNTHESIS_INSTRUCTION
+)
+
 
 # ============================================================
 # ФУНКЦИИ ПОЛУЧЕНИЯ ПРОМПТОВ
 # ============================================================
 
 def _load_from_db(agent_name: str, prompt_type: str) -> Optional[str]:
-    """Попытаться загрузить промпт из БД"""
+    """Промпт из снимка БД (загружается prepare_prompts, без запросов здесь)"""
     settings = get_settings()
     if not settings.enable_rag or not PROMPT_LOADER_AVAILABLE:
         return None
@@ -221,61 +262,135 @@ def _load_from_db(agent_name: str, prompt_type: str) -> Optional[str]:
         return None
 
 
-def get_analysis_prompt(agent_config: dict, task: str, task_type: str, context: str) -> tuple[str, str]:
-    """Получить промпты для анализа"""
+async def prepare_prompts():
+    """
+    Загрузить снимок промптов из БД до первого анализа
+
+    Повторные вызовы дешёвые: устаревший снимок обновляется в фоне.
+    """
+    settings = get_settings()
+    if settings.enable_rag and PROMPT_LOADER_AVAILABLE:
+        await get_prompt_loader().ensure_fresh()
+
+
+async def close_prompts():
+    """Отправить накопленные счётчики использования промптов"""
+    if PROMPT_LOADER_AVAILABLE:
+        await get_prompt_loader().close()
+
+
+def _analysis_system_prompt(agent_config: dict) -> str:
     agent_name = agent_config.get("name", "").lower()
 
     # Пробуем загрузить из БД
     db_system = _load_from_db(agent_name, "system")
-
     if db_system:
-        system = db_system
-    else:
-        # Fallback на захардкоженный промпт
-        system = ANALYSIS_SYSTEM_PROMPT.format(
-            role=agent_config["role"],
-            focus=agent_config["focus"],
-            strengths=", ".join(agent_config["strengths"]),
-        )
-
-    user = ANALYSIS_USER_PROMPT.format(
-        task=task,
-        task_type=task_type,
-        context=context or "Не предоставлен",
+        return db_system
+
+    # Fallback на захардкоженный промпт
+    return ANALYSIS_SYSTEM_PROMPT.format(
+        role=agent_config["role"],
+        focus=agent_config["focus"],
+        strengths=", ".join(agent_config["strengths"]),
     )
-    return system, user
 
 
-def get_critique_prompt(agent_config: dict, task: str, target_name: str, analysis: str) -> tuple[str, str]:
-    """Получить промпты для критики"""
+def _critique_system_prompt(agent_config: dict) -> str:
     agent_name = agent_config.get("name", "").lower()
 
     # Пробуем загрузить из БД
     db_critique = _load_from_db(agent_name, "critique")
-
     if db_critique:
-        system = db_critique
-    else:
-        system = CRITIQUE_SYSTEM_PROMPT.format(role=agent_config["role"])
+        return db_critique
 
-    user = CRITIQUE_USER_PROMPT.format(
-        task=task,
-        target_name=target_name,
-        analysis=analysis,
-    )
-    return system, user
+    return CRITIQUE_SYSTEM_PROMPT.format(role=agent_config["role"])
 
 
-def get_synthesis_prompt(task: str, analyses: str, critiques: str) -> tuple[str, str]:
-    """Получить промпты для синтеза"""
+def _synthesis_system_prompt() -> str:
     # Пробуем загрузить из БД (Claude - интегратор)
     db_synthesis = _load_from_db("claude", "synthesis")
+    return db_synthesis if db_synthesis else SYNTHESIS_SYSTEM_PROMPT
+
+
+def get_prompt_version(agent_config: Optional[dict], stage: str) -> str:
+    """
+    Версия промптов этапа: хэш системного промпта и шаблона запроса
+
+    Меняется при правке шаблонов или активации новой версии промпта в БД.
+
+    Args:
+        agent_config: Конфигурация агента (None для синтеза)
+        stage: analysis, critique, critique_batched, synthesis
+    """
+    if stage == "analysis":
+        parts = [_analysis_system_prompt(agent_config), ANALYSIS_USER_PROMPT]
+    elif stage == "critique":
+        parts = [_critique_system_prompt(agent_config), CRITIQUE_USER_PROMPT]
+    elif stage == "critique_batched":
+        parts = [
+            _critique_system_prompt(agent_config),
+            BATCH_CRITIQUE_USER_PROMPT,
+            BATCH_CRITIQUE_ITEM,
+        ]
+    elif stage == "synthesis":
+        parts = [_synthesis_system_prompt(), SYNTHESIS_USER_PROMPT]
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()[:16]
 
-    system = db_synthesis if db_synthesis else SYNTHESIS_SYSTEM_PROMPT
 
-    user = SYNTHESIS_USER_PROMPT.format(
-        task=task,
-        analyses=analyses,
-        critiques=critiques,
+def get_analysis_prompt(agent_config: dict, task: str, task_type: str, context: str) -> tuple[str, list[str]]:
+    """Получить промпты для анализа: системный и части запроса (от стабильных к переменным)"""
+    system = _analysis_system_prompt(agent_config)
+    parts = [
+        ANALYSIS_CONTEXT_PROMPT.format(
+            task=task,
+            task_type=task_type,
+            context=context or "Не предоставлен",
+        ),
+        ANALYSIS_INSTRUCTION,
+    ]
+    return system, parts
+
+
+def get_critique_prompt(agent_config: dict, task: str, target_name: str, analysis: str) -> tuple[str, list[str]]:
+    """Получить промпты для критики"""
+    system = _critique_system_prompt(agent_config)
+    parts = [
+        TASK_PROMPT.format(task=task),
+        CRITIQUE_TARGET_PROMPT.format(target_name=target_name, analysis=analysis),
+        CRITIQUE_INSTRUCTION,
+    ]
+    return system, parts
+
+
+def get_batch_critique_prompt(
+    agent_config: dict,
+    task: str,
+    targets: list[tuple[str, str]],
+) -> tuple[str, list[str]]:
+    """Получить промпты для критики нескольких анализов одним вызовом"""
+    system = _critique_system_prompt(agent_config)
+    analyses = "\n".join(
+        BATCH_CRITIQUE_ITEM.format(target_name=name, analysis=analysis)
+        for name, analysis in targets
     )
-    return system, user
+    parts = [
+        TASK_PROMPT.format(task=task),
+        BATCH_CRITIQUE_TARGETS_PROMPT.format(analyses=analyses),
+        BATCH_CRITIQUE_INSTRUCTION,
+    ]
+    return system, parts
+
+
+def get_synthesis_prompt(task: str, analyses: str, critiques: str) -> tuple[str, list[str]]:
+    """Получить промпты для синтеза"""
+    system = _synthesis_system_prompt()
+    parts = [
+        TASK_PROMPT.format(task=task),
+        SYNTHESIS_ANALYSES_PROMPT.format(analyses=analyses),
+        SYNTHESIS_CRITIQUES_PROMPT.format(critiques=critiques),
+        SYNTHESIS_INSTRUCTION,
+    ]
+    return system, parts
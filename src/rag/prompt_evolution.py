@@ -10,6 +10,7 @@ from pydantic import BaseModel, Field
 from langchain_anthropic import ChatAnthropic
 from langchain_core.messages import HumanMessage, SystemMessage
 
+from src.agents.llm_pool import get_llm
 from src.config import get_settings
 from src.rag.vector_store import VectorStore, Document
 
@@ -46,9 +47,14 @@ class PromptEvolution:
     """
 
     def __init__(self):
-        settings = get_settings()
         self.vector_store = VectorStore()
-        self.llm = ChatAnthropic(
+
+    @property
+    def llm(self):
+        settings = get_settings()
+        return get_llm(
+            ChatAnthropic,
+            provider="anthropic",
             model="claude-3-haiku-20240307",  # Быстрая модель для мета-анализа
             temperature=0.3,
             api_key=settings.anthropic_api_key,
@@ -3,32 +3,121 @@ LLM-top: Prompt Loader
 Загрузка промптов из базы данных Supabase
 """
 
+import asyncio
+import time
+from collections import Counter
 from typing import Optional
-from functools import lru_cache
-from supabase import create_client, Client
+from supabase import acreate_client, AsyncClient
 
 from src.config import get_settings
 
 
 class PromptLoader:
-    """Загрузчик промптов из таблицы rag_prompts"""
+    """
+    Загрузчик промптов из таблицы rag_prompts
 
-    def __init__(self):
+    Все активные промпты загружаются одним запросом и хранятся в памяти:
+    `get_prompt()` не обращается к БД и не блокирует event loop.
+    Снимок обновляется в фоне, когда старше `prompt_cache_ttl` или после
+    `invalidate()` (активирована новая версия промпта). Пока идёт
+    обновление, отдаётся предыдущий снимок.
+
+    Счётчики использования копятся в памяти и отправляются пачкой
+    (`flush_usage()`), а не RPC на каждый вызов.
+    """
+
+    def __init__(self, client: Optional[AsyncClient] = None):
         settings = get_settings()
-        self.client: Client = create_client(
-            settings.supabase_url,
-            settings.supabase_key
-        )
-        self._cache: dict[str, str] = {}
-
-    def get_prompt(
-        self,
-        agent_name: str,
-        prompt_type: str,
-        use_cache: bool = True
-    ) -> Optional[str]:
+        self.client = client
+        self.enabled = client is not None or bool(settings.supabase_url and settings.supabase_key)
+        self.ttl = settings.prompt_cache_ttl
+        self.usage_flush_interval = settings.prompt_usage_flush_interval
+
+        # (agent_name, prompt_type) -> (version, content)
+        self._prompts: dict[tuple[str, str], tuple[int, str]] = {}
+        self._loaded_at: Optional[float] = None
+        self._stale = False
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        self._pending_usage: Counter = Counter()
+        self._usage_flushed_at = time.monotonic()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    # ------------------------------------------------------------
+    # Загрузка
+    # ------------------------------------------------------------
+
+    async def load(self) -> bool:
+        """Загрузить все активные промпты одним запросом"""
+        if not self.enabled:
+            return False
+        try:
+            client = await self._get_client()
+            result = await client.table("rag_prompts")\
+                .select("agent_name, prompt_type, content, version")\
+                .eq("is_active", True)\
+                .execute()
+        except Exception as e:
+            print(f"Error loading prompts: {e}")
+            # Клиент мог остаться от другого (закрытого) event loop
+            self.client = None
+            # Повторим не раньше чем через ttl, до этого — прежний снимок
+            self._loaded_at = time.monotonic()
+            return False
+
+        prompts: dict[tuple[str, str], tuple[int, str]] = {}
+        for row in result.data:
+            key = (row["agent_name"], row["prompt_type"])
+            version = row.get("version") or 0
+            # Несколько активных версий — берём последнюю
+            if key not in prompts or version > prompts[key][0]:
+                prompts[key] = (version, row["content"])
+
+        self._prompts = prompts
+        self._loaded_at = time.monotonic()
+        self._stale = False
+        return True
+
+    async def ensure_fresh(self):
         """
-        Получить промпт для агента из БД.
+        Подготовить снимок к использованию
+
+        Первый вызов ждёт загрузки, дальше устаревший снимок
+        обновляется в фоне. Заодно отправляет накопленные счётчики.
+        """
+        if not self.enabled:
+            return
+        if not self.loaded:
+            await self.load()
+        elif self._stale or time.monotonic() - self._loaded_at >= self.ttl:
+            if _idle(self._refresh_task):
+                self._refresh_task = asyncio.create_task(self.load())
+
+        if self._pending_usage and time.monotonic() - self._usage_flushed_at >= self.usage_flush_interval:
+            if _idle(self._flush_task):
+                self._flush_task = asyncio.create_task(self.flush_usage())
+
+    def invalidate(self):
+        """Сигнал смены версии промпта: обновить снимок при следующем ensure_fresh"""
+        self._stale = True
+
+    async def _get_client(self) -> AsyncClient:
+        if self.client is None:
+            settings = get_settings()
+            self.client = await acreate_client(settings.supabase_url, settings.supabase_key)
+        return self.client
+
+    # ------------------------------------------------------------
+    # Чтение (только память)
+    # ------------------------------------------------------------
+
+    def get_prompt(self, agent_name: str, prompt_type: str) -> Optional[str]:
+        """
+        Получить промпт для агента из снимка
 
         Args:
             agent_name: chatgpt, claude, gemini, deepseek
@@ -37,63 +126,78 @@ class PromptLoader:
         Returns:
             Текст промпта или None
         """
-        cache_key = f"{agent_name}:{prompt_type}"
-
-        if use_cache and cache_key in self._cache:
-            return self._cache[cache_key]
-
-        try:
-            result = self.client.table("rag_prompts")\
-                .select("content")\
-                .eq("agent_name", agent_name)\
-                .eq("prompt_type", prompt_type)\
-                .eq("is_active", True)\
-                .order("version", desc=True)\
-                .limit(1)\
-                .execute()
-
-            if result.data:
-                content = result.data[0]["content"]
-                self._cache[cache_key] = content
-                return content
-        except Exception as e:
-            print(f"Error loading prompt {cache_key}: {e}")
+        prompt = self._prompts.get((agent_name, prompt_type))
+        return prompt[1] if prompt else None
 
-        return None
+    def get_version(self, agent_name: str, prompt_type: str) -> Optional[int]:
+        """Версия активного промпта"""
+        prompt = self._prompts.get((agent_name, prompt_type))
+        return prompt[0] if prompt else None
 
     def get_all_prompts(self, agent_name: str) -> dict[str, str]:
         """Получить все промпты для агента"""
-        try:
-            result = self.client.table("rag_prompts")\
-                .select("prompt_type, content")\
-                .eq("agent_name", agent_name)\
-                .eq("is_active", True)\
-                .execute()
-
-            prompts = {}
-            for row in result.data:
-                prompts[row["prompt_type"]] = row["content"]
-            return prompts
-        except Exception as e:
-            print(f"Error loading prompts for {agent_name}: {e}")
-            return {}
+        return {
+            prompt_type: content
+            for (agent, prompt_type), (_, content) in self._prompts.items()
+            if agent == agent_name
+        }
 
     def clear_cache(self):
-        """Очистить кэш промптов"""
-        self._cache.clear()
+        """Очистить снимок промптов (следующий ensure_fresh загрузит заново)"""
+        self._prompts = {}
+        self._loaded_at = None
+
+    # ------------------------------------------------------------
+    # Счётчики использования
+    # ------------------------------------------------------------
+
+    def increment_usage(self, agent_name: str, prompt_type: str, count: int = 1):
+        """Учесть использование промпта (отправляется в flush_usage)"""
+        self._pending_usage[(agent_name, prompt_type)] += count
+
+    async def flush_usage(self):
+        """Отправить накопленные счётчики: один RPC на промпт"""
+        pending, self._pending_usage = self._pending_usage, Counter()
+        self._usage_flushed_at = time.monotonic()
+        if not pending or not self.enabled:
+            return
 
-    def increment_usage(self, agent_name: str, prompt_type: str):
-        """Увеличить счётчик использования промпта"""
         try:
-            self.client.rpc("increment_prompt_usage", {
-                "p_agent": agent_name,
-                "p_type": prompt_type
-            }).execute()
+            client = await self._get_client()
+            await asyncio.gather(*(
+                client.rpc("increment_prompt_usage", {
+                    "p_agent": agent_name,
+                    "p_type": prompt_type,
+                    "p_count": count,
+                }).execute()
+                for (agent_name, prompt_type), count in pending.items()
+            ))
         except Exception:
-            pass  # Не критично
+            self.client = None  # Не критично
+
+    async def close(self):
+        """Отправить счётчики и остановить фоновое обновление"""
+        if not _idle(self._refresh_task):
+            self._refresh_task.cancel()
+        await self.flush_usage()
+
+
+def _idle(task: Optional[asyncio.Task]) -> bool:
+    """Фоновая задача не выполняется (или осталась в другом event loop)"""
+    return (
+        task is None
+        or task.done()
+        or task.get_loop() is not asyncio.get_running_loop()
+    )
+
+
+_prompt_loader: Optional[PromptLoader] = None
 
 
-@lru_cache
 def get_prompt_loader() -> PromptLoader:
     """Получить singleton экземпляр загрузчика промптов"""
-    return PromptLoader()
+    global _prompt_loader
+    if _prompt_loader is None:
+        _prompt_loader = PromptLoader()
+    return _prompt_loader
+
@@ -17,6 +17,24 @@ from src.models.state import (
 from src.api.main import api
 
 
+# ============================================================
+# Fixtures: Environment
+# ============================================================
+
+@pytest.fixture(autouse=True)
+def disable_stage_cache(monkeypatch):
+    """Кэш этапов не переносит результаты моков между тестами"""
+    from src.config import get_settings
+    monkeypatch.setattr(get_settings(), "stage_cache_enabled", False)
+
+
+@pytest.fixture(autouse=True)
+def disable_llm_telemetry(monkeypatch):
+    """Телеметрия LLM вызовов не пишет в Redis/LangSmith из тестов"""
+    from src.config import get_settings
+    monkeypatch.setattr(get_settings(), "llm_telemetry_enabled", False)
+
+
 # ============================================================
 # Fixtures: Test Data
 # ============================================================
@@ -78,6 +78,88 @@ class TestBaseAgentParsing:
         assert mock_agent._extract_risks(text) == []
 
 
+class TestSectionParser:
+    """Тесты разбора ответа на секции"""
+
+    TEXT = """Вступление до заголовков.
+
+## Ключевые выводы
+
+- Вывод 1
+* Вывод 2
+**Не пункт**
+
+### Риски ###
+- Риск 1
+
+## Таблица выводов
+Пояснение к таблице.
+
+| Вывод | Вероятность |
+|-------|-------------|
+| Вывод A | 70% |
+| Вывод B | 40% |
+
+Текст после таблицы.
+| Не строка таблицы |
+
+## Общая оценка: 8/10
+"""
+
+    @pytest.mark.unit
+    def test_sections_and_items(self):
+        from src.agents.sections import Sections
+
+        sections = Sections(self.TEXT)
+        assert sections.preamble.strip() == "Вступление до заголовков."
+        assert "ключевые  ВЫВОДЫ" in sections
+        assert sections.items("Ключевые выводы") == ["Вывод 1", "Вывод 2"]
+        assert sections.items("Риски") == ["Риск 1"]
+        assert sections.items("Нет такой", "Риски") == ["Риск 1"]
+        assert sections.items("Нет такой") == []
+        assert sections.body("Нет такой") is None
+        assert sections.titles[-1] == "Общая оценка: 8/10"
+
+    @pytest.mark.unit
+    def test_table(self):
+        from src.agents.sections import Sections
+
+        rows = Sections(self.TEXT).table("Таблица выводов")
+        assert rows == [["Вывод A", "70%"], ["Вывод B", "40%"]]
+
+    @pytest.mark.unit
+    def test_parse_is_cached(self):
+        from src.agents.sections import parse_sections
+
+        assert parse_sections(self.TEXT) is parse_sections(self.TEXT)
+
+    @pytest.mark.unit
+    def test_confidence_and_score_prefer_sections(self):
+        with patch.object(BaseAgent, "__abstractmethods__", set()):
+            agent = BaseAgent("chatgpt")
+        text = "Выборка: 5/10 регионов, уверенность: 40% в прогнозе\n\n## Уверенность\nУверенность: 80%\n"
+        assert agent._extract_confidence(text) == 0.8
+        assert agent._extract_score(text) == 5.0
+        assert agent._extract_score(text + "## Общая оценка: 7.5/10\n") == 7.5
+
+    @pytest.mark.unit
+    def test_matches_legacy_regex_parsing(self):
+        """Результат совпадает с прежним разбором регулярными выражениями"""
+        from benchmarks import parsing
+
+        for size_kb in (1, 10):
+            analysis = parsing.make_analysis(size_kb)
+            critique = parsing.make_critique(size_kb)
+            synthesis = parsing.make_synthesis(size_kb)
+            assert parsing.parse_analysis(analysis) == parsing.legacy_parse_analysis(analysis)
+            assert parsing.parse_critique(critique) == parsing.legacy_parse_critique(critique)
+            summary, conclusions, recommendations, formalized, dissenting = parsing.parse_synthesis(synthesis)
+            legacy = parsing.legacy_parse_synthesis(synthesis)
+            assert (summary, formalized, dissenting) == (legacy[0], legacy[3], legacy[4])
+            assert [c["conclusion"] for c in conclusions] == [row[0] for row in legacy[1]]
+            assert [r["recommendation"] for r in recommendations] == [row[0] for row in legacy[2]]
+
+
 class TestChatGPTAgent:
     """Тесты для ChatGPT агента"""
 
@@ -254,3 +336,647 @@ class TestSynthesizer:
             conclusions = synth._extract_conclusions(text)
             assert len(conclusions) == 2
             assert conclusions[0]["conclusion"] == "Вывод 1"
+
+
+class TestTokenStreaming:
+    """Тесты потоковой передачи токенов"""
+
+    @pytest.mark.unit
+    async def test_analyze_streams_deltas(self):
+        from langchain_core.messages import AIMessageChunk
+        from src.agents.streaming import TokenStream, stream_tokens, set_stream_iteration
+
+        async def fake_astream(messages, **kwargs):
+            for part in ["## Анализ\n", "Тест. ", "Уверенность: 80%"]:
+                yield AIMessageChunk(content=part)
+
+        with patch("src.agents.llm_agents.ChatOpenAI") as mock_llm:
+            mock_llm.return_value.astream = fake_astream
+            agent = ChatGPTAgent()
+
+            stream = TokenStream()
+            with stream_tokens(stream):
+                set_stream_iteration(1)
+                result = await agent.analyze("Test task", "research", "")
+
+            events = []
+            while not stream.queue.empty():
+                events.append(stream.queue.get_nowait())
+
+            assert result.confidence == 0.8
+            assert [kind for kind, _ in events] == ["token"] * 3
+            assert events[0][1].agent == "ChatGPT"
+            assert events[0][1].stage == "analysis"
+            assert events[0][1].iteration == 1
+            mock_llm.return_value.ainvoke.assert_not_called()
+
+
+class TestBatchCritique:
+    """Тесты пакетной критики"""
+
+    @pytest.mark.unit
+    async def test_critique_batch_splits_sections(self, sample_analyses):
+        response = MagicMock()
+        response.content = """# Критика: Claude
+
+## Слабости
+- Мало данных
+
+## Общая оценка: 6/10
+
+# Критика: Gemini
+
+## Сильные стороны
+- Широта
+
+## Общая оценка: 8/10
+"""
+        with patch("src.agents.llm_agents.ChatOpenAI") as mock_llm:
+            mock_llm.return_value.ainvoke = AsyncMock(return_value=response)
+
+            agent = ChatGPTAgent()
+            critiques = await agent.critique_batch("Test task", sample_analyses[1:])
+
+            assert mock_llm.return_value.ainvoke.await_count == 1
+            assert [c.target_name for c in critiques] == ["Claude", "Gemini"]
+            assert critiques[0].score == 6.0
+            assert critiques[0].weaknesses == ["Мало данных"]
+            assert critiques[1].score == 8.0
+
+
+class TestStructuredOutput:
+    """Тесты режима structured output"""
+
+    ANALYSIS_ARGS = {
+        "analysis": "Рынок растёт, но конкуренция усиливается.",
+        "key_points": ["Рост 12%", "Высокий CAC"],
+        "risks": "- Санкции\n- Демпинг",
+        "assumptions": [],
+        "confidence": 85,
+    }
+
+    @pytest.fixture(autouse=True)
+    def structured(self, monkeypatch):
+        from src.config import get_settings
+        monkeypatch.setattr(get_settings(), "structured_output_enabled", True)
+
+    @staticmethod
+    def _tool_message(name: str, args: dict):
+        from langchain_core.messages import AIMessage
+        return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": "call_1"}])
+
+    @pytest.mark.unit
+    async def test_analyze_uses_tool_arguments(self):
+        with patch("src.agents.llm_agents.ChatOpenAI") as mock_llm:
+            bound = mock_llm.return_value.bind_tools.return_value
+            bound.ainvoke = AsyncMock(return_value=self._tool_message("AnalysisOutput", self.ANALYSIS_ARGS))
+            agent = ChatGPTAgent()
+
+            result = await agent.analyze("Test task", "research", "")
+
+            _, kwargs = mock_llm.return_value.bind_tools.call_args
+            assert kwargs["tool_choice"] == "AnalysisOutput"
+            assert result.confidence == 0.85
+            assert result.key_points == ["Рост 12%", "Высокий CAC"]
+            assert result.risks == ["Санкции", "Демпинг"]
+            # Текст в прежнем формате: разделы и уверенность дописаны
+            assert "## Ключевые выводы\n- Рост 12%" in result.analysis
+            assert agent._extract_confidence(result.analysis) == 0.85
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("value", [None, [85], {"value": 85}, "высокая"])
+    def test_non_numeric_values_fail_validation(self, value):
+        from src.agents.structured import AnalysisOutput, CritiqueOutput, validate_output
+
+        assert validate_output(AnalysisOutput, dict(self.ANALYSIS_ARGS, confidence=value)) is None
+        assert validate_output(CritiqueOutput, {"critique": "c", "score": value}) is None
+
+    @pytest.mark.unit
+    async def test_null_confidence_falls_back_to_markdown(self):
+        with patch("src.agents.llm_agents.ChatOpenAI") as mock_llm:
+            bound = mock_llm.return_value.bind_tools.return_value
+            args = dict(self.ANALYSIS_ARGS, confidence=None)
+            bound.ainvoke = AsyncMock(return_value=self._tool_message("AnalysisOutput", args))
+            agent = ChatGPTAgent()
+
+            result = await agent.analyze("Test task", "research", "")
+
+            assert result.agent_name == agent.name
+
+    @pytest.mark.unit
+    async def test_analyze_streams_partial_json(self):
+        import json
+        from langchain_core.messages import AIMessageChunk
+        from src.agents.streaming import TokenStream, stream_tokens
+
+        raw = json.dumps(dict(self.ANALYSIS_ARGS, analysis="Длинный анализ. " * 40), ensure_ascii=False)
+
+        async def fake_astream(messages, **kwargs):
+            for i in range(0, len(raw), 5):
+                yield AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[{"name": None, "args": raw[i:i + 5], "id": None, "index": 0}],
+                )
+
+        with patch("src.agents.llm_agents.ChatOpenAI") as mock_llm:
+            mock_llm.return_value.bind_tools.return_value.astream = fake_astream
+            agent = ChatGPTAgent()
+
+            stream = TokenStream(maxsize=0)
+            with stream_tokens(stream):
+                result = await agent.analyze("Test task", "research", "")
+
+            deltas = []
+            while not stream.queue.empty():
+                deltas.append(stream.queue.get_nowait()[1].delta)
+
+            assert 1 < len(deltas) < len(raw) // 5
+            assert "".join(deltas) == "Длинный анализ. " * 40
+            assert result.key_points == ["Рост 12%", "Высокий CAC"]
+
+    @pytest.mark.unit
+    async def test_falls_back_to_markdown_without_tool_call(self):
+        from langchain_core.messages import AIMessage
+
+        with patch("src.agents.llm_agents.ChatOpenAI") as mock_llm:
+            mock_llm.return_value.bind_tools.return_value.ainvoke = AsyncMock(
+                return_value=AIMessage(content="## Риски\n- Риск 1\n\nУверенность: 60%")
+            )
+            agent = ChatGPTAgent()
+
+            result = await agent.analyze("Test task", "research", "")
+
+            assert result.confidence == 0.6
+            assert result.risks == ["Риск 1"]
+
+    @pytest.mark.unit
+    async def test_critique_batch(self, sample_analyses):
+        args = {"critiques": [
+            {"target": "Gemini", "review": {"critique": "Широко", "strengths": ["Широта"], "score": "8/10"}},
+            {"target": "**Claude**", "review": {"critique": "Мало данных", "weaknesses": ["Мало данных"], "score": 6}},
+        ]}
+        with patch("src.agents.llm_agents.ChatOpenAI") as mock_llm:
+            mock_llm.return_value.bind_tools.return_value.ainvoke = AsyncMock(
+                return_value=self._tool_message("BatchCritiqueOutput", args)
+            )
+            agent = ChatGPTAgent()
+
+            critiques = await agent.critique_batch("Test task", sample_analyses[1:])
+
+            assert [c.target_name for c in critiques] == ["Claude", "Gemini"]
+            assert [c.score for c in critiques] == [6.0, 8.0]
+            assert critiques[0].weaknesses == ["Мало данных"]
+            assert "## Общая оценка: 6/10" in critiques[0].critique
+
+    @pytest.mark.unit
+    def test_batch_stream_text_grows_only(self):
+        from src.agents.structured import batch_critique_text
+
+        partial = {"critiques": [{"target": "Cla"}]}
+        assert batch_critique_text(partial) == ""
+        partial = {"critiques": [{"target": "Claude", "review": {"critique": "Мало"}}]}
+        assert batch_critique_text(partial) == "# Критика: Claude\n\nМало"
+
+
+class TestTokenizer:
+    """Тесты загрузки кодировки tiktoken"""
+
+    @pytest.mark.unit
+    async def test_tokenizer_warmup_and_fallback(self, monkeypatch, caplog):
+        from src.agents import budget
+        from src.config import get_settings
+
+        budget._encoding.cache_clear()
+        monkeypatch.setattr(get_settings(), "prompt_budget_encoding", "no-such-encoding")
+        try:
+            with patch.object(budget.asyncio, "to_thread", wraps=budget.asyncio.to_thread) as to_thread:
+                await budget.warmup_tokenizer()
+            to_thread.assert_called_once()
+            assert budget._encoding() is None
+            assert "no-such-encoding" in caplog.text
+        finally:
+            budget._encoding.cache_clear()
+
+
+class TestPromptBudget:
+    """Тесты бюджета токенов промптов"""
+
+    LONG_ANALYSIS = (
+        "## Анализ\n\n"
+        + "\n\n".join("Первое предложение абзаца. Второе предложение. Третье предложение." for _ in range(60))
+        + "\n\n## Ключевые выводы\n- Вывод 1\n- Вывод 2\n\n## Риски\n- Риск 1\n"
+    )
+
+    @pytest.fixture(autouse=True)
+    def byte_tokenizer(self):
+        """Подсчёт без словаря tiktoken: UTF-8 байты / 4"""
+        with patch("src.agents.budget._encoding", return_value=None):
+            yield
+
+    @pytest.mark.unit
+    def test_allocate_water_filling(self):
+        from src.agents.budget import allocate
+
+        assert allocate([100, 5000, 3000, 50], 4000) == [100, 1925, 1925, 50]
+        assert allocate([10, 20], 100) == [10, 20]
+
+    @pytest.mark.unit
+    def test_fit_text_keeps_key_sections(self):
+        from src.agents.budget import count_tokens, fit_text
+
+        assert fit_text(self.LONG_ANALYSIS, 10_000) is self.LONG_ANALYSIS
+        for budget in (1500, 800, 300):
+            fitted = fit_text(self.LONG_ANALYSIS, budget)
+            assert count_tokens(fitted) <= budget
+            assert "## Ключевые выводы\n- Вывод 1\n- Вывод 2" in fitted
+            assert "- Риск 1" in fitted
+        assert "Третье предложение" not in fit_text(self.LONG_ANALYSIS, 800)
+
+    @pytest.mark.unit
+    def test_dedupe_weaknesses(self):
+        from src.agents.budget import dedupe_weaknesses
+
+        critiques = [
+            AgentCritique(
+                critic_name=critic, target_name="ChatGPT", score=7.0,
+                critique=f"## Слабости\n- Недостаточно данных по рынку\n- {extra}\n\n## Общая оценка: 7/10",
+            )
+            for critic, extra in [("Claude", "Нет альтернатив"), ("Gemini", "Слабая формализация")]
+        ]
+        texts, removed = dedupe_weaknesses(critiques)
+
+        assert removed == 1
+        assert "- Недостаточно данных по рынку (также: Gemini)" in texts[0]
+        assert "Недостаточно данных" not in texts[1]
+        assert "- Слабая формализация" in texts[1]
+        assert "## Общая оценка: 7/10" in texts[1]
+
+    @pytest.mark.unit
+    async def test_critique_prompt_within_budget(self, monkeypatch):
+        from src.agents.budget import count_tokens, track_budget
+        from src.config import get_settings
+
+        monkeypatch.setattr(get_settings(), "critique_prompt_budget", 500)
+        response = MagicMock(content="## Общая оценка: 7/10")
+        with patch("src.agents.llm_agents.ChatOpenAI") as mock_llm:
+            mock_llm.return_value.ainvoke = AsyncMock(return_value=response)
+            agent = ChatGPTAgent()
+
+            with track_budget("critique", 1) as stats:
+                await agent.critique("Test task", "Claude", self.LONG_ANALYSIS)
+
+            prompt = mock_llm.return_value.ainvoke.call_args[0][0][1].content
+            assert "- Риск 1" in prompt
+            assert stats.prompts == 1
+            assert stats.original_tokens == count_tokens(self.LONG_ANALYSIS)
+            assert stats.final_tokens <= 500
+            assert stats.saved_tokens == stats.original_tokens - stats.final_tokens
+
+    @pytest.mark.unit
+    async def test_synthesis_records_savings(self, sample_analyses, sample_critiques, monkeypatch):
+        from src.agents.budget import track_budget
+        from src.config import get_settings
+
+        monkeypatch.setattr(get_settings(), "synthesis_prompt_budget", 400)
+        analyses = [a.model_copy(update={"analysis": self.LONG_ANALYSIS}) for a in sample_analyses]
+        response = MagicMock(content="## Резюме\nИтог")
+        with patch("src.agents.synthesizer.ChatAnthropic") as mock_llm:
+            mock_llm.return_value.ainvoke = AsyncMock(return_value=response)
+            synth = Synthesizer()
+
+            with track_budget("synthesis", 1) as stats:
+                await synth.synthesize("Test task", analyses, sample_critiques)
+
+            assert stats.prompts == 1
+            assert stats.saved_tokens > 0
+            assert stats.final_tokens <= 400
+
+
+class TestLLMPool:
+    """Тесты общего реестра LLM клиентов"""
+
+    @pytest.mark.unit
+    async def test_reuses_client_within_loop(self):
+        from langchain_openai import ChatOpenAI
+        from src.agents.llm_pool import LLMPool
+
+        pool = LLMPool()
+        first = pool.get(ChatOpenAI, "openai", "gpt-4o", 0.7, api_key="x")
+        second = pool.get(ChatOpenAI, "openai", "gpt-4o", 0.7, api_key="x")
+        other = pool.get(ChatOpenAI, "openai", "gpt-4o-mini", 0.7, api_key="x")
+
+        assert first is second
+        assert other is not first
+        # Модели одного провайдера делят HTTP пул
+        assert first.http_async_client is other.http_async_client
+        assert pool.stats()["http_clients"] == 1
+
+        await pool.aclose_loop()
+        assert pool.stats()["models"] == 0
+
+    @pytest.mark.unit
+    async def test_anthropic_uses_shared_pool(self, caplog):
+        """ChatAnthropic ходит через общий HTTP пул (ловит несовместимую версию пакета)"""
+        from langchain_anthropic import ChatAnthropic
+        from src.agents.llm_pool import LLMPool
+
+        pool = LLMPool()
+        with caplog.at_level("WARNING", logger="src.agents.llm_pool"):
+            first = pool.get(ChatAnthropic, "anthropic", "claude-sonnet-4", 0.7, api_key="x")
+            other = pool.get(ChatAnthropic, "anthropic", "claude-haiku-4", 0.7, api_key="x")
+        assert "HTTP пул не подключён" not in caplog.text
+
+        shared = first._async_client._client
+        assert other._async_client._client is shared
+        assert pool.stats()["http_clients"] == 1
+        await pool.aclose_loop()
+        assert shared.is_closed
+
+    @pytest.mark.unit
+    def test_anthropic_bind_failure_logged(self, caplog):
+        """Несовместимый ChatAnthropic: клиент по умолчанию и предупреждение в лог"""
+        from src.agents.llm_pool import _bind_anthropic_http_client
+
+        llm = MagicMock(spec=[])  # нет _client_params
+        with caplog.at_level("WARNING", logger="src.agents.llm_pool"):
+            _bind_anthropic_http_client(llm, MagicMock())
+        assert "HTTP пул не подключён" in caplog.text
+
+
+class TestPromptLoader:
+    """Тесты загрузчика промптов"""
+
+    @staticmethod
+    def _client(rows: list[dict]) -> MagicMock:
+        query = MagicMock()
+        query.select.return_value = query
+        query.eq.return_value = query
+        query.execute = AsyncMock(return_value=MagicMock(data=rows))
+        client = MagicMock()
+        client.table.return_value = query
+        rpc = MagicMock()
+        rpc.execute = AsyncMock()
+        client.rpc.return_value = rpc
+        return client
+
+    @pytest.mark.unit
+    async def test_bulk_load_serves_from_memory(self):
+        from src.rag.prompt_loader import PromptLoader
+
+        client = self._client([
+            {"agent_name": "claude", "prompt_type": "system", "content": "v1", "version": 1},
+            {"agent_name": "claude", "prompt_type": "system", "content": "v2", "version": 2},
+            {"agent_name": "gemini", "prompt_type": "critique", "content": "c", "version": 1},
+        ])
+        loader = PromptLoader(client)
+        await loader.ensure_fresh()
+
+        assert loader.get_prompt("claude", "system") == "v2"
+        assert loader.get_version("claude", "system") == 2
+        assert loader.get_prompt("gemini", "critique") == "c"
+        assert loader.get_prompt("chatgpt", "system") is None
+        # Один запрос на все промпты, чтения из памяти
+        assert client.table.call_count == 1
+
+        await loader.ensure_fresh()
+        assert client.table.call_count == 1
+
+    @pytest.mark.unit
+    async def test_invalidate_refreshes_in_background(self):
+        from src.rag.prompt_loader import PromptLoader
+
+        client = self._client([
+            {"agent_name": "claude", "prompt_type": "system", "content": "old", "version": 1},
+        ])
+        loader = PromptLoader(client)
+        await loader.ensure_fresh()
+
+        client.table.return_value.execute.return_value = MagicMock(data=[
+            {"agent_name": "claude", "prompt_type": "system", "content": "new", "version": 2},
+        ])
+        loader.invalidate()
+        await loader.ensure_fresh()
+        # Пока идёт обновление, отдаётся прежний снимок
+        assert loader.get_prompt("claude", "system") == "old"
+
+        await loader._refresh_task
+        assert loader.get_prompt("claude", "system") == "new"
+
+    @pytest.mark.unit
+    async def test_usage_is_batched(self):
+        from src.rag.prompt_loader import PromptLoader
+
+        client = self._client([])
+        loader = PromptLoader(client)
+        for _ in range(5):
+            loader.increment_usage("claude", "system")
+        loader.increment_usage("gemini", "analysis")
+        assert client.rpc.call_count == 0
+
+        await loader.flush_usage()
+        calls = sorted(call.args[1]["p_count"] for call in client.rpc.call_args_list)
+        assert calls == [1, 5]
+
+
+class TestLLMCallTelemetry:
+    """Тесты телеметрии LLM вызовов"""
+
+    @pytest.fixture
+    def records(self, monkeypatch):
+        import src.monitoring.llm_calls as module
+        from src.config import get_settings
+
+        collected = []
+
+        async def consumer(batch):
+            collected.extend(batch)
+
+        sink = module.TelemetrySink(flush_interval=0.01)
+        sink.add_consumer(consumer)
+        monkeypatch.setattr(get_settings(), "llm_telemetry_enabled", True)
+        monkeypatch.setattr(module, "_handler", module.LLMCallHandler(sink))
+        return sink, collected
+
+    @staticmethod
+    def _llm(text: str = "Ответ модели из нескольких слов"):
+        from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+        from langchain_core.messages import AIMessage
+
+        return GenericFakeChatModel(messages=iter([AIMessage(
+            content=text,
+            usage_metadata={
+                "input_tokens": 120,
+                "output_tokens": 30,
+                "total_tokens": 150,
+                "input_token_details": {"cache_read": 100},
+            },
+        )]))
+
+    @pytest.mark.unit
+    async def test_call_is_recorded_off_the_call_path(self, records):
+        from langchain_core.messages import HumanMessage
+        from src.agents.streaming import invoke_llm, set_stream_iteration
+
+        sink, collected = records
+        set_stream_iteration(2)
+        await invoke_llm(self._llm(), [HumanMessage(content="Задача")], "Claude", "critique", provider="anthropic")
+
+        # Запись только поставлена в очередь
+        assert collected == []
+        await sink.flush()
+
+        [record] = collected
+        assert (record.agent, record.stage, record.provider, record.iteration) == (
+            "Claude", "critique", "anthropic", 2,
+        )
+        assert (record.input_tokens, record.output_tokens, record.cached_tokens) == (120, 30, 100)
+        assert record.latency_ms > 0
+        assert record.error is None
+
+    @pytest.mark.unit
+    async def test_streaming_call_has_ttft(self, records):
+        from langchain_core.messages import HumanMessage
+        from src.agents.streaming import TokenStream, invoke_llm, stream_tokens
+
+        sink, collected = records
+        with stream_tokens(TokenStream()):
+            await invoke_llm(self._llm(), [HumanMessage(content="Задача")], "Gemini", "analysis")
+        await sink.flush()
+
+        assert collected[0].ttft_ms is not None
+        assert collected[0].ttft_ms <= collected[0].latency_ms
+
+    @pytest.mark.unit
+    async def test_failed_call_feeds_selector(self, records):
+        from langchain_core.messages import HumanMessage
+        from src.agents.selector import AgentStatus, get_agent_selector
+        from src.agents.streaming import invoke_llm
+        from src.monitoring.llm_calls import _selector_consumer
+
+        sink, collected = records
+        sink.add_consumer(_selector_consumer)
+        get_agent_selector().reset_agent("deepseek")
+
+        failing = self._llm()
+        failing.__dict__["messages"] = iter([])  # Генератор пуст — вызов падает
+        with pytest.raises(Exception):
+            await invoke_llm(failing, [HumanMessage(content="Задача")], "DeepSeek", "analysis")
+        await sink.flush()
+
+        assert collected[0].error
+        assert get_agent_selector().health_status["deepseek"].status == AgentStatus.DEGRADED
+        get_agent_selector().reset_agent("deepseek")
+
+    @pytest.mark.unit
+    async def test_cost_tracker_prices_cached_tokens(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        from decimal import Decimal
+        from src.infrastructure.cost_tracker import CostTracker
+        from src.monitoring.llm_calls import LLMCallRecord
+
+        tracker = CostTracker()
+        tracker.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        [record] = await tracker.record_calls([LLMCallRecord(
+            model="deepseek-chat",
+            provider="deepseek",
+            stage="synthesis",
+            input_tokens=1000,
+            output_tokens=1000,
+            cached_tokens=1000,
+        )])
+
+        # 1000 cached × 0.000014 + 1000 output × 0.00028
+        assert record.cost_usd == Decimal("0.000294")
+        daily = await tracker.get_daily_cost()
+        assert daily.requests_count == 1
+        assert daily.by_provider["deepseek"] == Decimal("0.000294")
+
+
+class TestPromptCache:
+    """Тесты стабильного префикса промптов и кэша провайдера"""
+
+    @staticmethod
+    def _anthropic():
+        llm = MagicMock()
+        llm._llm_type = "anthropic-chat"
+        return llm
+
+    @pytest.mark.unit
+    def test_prompt_parts_keep_template_text(self):
+        from src.prompts import agent_prompts as prompts
+
+        from src.config import AGENT_CONFIGS
+
+        config = AGENT_CONFIGS["chatgpt"]
+        _, parts = prompts.get_critique_prompt(config, "Задача", "Claude", "Текст анализа")
+        assert "".join(parts) == prompts.CRITIQUE_USER_PROMPT.format(
+            task="Задача", target_name="Claude", analysis="Текст анализа"
+        )
+        # Инструкция — в конце, задача — в начале
+        assert parts[0].startswith("Исходная задача: Задача")
+        assert parts[-1] == prompts.CRITIQUE_INSTRUCTION
+
+        _, parts = prompts.get_synthesis_prompt("Задача", "Анализы", "Критики")
+        assert "".join(parts) == prompts.SYNTHESIS_USER_PROMPT.format(
+            task="Задача", analyses="Анализы", critiques="Критики"
+        )
+
+    @pytest.mark.unit
+    def test_plain_prompt_for_automatic_caching(self):
+        from src.agents.prompt_cache import cache_prompt, prompt_messages
+
+        messages = cache_prompt(MagicMock(), prompt_messages("Система", ["Задача. ", "Инструкция"]))
+
+        assert messages[0].content == "Система"
+        assert messages[1].content == "Задача. Инструкция"
+
+    @pytest.mark.unit
+    def test_anthropic_prefix_marked(self):
+        from src.agents.prompt_cache import CACHE_CONTROL, cache_prompt, prompt_messages
+
+        system, user = cache_prompt(
+            self._anthropic(), prompt_messages("Система", ["Задача", "Анализ", "Инструкция"])
+        )
+
+        assert system.content == [{"type": "text", "text": "Система", "cache_control": CACHE_CONTROL}]
+        assert [block.get("cache_control") for block in user.content] == [CACHE_CONTROL, CACHE_CONTROL, None]
+
+    @pytest.mark.unit
+    def test_breakpoints_limited(self, monkeypatch):
+        from src.agents.prompt_cache import MAX_CACHE_BREAKPOINTS, cache_prompt, prompt_messages
+        from src.config import get_settings
+
+        parts = [f"Часть {i}" for i in range(6)]
+        system, user = cache_prompt(self._anthropic(), prompt_messages("Система", parts))
+        marked = [block for block in user.content if "cache_control" in block]
+        assert len(marked) == MAX_CACHE_BREAKPOINTS - 1
+        # Отмечены последние стабильные блоки
+        assert "cache_control" in user.content[-2] and "cache_control" not in user.content[0]
+
+        monkeypatch.setattr(get_settings(), "prompt_caching_enabled", False)
+        system, user = cache_prompt(self._anthropic(), prompt_messages("Система", parts))
+        assert system.content == "Система"
+        assert user.content == "".join(parts)
+
+    @pytest.mark.unit
+    def test_cached_tokens_from_llm_output(self):
+        from langchain_core.outputs import ChatGeneration, LLMResult
+        from langchain_core.messages import AIMessage
+        from src.monitoring.llm_calls import _usage
+
+        def result(token_usage):
+            return LLMResult(
+                generations=[[ChatGeneration(message=AIMessage(content="Ответ"))]],
+                llm_output={"token_usage": token_usage},
+            )
+
+        openai = _usage(result({
+            "prompt_tokens": 2000, "completion_tokens": 100,
+            "prompt_tokens_details": {"cached_tokens": 1536},
+        }))
+        assert openai == {"input_tokens": 2000, "output_tokens": 100, "cached_tokens": 1536}
+
+        deepseek = _usage(result({
+            "prompt_tokens": 2000, "completion_tokens": 100, "prompt_cache_hit_tokens": 1792,
+        }))
+        assert deepseek["cached_tokens"] == 1792
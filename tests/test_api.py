@@ -3,11 +3,22 @@ LLM-top: API Tests
 Тесты для FastAPI endpoints
 """
 
+import asyncio
+import json
 import pytest
 from unittest.mock import AsyncMock, patch
 from fastapi.testclient import TestClient
 
-from src.api.main import api, tasks_store
+from src.api.main import (
+    api,
+    analysis_flights,
+    _request_key,
+    _run_analysis,
+    flight_tasks,
+    run_analysis_background,
+)
+from src.infrastructure.task_store import MemoryTaskStore, RedisTaskStore, TaskProgressHandler
+from src.models.state import TaskInput
 
 
 @pytest.fixture
@@ -17,11 +28,15 @@ def client():
 
 
 @pytest.fixture(autouse=True)
-def clear_tasks_store():
-    """Clear tasks store before each test"""
-    tasks_store.clear()
-    yield
-    tasks_store.clear()
+def task_store():
+    """Реестр задач в памяти для каждого теста"""
+    store = MemoryTaskStore()
+    with patch("src.api.main.get_task_store", return_value=store):
+        yield store
+
+
+def _run(coro):
+    return asyncio.run(coro)
 
 
 class TestHealthEndpoints:
@@ -51,6 +66,22 @@ class TestHealthEndpoints:
         assert "deepseek" in data
 
 
+class TestMetricsEndpoint:
+    """Тесты для /metrics endpoint"""
+
+    def test_metrics_format(self, client):
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert "# TYPE cosilium_node_duration_seconds histogram" in response.text
+        assert "# TYPE cosilium_cache_requests_total counter" in response.text
+
+    def test_background_queue_wait(self, client):
+        with patch("src.api.main._run_analysis", AsyncMock(side_effect=RuntimeError("stop"))):
+            client.post("/analyze/async", json={"task": "Test task for analysis"})
+        assert 'cosilium_queue_wait_seconds_count{queue="background"}' in client.get("/metrics").text
+
+
 class TestAnalyzeEndpoint:
     """Тесты для /analyze endpoint"""
 
@@ -115,7 +146,7 @@ class TestAsyncAnalyzeEndpoint:
         assert "task_id" in data
         assert data["status"] == "pending"
 
-    def test_async_analyze_creates_task(self, client):
+    def test_async_analyze_creates_task(self, client, task_store):
         with patch("src.api.main.run_analysis_background"):
             response = client.post(
                 "/analyze/async",
@@ -123,8 +154,9 @@ class TestAsyncAnalyzeEndpoint:
             )
 
             task_id = response.json()["task_id"]
-            assert task_id in tasks_store
-            assert tasks_store[task_id]["status"] == "pending"
+            task = _run(task_store.get(task_id))
+            assert task is not None
+            assert task["status"] == "pending"
 
 
 class TestTasksEndpoint:
@@ -134,39 +166,29 @@ class TestTasksEndpoint:
         response = client.get("/tasks/nonexistent-id")
         assert response.status_code == 404
 
-    def test_get_existing_task(self, client):
+    def test_get_existing_task(self, client, task_store):
         # Create a task
-        tasks_store["test-task-id"] = {
-            "status": "completed",
-            "input": {"task": "Test"},
-            "result": {"summary": "Done"},
-            "error": None,
-        }
+        _run(task_store.create("test-task-id", {"task": "Test"}))
+        _run(task_store.set_result("test-task-id", {"summary": "Done"}))
 
         response = client.get("/tasks/test-task-id")
         assert response.status_code == 200
         data = response.json()
         assert data["status"] == "completed"
+        assert data["result"] == {"summary": "Done"}
 
-    def test_get_running_task(self, client):
-        tasks_store["running-task"] = {
-            "status": "running",
-            "input": {"task": "Test"},
-            "result": None,
-            "error": None,
-        }
+    def test_get_running_task(self, client, task_store):
+        _run(task_store.create("running-task", {"task": "Test"}))
+        _run(task_store.update("running-task", status="running"))
 
         response = client.get("/tasks/running-task")
         assert response.status_code == 200
         assert response.json()["status"] == "running"
+        assert client.get("/health").json()["active_tasks"] == 1
 
-    def test_get_failed_task(self, client):
-        tasks_store["failed-task"] = {
-            "status": "failed",
-            "input": {"task": "Test"},
-            "result": None,
-            "error": "Something went wrong",
-        }
+    def test_get_failed_task(self, client, task_store):
+        _run(task_store.create("failed-task", {"task": "Test"}))
+        _run(task_store.update("failed-task", status="failed", error="Something went wrong"))
 
         response = client.get("/tasks/failed-task")
         assert response.status_code == 200
@@ -175,6 +197,100 @@ class TestTasksEndpoint:
         assert data["error"] == "Something went wrong"
 
 
+class TestTaskEvents:
+    """Тесты событий задач и выборки полей результата"""
+
+    def test_fields_selection(self, client, task_store):
+        _run(task_store.create("t", {"task": "Test"}))
+        _run(task_store.set_result("t", {"synthesis": {"summary": "S"}, "analyses": [1, 2, 3], "iterations_used": 2}))
+
+        data = client.get("/tasks/t", params={"fields": "synthesis,iterations_used"}).json()
+        assert data["result"] == {"synthesis": {"summary": "S"}, "iterations_used": 2}
+        assert "result" not in client.get("/tasks/t", params={"include_result": False}).json()
+
+    def test_events_stream(self, client, task_store):
+        _run(task_store.create("t", {"task": "Test"}))
+        _run(task_store.update("t", status="running"))
+        _run(task_store.publish("t", "node", {"node": "parallel_analysis", "analyses": 4}))
+        _run(task_store.set_result("t", {"iterations_used": 1}))
+
+        body = client.get("/tasks/t/events").text
+        assert "event: node" in body
+        assert '"analyses": 4' in body
+        assert body.rstrip().endswith('"fields": ["iterations_used"]}')
+
+        # Переподключение после последнего события node
+        resumed = client.get("/tasks/t/events", headers={"Last-Event-ID": "3"}).text
+        assert "event: node" not in resumed and "event: completed" in resumed
+
+    def test_events_unknown_task(self, client):
+        assert client.get("/tasks/missing/events").status_code == 404
+
+    @pytest.mark.unit
+    async def test_progress_handler_publishes_nodes(self, task_store):
+        from typing import TypedDict
+        from langgraph.graph import StateGraph, END
+
+        class State(TypedDict):
+            analyses: list
+            iteration: int
+
+        graph = StateGraph(State)
+        graph.add_node("analyze", lambda state: {"analyses": ["a", "b"], "iteration": 1})
+        graph.set_entry_point("analyze")
+        graph.add_edge("analyze", END)
+
+        await task_store.create("t", {})
+        handler = TaskProgressHandler(task_store, {"t"})
+        await graph.compile().ainvoke({"analyses": [], "iteration": 0}, {"callbacks": [handler]})
+
+        events = await task_store.read_events("t")
+        assert events[-1][1:] == ("node", {"node": "analyze", "analyses": 2, "iteration": 1})
+        assert (await task_store.get("t"))["stage"] == "analyze"
+
+    @pytest.mark.unit
+    async def test_memory_read_events_waits_for_publish(self, task_store):
+        await task_store.create("t", {})
+        reader = asyncio.create_task(task_store.read_events("t", "1", timeout=5.0))
+        await asyncio.sleep(0.01)
+        assert not reader.done()
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await task_store.publish("t", "node", {"node": "analyze"})
+        events = await reader
+        assert [kind for _, kind, _ in events] == ["node"]
+        assert loop.time() - start < 0.05
+        assert await task_store.read_events("t", events[-1][0], timeout=0.01) == []
+
+    @pytest.mark.unit
+    async def test_redis_store(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        store = RedisTaskStore(fakeredis.FakeAsyncRedis(decode_responses=True), ttl=60)
+
+        await store.create("t", {"task": "Test"})
+        await store.update("t", status="running")
+        assert await store.count_active() == 1
+        assert (await store.get("t"))["result"] is None
+
+        await store.set_result("t", {"synthesis": {"summary": "S"}, "analyses": [1, 2]})
+        task = await store.get("t", fields=["synthesis", "missing"])
+        assert task["status"] == "completed"
+        assert task["input"] == {"task": "Test"}
+        assert task["result"] == {"synthesis": {"summary": "S"}}
+        assert await store.count_active() == 0
+        assert 0 < await store.redis.ttl(store._key("t", "result")) <= 60
+
+        events = await store.read_events("t")
+        assert [kind for _, kind, _ in events] == ["status", "status", "completed"]
+        assert await store.read_events("t", events[-1][0], timeout=0.01) == []
+
+        # Обновление вытесненной задачи её не воскрешает
+        await store.update("gone", status="running")
+        assert await store.get("gone") is None
+        assert await store.count_active() == 0
+
+
 class TestStreamEndpoint:
     """Тесты для /analyze/stream endpoint"""
 
@@ -253,3 +369,191 @@ class TestInputValidation:
                     json={"task": "Test", "task_type": task_type},
                 )
                 assert response.status_code == 200, f"Failed for task_type: {task_type}"
+
+
+class TestStreamTokens:
+    """Тесты token-level streaming"""
+
+    def test_stream_emits_node_and_completion_events(self, client):
+        with patch("src.api.main.langgraph_app") as mock_app:
+            async def mock_stream(*args, **kwargs):
+                from src.agents.streaming import get_token_stream
+                stream = get_token_stream()
+                await stream.emit("ChatGPT", "analysis", "Привет")
+                yield {"parallel_analysis": {"iteration": 1}}
+
+            mock_app.astream = mock_stream
+
+            response = client.get("/analyze/stream", params={"task": "Test task"})
+
+            body = response.text
+            assert "event: token" in body
+            assert "Привет" in body
+            assert "parallel_analysis" in body
+            assert body.rstrip().endswith('{"status": "completed"}')
+
+
+class TestBatchEndpoint:
+    """Тесты /analyze/batch"""
+
+    @staticmethod
+    def _events(text: str) -> list[tuple[str, dict]]:
+        events = []
+        for block in text.strip().split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in block.splitlines())
+            events.append((lines["event"], json.loads(lines["data"])))
+        return events
+
+    @pytest.mark.unit
+    def test_json_batch_streams_items(self, client, sample_state):
+        with patch("src.api.main.langgraph_app") as mock_app:
+            mock_app.ainvoke = AsyncMock(return_value=sample_state)
+            response = client.post("/analyze/batch", json={"items": [
+                {"task": "Задача 1"}, {"task": "Задача 2"}, {"task": "Задача 1"},
+            ]})
+
+        assert response.status_code == 200
+        events = self._events(response.text)
+        items = {data["index"]: data for kind, data in events if kind == "item"}
+        assert sorted(items) == [0, 1, 2]
+        assert items[2]["duplicate_of"] == 0
+        assert mock_app.ainvoke.await_count == 2
+
+        kind, stats = events[-1]
+        assert kind == "done"
+        assert stats["items"] == 3 and stats["unique"] == 2 and stats["completed"] == 3
+
+    @pytest.mark.unit
+    def test_jsonl_upload(self, client, sample_state):
+        body = '{"task": "Задача 1"}\n\n{"task": "Задача 2", "task_type": "audit"}\n'
+        with patch("src.api.main.langgraph_app") as mock_app:
+            mock_app.ainvoke = AsyncMock(return_value=sample_state)
+            response = client.post(
+                "/analyze/batch",
+                content=body.encode(),
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+
+        assert response.status_code == 200
+        assert self._events(response.text)[-1][1]["completed"] == 2
+
+    @pytest.mark.unit
+    def test_invalid_batch(self, client):
+        response = client.post(
+            "/analyze/batch",
+            content=b'{"task": "ok"}\n{"task": ""}\n',
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert response.status_code == 422
+        assert response.json()["detail"]["line"] == 2
+
+        assert client.post("/analyze/batch", json={"items": []}).status_code == 422
+
+
+class TestPriorityHeaders:
+    """Тесты класса приоритета LLM вызовов по эндпоинтам"""
+
+    @pytest.mark.unit
+    def test_priority_scope_per_endpoint(self, client, sample_state):
+        from src.infrastructure.admission import current_priority
+
+        seen = []
+
+        async def ainvoke(state, config):
+            seen.append(current_priority())
+            return sample_state
+
+        with patch("src.api.main.langgraph_app") as mock_app:
+            mock_app.ainvoke = ainvoke
+            client.post("/analyze", json={"task": "Задача 1"})
+            client.post("/analyze", json={"task": "Задача 2"}, headers={"X-Priority": "batch", "X-Tenant-ID": "t1"})
+            client.post("/analyze/batch", json={"items": [{"task": "Задача 3"}]}, headers={"X-Tenant-ID": "t2"})
+
+        assert seen == [("interactive", ""), ("batch", "t1"), ("batch", "t2")]
+
+
+class TestRequestCoalescing:
+    """Тесты объединения одинаковых одновременных запросов"""
+
+    @pytest.mark.unit
+    async def test_identical_requests_share_graph_run(self, sample_state):
+        async def slow_invoke(state, config):
+            await asyncio.sleep(0.05)
+            return sample_state
+
+        with patch("src.api.main.langgraph_app") as mock_app:
+            mock_app.ainvoke = AsyncMock(side_effect=slow_invoke)
+            same = TaskInput(task="Test task", context="ctx")
+            other = TaskInput(task="Test task", context="ctx", max_iterations=1)
+
+            results = await asyncio.gather(
+                _run_analysis(same, "t1"),
+                _run_analysis(same, "t2"),
+                _run_analysis(same, "t3"),
+                _run_analysis(other, "t4"),
+            )
+
+            assert mock_app.ainvoke.await_count == 2
+            assert results[0] is results[1] is results[2]
+            assert not analysis_flights.in_flight(_request_key(same))
+
+    @pytest.mark.unit
+    async def test_async_requests_coalesced(self, sample_state, task_store):
+        async def slow_invoke(state, config):
+            await asyncio.sleep(0.05)
+            return sample_state
+
+        with patch("src.api.main.langgraph_app") as mock_app:
+            mock_app.ainvoke = AsyncMock(side_effect=slow_invoke)
+            input_data = TaskInput(task="Test task")
+            for task_id in ("a", "b"):
+                await task_store.create(task_id, input_data.model_dump())
+
+            await asyncio.gather(
+                run_analysis_background("a", input_data),
+                run_analysis_background("b", input_data),
+            )
+
+            assert mock_app.ainvoke.await_count == 1
+            a, b = await task_store.get("a"), await task_store.get("b")
+            assert a["status"] == b["status"] == "completed"
+
+    @pytest.mark.unit
+    async def test_async_task_joining_sync_run_gets_progress(self, sample_state, task_store):
+        """Задача /analyze/async, присоединившаяся к /analyze, получает события node"""
+        from uuid import uuid4
+
+        async def slow_invoke(state, config):
+            await asyncio.sleep(0.05)
+            for handler in config["callbacks"]:
+                run_id = uuid4()
+                await handler.on_chain_start(
+                    {}, {}, run_id=run_id, name="parallel_analysis",
+                    metadata={"langgraph_node": "parallel_analysis"},
+                )
+                await handler.on_chain_end({"analyses": [1, 2]}, run_id=run_id)
+            return sample_state
+
+        with patch("src.api.main.langgraph_app") as mock_app:
+            mock_app.ainvoke = AsyncMock(side_effect=slow_invoke)
+            input_data = TaskInput(task="Test task")
+            await task_store.create("a", input_data.model_dump())
+
+            sync = asyncio.create_task(_run_analysis(input_data, "sync"))
+            await asyncio.sleep(0.01)
+            await run_analysis_background("a", input_data)
+            await sync
+
+            assert mock_app.ainvoke.await_count == 1
+            kinds = [kind for _, kind, _ in await task_store.read_events("a")]
+            assert "node" in kinds and kinds[-1] == "completed"
+            assert _request_key(input_data) not in flight_tasks
+
+    @pytest.mark.unit
+    async def test_sync_run_leaves_no_subscribers(self, sample_state):
+        with patch("src.api.main.langgraph_app") as mock_app:
+            mock_app.ainvoke = AsyncMock(return_value=sample_state)
+            input_data = TaskInput(task="Sync only")
+            await _run_analysis(input_data, "t1")
+
+            assert _request_key(input_data) not in flight_tasks
@@ -3,6 +3,7 @@ LLM-top: Graph Tests
 Тесты для LangGraph workflow
 """
 
+import asyncio
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
 
@@ -14,8 +15,17 @@ from src.graph.workflow import (
     should_continue,
     create_workflow,
     create_app,
+    consensus_precheck,
+    route_after_precheck,
+    adaptive_check,
+    focused_refine,
+    pipelined_analysis_critique,
 )
-from src.models.state import CosiliumState, AgentAnalysis, AgentCritique, SynthesisResult
+from src.graph.consensus import agreement_matrix, decide
+from src.graph.topology import CritiqueTopology, plan_critiques
+from src.agents.hedging import AgentDeadline, analyze_with_deadline, gather_quorum, hedged
+from src.config import get_settings
+from src.models.state import CosiliumState, AgentAnalysis, AgentCritique, IterationMetrics, SynthesisResult
 
 
 class TestParallelAnalysis:
@@ -64,6 +74,105 @@ class TestParallelAnalysis:
             assert len(result["analyses"]) >= 1
 
 
+class TestDeadlines:
+    """Тесты дедлайнов, hedge-запросов и кворума анализа"""
+
+    @staticmethod
+    def _delayed(delay: float, value=None, error: Exception = None):
+        async def call():
+            await asyncio.sleep(delay)
+            if error:
+                raise error
+            return value
+        return call
+
+    @pytest.mark.unit
+    async def test_hedge_wins_after_soft_deadline(self):
+        result = await hedged(self._delayed(1.0, "primary"), self._delayed(0.01, "hedge"), soft=0.02, hard=2.0)
+        assert result == "hedge"
+
+    @pytest.mark.unit
+    async def test_no_hedge_before_soft_deadline(self):
+        hedge = AsyncMock(return_value="hedge")
+        result = await hedged(self._delayed(0.01, "primary"), hedge, soft=0.5, hard=2.0)
+        assert result == "primary"
+        hedge.assert_not_called()
+
+    @pytest.mark.unit
+    async def test_hedge_on_early_failure(self):
+        result = await hedged(
+            self._delayed(0, error=RuntimeError("503")), self._delayed(0.01, "hedge"), soft=10, hard=20
+        )
+        assert result == "hedge"
+
+    @pytest.mark.unit
+    async def test_hard_deadline(self):
+        with pytest.raises(asyncio.TimeoutError):
+            await hedged(self._delayed(1.0), self._delayed(1.0), soft=0.01, hard=0.05)
+
+    @pytest.mark.unit
+    async def test_agent_fallback_model(self, sample_analysis):
+        agent = MagicMock()
+        agent.name = "ChatGPT"
+        agent.agent_type = "chatgpt"
+        fallback = MagicMock()
+        agent.fallback_llm = MagicMock(return_value=fallback)
+
+        async def analyze(task, task_type, context, llm=None):
+            await asyncio.sleep(0.01 if llm is fallback else 1.0)
+            return sample_analysis
+
+        agent.analyze = analyze
+        deadline = AgentDeadline(soft=0.02, hard=2.0, fallback_model="gpt-4o-mini")
+        with patch("src.agents.hedging.get_agent_deadline", return_value=deadline):
+            assert await analyze_with_deadline(agent, "task", "research", "") is sample_analysis
+        agent.fallback_llm.assert_called_once_with("gpt-4o-mini")
+
+    @pytest.mark.unit
+    async def test_same_model_fallback_not_hedged(self, sample_analysis):
+        """Запасная модель совпадает с основной — hedge-запроса нет"""
+        agent = MagicMock()
+        agent.name = "DeepSeek"
+        agent.agent_type = "deepseek"
+        agent.llm.model_name = "deepseek-chat"
+        agent.analyze = AsyncMock(return_value=sample_analysis)
+
+        deadline = AgentDeadline(soft=0.0, hard=2.0, fallback_model="deepseek-chat")
+        with patch("src.agents.hedging.get_agent_deadline", return_value=deadline):
+            assert await analyze_with_deadline(agent, "task", "research", "") is sample_analysis
+        agent.fallback_llm.assert_not_called()
+        assert agent.analyze.await_count == 1
+
+    @pytest.mark.unit
+    async def test_gather_quorum(self):
+        results = await gather_quorum(
+            [self._delayed(0.01, 1)(), self._delayed(0, error=ValueError())(), self._delayed(0.02, 2)(),
+             self._delayed(5.0, 3)()],
+            quorum=2,
+        )
+        assert results[0] == 1 and results[2] == 2
+        assert isinstance(results[1], ValueError)
+        assert isinstance(results[3], asyncio.CancelledError)
+
+    @pytest.mark.unit
+    async def test_parallel_analysis_quorum(self, initial_state, sample_analysis):
+        fast = MagicMock()
+        fast.analyze = AsyncMock(return_value=sample_analysis)
+        async def slow_analyze(*args):
+            await asyncio.sleep(5.0)
+            return sample_analysis
+
+        slow = MagicMock()
+        slow.analyze = slow_analyze
+        agents = {"a": fast, "b": fast, "c": slow}
+
+        settings = get_settings()
+        with patch("src.graph.workflow.get_agents", return_value=agents), \
+                patch.object(settings, "analysis_quorum", 2):
+            result = await asyncio.wait_for(parallel_analysis(initial_state), 1.0)
+        assert len(result["analyses"]) == 2
+
+
 class TestAdversarialCritique:
     """Тесты для ноды adversarial_critique"""
 
@@ -216,6 +325,7 @@ class TestWorkflowCreation:
 
         # Check nodes exist
         assert "parallel_analysis" in workflow.nodes
+        assert "consensus_precheck" in workflow.nodes
         assert "adversarial_critique" in workflow.nodes
         assert "synthesize" in workflow.nodes
         assert "check_consensus" in workflow.nodes
@@ -231,3 +341,531 @@ class TestWorkflowCreation:
 
             assert app is not None
             mock_workflow.compile.assert_called_once()
+
+
+class TestCritiqueTopology:
+    """Тесты топологий критики"""
+
+    @pytest.fixture
+    def critics(self):
+        return ["chatgpt", "claude", "gemini", "deepseek"]
+
+    @pytest.mark.unit
+    def test_full_mesh_is_quadratic(self, critics, sample_analyses):
+        plan = plan_critiques(CritiqueTopology.FULL_MESH, critics, sample_analyses)
+        assert len(plan) == 12
+        assert all(a.critic != a.targets[0].agent_name.lower() for a in plan)
+
+    @pytest.mark.unit
+    def test_ring_critiques_each_analysis_once(self, critics, sample_analyses):
+        plan = plan_critiques(CritiqueTopology.RING, critics, sample_analyses)
+        assert len(plan) == 4
+        pairs = {(a.critic, a.targets[0].agent_name) for a in plan}
+        assert ("chatgpt", "Claude") in pairs
+        assert ("deepseek", "ChatGPT") in pairs
+
+    @pytest.mark.unit
+    def test_single_critic(self, critics, sample_analyses):
+        plan = plan_critiques(
+            CritiqueTopology.SINGLE_CRITIC, critics, sample_analyses, single_critic="claude"
+        )
+        assert len(plan) == 3
+        assert {a.critic for a in plan} == {"claude"}
+
+    @pytest.mark.unit
+    def test_batched_one_call_per_critic(self, critics, sample_analyses):
+        plan = plan_critiques(CritiqueTopology.BATCHED, critics, sample_analyses)
+        assert len(plan) == 4
+        assert all(a.batched and len(a.targets) == 3 for a in plan)
+
+    @pytest.mark.unit
+    async def test_node_reports_stats(self, sample_analyses, sample_critique):
+        state = CosiliumState(
+            task="Test",
+            task_type="research",
+            context="",
+            analyses=sample_analyses,
+            critiques=[],
+            synthesis=None,
+            iteration=1,
+            max_iterations=3,
+            should_continue=True,
+            error=None,
+            critique_topology="batched",
+        )
+
+        mock_agent = MagicMock()
+        mock_agent.critique_batch = AsyncMock(return_value=[sample_critique, sample_critique])
+        mock_agents = {"chatgpt": mock_agent, "claude": mock_agent}
+
+        with patch("src.graph.workflow.get_agents", return_value=mock_agents):
+            result = await adversarial_critique(state)
+
+        assert len(result["critiques"]) == 4
+        stats = result["critique_stats"][0]
+        assert stats.topology == "batched"
+        assert stats.calls == 2
+
+
+class TestConsensusPrecheck:
+    """Тесты проверки согласия анализов перед критикой"""
+
+    @staticmethod
+    def _analyses(*key_points: list[str]) -> list[AgentAnalysis]:
+        names = ["ChatGPT", "Claude", "Gemini", "DeepSeek"]
+        return [
+            AgentAnalysis(agent_name=name, analysis="Анализ", confidence=0.8, key_points=points)
+            for name, points in zip(names, key_points)
+        ]
+
+    @staticmethod
+    def _state(analyses: list[AgentAnalysis], **extra) -> CosiliumState:
+        return CosiliumState(
+            task="Test",
+            task_type="research",
+            context="",
+            analyses=analyses,
+            critiques=[],
+            synthesis=None,
+            iteration=1,
+            max_iterations=3,
+            should_continue=True,
+            error=None,
+            **extra,
+        )
+
+    @pytest.fixture
+    def agents(self):
+        return {name: MagicMock() for name in ["chatgpt", "claude", "gemini", "deepseek"]}
+
+    @pytest.mark.unit
+    def test_agreement_matrix(self):
+        analyses = self._analyses(
+            ["Рынок растёт на 15% в год", "Конкуренция высокая"],
+            ["Рынок растет на 15% ежегодно", "Высокая конкуренция на рынке"],
+            ["Санкции отрезают поставщиков оборудования"],
+        )
+        matrix = agreement_matrix(analyses)
+
+        assert matrix.shape == (3, 3)
+        assert (matrix == matrix.T).all()
+        assert matrix[0, 0] == 1
+        assert matrix[0, 1] > 0.6
+        assert matrix[0, 2] < 0.2
+        assert decide(matrix)[0] == "full"
+
+    @pytest.mark.unit
+    def test_contradicting_conclusions_disagree(self):
+        yes = ["Рынок вырастет на 10% в год", "Стоит инвестировать"]
+        no = ["Рынок не вырастет на 10% в год", "Не стоит инвестировать"]
+        matrix = agreement_matrix(self._analyses(yes, yes, no, no))
+
+        assert matrix[0, 1] == pytest.approx(1.0)
+        assert matrix[0, 2] < 0.2
+        assert decide(matrix)[0] == "full"
+
+    @pytest.mark.unit
+    async def test_skip_is_opt_in(self, agents):
+        points = ["Рынок растёт на 15% в год", "Конкуренция высокая"]
+        state = self._state(self._analyses(points, points, points, points), critique_topology="full_mesh")
+
+        with patch("src.graph.workflow.get_agents", return_value=agents):
+            result = await consensus_precheck(state)
+
+        assert result["critique_mode"] == "reduced"
+        assert result["consensus_stats"][0].topology == "ring"
+
+    @pytest.mark.unit
+    async def test_agreeing_analyses_skip_critique(self, agents, monkeypatch):
+        monkeypatch.setattr(get_settings(), "consensus_skip_enabled", True)
+        points = ["Рынок растёт на 15% в год", "Конкуренция высокая"]
+        state = self._state(self._analyses(points, points, points, points), critique_topology="full_mesh")
+
+        with patch("src.graph.workflow.get_agents", return_value=agents):
+            result = await consensus_precheck(state)
+
+        stats = result["consensus_stats"][0]
+        assert result["critique_mode"] == "skip"
+        assert stats.planned_calls == stats.saved_calls == 12
+        assert stats.saved_tokens > 0
+        assert stats.topology == ""
+        assert route_after_precheck({**state, **result}) == "synthesize"
+
+    @pytest.mark.unit
+    async def test_partial_agreement_reduces_topology(self, agents, monkeypatch, sample_critique):
+        monkeypatch.setattr(get_settings(), "consensus_skip_threshold", 1.01)
+        monkeypatch.setattr(get_settings(), "consensus_reduce_threshold", 0.5)
+        points = ["Рынок растёт на 15% в год", "Конкуренция высокая"]
+        state = self._state(self._analyses(points, points, points, points), critique_topology="full_mesh")
+
+        with patch("src.graph.workflow.get_agents", return_value=agents):
+            result = await consensus_precheck(state)
+            stats = result["consensus_stats"][0]
+            assert result["critique_mode"] == "reduced"
+            assert stats.topology == "ring"
+            assert stats.saved_calls == 8
+            assert route_after_precheck({**state, **result}) == "critique"
+
+            for agent in agents.values():
+                agent.critique = AsyncMock(return_value=sample_critique)
+            critique = await adversarial_critique({**state, **result})
+
+        assert critique["critique_stats"][0].topology == "ring"
+        assert critique["critique_stats"][0].calls == 4
+
+    @pytest.mark.unit
+    async def test_disabled(self, agents, monkeypatch, sample_analyses):
+        monkeypatch.setattr(get_settings(), "consensus_precheck_enabled", False)
+        result = await consensus_precheck(self._state(sample_analyses))
+        assert result == {"critique_mode": "full"}
+
+    @pytest.mark.unit
+    async def test_skipped_critique_sets_consensus_level(self, sample_synthesis, agents, monkeypatch):
+        monkeypatch.setattr(get_settings(), "consensus_skip_enabled", True)
+        points = ["Рынок растёт на 15% в год"]
+        state = self._state(self._analyses(points, points))
+        with patch("src.graph.workflow.get_agents", return_value=agents):
+            state.update(await consensus_precheck(state))
+
+        mock_synth = MagicMock()
+        mock_synth.synthesize = AsyncMock(return_value=sample_synthesis.model_copy(update={"consensus_level": 0.5}))
+        with patch("src.graph.workflow.get_synthesizer", return_value=mock_synth):
+            result = await synthesize_results(state)
+
+        assert result["synthesis"].consensus_level == pytest.approx(1.0)
+        assert check_consensus({**state, **result}) == {"should_continue": False}
+
+
+class TestAdaptiveIterations:
+    """Тесты варианта графа adaptive"""
+
+    @staticmethod
+    def _state(analyses, critiques, synthesis, history=()) -> CosiliumState:
+        return CosiliumState(
+            task="Test",
+            task_type="research",
+            context="",
+            analyses=analyses,
+            critiques=critiques,
+            synthesis=synthesis,
+            iteration=3,
+            max_iterations=3,
+            should_continue=True,
+            error=None,
+            iteration_metrics=list(history),
+        )
+
+    @staticmethod
+    def _critique(target: str, weakness: str, score: float = 5) -> AgentCritique:
+        return AgentCritique(
+            critic_name="ChatGPT", target_name=target, critique="c", score=score,
+            weaknesses=[weakness], suggestions=["Добавить данные"],
+        )
+
+    @pytest.mark.unit
+    def test_continues_while_weak_areas(self, sample_analyses, sample_synthesis):
+        synthesis = sample_synthesis.model_copy(update={"consensus_level": 0.5})
+        state = self._state(sample_analyses, [self._critique("Claude", "Нет оценки рынка")], synthesis)
+
+        result = adaptive_check(state)
+
+        assert result["should_continue"] is True
+        metrics = result["iteration_metrics"][0]
+        assert metrics.iteration_number == 1
+        assert metrics.reason == "weak_areas_identified"
+
+    @pytest.mark.unit
+    def test_stops_when_improvement_stalls(self, sample_analyses, sample_synthesis):
+        previous = IterationMetrics(
+            iteration_number=1, consensus_level=0.5, avg_critique_score=5, disagreement_count=1
+        )
+        synthesis = sample_synthesis.model_copy(update={"consensus_level": 0.52})
+        state = self._state(
+            sample_analyses, [self._critique("Claude", "Нет оценки рынка")], synthesis, [previous]
+        )
+
+        result = adaptive_check(state)
+
+        assert result["should_continue"] is False
+        assert result["iteration_metrics"][0].reason == "diminishing_returns"
+
+    @pytest.mark.unit
+    def test_stops_without_weaknesses(self, sample_analyses, sample_synthesis):
+        synthesis = sample_synthesis.model_copy(update={"consensus_level": 0.5})
+        critique = AgentCritique(critic_name="ChatGPT", target_name="Claude", critique="c", score=7)
+
+        result = adaptive_check(self._state(sample_analyses, [critique], synthesis))
+
+        assert result["should_continue"] is False
+        assert result["iteration_metrics"][0].reason == "nothing_to_refine"
+
+    @pytest.mark.unit
+    async def test_refines_only_targeted_agents(self, sample_analyses, sample_synthesis):
+        from src.graph.iterative import FocusedRefiner
+
+        critiques = [
+            self._critique("Claude", "Нет оценки рынка"),
+            self._critique("Gemini", "Нет оценки рынка"),
+        ]
+        refiner = FocusedRefiner()
+
+        async def refine(analysis, targets, critiques):
+            assert all(analysis.agent_name in t.agents for t in targets)
+            return analysis.model_copy(update={"analysis": analysis.analysis + " (уточнено)"})
+
+        with patch("src.graph.workflow.get_refiner", return_value=refiner), \
+                patch.object(refiner, "refine_analysis", AsyncMock(side_effect=refine)) as mock_refine:
+            result = await focused_refine(self._state(sample_analyses, critiques, sample_synthesis))
+
+        assert mock_refine.await_count == 2
+        assert {a.agent_name for a in result["analyses"]} == {"Claude", "Gemini"}
+        assert result["critique_mode"] == "full"
+
+    @pytest.mark.unit
+    def test_create_adaptive_workflow(self):
+        workflow = create_workflow("adaptive")
+        assert workflow.nodes["check_consensus"] is not None
+        assert "refine" in workflow.nodes
+
+
+class TestPipelinedStages:
+    """Тесты конвейера анализ → критика"""
+
+    @staticmethod
+    def _agents(release: asyncio.Event) -> dict:
+        def make(name: str, slow: bool):
+            agent = MagicMock()
+            agent.name = name
+
+            async def analyze(task, task_type, context):
+                if slow:
+                    await release.wait()  # Отпускает только критика анализа быстрого
+                return AgentAnalysis(agent_name=name, analysis=f"Анализ {name}", confidence=0.8)
+
+            async def critique(task, target_name, analysis):
+                release.set()
+                return AgentCritique(critic_name=name, target_name=target_name, critique="c", score=7)
+
+            agent.analyze = AsyncMock(side_effect=analyze)
+            agent.critique = AsyncMock(side_effect=critique)
+            return agent
+
+        return {"chatgpt": make("ChatGPT", slow=False), "claude": make("Claude", slow=True)}
+
+    @pytest.mark.unit
+    async def test_critique_starts_before_slowest_analysis(self, initial_state):
+        release = asyncio.Event()
+        initial_state["critique_topology"] = "full_mesh"
+
+        with patch("src.graph.workflow.get_agents", return_value=self._agents(release)):
+            result = await asyncio.wait_for(pipelined_analysis_critique(initial_state), timeout=2)
+
+        assert {a.agent_name for a in result["analyses"]} == {"ChatGPT", "Claude"}
+        assert {(c.critic_name, c.target_name) for c in result["critiques"]} == {
+            ("Claude", "ChatGPT"), ("ChatGPT", "Claude"),
+        }
+        assert result["critique_stats"][0].calls == 2
+        assert result["iteration"] == 2
+
+    @pytest.mark.unit
+    async def test_batched_waits_for_all_analyses(self, initial_state, sample_critique):
+        release = asyncio.Event()
+        release.set()
+        agents = self._agents(release)
+        for agent in agents.values():
+            agent.critique_batch = AsyncMock(return_value=[sample_critique])
+        initial_state["critique_topology"] = "batched"
+
+        with patch("src.graph.workflow.get_agents", return_value=agents):
+            result = await pipelined_analysis_critique(initial_state)
+
+        assert result["critique_stats"][0].topology == "batched"
+        assert result["critique_stats"][0].calls == 2
+        assert all(a.critique.await_count == 0 for a in agents.values())
+
+    @pytest.mark.unit
+    def test_create_pipelined_workflow(self):
+        workflow = create_workflow(pipelined=True)
+        assert "analysis_critique" in workflow.nodes
+        assert "parallel_analysis" not in workflow.nodes
+        assert "adversarial_critique" in workflow.nodes
+
+
+class TestIncrementalCritique:
+    """Тесты переиспользования критики между итерациями"""
+
+    @pytest.mark.unit
+    async def test_unchanged_analyses_are_not_recritiqued(self, sample_analyses):
+        chatgpt, claude = sample_analyses[0], sample_analyses[1]
+
+        def make_agent(name):
+            agent = MagicMock()
+            agent.name = name
+
+            async def critique(task, target_name, analysis):
+                return AgentCritique(
+                    critic_name=name, target_name=target_name, critique="c", score=7
+                )
+
+            agent.critique = AsyncMock(side_effect=critique)
+            return agent
+
+        mock_agents = {"chatgpt": make_agent("ChatGPT"), "claude": make_agent("Claude")}
+        state = CosiliumState(
+            task="Test",
+            task_type="research",
+            context="",
+            analyses=[chatgpt, claude],
+            critiques=[],
+            synthesis=None,
+            iteration=1,
+            max_iterations=5,
+            should_continue=True,
+            error=None,
+        )
+
+        with patch("src.graph.workflow.get_agents", return_value=mock_agents):
+            first = await adversarial_critique(state)
+            assert first["critique_stats"][0].calls == 2
+
+            # Claude обновил анализ — перекритиковать нужно только его
+            refined = claude.model_copy(update={"analysis": "Уточнённый анализ"})
+            state["critiques"] = first["critiques"]
+            state["analyses"] = [chatgpt, refined]
+            second = await adversarial_critique(state)
+
+        stats = second["critique_stats"][0]
+        assert stats.calls == 1
+        assert stats.reused == 1
+        assert [c.target_name for c in second["critiques"]] == ["Claude"]
+        assert second["critiques"][0].target_hash == refined.content_hash()
+
+
+class TestStageCache:
+    """Тесты кэша этапов"""
+
+    @pytest.fixture
+    def stage_cache(self, monkeypatch):
+        from src.config import get_settings
+        from src.infrastructure import stage_cache as module
+
+        cache = module.StageCache()
+        cache._redis_down_until = float("inf")  # только L1
+        monkeypatch.setattr(get_settings(), "stage_cache_enabled", True)
+        monkeypatch.setattr(module, "_stage_cache", cache)
+        return cache
+
+    @staticmethod
+    def _agent(name: str, **methods) -> MagicMock:
+        agent = MagicMock()
+        agent.name = name
+        agent.model_id = f"{name.lower()}-model@0.7"
+        agent.prompt_version = MagicMock(return_value="v1")
+        for method, mock in methods.items():
+            setattr(agent, method, mock)
+        return agent
+
+    @pytest.mark.unit
+    async def test_retry_only_runs_failed_agents(self, stage_cache, initial_state):
+        ok = self._agent("ChatGPT", analyze=AsyncMock(
+            return_value=AgentAnalysis(agent_name="ChatGPT", analysis="A", confidence=0.8)
+        ))
+        flaky = self._agent("Claude", analyze=AsyncMock(side_effect=[
+            Exception("timeout"),
+            AgentAnalysis(agent_name="Claude", analysis="B", confidence=0.7),
+        ]))
+        agents = {"chatgpt": ok, "claude": flaky}
+
+        with patch("src.graph.workflow.get_agents", return_value=agents):
+            first = await parallel_analysis(initial_state)
+            second = await parallel_analysis(initial_state)
+
+        assert [a.agent_name for a in first["analyses"]] == ["ChatGPT"]
+        assert {a.agent_name for a in second["analyses"]} == {"ChatGPT", "Claude"}
+        assert ok.analyze.await_count == 1
+        assert flaky.analyze.await_count == 2
+
+    @pytest.mark.unit
+    async def test_hedge_answer_not_cached(self, stage_cache, initial_state):
+        """Ответ запасной модели не кэшируется под ключом основной"""
+        async def analyze(task, task_type, context, llm=None):
+            if llm is None:
+                await asyncio.sleep(1.0)
+            return AgentAnalysis(agent_name="ChatGPT", analysis="A", confidence=0.8)
+
+        agent = self._agent("ChatGPT", analyze=AsyncMock(side_effect=analyze))
+        agent.agent_type = "chatgpt"
+        agent.llm.model_name = "gpt-4o"
+        deadline = AgentDeadline(soft=0.01, hard=2.0, fallback_model="gpt-4o-mini")
+
+        with patch("src.graph.workflow.get_agents", return_value={"chatgpt": agent}), \
+                patch("src.agents.hedging.get_agent_deadline", return_value=deadline):
+            first = await parallel_analysis(initial_state)
+            second = await parallel_analysis(initial_state)
+
+        assert [a.agent_name for a in first["analyses"]] == ["ChatGPT"]
+        assert [a.agent_name for a in second["analyses"]] == ["ChatGPT"]
+        # Оба запуска вызывали модели: первый ответ в кэш не попал
+        assert agent.analyze.await_count == 4
+
+    @pytest.mark.unit
+    async def test_critique_and_synthesis_reused_across_runs(
+        self, stage_cache, sample_analyses, sample_synthesis
+    ):
+        def critique(task, target_name, analysis):
+            return AgentCritique(
+                critic_name="ChatGPT", target_name=target_name, critique="ok", score=7.0
+            )
+
+        critic = self._agent("ChatGPT", critique=AsyncMock(side_effect=critique))
+        synthesizer = self._agent(
+            "Synthesizer", synthesize=AsyncMock(return_value=sample_synthesis)
+        )
+        state = CosiliumState(
+            task="Test",
+            task_type="research",
+            context="",
+            analyses=sample_analyses[1:3],
+            critiques=[],
+            synthesis=None,
+            iteration=1,
+            max_iterations=3,
+            should_continue=True,
+            error=None,
+        )
+
+        with patch("src.graph.workflow.get_agents", return_value={"chatgpt": critic}), \
+             patch("src.graph.workflow.get_synthesizer", return_value=synthesizer):
+            first = await adversarial_critique(state)
+            second = await adversarial_critique(state)
+            state["critiques"] = second["critiques"]
+            await synthesize_results(state)
+            await synthesize_results(state)
+
+        assert critic.critique.await_count == 2
+        assert second["critique_stats"][0].calls == 0
+        assert second["critique_stats"][0].reused == 2
+        assert len(second["critiques"]) == len(first["critiques"]) == 2
+        assert synthesizer.synthesize.await_count == 1
+
+
+class TestBenchmarkHarness:
+    """Смоук-тест бенчмарка графа на fake-моделях"""
+
+    @pytest.mark.unit
+    async def test_scenario_runs_full_graph(self):
+        from benchmarks.fake_llm import LatencyProfile
+        from benchmarks.harness import ScenarioConfig, run_scenario
+
+        result = await run_scenario(ScenarioConfig(
+            concurrency=2,
+            agents=3,
+            runs=2,
+            profile=LatencyProfile(ttft_ms=0, tokens_per_second=1e9),
+            measure_memory=False,
+        ))
+
+        assert result.errors == 0
+        assert result.stages["analysis"]["per_run_calls"] == 3
+        assert result.stages["synthesis"]["per_run_calls"] == 1
+        assert {"parallel_analysis", "adversarial_critique", "synthesize"} <= set(result.nodes_ms)
@@ -0,0 +1,809 @@
+"""
+LLM-top: Infrastructure Tests
+Тесты инфраструктурных компонентов
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock
+
+from src.infrastructure.cache import AnalysisCache, LRUCache, SemanticCache
+from src.infrastructure.redis_state import RedisCheckpointer
+from src.infrastructure.admission import AdmissionController, priority_scope
+from src.infrastructure.batch import BatchScheduler, ProviderSlots
+from src.infrastructure.single_flight import SingleFlight
+from src.infrastructure.vector_index import VectorIndex
+from src.infrastructure.worker_loop import WorkerLoop
+from src.infrastructure.rate_limiter import (
+    RateLimiter,
+    RateLimitConfig,
+    RateLimitExceeded,
+)
+from src.models.state import CosiliumOutput, TaskInput
+from src.monitoring.exporter import ADMISSION_PREEMPTED, NODE_DURATION, RATE_LIMIT_WAIT, Registry, timed_node
+
+
+def _limiter(rpm: int = 60, lease: int = 1) -> RateLimiter:
+    limiter = RateLimiter(backend="memory")
+    limiter.lease_requests = lease
+    limiter.lease_tokens = 0
+    limiter.set_limits("test", RateLimitConfig(
+        requests_per_minute=rpm,
+        requests_per_hour=100000,
+        tokens_per_minute=1000000,
+        tokens_per_hour=10000000,
+        concurrent_requests=100,
+    ))
+    return limiter
+
+
+class TestRateLimiter:
+    """Тесты GCRA rate limiter"""
+
+    @pytest.mark.unit
+    async def test_burst_admitted_without_wait(self):
+        limiter = _limiter(rpm=60)
+
+        for _ in range(60):
+            assert await limiter.wait_for_admission("test", timeout=0) < 0.05
+
+    @pytest.mark.unit
+    async def test_waits_for_slot_instead_of_rejecting(self):
+        limiter = _limiter()
+        limiter.limits["test"].tokens_per_minute = 600  # токен каждые 0.1s
+        await limiter.wait_for_admission("test", tokens=600, timeout=0)
+
+        waited = await limiter.wait_for_admission("test", tokens=1, timeout=1)
+
+        assert 0.05 <= waited < 0.5
+
+    @pytest.mark.unit
+    async def test_deadline_raises(self):
+        limiter = _limiter(rpm=60)
+        for _ in range(60):
+            await limiter.wait_for_admission("test", timeout=0)
+
+        with pytest.raises(RateLimitExceeded) as exc:
+            await limiter.wait_for_admission("test", timeout=0.1)
+
+        assert exc.value.limit_type == "requests_per_minute"
+        assert exc.value.retry_after >= 1
+
+    @pytest.mark.unit
+    async def test_queued_callers_admitted_in_order(self):
+        limiter = _limiter(rpm=1200)  # слот каждые 0.05s
+        for _ in range(1200):
+            await limiter.wait_for_admission("test", timeout=0)
+
+        order = []
+
+        async def caller(i: int):
+            await limiter.wait_for_admission("test", timeout=2)
+            order.append(i)
+
+        await asyncio.gather(*(caller(i) for i in range(5)))
+
+        assert order == [0, 1, 2, 3, 4]
+
+    @pytest.mark.unit
+    async def test_lease_fast_path_skips_store(self):
+        limiter = _limiter(rpm=600, lease=4)
+        calls = 0
+        reserve = limiter._store.reserve
+
+        async def counting_reserve(*args):
+            nonlocal calls
+            calls += 1
+            return await reserve(*args)
+
+        limiter._store.reserve = counting_reserve
+        for _ in range(8):
+            async with limiter.acquire("test", timeout=0):
+                pass
+
+        assert calls == 2
+
+    @pytest.mark.unit
+    async def test_redis_script_matches_memory(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        from src.infrastructure.rate_limiter import _RedisBuckets
+
+        limiter = _limiter(rpm=60)
+        limiter._store = _RedisBuckets(fakeredis.FakeAsyncRedis())
+
+        for _ in range(60):
+            await limiter.wait_for_admission("test", timeout=0)
+        with pytest.raises(RateLimitExceeded):
+            await limiter.check_and_increment("test")
+
+        usage = await limiter.get_usage("test")
+        assert usage["requests_per_minute"]["current"] == 60
+
+
+class TestVectorIndex:
+    """Тесты IVF индекса семантического кэша"""
+
+    @pytest.mark.unit
+    def test_exact_search_before_training(self):
+        index = VectorIndex()
+        index.add("a", [1.0, 0.0, 0.0])
+        index.add("b", [0.0, 1.0, 0.0])
+        index.add("c", [0.9, 0.1, 0.0])
+
+        result = index.search([1.0, 0.05, 0.0], k=2)
+
+        assert [key for key, _ in result] == ["a", "c"]
+        assert result[0][1] > 0.99
+
+    @pytest.mark.unit
+    def test_ivf_finds_near_duplicates(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((2000, 64)).astype(np.float32)
+        index = VectorIndex(nprobe=4, train_threshold=1000)
+        for i, vector in enumerate(vectors):
+            index.add(f"k{i}", vector)
+
+        assert index._centroids is not None
+        queries = vectors[:50] + 0.01 * rng.standard_normal((50, 64)).astype(np.float32)
+        results = index.search_batch(queries, k=1, threshold=0.95)
+
+        assert [r[0][0] for r in results] == [f"k{i}" for i in range(50)]
+
+    @pytest.mark.unit
+    def test_expired_entries_skipped_and_evicted(self):
+        index = VectorIndex()
+        index.add("old", [1.0, 0.0], expires_at=100.0)
+        index.add("new", [0.9, 0.1], expires_at=300.0)
+
+        assert [key for key, _ in index.search([1.0, 0.0], now=200.0)] == ["new"]
+        assert index.evict_expired(now=200.0) == ["old"]
+        assert len(index) == 1
+
+    @pytest.mark.unit
+    def test_remove_keeps_positions_consistent(self):
+        index = VectorIndex()
+        for i in range(5):
+            index.add(f"k{i}", [float(i == j) for j in range(5)])
+
+        index.remove("k1")
+        index.add("k0", [0.0, 0.0, 0.0, 0.0, 1.0])
+
+        assert index.search([0.0, 0.0, 0.0, 1.0, 0.0])[0][0] == "k3"
+        assert {key for key, _ in index.search([0.0, 0.0, 0.0, 0.0, 1.0], k=2)} == {"k0", "k4"}
+
+
+class TestSemanticCache:
+    """Тесты семантического кэша"""
+
+    @pytest.mark.unit
+    async def test_similar_analysis_loaded_from_redis(self, sample_analyses, sample_synthesis):
+        fakeredis = pytest.importorskip("fakeredis")
+        redis_client = fakeredis.FakeAsyncRedis()
+        embeddings = {
+            "Рынок облаков strategy ": [1.0, 0.0, 0.0],
+            "Рынок облачных решений strategy ": [0.99, 0.05, 0.0],
+        }
+
+        def make_cache() -> SemanticCache:
+            cache = SemanticCache()
+            cache.redis = redis_client
+            cache._embed = AsyncMock(
+                side_effect=lambda text: np.asarray(embeddings[text], dtype=np.float32)
+            )
+            return cache
+
+        result = CosiliumOutput(
+            task="Рынок облаков",
+            analyses=sample_analyses,
+            critiques=[],
+            synthesis=sample_synthesis,
+            iterations_used=1,
+        )
+        await make_cache().set_with_embedding("Рынок облаков", "strategy", "", result)
+
+        # Другой процесс загружает индекс из Redis
+        reader = make_cache()
+        found = await reader.get_similar_analysis("Рынок облачных решений", "strategy")
+
+        assert found is not None
+        assert found[0].task == "Рынок облаков"
+        assert found[1] > 0.95
+        assert len(reader.index) == 1
+
+
+class TestAnalysisCacheTiers:
+    """Тесты двухуровневого кэша результатов"""
+
+    @pytest.mark.unit
+    def test_lru_bounds_and_ttl(self):
+        cache = LRUCache(max_entries=2, max_bytes=100, ttl=60)
+        cache.set("a", 1, size=40)
+        cache.set("b", 2, size=40)
+        cache.get("a")
+        cache.set("c", 3, size=40)  # вытесняет b (давно не читали)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.size_bytes == 80
+
+        cache.set("d", 4, size=10, ttl=0)
+        assert cache.get("d") is None
+
+    @pytest.mark.unit
+    async def test_l1_serves_repeated_reads(self, sample_analyses, sample_synthesis):
+        fakeredis = pytest.importorskip("fakeredis")
+        cache = AnalysisCache()
+        cache.redis = fakeredis.FakeAsyncRedis()
+        result = CosiliumOutput(
+            task="Задача",
+            analyses=sample_analyses,
+            critiques=[],
+            synthesis=sample_synthesis,
+            iterations_used=1,
+        )
+        task_hash = await cache.set_analysis("Задача", "research", "", result)
+
+        # Другой процесс: L1 пуст, первое чтение из Redis
+        reader = AnalysisCache()
+        reader.redis = cache.redis
+        first = await reader.get_analysis("Задача", "research")
+        reader.redis = AsyncMock()  # дальше Redis не нужен
+        second = await reader.get_analysis("Задача", "research")
+
+        assert first is second
+        assert reader.redis.get.await_count == 0
+
+        reader.redis = cache.redis
+        await reader.flush_hits()
+        assert int(await cache.redis.get(cache._key(task_hash, "hits"))) == 2
+
+
+class TestSingleFlight:
+    """Тесты single-flight"""
+
+    @pytest.mark.unit
+    async def test_waiter_cancellation_keeps_shared_run(self):
+        flights = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return "done"
+
+        leader = asyncio.ensure_future(flights.do("k", work))
+        follower = asyncio.ensure_future(flights.do("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        assert await follower == "done"
+        assert calls == 1
+        assert len(flights) == 0
+
+
+class TestBatchScheduler:
+    """Тесты пакетного планировщика"""
+
+    @staticmethod
+    def _output(task: str) -> CosiliumOutput:
+        return CosiliumOutput.model_construct(task=task, analyses=[], critiques=[], iterations_used=1)
+
+    @pytest.mark.unit
+    async def test_duplicates_run_once(self):
+        calls = []
+
+        async def runner(item, thread_id):
+            calls.append(item.task)
+            if item.task == "сбой":
+                raise RuntimeError("boom")
+            return self._output(item.task)
+
+        items = [TaskInput(task="A"), TaskInput(task="B"), TaskInput(task="A"), TaskInput(task="сбой")]
+        scheduler = BatchScheduler(runner=runner, budgets={})
+        results = {r.index: r async for r in scheduler.run(items)}
+
+        assert sorted(calls) == ["A", "B", "сбой"]
+        assert results[2].duplicate_of == 0 and results[2].result.task == "A"
+        assert results[3].status == "failed" and "boom" in results[3].error
+        assert scheduler.stats.unique == 3
+        assert (scheduler.stats.completed, scheduler.stats.failed) == (3, 1)
+
+    @pytest.mark.unit
+    async def test_slots_go_to_earlier_items(self):
+        slots = ProviderSlots({"openai": 1})
+        order = []
+
+        async def call(priority):
+            async with slots.slot("openai", priority):
+                order.append(priority)
+                await asyncio.sleep(0.01)
+
+        first = asyncio.create_task(call(5))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(call(p)) for p in (3, 1, 2)]
+        await asyncio.sleep(0)
+        waiters[0].cancel()  # Отменённый ожидающий не забирает слот
+        await asyncio.gather(first, *waiters, return_exceptions=True)
+
+        assert order == [5, 1, 2]
+        assert slots._free["openai"] == 1
+        assert slots.calls["openai"] == 3
+
+    @pytest.mark.unit
+    async def test_llm_calls_share_provider_budget(self):
+        from langchain_core.messages import HumanMessage
+        from src.agents.streaming import invoke_llm
+
+        active = peak = 0
+
+        class SlowLLM:
+            async def ainvoke(self, messages, config=None):
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.02)
+                active -= 1
+                return type("Response", (), {"content": "ok", "usage_metadata": None})()
+
+        async def runner(item, thread_id):
+            await asyncio.gather(*(
+                invoke_llm(SlowLLM(), [HumanMessage(content=item.task)], "ChatGPT", "analysis", provider="openai")
+                for _ in range(3)
+            ))
+            return self._output(item.task)
+
+        scheduler = BatchScheduler(runner=runner, budgets={"openai": 2})
+        items = [TaskInput(task=f"Задача {i}") for i in range(4)]
+        assert len([r async for r in scheduler.run(items)]) == 4
+
+        assert peak == 2
+        [openai] = scheduler.stats.providers
+        assert openai.calls == 12 and openai.concurrency == 2
+        assert 0 < openai.utilization <= 1
+        assert scheduler.stats.items_per_minute > 0
+
+
+class TestAdmissionController:
+    """Тесты контроля допуска по классам приоритета"""
+
+    @staticmethod
+    def _controller(capacity: int = 1, headroom: int = 0, max_wait: float = 30.0, **weights):
+        controller = AdmissionController()
+        controller.concurrency = {"test": capacity}
+        controller.batch_headroom = headroom
+        controller.preempt_max_wait = max_wait
+        controller.weights.update(weights)
+        return controller
+
+    @staticmethod
+    async def _order(controller: AdmissionController, calls: list[tuple[str, str]]) -> list[int]:
+        """Занять единственный слот, поставить calls (класс, тенант) в очередь; порядок допуска"""
+        order = []
+        gate = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("test"):
+                await gate.wait()
+
+        async def call(index: int, priority: str, tenant: str):
+            with priority_scope(priority, tenant):
+                async with controller.admit("test"):
+                    order.append(index)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        tasks = []
+        for index, (priority, tenant) in enumerate(calls):
+            tasks.append(asyncio.create_task(call(index, priority, tenant)))
+            await asyncio.sleep(0)
+        assert controller.queue_depths()[("test", calls[0][0])] >= 1
+        gate.set()
+        await asyncio.gather(holder, *tasks)
+        return order
+
+    @pytest.mark.unit
+    async def test_interactive_preempts_queued_batch(self):
+        preempted = ADMISSION_PREEMPTED.labels("test").value
+        controller = self._controller()
+        order = await self._order(controller, [("batch", ""), ("batch", ""), ("interactive", "")])
+
+        assert order == [2, 0, 1]
+        assert ADMISSION_PREEMPTED.labels("test").value > preempted
+
+    @pytest.mark.unit
+    async def test_starved_batch_not_preempted(self):
+        controller = self._controller(max_wait=0)
+        order = await self._order(controller, [("batch", "")] + [("interactive", "")] * 4)
+        # Долго ждущий batch вызов получает долю по весу, а не ждёт всех интерактивных
+        assert order.index(0) == 1
+
+    @pytest.mark.unit
+    async def test_weighted_fair_between_classes(self):
+        controller = self._controller(interactive=3.0, standard=1.0)
+        calls = [("standard", "")] * 8 + [("interactive", "")] * 8
+        order = await self._order(controller, calls)
+
+        first = order[:8]
+        assert sum(index >= 8 for index in first) == 6  # 3:1 по весам
+
+    @pytest.mark.unit
+    async def test_tenants_share_class(self):
+        controller = self._controller()
+        calls = [("standard", "a")] * 4 + [("standard", "b")] * 2
+        order = await self._order(controller, calls)
+        assert order[:4] == [0, 4, 1, 5]
+
+    @pytest.mark.unit
+    async def test_batch_headroom(self):
+        controller = self._controller(capacity=2, headroom=1)
+        gate = asyncio.Event()
+        admitted = []
+
+        async def call(name: str, priority: str):
+            with priority_scope(priority):
+                async with controller.admit("test"):
+                    admitted.append(name)
+                    await gate.wait()
+
+        tasks = [asyncio.create_task(call(f"batch{i}", "batch")) for i in range(2)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(call("interactive", "interactive")))
+        await asyncio.sleep(0)
+
+        # Второй batch ждёт: последний слот — запас для интерактивных
+        assert admitted == ["batch0", "interactive"]
+        gate.set()
+        await asyncio.gather(*tasks)
+        assert admitted[-1] == "batch1"
+
+    @pytest.mark.unit
+    async def test_cancelled_waiter_releases_queue(self):
+        controller = self._controller()
+        gate = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("test"):
+                await gate.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        await holder
+
+        queue = controller._queue("test")
+        assert queue.in_flight == 0 and queue.waiters == []
+
+
+class TestRedisCheckpointer:
+    """Тесты LangGraph checkpointer на Redis"""
+
+    @pytest.fixture
+    def redis_client(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        return fakeredis.FakeAsyncRedis()
+
+    @staticmethod
+    def _checkpoint(checkpoint_id: str, values: dict, versions: dict) -> dict:
+        return {
+            "v": 1,
+            "id": checkpoint_id,
+            "ts": "2024-01-01T00:00:00+00:00",
+            "channel_values": values,
+            "channel_versions": versions,
+            "versions_seen": {},
+        }
+
+    @pytest.mark.unit
+    async def test_put_stores_only_changed_channels(self, redis_client, sample_analyses):
+        saver = RedisCheckpointer(redis_client)
+        config = {"configurable": {"thread_id": "t1", "checkpoint_ns": ""}}
+
+        first = await saver.aput(
+            config,
+            self._checkpoint("1", {"task": "T", "analyses": sample_analyses}, {"task": 1, "analyses": 1}),
+            {"step": 0},
+            {"task": 1, "analyses": 1},
+        )
+        # Второй шаг меняет только iteration: task/analyses не пишутся заново
+        await saver.aput(
+            first,
+            self._checkpoint(
+                "2",
+                {"task": "T", "analyses": sample_analyses, "iteration": 1},
+                {"task": 1, "analyses": 1, "iteration": 1},
+            ),
+            {"step": 1},
+            {"iteration": 1},
+        )
+
+        blobs = await redis_client.hkeys(saver._key("t1", "", "blobs"))
+        assert sorted(b.decode() for b in blobs) == ["analyses:1", "iteration:1", "task:1"]
+
+        latest = await saver.aget_tuple({"configurable": {"thread_id": "t1"}})
+        assert latest.checkpoint["id"] == "2"
+        assert latest.checkpoint["channel_values"]["analyses"] == sample_analyses
+        assert latest.checkpoint["channel_values"]["iteration"] == 1
+        assert latest.metadata["step"] == 1
+        assert latest.parent_config["configurable"]["checkpoint_id"] == "1"
+
+        items = [item async for item in saver.alist({"configurable": {"thread_id": "t1"}})]
+        assert [item.checkpoint["id"] for item in items] == ["2", "1"]
+        before = [
+            item async for item in saver.alist(
+                {"configurable": {"thread_id": "t1"}}, before=latest.config
+            )
+        ]
+        assert [item.checkpoint["id"] for item in before] == ["1"]
+
+    @pytest.mark.unit
+    async def test_stats_models_round_trip(self, redis_client):
+        from src.models.state import PromptBudgetStats
+
+        saver = RedisCheckpointer(redis_client)
+        stats = [PromptBudgetStats(stage="critique", prompts=2, original_tokens=900, final_tokens=600)]
+        config = await saver.aput(
+            {"configurable": {"thread_id": "t3", "checkpoint_ns": ""}},
+            self._checkpoint("1", {"budget_stats": stats}, {"budget_stats": 1}),
+            {},
+            {"budget_stats": 1},
+        )
+
+        item = await saver.aget_tuple(config)
+        assert item.checkpoint["channel_values"]["budget_stats"] == stats
+
+    @pytest.mark.unit
+    async def test_pending_writes_ttl_and_delete(self, redis_client, sample_critique):
+        saver = RedisCheckpointer(redis_client)
+        config = await saver.aput(
+            {"configurable": {"thread_id": "t2", "checkpoint_ns": ""}},
+            self._checkpoint("1", {}, {}),
+            {},
+            {},
+        )
+        await saver.aput_writes(config, [("critiques", [sample_critique])], task_id="task-a")
+
+        item = await saver.aget_tuple(config)
+        assert item.pending_writes == [("task-a", "critiques", [sample_critique])]
+        assert 0 < await redis_client.ttl(saver._key("t2", "", "checkpoints")) <= saver.ttl.total_seconds()
+
+        await saver.adelete_thread("t2")
+        assert await saver.aget_tuple(config) is None
+        assert await redis_client.keys(f"{saver.prefix}t2:*") == []
+
+    @pytest.mark.unit
+    async def test_graph_resumes_after_crash(
+        self, redis_client, initial_state, sample_analysis, sample_critique, sample_synthesis
+    ):
+        from unittest.mock import MagicMock, patch
+        from src.graph.workflow import create_workflow
+
+        agent = MagicMock()
+        agent.analyze = AsyncMock(return_value=sample_analysis)
+        agent.critique = AsyncMock(return_value=sample_critique)
+        agents = {"chatgpt": agent, "claude": agent}
+        synthesizer = MagicMock()
+        synthesizer.synthesize = AsyncMock(side_effect=[RuntimeError("worker died"), sample_synthesis])
+        config = {"configurable": {"thread_id": "run-1"}}
+
+        with patch("src.graph.workflow.get_agents", return_value=agents), \
+                patch("src.graph.workflow.get_synthesizer", return_value=synthesizer):
+            app = create_workflow().compile(checkpointer=RedisCheckpointer(redis_client))
+            with pytest.raises(RuntimeError):
+                await app.ainvoke(dict(initial_state, max_iterations=1), config)
+
+            # Новый процесс: продолжаем с последнего checkpoint'а
+            app = create_workflow().compile(checkpointer=RedisCheckpointer(redis_client))
+            result = await app.ainvoke(None, config)
+
+        assert result["synthesis"] == sample_synthesis
+        # Анализ и критика не повторялись
+        assert agent.analyze.await_count == 2
+        assert synthesizer.synthesize.await_count == 2
+
+    @staticmethod
+    def _agents(sample_analysis) -> dict:
+        from unittest.mock import MagicMock
+
+        agents = {}
+        for name in ("ChatGPT", "Claude"):
+            agent = MagicMock()
+            agent.name = name
+            agent.analyze = AsyncMock(return_value=sample_analysis.model_copy(update={"agent_name": name}))
+            agents[name.lower()] = agent
+        return agents
+
+    @pytest.mark.unit
+    async def test_consensus_stats_survive_resume(
+        self, redis_client, initial_state, sample_analysis, sample_synthesis, monkeypatch
+    ):
+        from unittest.mock import MagicMock, patch
+        from src.config import get_settings
+        from src.graph.workflow import create_workflow
+        from src.models.state import ConsensusStats
+
+        monkeypatch.setattr(get_settings(), "consensus_skip_enabled", True)
+        synthesizer = MagicMock()
+        synthesizer.synthesize = AsyncMock(side_effect=[RuntimeError("worker died"), sample_synthesis])
+        config = {"configurable": {"thread_id": "run-consensus"}}
+
+        with patch("src.graph.workflow.get_agents", return_value=self._agents(sample_analysis)), \
+                patch("src.graph.workflow.get_synthesizer", return_value=synthesizer):
+            app = create_workflow().compile(checkpointer=RedisCheckpointer(redis_client))
+            with pytest.raises(RuntimeError):
+                await app.ainvoke(dict(initial_state, max_iterations=1), config)
+
+            app = create_workflow().compile(checkpointer=RedisCheckpointer(redis_client))
+            result = await app.ainvoke(None, config)
+
+        assert isinstance(result["consensus_stats"][0], ConsensusStats)
+        assert result["consensus_stats"][0].decision == "skip"
+        assert result["synthesis"].consensus_level == pytest.approx(1.0)
+
+    @pytest.mark.unit
+    async def test_adaptive_history_survives_resume(
+        self, redis_client, initial_state, sample_analysis, sample_synthesis
+    ):
+        from unittest.mock import MagicMock, patch
+        from src.graph.iterative import FocusedRefiner
+        from src.graph.workflow import create_workflow
+        from src.models.state import AgentCritique, IterationMetrics
+
+        agents = self._agents(sample_analysis)
+        for agent in agents.values():
+            agent.critique = AsyncMock(side_effect=lambda task, target, analysis: AgentCritique(
+                critic_name="ChatGPT", target_name=target, critique="c", score=5,
+                weaknesses=["Нет оценки рынка"],
+            ))
+        refiner = FocusedRefiner()
+        refiner.refine_analysis = AsyncMock(
+            side_effect=lambda analysis, targets, critiques: analysis.model_copy(
+                update={"analysis": analysis.analysis + " (уточнено)"}
+            )
+        )
+        synthesizer = MagicMock()
+        synthesizer.synthesize = AsyncMock(side_effect=[
+            sample_synthesis.model_copy(update={"consensus_level": 0.5}),
+            RuntimeError("worker died"),
+            sample_synthesis.model_copy(update={"consensus_level": 0.52}),
+        ])
+        config = {"configurable": {"thread_id": "run-adaptive"}}
+
+        with patch("src.graph.workflow.get_agents", return_value=agents), \
+                patch("src.graph.workflow.get_refiner", return_value=refiner), \
+                patch("src.graph.workflow.get_synthesizer", return_value=synthesizer):
+            app = create_workflow("adaptive", pipelined=False).compile(checkpointer=RedisCheckpointer(redis_client))
+            with pytest.raises(RuntimeError):
+                await app.ainvoke(dict(initial_state, max_iterations=3), config)
+
+            app = create_workflow("adaptive", pipelined=False).compile(checkpointer=RedisCheckpointer(redis_client))
+            result = await app.ainvoke(None, config)
+
+        history = result["iteration_metrics"]
+        assert all(isinstance(m, IterationMetrics) for m in history)
+        assert [m.reason for m in history] == ["weak_areas_identified", "diminishing_returns"]
+
+
+class TestMetricsExporter:
+    """Тесты Prometheus метрик"""
+
+    @pytest.mark.unit
+    def test_histogram_render(self):
+        registry = Registry()
+        histogram = registry.histogram("test_seconds", "Test", ("node",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.labels('a"b').observe(value)
+
+        text = registry.render()
+        assert "# TYPE test_seconds histogram" in text
+        assert 'test_seconds_bucket{node="a\\"b",le="0.1"} 2' in text
+        assert 'test_seconds_bucket{node="a\\"b",le="1"} 3' in text
+        assert 'test_seconds_bucket{node="a\\"b",le="+Inf"} 4' in text
+        assert 'test_seconds_count{node="a\\"b"} 4' in text
+        assert 'test_seconds_sum{node="a\\"b"} 2.65' in text
+
+    @pytest.mark.unit
+    def test_counter_and_gauge_render(self):
+        registry = Registry()
+        registry.counter("test_requests", "Test", ("result",)).labels("hit").inc(3)
+        registry.gauge("test_depth", "Test", lambda: {("q",): 5}, ("queue",))
+
+        text = registry.render()
+        assert "# TYPE test_requests_total counter" in text
+        assert "# HELP test_requests_total Test" in text
+        assert 'test_requests_total{result="hit"} 3' in text
+        assert 'test_depth{queue="q"} 5' in text
+
+    @pytest.mark.unit
+    def test_gauge_has_no_series(self):
+        """Gauge вычисляется при сборе: серий по меткам у него нет"""
+        gauge = Registry().gauge("test_depth", "Test", lambda: 1.0)
+        assert not hasattr(gauge, "labels")
+
+    @pytest.mark.unit
+    def test_observe_is_cheap(self):
+        child = Registry().histogram("test_cost_seconds", "Test").labels()
+        n = 100_000
+        start = time.perf_counter()
+        for _ in range(n):
+            child.observe(0.02)
+        per_call = (time.perf_counter() - start) / n
+        # ~0.2 мкс на наблюдение; запас на медленные CI
+        assert per_call < 5e-6
+
+    @pytest.mark.unit
+    async def test_timed_node(self):
+        async def node(state):
+            return {"iteration": state["iteration"] + 1}
+
+        child = NODE_DURATION.labels("test_node")
+        before = sum(child.counts)
+        assert await timed_node("test_node", node)({"iteration": 0}) == {"iteration": 1}
+        assert sum(child.counts) == before + 1
+
+    @pytest.mark.unit
+    async def test_rate_limiter_wait_observed(self):
+        limiter = _limiter()
+        child = RATE_LIMIT_WAIT.labels("test")
+        before = sum(child.counts)
+        async with limiter.acquire("test"):
+            pass
+        assert sum(child.counts) == before + 1
+
+
+class TestWorkerLoop:
+    """Тесты общего event loop воркера"""
+
+    @pytest.mark.unit
+    def test_loop_persists_between_tasks(self):
+        worker = WorkerLoop(max_concurrency=4)
+
+        async def current_loop():
+            return asyncio.get_running_loop()
+
+        try:
+            assert worker.run(current_loop()) is worker.run(current_loop())
+        finally:
+            worker.stop()
+        assert not worker.running
+
+    @pytest.mark.unit
+    def test_concurrency_limit(self):
+        worker = WorkerLoop(max_concurrency=3)
+        peak = 0
+
+        async def analysis():
+            nonlocal peak
+            peak = max(peak, worker.active)
+            await asyncio.sleep(0.05)
+            return worker.active
+
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                start = time.perf_counter()
+                results = list(pool.map(lambda _: worker.run(analysis()), range(8)))
+                elapsed = time.perf_counter() - start
+        finally:
+            worker.stop()
+
+        assert len(results) == 8
+        assert peak == 3
+        # 8 задач по 50 мс при лимите 3 — три волны, а не восемь
+        assert elapsed < 0.3
+
+    @pytest.mark.unit
+    def test_timeout(self):
+        worker = WorkerLoop(timeout=0.05)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                worker.run(asyncio.sleep(1))
+        finally:
+            worker.stop()
@@ -12,6 +12,8 @@ from src.models.state import (
     SynthesisResult,
     TaskInput,
     CosiliumOutput,
+    merge_analyses,
+    merge_critiques,
 )
 
 
@@ -169,3 +171,34 @@ class TestCosiliumOutput:
         assert "task" in json_data
         assert "synthesis" in json_data
         assert isinstance(json_data["analyses"], list)
+
+
+class TestStateReducers:
+    """Тесты reducer'ов состояния"""
+
+    def test_merge_critiques_replaces_same_pair(self):
+        old = AgentCritique(critic_name="Claude", target_name="ChatGPT", critique="old", score=5)
+        other = AgentCritique(critic_name="Gemini", target_name="ChatGPT", critique="g", score=6)
+        new = AgentCritique(critic_name="Claude", target_name="ChatGPT", critique="new", score=7)
+
+        merged = merge_critiques([old, other], [new])
+
+        assert len(merged) == 2
+        assert {c.critique for c in merged} == {"new", "g"}
+
+    def test_merge_analyses_replaces_same_agent(self):
+        old = AgentAnalysis(agent_name="ChatGPT", analysis="v1", confidence=0.5)
+        new = AgentAnalysis(agent_name="ChatGPT", analysis="v2", confidence=0.6)
+
+        merged = merge_analyses([old], [new])
+
+        assert len(merged) == 1
+        assert merged[0].analysis == "v2"
+
+    def test_content_hash_tracks_text(self):
+        a = AgentAnalysis(agent_name="ChatGPT", analysis="v1", confidence=0.5)
+        b = AgentAnalysis(agent_name="ChatGPT", analysis="v1", confidence=0.9)
+        c = AgentAnalysis(agent_name="ChatGPT", analysis="v2", confidence=0.5)
+
+        assert a.content_hash() == b.content_hash()
+        assert a.content_hash() != c.content_hash()